@@ -0,0 +1,161 @@
+"""
+Arquivamento frio de coleções que só crescem (transações e notificações).
+
+Os documentos mais antigos que ARCHIVE_AFTER_DAYS saem da coleção quente e vão para
+coleções mensais <colecao>_arquivo_AAAA_MM, criadas com compressão zstd por bloco quando o
+servidor permite e com os mesmos índices da coleção de origem. A idade vem do _id (o
+ObjectId é gerado na inserção), então a varredura usa o índice _id sem exigir um índice em
+data na coleção quente; o mês de destino vem do campo de data.
+
+Cada lote é inserido no arquivo (chaves duplicadas de uma execução interrompida são
+ignoradas) e só depois removido da coleção quente, de forma idempotente. A fronteira do
+arquivo é gravada antes da migração: a partir dela as leituras também consultam os meses
+arquivados e descartam o _id que ainda estiver nos dois lugares.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def _mes(data: datetime) -> datetime:
+    return datetime(data.year, data.month, 1)
+
+
+def _proximo_mes(mes: datetime) -> datetime:
+    return datetime(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+class MonthlyArchive:
+    def __init__(self, origem, nome: str, abrir: Callable[[str], Any], criar_colecao: Callable[..., Any],
+                 metadados, preparar: Callable[[str], None] = lambda nome: None, idade_dias: int = 365,
+                 compressor: str = "zstd", campo_data: str = "data"):
+        """
+        origem: coleção quente; abrir(nome) devolve uma coleção de arquivo; criar_colecao é o
+        create_collection do banco; preparar(nome) cria os índices do arquivo recém-criado;
+        metadados guarda a fronteira e os meses arquivados (um documento por coleção).
+        """
+        self.origem = origem
+        self.nome = nome
+        self.idade_dias = idade_dias
+        self.compressor = compressor
+        self.campo_data = campo_data
+        self._abrir = abrir
+        self._criar_colecao = criar_colecao
+        self._preparar = preparar
+        self._metadados = metadados
+        self._criadas: Set[str] = set()
+
+    def nome_arquivo(self, mes: datetime) -> str:
+        return f"{self.nome}_arquivo_{mes:%Y_%m}"
+
+    def estado(self) -> dict:
+        """Fronteira (documentos anteriores podem estar no arquivo) e meses arquivados."""
+        return self._metadados.find_one({"_id": self.nome}) or {"fronteira": None, "meses": []}
+
+    def colecoes(self) -> List[Any]:
+        """Coleções mensais já criadas, da mais recente para a mais antiga."""
+        return [self._abrir(self.nome_arquivo(mes)) for mes in sorted(self.estado().get("meses", []), reverse=True)]
+
+    def _destino(self, mes: datetime):
+        nome = self.nome_arquivo(mes)
+        if nome not in self._criadas:
+            opcoes = {}
+            if self.compressor:
+                opcoes["storageEngine"] = {"wiredTiger": {"configString": f"block_compressor={self.compressor}"}}
+            try:
+                self._criar_colecao(nome, **opcoes)
+            except CollectionInvalid:
+                pass  # Já existe (execução anterior ou outra instância)
+            except OperationFailure as e:
+                # Cosmos DB e servidores sem WiredTiger não aceitam storageEngine
+                logger.warning(f"Coleção {nome} criada sem compressão por bloco: {e}")
+                try:
+                    self._criar_colecao(nome)
+                except CollectionInvalid:
+                    pass
+            self._preparar(nome)
+            # O mês é registrado antes de receber documentos, para as leituras o encontrarem
+            self._metadados.update_one({"_id": self.nome}, {"$addToSet": {"meses": mes}}, upsert=True)
+            self._criadas.add(nome)
+        return self._abrir(nome)
+
+    def arquivar(self, tamanho_lote: int = 1000, agora: Optional[datetime] = None) -> dict:
+        """Move os documentos mais antigos que idade_dias para os arquivos mensais."""
+        limite = (agora or datetime.utcnow()) - timedelta(days=self.idade_dias)
+        self._metadados.update_one({"_id": self.nome}, {"$max": {"fronteira": limite}}, upsert=True)
+        filtro = {"_id": {"$lt": ObjectId.from_datetime(limite)}}
+        movidos, por_mes = 0, {}
+        while True:
+            lote = list(self.origem.find(filtro).sort("_id", 1).limit(tamanho_lote))
+            if not lote:
+                break
+            grupos: Dict[datetime, List[dict]] = {}
+            for documento in lote:
+                data = documento.get(self.campo_data)
+                if not isinstance(data, datetime):
+                    data = documento["_id"].generation_time.replace(tzinfo=None)
+                grupos.setdefault(_mes(data), []).append(documento)
+            for mes, documentos in grupos.items():
+                try:
+                    self._destino(mes).insert_many(documentos, ordered=False)
+                except BulkWriteError as e:
+                    # Documentos já arquivados numa execução interrompida antes da remoção
+                    if any(erro.get("code") != DUPLICATE_KEY for erro in e.details.get("writeErrors", [])):
+                        raise
+                chave = f"{mes:%Y-%m}"
+                por_mes[chave] = por_mes.get(chave, 0) + len(documentos)
+            self.origem.delete_many({"_id": {"$in": [documento["_id"] for documento in lote]}})
+            movidos += len(lote)
+        if movidos:
+            logger.info(f"{movidos} documentos de {self.nome} arquivados: {por_mes}")
+        return {"movidos": movidos, "meses": por_mes}
+
+    def consultar(self, filtro: dict, inicio: Optional[datetime] = None, fim: Optional[datetime] = None,
+                  limite: int = 100) -> List[dict]:
+        """
+        Documentos do filtro no intervalo [inicio, fim], do mais recente para o mais antigo.
+        Os meses arquivados só são lidos quando a coleção quente não preencheu o limite e o
+        intervalo passa da fronteira, do mais recente para o mais antigo e só pelo que falta.
+        """
+        intervalo = {}
+        if inicio is not None:
+            intervalo["$gte"] = inicio
+        if fim is not None:
+            intervalo["$lte"] = fim
+        consulta = {**filtro, self.campo_data: intervalo} if intervalo else dict(filtro)
+        documentos = list(self.origem.find(consulta).sort(self.campo_data, -1).limit(limite))
+        if len(documentos) >= limite:
+            # Os arquivados são mais antigos que qualquer documento da coleção quente
+            return documentos
+
+        estado = self.estado()
+        fronteira = estado.get("fronteira")
+        if fronteira is None or (inicio is not None and inicio >= fronteira):
+            return documentos
+        vistos = {documento["_id"] for documento in documentos}
+        # Documentos anteriores à fronteira ainda na coleção quente (migração em andamento)
+        # podem voltar repetidos do arquivo: cada mês lê o que falta mais essa sobra
+        sobrepostos = sum(1 for _id in vistos if _id < ObjectId.from_datetime(fronteira))
+        restante = limite - len(documentos)
+        for mes in sorted(estado.get("meses", []), reverse=True):
+            if (inicio is not None and _proximo_mes(mes) <= inicio) or (fim is not None and mes > fim):
+                continue
+            cursor = self._abrir(self.nome_arquivo(mes)).find(consulta).sort(self.campo_data, -1)
+            for documento in cursor.limit(restante + sobrepostos):
+                if documento["_id"] not in vistos:
+                    vistos.add(documento["_id"])
+                    documentos.append(documento)
+                    restante -= 1
+            # Os meses são disjuntos e percorridos do mais recente: preenchido o limite, os
+            # mais antigos não entram no resultado
+            if restante <= 0:
+                break
+        documentos.sort(key=lambda documento: documento[self.campo_data], reverse=True)
+        return documentos[:limite]
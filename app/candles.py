@@ -0,0 +1,166 @@
+"""
+Histórico de preços das ações e candles OHLC.
+
+Cada alteração de preço grava um tick em historico_precos e atualiza, no mesmo
+bulk_write, os buckets pré-agregados de 1m, 1h e 1d da coleção candles. Intervalos
+arbitrários (ex.: 5m, 4h, 1w) são reamostrados com NumPy a partir do maior bucket base
+que divide o intervalo pedido, então um gráfico diário de um ano lê ~365 documentos.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .database import candles, historico_precos
+
+EPOCH = datetime(1970, 1, 1)
+
+# Buckets mantidos incrementalmente, em segundos
+INTERVALOS_BASE: Dict[str, int] = {"1m": 60, "1h": 3600, "1d": 86400}
+
+_SEMANA = 7 * 86400
+_UNIDADES = {"m": 60, "h": 3600, "d": 86400, "w": _SEMANA}
+
+# 1970-01-01 foi uma quinta-feira: barras semanais contam a partir da segunda, 4 dias depois
+_DESLOCAMENTO_SEMANA = 4 * 86400
+_INTERVALO_RE = re.compile(r"^(\d+)([mhdw])$")
+
+
+class IntervaloInvalido(ValueError):
+    pass
+
+
+def parse_intervalo(intervalo: str) -> int:
+    """Converte "15m", "4h", "1d", "1w" em segundos."""
+    encontrado = _INTERVALO_RE.match(intervalo)
+    if not encontrado or int(encontrado.group(1)) == 0:
+        raise IntervaloInvalido(f"Intervalo inválido: {intervalo}")
+    return int(encontrado.group(1)) * _UNIDADES[encontrado.group(2)]
+
+
+def _deslocamento(segundos: int) -> int:
+    """Origem dos buckets em segundos desde a época (segunda-feira para intervalos em semanas)."""
+    return _DESLOCAMENTO_SEMANA if segundos % _SEMANA == 0 else 0
+
+
+def _utc(data: Optional[datetime]) -> Optional[datetime]:
+    """Datas com fuso (ex.: ?inicio=...Z) viram UTC sem fuso, como as gravadas no banco."""
+    if data is None or data.tzinfo is None:
+        return data
+    return data.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _inicio_bucket(data: datetime, segundos: int) -> datetime:
+    decorrido = int((data - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=decorrido - (decorrido - _deslocamento(segundos)) % segundos)
+
+
+def registrar_tick(acao_id, preco: float, data: Optional[datetime] = None):
+    """Grava o tick de preço e atualiza os buckets OHLC base."""
+    registrar_ticks([(acao_id, preco)], data)
+
+
+def registrar_ticks(ticks: List[Tuple[Any, float]], data: Optional[datetime] = None):
+    """Ticks de várias ações no mesmo instante: um insert_many e um bulk_write para todas."""
+    if not ticks:
+        return
+    data = data or datetime.utcnow()
+    ticks = [(ObjectId(acao_id), preco) for acao_id, preco in ticks]
+    historico_precos.insert_many([{"acao_id": acao_id, "preco": preco, "data": data} for acao_id, preco in ticks],
+                                 ordered=False)
+    candles.bulk_write(
+        [
+            UpdateOne(
+                {"acao_id": acao_id, "intervalo": nome, "inicio": _inicio_bucket(data, segundos)},
+                {
+                    "$setOnInsert": {"o": preco},
+                    "$max": {"h": preco},
+                    "$min": {"l": preco},
+                    "$set": {"c": preco, "atualizado_em": data},
+                    "$inc": {"n": 1},
+                },
+                upsert=True,
+            )
+            for acao_id, preco in ticks
+            for nome, segundos in INTERVALOS_BASE.items()
+        ],
+        ordered=False,
+    )
+
+
+def _base_para(segundos: int) -> str:
+    """Maior bucket base cujo tamanho divide o intervalo pedido."""
+    for nome, tamanho in sorted(INTERVALOS_BASE.items(), key=lambda item: -item[1]):
+        if segundos % tamanho == 0:
+            return nome
+    raise IntervaloInvalido("O intervalo deve ser múltiplo de 1 minuto")
+
+
+def reamostrar(inicios: np.ndarray, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray,
+               n: np.ndarray, segundos: int) -> Dict[str, np.ndarray]:
+    """
+    Agrupa barras ordenadas (inícios em segundos desde a época) em barras de `segundos`.
+    Abertura = primeira, máxima/mínima = extremos, fechamento = última, ticks = soma.
+    Barras em semanas começam na segunda-feira.
+    """
+    if len(inicios) == 0:
+        vazio = np.array([], dtype=np.float64)
+        return {"inicio": vazio.astype(np.int64), "o": vazio, "h": vazio, "l": vazio, "c": vazio, "n": vazio.astype(np.int64)}
+    grupos = inicios - (inicios - _deslocamento(segundos)) % segundos
+    # Posições onde começa cada novo grupo (as barras já estão ordenadas)
+    cortes = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+    ultimos = np.r_[cortes[1:], len(grupos)] - 1
+    return {
+        "inicio": grupos[cortes],
+        "o": o[cortes],
+        "h": np.maximum.reduceat(h, cortes),
+        "l": np.minimum.reduceat(l, cortes),
+        "c": c[ultimos],
+        "n": np.add.reduceat(n, cortes),
+    }
+
+
+def obter_candles(acao_id, intervalo: str, inicio: Optional[datetime] = None, fim: Optional[datetime] = None,
+                  limite: int = 500) -> List[dict]:
+    segundos = parse_intervalo(intervalo)
+    base = _base_para(segundos)
+    inicio, fim = _utc(inicio), _utc(fim)
+    fim = fim or datetime.utcnow()
+    if inicio is None:
+        inicio = fim - timedelta(seconds=segundos * limite)
+    inicio = _inicio_bucket(inicio, segundos)
+
+    documentos = list(
+        candles.find(
+            {"acao_id": ObjectId(acao_id), "intervalo": base, "inicio": {"$gte": inicio, "$lte": fim}},
+            {"_id": 0, "inicio": 1, "o": 1, "h": 1, "l": 1, "c": 1, "n": 1},
+        ).sort("inicio", 1)
+    )
+    if not documentos:
+        return []
+
+    barras = reamostrar(
+        np.array([int((d["inicio"] - EPOCH).total_seconds()) for d in documentos], dtype=np.int64),
+        np.array([d["o"] for d in documentos], dtype=np.float64),
+        np.array([d["h"] for d in documentos], dtype=np.float64),
+        np.array([d["l"] for d in documentos], dtype=np.float64),
+        np.array([d["c"] for d in documentos], dtype=np.float64),
+        np.array([d.get("n", 1) for d in documentos], dtype=np.int64),
+        segundos,
+    )
+    quantidade = len(barras["inicio"])
+    primeiro = max(quantidade - limite, 0)
+    return [
+        {
+            "inicio": EPOCH + timedelta(seconds=int(barras["inicio"][i])),
+            "abertura": float(barras["o"][i]),
+            "maxima": float(barras["h"][i]),
+            "minima": float(barras["l"][i]),
+            "fechamento": float(barras["c"][i]),
+            "ticks": int(barras["n"][i]),
+        }
+        for i in range(primeiro, quantidade)
+    ]
@@ -0,0 +1,425 @@
+"""
+Feed de alterações para sincronização incremental (delta-sync) de coleções.
+
+Cada escrita feita por um SequencedCollection recebe um número de sequência (sync_seq,
+derivado do relógio, sem documento contador compartilhado) e atualizado_em; remoções geram
+tombstones na coleção de remoções com a mesma sequência. Os clientes leem as alterações
+posteriores a um token opaco, paginando por (sync_seq, _id) com índice, em O(alterações).
+
+Quando o servidor oferece change streams, a carga inicial captura os resume tokens antes
+de percorrer as coleções e, ao terminar, o token passa a apontar para os change streams.
+Sem change streams (standalone, motor em memória) o índice de sequência é usado sempre.
+
+Sequências alocadas mas ainda não gravadas (ou vindas de um servidor com o relógio um pouco
+atrasado) podem ficar visíveis fora de ordem; por isso o token só avança sobre documentos com
+atualizado_em anterior a settle_ms (os mais recentes são entregues, mas reenviados na próxima
+leitura — o cliente aplica as alterações de forma idempotente).
+"""
+import base64
+import copy
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId, json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne
+from pymongo.errors import OperationFailure
+
+CHANGE_STREAMS_NOT_SUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+
+OPERACOES_STREAM = ("insert", "update", "replace", "delete")
+
+# Sequências distintas que um processo pode alocar no mesmo microssegundo
+_BITS_DESEMPATE = 10
+
+# Remoção vista no change stream antes do tombstone que identifica o dono do documento
+_PENDENTE = object()
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class ExpiredToken(Exception):
+    """O resume token saiu da janela do oplog; o cliente precisa de uma carga completa."""
+
+
+class SequenceAllocator:
+    """
+    Sequência monotônica derivada do relógio: o instante em microssegundos deslocado
+    _BITS_DESEMPATE bits, estritamente crescente dentro do processo.
+
+    Um contador único ($inc em um documento) serializaria todas as escritas de ações e
+    carteiras. Entre processos, sequências iguais são desempatadas pelo _id na paginação e a
+    diferença de relógio entre servidores é coberta pela janela settle_ms do ChangeFeed.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self._ultima = 0
+        self._lock = threading.Lock()
+
+    def next(self, quantity: int = 1) -> int:
+        """Reserva `quantity` sequências e retorna a primeira."""
+        with self._lock:
+            primeira = max(int(self._clock() * 1_000_000) << _BITS_DESEMPATE, self._ultima + 1)
+            self._ultima = primeira + quantity - 1
+        return primeira
+
+
+class SequencedCollection:
+    """
+    Wrapper que carimba sync_seq e atualizado_em em todas as escritas da coleção e grava
+    tombstones nas remoções. Os demais métodos são repassados à coleção envolvida.
+    """
+
+    def __init__(self, collection, name: str, sequence: SequenceAllocator, tombstones):
+        self._collection = collection
+        self._name = name
+        self._sequence = sequence
+        self._tombstones = tombstones
+
+    def __getattr__(self, nome: str):
+        return getattr(self._collection, nome)
+
+    def __getitem__(self, nome: str):
+        return self._collection[nome]
+
+    # -- carimbo -------------------------------------------------------------
+
+    def _carimbo(self, quantity: int = 1) -> dict:
+        return {"sync_seq": self._sequence.next(quantity), "atualizado_em": datetime.utcnow()}
+
+    @staticmethod
+    def _carimbar_update(update: Any, carimbo: dict) -> Any:
+        if isinstance(update, list):
+            # Update com pipeline de agregação
+            return [*update, {"$set": carimbo}]
+        update = dict(update)
+        update["$set"] = {**update.get("$set", {}), **carimbo}
+        return update
+
+    # -- escrita -------------------------------------------------------------
+
+    def insert_one(self, document: dict, *args, **kwargs):
+        document.update(self._carimbo())
+        return self._collection.insert_one(document, *args, **kwargs)
+
+    def insert_many(self, documents, *args, **kwargs):
+        documents = list(documents)
+        if documents:
+            carimbo = self._carimbo(len(documents))
+            for deslocamento, document in enumerate(documents):
+                document.update(carimbo, sync_seq=carimbo["sync_seq"] + deslocamento)
+        return self._collection.insert_many(documents, *args, **kwargs)
+
+    def update_one(self, filter: dict, update: Any, *args, **kwargs):
+        return self._collection.update_one(filter, self._carimbar_update(update, self._carimbo()), *args, **kwargs)
+
+    def update_many(self, filter: dict, update: Any, *args, **kwargs):
+        return self._collection.update_many(filter, self._carimbar_update(update, self._carimbo()), *args, **kwargs)
+
+    def replace_one(self, filter: dict, replacement: dict, *args, **kwargs):
+        return self._collection.replace_one(filter, {**replacement, **self._carimbo()}, *args, **kwargs)
+
+    def find_one_and_update(self, filter: dict, update: Any, *args, **kwargs):
+        return self._collection.find_one_and_update(
+            filter, self._carimbar_update(update, self._carimbo()), *args, **kwargs
+        )
+
+    def find_one_and_replace(self, filter: dict, replacement: dict, *args, **kwargs):
+        return self._collection.find_one_and_replace(filter, {**replacement, **self._carimbo()}, *args, **kwargs)
+
+    def delete_one(self, filter: dict, *args, **kwargs):
+        removidos = list(self._collection.find(filter, {"_id": 1, "usuario_id": 1}).limit(1))
+        resultado = self._collection.delete_one(filter, *args, **kwargs)
+        if resultado.deleted_count:
+            self._registrar_remocoes(removidos)
+        return resultado
+
+    def delete_many(self, filter: dict, *args, **kwargs):
+        removidos = list(self._collection.find(filter, {"_id": 1, "usuario_id": 1}))
+        resultado = self._collection.delete_many(filter, *args, **kwargs)
+        self._registrar_remocoes(removidos)
+        return resultado
+
+    def find_one_and_delete(self, filter: dict, *args, **kwargs):
+        documento = self._collection.find_one_and_delete(filter, *args, **kwargs)
+        if documento is not None:
+            self._registrar_remocoes([documento])
+        return documento
+
+    def bulk_write(self, requests, *args, **kwargs):
+        requests = list(requests)
+        escritas = sum(1 for operacao in requests if not isinstance(operacao, (DeleteOne, DeleteMany)))
+        # Um único bloco de sequências para todas as escritas do lote
+        carimbo = self._carimbo(escritas) if escritas else {}
+        operacoes, removidos = [], []
+        for operacao in requests:
+            if isinstance(operacao, (DeleteOne, DeleteMany)):
+                encontrados = self._collection.find(operacao._filter, {"_id": 1, "usuario_id": 1})
+                removidos.extend(encontrados.limit(1) if isinstance(operacao, DeleteOne) else encontrados)
+                operacoes.append(operacao)
+                continue
+            operacao = copy.copy(operacao)
+            if isinstance(operacao, InsertOne):
+                operacao._doc.update(carimbo)
+            elif isinstance(operacao, ReplaceOne):
+                operacao._doc = {**operacao._doc, **carimbo}
+            else:
+                operacao._doc = self._carimbar_update(operacao._doc, carimbo)
+            operacoes.append(operacao)
+            carimbo = {**carimbo, "sync_seq": carimbo["sync_seq"] + 1}
+        resultado = self._collection.bulk_write(operacoes, *args, **kwargs)
+        self._registrar_remocoes(removidos)
+        return resultado
+
+    def _registrar_remocoes(self, documentos: List[dict]):
+        if not documentos:
+            return
+        carimbo = self._carimbo(len(documentos))
+        self._tombstones.insert_many([
+            {
+                "colecao": self._name,
+                "doc_id": documento["_id"],
+                "usuario_id": documento.get("usuario_id"),
+                "sync_seq": carimbo["sync_seq"] + deslocamento,
+                "atualizado_em": carimbo["atualizado_em"],
+            }
+            for deslocamento, documento in enumerate(documentos)
+        ], ordered=False)
+
+
+def encode_token(estado: dict) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(estado).encode()).decode().rstrip("=")
+
+
+def decode_token(token: str) -> dict:
+    try:
+        preenchido = token + "=" * (-len(token) % 4)
+        estado = json_util.loads(base64.urlsafe_b64decode(preenchido.encode()).decode())
+    except (ValueError, json.JSONDecodeError, UnicodeDecodeError) as exc:
+        raise InvalidToken("Token de sincronização inválido") from exc
+    if not isinstance(estado, dict) or not ({"pos", "cs"} & estado.keys()):
+        raise InvalidToken("Token de sincronização inválido")
+    return estado
+
+
+def _serializar(valor: Any) -> Any:
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, dict):
+        return {chave: _serializar(item) for chave, item in valor.items()}
+    if isinstance(valor, list):
+        return [_serializar(item) for item in valor]
+    return valor
+
+
+class ChangeFeed:
+    """
+    Lê as alterações de um conjunto de coleções sequenciadas a partir de um token.
+
+    `filters` permite restringir cada coleção (ex.: apenas a carteira do próprio usuário);
+    o mesmo filtro é aplicado aos tombstones pelos campos guardados neles.
+    """
+
+    TOMBSTONES = "_remocoes"
+
+    def __init__(self, collections: Dict[str, Any], tombstones, settle_ms: int = 2000,
+                 change_streams: str = "auto"):
+        self._collections = collections
+        self._tombstones = tombstones
+        self._settle = timedelta(milliseconds=settle_ms)
+        self._change_streams = change_streams
+        self._disponivel: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    # -- change streams ------------------------------------------------------
+
+    def change_streams_available(self) -> bool:
+        if self._change_streams in ("off", False):
+            return False
+        with self._lock:
+            if self._disponivel is None:
+                try:
+                    with next(iter(self._collections.values())).watch():
+                        pass
+                    self._disponivel = True
+                except OperationFailure as exc:
+                    if self._change_streams == "on" or exc.code != CHANGE_STREAMS_NOT_SUPPORTED:
+                        raise
+                    self._disponivel = False
+            return self._disponivel
+
+    def _watch(self, colecao, resume_token: Optional[dict]):
+        pipeline = [{"$match": {"operationType": {"$in": list(OPERACOES_STREAM)}}}]
+        try:
+            return colecao.watch(pipeline, full_document="updateLookup", resume_after=resume_token)
+        except OperationFailure as exc:
+            if exc.code in CHANGE_STREAM_HISTORY_LOST:
+                raise ExpiredToken(str(exc)) from exc
+            raise
+
+    def _resume_tokens(self) -> Dict[str, dict]:
+        tokens = {}
+        for nome, colecao in self._collections.items():
+            with self._watch(colecao, None) as stream:
+                stream.try_next()
+                tokens[nome] = stream.resume_token
+        return tokens
+
+    def _ler_streams(self, tokens: Dict[str, dict], limite: int, filtros: Dict[str, dict],
+                     colecoes: List[str]) -> Tuple[List[dict], Dict[str, dict], bool]:
+        alteracoes: List[dict] = []
+        novos = dict(tokens)
+        mais = False
+        for nome in colecoes:
+            colecao = self._collections[nome]
+            with self._watch(colecao, tokens.get(nome)) as stream:
+                pendente = False
+                while True:
+                    if len(alteracoes) >= limite:
+                        mais = True
+                        break
+                    anterior = stream.resume_token
+                    try:
+                        evento = stream.try_next()
+                    except OperationFailure as exc:
+                        if exc.code in CHANGE_STREAM_HISTORY_LOST:
+                            raise ExpiredToken(str(exc)) from exc
+                        raise
+                    if evento is None:
+                        break
+                    alteracao = self._de_evento(nome, evento, filtros.get(nome))
+                    if alteracao is _PENDENTE:
+                        # O token fica antes da remoção; ela é relida na próxima consulta
+                        pendente = True
+                        break
+                    if alteracao is not None:
+                        alteracoes.append(alteracao)
+                novos[nome] = anterior if pendente else stream.resume_token
+        return alteracoes, novos, mais
+
+    def _de_evento(self, nome: str, evento: dict, filtro: Optional[dict]) -> Any:
+        documento = evento.get("fullDocument")
+        doc_id = evento["documentKey"]["_id"]
+        if evento["operationType"] == "delete" or documento is None:
+            if filtro:
+                # O evento de remoção não traz o documento: o filtro é aplicado ao tombstone
+                documento = self._tombstones.find_one({"colecao": nome, "doc_id": doc_id})
+                if documento is None:
+                    return _PENDENTE
+                if any(documento.get(campo) != valor for campo, valor in filtro.items()):
+                    return None
+            return {"colecao": nome, "operacao": "delete", "id": str(doc_id), "documento": None}
+        if filtro and any(documento.get(campo) != valor for campo, valor in filtro.items()):
+            return None
+        return {"colecao": nome, "operacao": "upsert", "id": str(doc_id), "documento": _serializar(documento)}
+
+    # -- índice de sequência -------------------------------------------------
+
+    @staticmethod
+    def _apos(posicao: Optional[list]) -> dict:
+        if not posicao:
+            return {}
+        seq, doc_id = posicao
+        return {"$or": [{"sync_seq": {"$gt": seq}}, {"sync_seq": seq, "_id": {"$gt": doc_id}}]}
+
+    def _ler_fonte(self, colecao, filtro: dict, posicao: Optional[list], limite: int,
+                   corte: datetime, converter: Callable[[dict], dict]) -> Tuple[List[dict], Optional[list], bool]:
+        apos = self._apos(posicao)
+        # O filtro das remoções também é um $or: combinados por $and para um não sobrescrever o outro
+        consulta = {"$and": [filtro, apos]} if "$or" in filtro and apos else {**filtro, **apos}
+        documentos = list(colecao.find(consulta).sort([("sync_seq", 1), ("_id", 1)]).limit(limite))
+        nova_posicao = posicao
+        assentado = True
+        for documento in documentos:
+            # O token só avança sobre o prefixo de documentos já assentados
+            assentado = assentado and documento.get("atualizado_em", corte) <= corte
+            if assentado:
+                nova_posicao = [documento.get("sync_seq", 0), documento["_id"]]
+        completo = len(documentos) >= limite and nova_posicao != posicao
+        return [converter(d) for d in documentos], nova_posicao, completo
+
+    def _ler_sequencia(self, posicoes: Dict[str, list], limite: int, filtros: Dict[str, dict],
+                       colecoes: List[str]) -> Tuple[List[dict], Dict[str, list], bool]:
+        corte = datetime.utcnow() - self._settle
+        alteracoes: List[dict] = []
+        novas = dict(posicoes)
+        mais = False
+        for nome in colecoes:
+            colecao = self._collections[nome]
+            restante = limite - len(alteracoes)
+            if restante <= 0:
+                mais = True
+                break
+            lidas, novas[nome], completo = self._ler_fonte(
+                colecao, filtros.get(nome, {}), posicoes.get(nome), restante, corte,
+                lambda d, nome=nome: {"colecao": nome, "operacao": "upsert", "id": str(d["_id"]),
+                                      "documento": _serializar(d)},
+            )
+            alteracoes.extend(lidas)
+            mais = mais or completo
+
+        restante = limite - len(alteracoes)
+        if restante > 0:
+            filtro_remocoes: Dict[str, Any] = {"colecao": {"$in": colecoes}}
+            restricoes = [{"colecao": nome, **filtros[nome]} for nome in colecoes if filtros.get(nome)]
+            if restricoes:
+                livres = [nome for nome in colecoes if not filtros.get(nome)]
+                filtro_remocoes = {"$or": restricoes + ([{"colecao": {"$in": livres}}] if livres else [])}
+            lidas, novas[self.TOMBSTONES], completo = self._ler_fonte(
+                self._tombstones, filtro_remocoes, posicoes.get(self.TOMBSTONES), restante, corte,
+                lambda t: {"colecao": t["colecao"], "operacao": "delete", "id": str(t["doc_id"]), "documento": None},
+            )
+            alteracoes.extend(lidas)
+            mais = mais or completo
+        else:
+            mais = True
+        return alteracoes, novas, mais
+
+    # -- API -----------------------------------------------------------------
+
+    def head_token(self) -> str:
+        """Token posicionado no fim atual do feed (para acompanhar apenas alterações futuras)."""
+        if self.change_streams_available():
+            return encode_token({"cs": self._resume_tokens()})
+        posicoes = {}
+        fontes = {**self._collections, self.TOMBSTONES: self._tombstones}
+        for nome, colecao in fontes.items():
+            ultimo = next(iter(colecao.find({}, {"sync_seq": 1}).sort([("sync_seq", -1), ("_id", -1)]).limit(1)), None)
+            if ultimo is not None:
+                posicoes[nome] = [ultimo.get("sync_seq", 0), ultimo["_id"]]
+        return encode_token({"pos": posicoes})
+
+    def changes(self, token: Optional[str] = None, limite: int = 500,
+                filtros: Optional[Dict[str, dict]] = None, colecoes: Optional[List[str]] = None) -> dict:
+        """
+        Alterações posteriores ao token (todas as coleções quando token é None).
+        Retorna {"alteracoes", "token", "mais", "modo"}; com mais=True o cliente deve
+        pedir a próxima página imediatamente usando o token retornado.
+        """
+        filtros = filtros or {}
+        colecoes = [nome for nome in self._collections if colecoes is None or nome in colecoes]
+        estado = decode_token(token) if token else {"pos": {}}
+
+        if "cs" in estado and "pos" not in estado:
+            alteracoes, tokens, mais = self._ler_streams(estado["cs"], limite, filtros, colecoes)
+            return {"alteracoes": alteracoes, "token": encode_token({"cs": tokens}), "mais": mais,
+                    "modo": "change_stream"}
+
+        if token is None and self.change_streams_available():
+            # Carga inicial: os resume tokens são capturados antes de percorrer as coleções
+            estado["cs"] = self._resume_tokens()
+
+        alteracoes, posicoes, mais = self._ler_sequencia(estado["pos"], limite, filtros, colecoes)
+        if "cs" in estado and not mais:
+            # Carga concluída: as próximas leituras seguem pelos change streams
+            novo = {"cs": estado["cs"]}
+        else:
+            novo = {**estado, "pos": posicoes}
+        return {"alteracoes": alteracoes, "token": encode_token(novo), "mais": mais,
+                "modo": "change_stream" if "cs" in estado else "sequencia"}
@@ -1,5 +1,6 @@
 import os
 from functools import lru_cache
+from typing import Dict, Optional
 from pydantic import Field, ConfigDict
 from pydantic_settings import BaseSettings
 
@@ -9,10 +10,175 @@ class Settings(BaseSettings):
     MONGODB_URL: str = Field(default="mongodb://localhost:27017")
     JWT_SECRET: str = Field(default="your-secret-key")
     LOG_LEVEL: str = Field(default="INFO")
+
+    # Pipeline de logging: JSON por linha (ou texto), exportado em lotes por uma thread própria
+    LOG_FORMAT: str = Field(default="json")  # json ou text
+    LOG_QUEUE_MAX: int = Field(default=10000)  # Registros além disso são descartados, sem bloquear a requisição
+    LOG_BATCH_SIZE: int = Field(default=200)
+    LOG_FLUSH_INTERVAL_MS: int = Field(default=500)
+    # Fração do log de acesso mantida por nível; níveis ausentes (WARNING, ERROR) são sempre registrados
+    LOG_ACCESS_SAMPLE_RATES: Dict[str, float] = Field(default_factory=lambda: {"DEBUG": 0.0, "INFO": 0.1})
+    LOG_ACCESS_SLOW_MS: int = Field(default=1000)  # Requisições mais lentas são registradas como WARNING
+    APPLICATIONINSIGHTS_CONNECTION_STRING: Optional[str] = Field(default=None)
     JWT_ALGORITHM: str = Field(default="HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(default=30)
     DATABASE_NAME: str = Field(default="investimentos")
 
+    # Motor de armazenamento: "mongo" (MongoDB/Cosmos DB) ou "memory" (em processo)
+    STORAGE_ENGINE: str = Field(default="mongo")
+    MEMORY_SNAPSHOT_PATH: Optional[str] = Field(default=None)  # Snapshot BSON carregado na partida e gravado no desligamento
+    MEMORY_SNAPSHOT_INTERVAL_S: int = Field(default=0)  # 0 desabilita o snapshot periódico
+
+    # Escrita adiada (write-behind) de notificações e transações
+    WRITE_BEHIND_ENABLED: bool = Field(default=False)
+    WRITE_BEHIND_MAX_QUEUE: int = Field(default=10000)
+    WRITE_BEHIND_BATCH_SIZE: int = Field(default=500)
+    WRITE_BEHIND_FLUSH_INTERVAL_MS: int = Field(default=200)
+    WRITE_BEHIND_ENQUEUE_TIMEOUT_MS: int = Field(default=50)  # Após esse tempo com a fila cheia, grava de forma síncrona
+    WRITE_BEHIND_TRANSACOES: bool = Field(default=False)  # Registros financeiros só são adiados se explicitamente permitido
+    # Lotes que falham são regravados com backoff; esgotadas as tentativas, vão para escritas_adiadas_falhas
+    WRITE_BEHIND_MAX_RETRIES: int = Field(default=5)
+    WRITE_BEHIND_RETRY_BASE_MS: int = Field(default=200)
+    WRITE_BEHIND_RETRY_MAX_MS: int = Field(default=5000)
+
+    # Ledger de saldos: um snapshot a cada N lançamentos limita a cauda a percorrer
+    LEDGER_SNAPSHOT_INTERVAL: int = Field(default=100)
+
+    # Feed de alterações (/api/sync/changes): change streams em auto, on ou off
+    SYNC_CHANGE_STREAMS: str = Field(default="auto")
+    SYNC_SETTLE_MS: int = Field(default=2000)  # Atraso antes de o token avançar sobre uma escrita
+
+    # Stream de preços por WebSocket (/ws/precos)
+    PRICE_STREAM_TICK_MS: int = Field(default=100)  # Janela de coalescência
+    PRICE_STREAM_SEND_TIMEOUT_MS: int = Field(default=5000)
+    PRICE_STREAM_MAX_LAG_TICKS: int = Field(default=50)  # Ticks com envio pendente antes de desconectar
+    PRICE_STREAM_MAX_SUBSCRIPTIONS: int = Field(default=500)
+    PRICE_STREAM_POLL_MS: int = Field(default=1000)  # Poll do feed para alterações de outros workers (0 desativa)
+
+    # Tabela de preços compartilhada entre os workers (arquivo mapeado, por padrão em /dev/shm)
+    PRICE_TABLE_ENABLED: bool = Field(default=True)
+    PRICE_TABLE_PATH: str = Field(default="")  # Vazio: /dev/shm/<DATABASE_NAME>_precos
+    PRICE_TABLE_CAPACITY: int = Field(default=16384)  # Slots de 256 bytes; mantenha acima do dobro do número de ações
+    PRICE_TABLE_REFRESH_MS: int = Field(default=500)
+    PRICE_TABLE_RELOAD_S: int = Field(default=300)  # Recarga completa periódica pelo atualizador
+    PRICE_TABLE_MAX_STALENESS_MS: int = Field(default=5000)  # Acima disso as rotas voltam a ler do MongoDB
+
+    # Análise de risco das carteiras (janela de candles diários e cache por carteira)
+    RISCO_JANELA_DIAS: int = Field(default=365)
+    RISCO_CACHE_TTL_S: int = Field(default=300)
+    RISCO_CACHE_MAX_ITENS: int = Field(default=10000)
+
+    # Coalescência de find_one concorrentes em usuarios, acoes e carteiras; o micro-cache
+    # (0 desativa) reaproveita o resultado por alguns milissegundos
+    SINGLEFLIGHT_ENABLED: bool = Field(default=True)
+    SINGLEFLIGHT_CACHE_MS: int = Field(default=0)
+
+    # Limitação de taxa (token bucket): regras "capacidade/período" por rota e tipo_usuario
+    # ("*" vale para os demais tipos) e um limite global por tipo; tipos sem regra não são limitados
+    RATE_LIMIT_ENABLED: bool = Field(default=True)
+    RATE_LIMIT_BACKEND: str = Field(default="memory")  # memory (por worker) ou mongo (compartilhado)
+    RATE_LIMIT_TRUSTED_PROXIES: int = Field(default=1)  # Proxies que acrescentam ao X-Forwarded-For (0 sem proxy na frente)
+    RATE_LIMIT_ROTAS: Dict[str, Dict[str, str]] = Field(default_factory=lambda: {
+        "POST /api/usuarios/login": {"*": "10/minute"},
+        "POST /api/usuarios/registrar": {"*": "5/minute"},
+        "GET /api/carteiras": {"*": "30/minute", "bot": "10/minute"},
+    })
+    RATE_LIMIT_POR_TIPO: Dict[str, str] = Field(default_factory=lambda: {
+        "anonimo": "120/minute",
+        "comum": "600/minute",
+        "bot": "1200/minute",
+    })
+
+    # Threadpool das rotas síncronas e controle de concorrência adaptativo (por worker): acima do
+    # limite as requisições esperam por prioridade e recebem 503 ao passar do orçamento de espera
+    # da prioridade (a "baixa" é descartada primeiro); prioridade por rota e tipo_usuario ("*"
+    # vale para os demais tipos), "normal" para as rotas sem regra
+    THREADPOOL_SIZE: int = Field(default=40)
+    LOAD_SHED_ENABLED: bool = Field(default=True)
+    LOAD_SHED_MIN_CONCURRENCY: int = Field(default=4)
+    LOAD_SHED_MAX_CONCURRENCY: int = Field(default=0)  # 0 usa THREADPOOL_SIZE
+    LOAD_SHED_MAX_QUEUE: int = Field(default=1000)
+    LOAD_SHED_QUEUE_BUDGET_MS: Dict[str, float] = Field(default_factory=lambda: {
+        "alta": 10000, "normal": 1000, "baixa": 100,
+    })
+    LOAD_SHED_PRIORIDADES: Dict[str, Dict[str, str]] = Field(default_factory=lambda: {
+        "POST /api/usuarios/login": {"*": "alta"},
+        "POST /api/usuarios/registrar": {"*": "alta"},
+        "POST /api/carteira/comprar": {"*": "alta"},
+        "GET /api/acoes": {"bot": "baixa"},
+        "GET /api/carteiras": {"bot": "baixa"},
+        "GET /api/sync/changes": {"bot": "baixa"},
+        "GET /api/carteiras/exportar": {"*": "baixa"},
+    })
+
+    # Catálogo de índices (app/indices.py): também recria e remove índices na inicialização
+    # (só para uma instância única; com vários workers use python -m app.indices --aplicar)
+    INDEX_CATALOG_DROP_STALE: bool = Field(default=False)
+
+    # Arquivamento frio (job arquivamento): transações e notificações com mais de ARCHIVE_AFTER_DAYS
+    # vão para coleções mensais <colecao>_arquivo_AAAA_MM, com compressão por bloco ARCHIVE_COMPRESSOR
+    # ("" usa a padrão do servidor); as leituras de períodos antigos consultam o arquivo
+    ARCHIVE_AFTER_DAYS: int = Field(default=365)
+    ARCHIVE_BATCH_SIZE: int = Field(default=1000)
+    ARCHIVE_COMPRESSOR: str = Field(default="zstd")
+
+    # Importação em lote por CSV: linhas válidas gravadas em bulk_write de IMPORT_BATCH_SIZE;
+    # a resposta lista até IMPORT_MAX_ERROS erros por linha (o total é sempre contado)
+    IMPORT_BATCH_SIZE: int = Field(default=1000)
+    IMPORT_MAX_ERROS: int = Field(default=1000)
+
+    # Reconciliação do estoque (job reconciliacao_estoque): faixas de ações agregadas por um pool de
+    # processos; 0 usa um worker por núcleo e 4 faixas por worker
+    INVENTORY_RECONCILE_WORKERS: int = Field(default=0)
+    INVENTORY_RECONCILE_PARTITIONS: int = Field(default=0)
+    INVENTORY_RECONCILE_MAX_DIVERGENCIAS: int = Field(default=1000)  # Divergências gravadas no relatório (o total é sempre contado)
+
+    # Registro de operações lentas do MongoDB (CommandListener) com explain uma vez por forma
+    # de consulta a cada SLOW_QUERY_EXPLAIN_INTERVAL_S; gravado na coleção capped consultas_lentas
+    SLOW_QUERY_ENABLED: bool = Field(default=False)
+    SLOW_QUERY_THRESHOLD_MS: int = Field(default=500)
+    SLOW_QUERY_EXPLAIN_INTERVAL_S: int = Field(default=3600)
+    SLOW_QUERY_MAX_QUEUE: int = Field(default=1000)  # Acima disso as operações lentas são descartadas
+    SLOW_QUERY_CAPPED_BYTES: int = Field(default=16 * 1024 * 1024)
+    SLOW_QUERY_CAPPED_MAX: int = Field(default=10000)
+    SLOW_QUERY_RETENCAO_DIAS: int = Field(default=7)  # TTL quando a coleção não pode ser capped (Cosmos DB)
+
+    # Agendador de jobs (cron em UTC; agendamento vazio desativa o job)
+    JOBS_ENABLED: bool = Field(default=True)
+    JOBS_LEASE_S: int = Field(default=300)  # Lease renovado durante a execução; expira se o worker cair
+    JOBS_JITTER_S: float = Field(default=30.0)
+    JOBS_HISTORICO_DIAS: int = Field(default=30)
+    JOB_RELATORIOS_CRON: str = Field(default="0 4 * * *")
+    JOB_LIMPEZA_NOTIFICACOES_CRON: str = Field(default="30 4 * * *")
+    JOB_RECONCILIACAO_DASHBOARD_CRON: str = Field(default="0 * * * *")
+    JOB_ARQUIVAMENTO_CRON: str = Field(default="0 5 * * *")
+    JOB_RECONCILIACAO_ESTOQUE_CRON: str = Field(default="30 5 * * *")
+    NOTIFICACOES_RETENCAO_DIAS: int = Field(default=90)  # Notificações lidas mais antigas são removidas
+
+    # Retentativas de throttling (erro 16500) do Cosmos DB
+    COSMOS_RETRY_MAX_ATTEMPTS: int = Field(default=5)
+    COSMOS_RETRY_BASE_DELAY_MS: int = Field(default=50)
+    COSMOS_RETRY_MAX_DELAY_MS: int = Field(default=2000)
+    COSMOS_REQUEST_DEADLINE_MS: int = Field(default=10000)
+    COSMOS_TRACK_REQUEST_CHARGE: bool = Field(default=False)  # Lê o RequestCharge das respostas (command listener)
+
+    # Pool de conexões e compressão do protocolo
+    MONGODB_MAX_POOL_SIZE: int = Field(default=100)
+    MONGODB_MIN_POOL_SIZE: int = Field(default=0)
+    MONGODB_MAX_IDLE_TIME_MS: Optional[int] = Field(default=None)
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = Field(default=None)
+    MONGODB_COMPRESSORS: str = Field(default="")  # Ex.: "zstd,snappy,zlib"
+
+    # Roteamento de leituras: escritas e leituras transacionais sempre vão ao primário;
+    # as leituras de listagem/relatórios usam MONGODB_ANALYTICS_READ_PREFERENCE
+    MONGODB_READ_PREFERENCE: str = Field(default="primary")
+    MONGODB_ANALYTICS_READ_PREFERENCE: str = Field(default="secondaryPreferred")
+    MONGODB_ANALYTICS_MAX_STALENESS_S: Optional[int] = Field(default=None)  # Mínimo de 90 s exigido pelo driver
+    MONGODB_READ_CONCERN: Optional[str] = Field(default=None)  # local, majority, available...
+    # Sobrescritas por coleção, em JSON. Ex.: {"acoes": "nearest"} / {"carteiras": "majority"}
+    MONGODB_ANALYTICS_READ_PREFERENCES: Dict[str, str] = Field(default_factory=dict)
+    MONGODB_READ_CONCERNS: Dict[str, str] = Field(default_factory=dict)
+
     model_config = ConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
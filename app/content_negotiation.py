@@ -0,0 +1,152 @@
+"""
+Negociação de conteúdo: respostas e corpos em msgpack (ou CBOR) além de JSON.
+
+Os bots processam listas de carteiras e ações em grande volume e gastam boa parte da CPU
+com JSON. Qualquer rota da API pode responder em msgpack ou CBOR conforme o cabeçalho
+Accept (com pesos q; sem Accept ou com */*, JSON), e os corpos das requisições (ex.:
+CompraAcao) podem ser enviados com Content-Type msgpack ou CBOR.
+
+A validação continua a mesma: o corpo decodificado passa pelo mesmo modelo pydantic que o
+JSON, e a resposta é serializada pelo response_model antes de codificada, então os tipos
+são os do JSON (ids e datas como texto). Só muda a codificação dos bytes.
+
+NegotiatingRoute (route_class do router) escolhe o formato da resposta pelo Accept e o
+guarda em context.formato_resposta; NegotiatedResponse (default_response_class) o lê ao
+renderizar. Respostas montadas pela própria rota (StreamingResponse) e as de erro dos
+exception handlers continuam como estão.
+
+CBOR requer cbor2 instalado; sem ele, o Accept CBOR é ignorado (resposta em JSON) e um
+corpo CBOR recebe 415.
+"""
+import functools
+from typing import Any, Callable, Dict, Mapping, Optional
+
+import msgpack
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+
+from . import context
+
+try:  # cbor2 é opcional
+    import cbor2
+except ImportError:  # pragma: no cover - depende do ambiente
+    cbor2 = None
+
+# Tipo de mídia -> formato (aceitos no Accept e no Content-Type)
+TIPOS: Dict[str, str] = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/cbor": "cbor",
+}
+
+# Tipo de mídia das respostas por formato (o msgpack como na exportação em lote)
+MEDIA_TYPES: Dict[str, str] = {
+    "json": "application/json",
+    "msgpack": "application/x-msgpack",
+    "cbor": "application/cbor",
+}
+
+
+def disponiveis() -> tuple:
+    return ("json", "msgpack", "cbor") if cbor2 is not None else ("json", "msgpack")
+
+
+@functools.lru_cache(maxsize=256)
+def escolher_formato(accept: Optional[str]) -> str:
+    """Formato de maior peso q no Accept entre os disponíveis; JSON se nenhum servir."""
+    if not accept:
+        return "json"
+    melhor, melhor_q = "json", 0.0
+    for item in accept.split(","):
+        tipo, *parametros = [parte.strip() for parte in item.split(";")]
+        tipo = tipo.lower()
+        formato = "json" if tipo in ("*/*", "application/*") else TIPOS.get(tipo)
+        if formato is None or formato not in disponiveis():
+            continue
+        q = 1.0
+        for parametro in parametros:
+            nome, _, valor = parametro.partition("=")
+            if nome.strip().lower() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        # Em caso de empate vale a ordem do cabeçalho
+        if q > melhor_q:
+            melhor, melhor_q = formato, q
+    return melhor
+
+
+def codificar(conteudo: Any, formato: str) -> bytes:
+    if formato == "msgpack":
+        return msgpack.packb(conteudo, use_bin_type=True)
+    if formato == "cbor":
+        return cbor2.dumps(conteudo)
+    raise ValueError(f"Formato desconhecido: {formato}")
+
+
+def decodificar(corpo: bytes, formato: str) -> Any:
+    if formato == "msgpack":
+        return msgpack.unpackb(corpo, raw=False)
+    if formato == "cbor":
+        return cbor2.loads(corpo)
+    raise ValueError(f"Formato desconhecido: {formato}")
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSONResponse que codifica em msgpack/CBOR quando a rota negociou outro formato."""
+
+    # Mesma assinatura do Response: o FastAPI lê o status_code padrão dela para o OpenAPI
+    def __init__(self, content: Any = None, status_code: int = 200, headers: Optional[Mapping[str, str]] = None,
+                 media_type: Optional[str] = None, background: Optional[BackgroundTask] = None):
+        self.formato = context.formato_resposta.get() or "json"
+        if self.formato != "json":
+            self.media_type = MEDIA_TYPES[self.formato]
+        super().__init__(content, status_code, headers, media_type, background)
+        self.headers.add_vary_header("Accept")
+
+    def render(self, content: Any) -> bytes:
+        if self.formato == "json":
+            return super().render(content)
+        return codificar(content, self.formato)
+
+
+class _RequisicaoBinaria(Request):
+    """Requisição com corpo msgpack/CBOR apresentada ao FastAPI como JSON já decodificado."""
+
+    def __init__(self, request: Request, formato: str):
+        # O FastAPI só chama request.json() para Content-Type JSON
+        cabecalhos = [(nome, valor) for nome, valor in request.scope["headers"] if nome != b"content-type"]
+        cabecalhos.append((b"content-type", b"application/json"))
+        super().__init__({**request.scope, "headers": cabecalhos}, request.receive)
+        self._formato_corpo = formato
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            # Erros de decodificação viram 400 no FastAPI, como um JSON malformado
+            self._json = decodificar(await self.body(), self._formato_corpo)
+        return self._json
+
+
+class NegotiatingRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negociar(request: Request) -> Response:
+            tipo = request.headers.get("content-type", "").split(";")[0].strip().lower()
+            formato_corpo = TIPOS.get(tipo, "json")
+            if formato_corpo != "json":
+                if formato_corpo not in disponiveis():
+                    raise HTTPException(status_code=415, detail=f"Formato do corpo indisponível: {tipo}")
+                request = _RequisicaoBinaria(request, formato_corpo)
+            token = context.formato_resposta.set(escolher_formato(request.headers.get("accept")))
+            try:
+                return await handler(request)
+            finally:
+                context.formato_resposta.reset(token)
+
+        return negociar
@@ -0,0 +1,17 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# Variáveis de contexto da requisição HTTP em andamento.
+# Definidas pelo middleware em app.main e lidas pela camada de acesso a dados.
+
+# Template da rota atendida (ex.: "/api/acoes/{acao_id}")
+rota_atual: ContextVar[Optional[str]] = ContextVar("rota_atual", default=None)
+
+# Instante (time.monotonic) a partir do qual a requisição não deve mais aguardar o banco
+prazo_requisicao: ContextVar[Optional[float]] = ContextVar("prazo_requisicao", default=None)
+
+# Identificador da requisição (X-Request-ID recebido ou gerado), incluído nos logs
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Formato negociado da resposta pelo cabeçalho Accept ("json", "msgpack" ou "cbor")
+formato_resposta: ContextVar[Optional[str]] = ContextVar("formato_resposta", default=None)
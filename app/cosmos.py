@@ -0,0 +1,310 @@
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import monitoring
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from .context import prazo_requisicao, rota_atual
+
+logger = logging.getLogger(__name__)
+
+# Código retornado pelo Cosmos DB (API MongoDB) quando a taxa de RUs é excedida (HTTP 429)
+THROTTLING_CODE = 16500
+
+_RETRY_AFTER_RE = re.compile(r"RetryAfterMs=(\d+)")
+
+# Campos com o custo em RUs na resposta dos comandos do Cosmos DB
+_CAMPOS_REQUEST_CHARGE = ("RequestCharge", "requestCharge", "$requestCharge")
+
+
+def is_throttle_error(exc: Exception) -> bool:
+    """Indica se a exceção corresponde a um throttling (16500) do Cosmos DB."""
+    if isinstance(exc, BulkWriteError):
+        erros = exc.details.get("writeErrors", []) if exc.details else []
+        return any(erro.get("code") == THROTTLING_CODE for erro in erros)
+    if isinstance(exc, OperationFailure):
+        return exc.code == THROTTLING_CODE
+    return False
+
+
+def retry_after_ms(exc: Exception) -> Optional[int]:
+    """Extrai o RetryAfterMs informado pelo servidor na mensagem de erro, se houver."""
+    textos = [str(exc)]
+    details = getattr(exc, "details", None) or {}
+    textos.append(str(details.get("errmsg", "")))
+    for erro in details.get("writeErrors", []):
+        textos.append(str(erro.get("errmsg", "")))
+    for texto in textos:
+        encontrado = _RETRY_AFTER_RE.search(texto)
+        if encontrado:
+            return int(encontrado.group(1))
+    return None
+
+
+def _bulk_write_parcial(exc: Exception) -> bool:
+    """Um BulkWriteError que já aplicou parte das escritas não pode ser repetido com segurança."""
+    if not isinstance(exc, BulkWriteError) or not exc.details:
+        return False
+    return any(exc.details.get(campo, 0) for campo in ("nInserted", "nUpserted", "nModified", "nRemoved"))
+
+
+class RetryPolicy:
+    """Política de retentativa para erros de throttling."""
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay_ms: int = 50,
+        max_delay_ms: int = 2000,
+        deadline_ms: int = 10000,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.deadline_ms = deadline_ms
+
+    def delay(self, attempt: int, retry_after: Optional[int]) -> float:
+        """Tempo de espera (em segundos) antes da próxima tentativa."""
+        if retry_after is not None:
+            # Respeita o valor do servidor, com um pequeno jitter para não sincronizar os clientes
+            espera_ms = retry_after + random.uniform(0, self.base_delay_ms)
+        else:
+            # Backoff exponencial com "full jitter"
+            teto = min(self.max_delay_ms, self.base_delay_ms * (2 ** (attempt - 1)))
+            espera_ms = random.uniform(0, teto)
+        return min(espera_ms, self.max_delay_ms) / 1000.0
+
+
+class RequestChargeListener(monitoring.CommandListener):
+    """
+    Lê o custo em RUs da resposta de cada comando (CommandSucceededEvent.reply).
+
+    O pymongo publica os eventos na thread que executa a operação, então o total por thread
+    atribui a cada operação exatamente os comandos que ela enviou, na mesma conexão e sem
+    uma consulta extra ao servidor (como seria com getLastRequestStatistics).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def started(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def succeeded(self, event):
+        for campo in _CAMPOS_REQUEST_CHARGE:
+            valor = event.reply.get(campo) if isinstance(event.reply, dict) else None
+            if isinstance(valor, (int, float)):
+                self._local.total = self.total() + float(valor)
+                self._local.respostas = self.respostas() + 1
+                return
+
+    def total(self) -> float:
+        return getattr(self._local, "total", 0.0)
+
+    def respostas(self) -> int:
+        return getattr(self._local, "respostas", 0)
+
+
+class RequestChargeMetrics:
+    """Acumula o consumo de RUs e os throttlings por rota e operação."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dados: Dict[tuple, Dict[str, float]] = {}
+
+    def _entrada(self, rota: str, operacao: str) -> Dict[str, float]:
+        chave = (rota, operacao)
+        if chave not in self._dados:
+            self._dados[chave] = {
+                "chamadas": 0,
+                "ru_total": 0.0,
+                "throttles": 0,
+                "retentativas": 0,
+                "falhas": 0,
+            }
+        return self._dados[chave]
+
+    def record_call(self, rota: str, operacao: str, request_charge: Optional[float]):
+        with self._lock:
+            entrada = self._entrada(rota, operacao)
+            entrada["chamadas"] += 1
+            if request_charge is not None:
+                entrada["ru_total"] += request_charge
+
+    def record_throttle(self, rota: str, operacao: str, retried: bool):
+        with self._lock:
+            entrada = self._entrada(rota, operacao)
+            entrada["throttles"] += 1
+            if retried:
+                entrada["retentativas"] += 1
+            else:
+                entrada["falhas"] += 1
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Retorna as métricas ordenadas pelo consumo total de RUs."""
+        with self._lock:
+            itens = [
+                {
+                    "rota": rota,
+                    "operacao": operacao,
+                    "chamadas": int(valores["chamadas"]),
+                    "ru_total": round(valores["ru_total"], 2),
+                    "ru_medio": round(valores["ru_total"] / valores["chamadas"], 2) if valores["chamadas"] else 0.0,
+                    "throttles": int(valores["throttles"]),
+                    "retentativas": int(valores["retentativas"]),
+                    "falhas": int(valores["falhas"]),
+                }
+                for (rota, operacao), valores in self._dados.items()
+            ]
+        return sorted(itens, key=lambda item: item["ru_total"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._dados.clear()
+
+
+class ThrottledCollection:
+    """
+    Envolve uma coleção do pymongo repetindo operações que sofrem throttling (16500)
+    e registrando o consumo de RUs de cada operação por rota.
+    """
+
+    def __init__(
+        self,
+        collection,
+        policy: RetryPolicy,
+        metrics: RequestChargeMetrics,
+        request_charge: Optional[RequestChargeListener] = None,
+    ):
+        self._collection = collection
+        self._policy = policy
+        self._metrics = metrics
+        self._request_charge = request_charge
+
+    def __getattr__(self, nome: str):
+        atributo = getattr(self._collection, nome)
+        if not callable(atributo):
+            return atributo
+        if nome == "find":
+            return lambda *args, **kwargs: _RetryingCursor(self, args, kwargs)
+        if nome == "with_options":
+            return lambda *args, **kwargs: ThrottledCollection(
+                atributo(*args, **kwargs), self._policy, self._metrics, self._request_charge
+            )
+
+        def executar(*args, **kwargs):
+            return self._execute(nome, lambda: atributo(*args, **kwargs))
+
+        return executar
+
+    def __getitem__(self, nome: str):
+        return ThrottledCollection(
+            self._collection[nome], self._policy, self._metrics, self._request_charge
+        )
+
+    def _deadline(self, inicio: float) -> float:
+        prazo = inicio + self._policy.deadline_ms / 1000.0
+        prazo_contexto = prazo_requisicao.get()
+        if prazo_contexto is not None:
+            prazo = min(prazo, prazo_contexto)
+        return prazo
+
+    def _execute(self, operacao: str, funcao: Callable[[], Any]) -> Any:
+        rota = rota_atual.get() or "-"
+        prazo = self._deadline(time.monotonic())
+        tentativa = 0
+        if self._request_charge is not None:
+            total, respostas = self._request_charge.total(), self._request_charge.respostas()
+        while True:
+            try:
+                resultado = funcao()
+            except OperationFailure as exc:
+                if not is_throttle_error(exc) or _bulk_write_parcial(exc):
+                    raise
+                tentativa += 1
+                espera = self._policy.delay(tentativa, retry_after_ms(exc))
+                if tentativa >= self._policy.max_attempts or time.monotonic() + espera > prazo:
+                    self._metrics.record_throttle(rota, operacao, retried=False)
+                    logger.warning(
+                        f"Throttling em {self._collection.name}.{operacao} ({rota}) "
+                        f"após {tentativa} tentativa(s); desistindo"
+                    )
+                    raise
+                self._metrics.record_throttle(rota, operacao, retried=True)
+                time.sleep(espera)
+                continue
+            carga = None
+            # Soma das respostas desta thread durante a operação (inclui as retentativas);
+            # MongoDB "puro" não informa o custo e a carga fica vazia
+            if self._request_charge is not None and self._request_charge.respostas() > respostas:
+                carga = self._request_charge.total() - total
+            self._metrics.record_call(rota, operacao, carga)
+            return resultado
+
+
+class _RetryingCursor:
+    """
+    Cursor preguiçoso: a consulta só é enviada na iteração e a obtenção do primeiro
+    lote é repetida em caso de throttling. Os lotes seguintes (getMore) não são repetidos.
+    """
+
+    _CHAINABLE = {
+        "sort", "skip", "limit", "batch_size", "hint", "max_time_ms",
+        "collation", "comment", "allow_disk_use", "max", "min", "where",
+    }
+
+    def __init__(self, owner: ThrottledCollection, args: tuple, kwargs: dict):
+        self._owner = owner
+        self._args = args
+        self._kwargs = kwargs
+        self._chamadas: List[tuple] = []
+        self._iterador = None
+
+    def _build(self):
+        cursor = self._owner._collection.find(*self._args, **self._kwargs)
+        for nome, args, kwargs in self._chamadas:
+            cursor = getattr(cursor, nome)(*args, **kwargs)
+        return cursor
+
+    def __getattr__(self, nome: str):
+        if nome in self._CHAINABLE:
+            def encadear(*args, **kwargs):
+                self._chamadas.append((nome, args, kwargs))
+                return self
+            return encadear
+
+        # Demais métodos (explain, distinct, ...) executam sobre um cursor novo
+        def executar(*args, **kwargs):
+            return self._owner._execute(f"find.{nome}", lambda: getattr(self._build(), nome)(*args, **kwargs))
+
+        return executar
+
+    def _first(self):
+        cursor = self._build()
+        return cursor, next(cursor, None)
+
+    def _generate(self):
+        cursor, primeiro = self._owner._execute("find", self._first)
+        if primeiro is None:
+            return
+        yield primeiro
+        yield from cursor
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterador is None:
+            self._iterador = self._generate()
+        return next(self._iterador)
+
+    def close(self):
+        if self._iterador is not None:
+            self._iterador.close()
@@ -0,0 +1,130 @@
+"""
+Preço médio ponderado (custo de aquisição) das posições das carteiras.
+
+A compra grava a posição com um update em pipeline de agregação: na mesma escrita atômica,
+a posição existente recebe qtd + q e preco_compra = (qtd·preco_compra + q·preco) / (qtd + q),
+ou é acrescentada ao array se a carteira ainda não tem a ação. Assim o preço médio não
+depende de reler transacoes, e compras concorrentes da mesma carteira não sobrescrevem o
+array uma da outra.
+
+Posições gravadas antes guardam o preço da primeira compra; recalcular() refaz o preço médio
+a partir das compras em transacoes (incluindo os meses arquivados), por lotes de carteiras
+gravados com bulk_write. Posições cuja quantidade não bate com a soma das compras (ver
+app.reconciliacao_estoque) são mantidas como estão.
+
+Recálculo (uma vez, após o deploy):
+    python -m app.custo_medio --lote 1000
+"""
+import argparse
+import json
+import logging
+import math
+from typing import Any, Dict, List, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .database import arquivo_transacoes, carteiras, transacoes
+from . import dashboard
+
+logger = logging.getLogger(__name__)
+
+
+def atualizacao_compra(acao_id: Any, quantidade: int, preco: float) -> List[dict]:
+    """Pipeline de update que soma a compra à posição e atualiza o preço médio ponderado."""
+    # Posições antigas podem ter o acao_id gravado como texto
+    mesma_acao = {"$in": ["$$posicao.acao_id", [ObjectId(acao_id), str(acao_id)]]}
+    posicao_atualizada = {"$mergeObjects": ["$$posicao", {
+        "qtd": {"$add": ["$$posicao.qtd", quantidade]},
+        "preco_compra": {"$divide": [
+            {"$add": [{"$multiply": ["$$posicao.qtd", {"$ifNull": ["$$posicao.preco_compra", 0]}]},
+                      quantidade * preco]},
+            {"$add": ["$$posicao.qtd", quantidade]},
+        ]},
+    }]}
+    return [
+        {"$set": {"acoes": {"$ifNull": ["$acoes", []]}}},
+        {"$set": {
+            "acoes": {"$cond": [
+                {"$gt": [{"$size": {"$filter": {"input": "$acoes", "as": "posicao", "cond": mesma_acao}}}, 0]},
+                {"$map": {"input": "$acoes", "as": "posicao", "in": {"$cond": [mesma_acao, posicao_atualizada, "$$posicao"]}}},
+                {"$concatArrays": ["$acoes", [{"acao_id": ObjectId(acao_id), "qtd": quantidade, "preco_compra": preco}]]},
+            ]},
+            "versao_posicoes": {"$add": [{"$ifNull": ["$versao_posicoes", 0]}, 1]},
+        }},
+    ]
+
+
+def _compras(usuario_ids: List[ObjectId]) -> Dict[Tuple[Any, str], Tuple[int, float]]:
+    """Quantidade e valor comprados por (usuario_id, acao_id) das carteiras do lote."""
+    pipeline = [
+        {"$match": {"usuario_id": {"$in": usuario_ids}, "tipo": "compra"}},
+        {"$group": {
+            "_id": {"usuario_id": "$usuario_id", "acao_id": "$acao_id"},
+            "qtd": {"$sum": "$qtd"},
+            "valor": {"$sum": {"$ifNull": ["$valor", {"$multiply": ["$qtd", "$preco_unitario"]}]}},
+        }},
+    ]
+    compras: Dict[Tuple[Any, str], Tuple[int, float]] = {}
+    for colecao in [transacoes] + arquivo_transacoes.colecoes():
+        for grupo in colecao.aggregate(pipeline):
+            chave = (grupo["_id"]["usuario_id"], str(grupo["_id"]["acao_id"]))
+            qtd, valor = compras.get(chave, (0, 0.0))
+            compras[chave] = (qtd + grupo["qtd"], valor + grupo["valor"])
+    return compras
+
+
+def recalcular(tamanho_lote: int = 1000) -> dict:
+    """Recalcula o preço médio de todas as posições a partir das compras registradas."""
+    resumo = {"carteiras": 0, "atualizadas": 0, "alteradas_durante": 0, "posicoes_divergentes": 0}
+    ultimo = None
+    while True:
+        filtro = {"_id": {"$gt": ultimo}} if ultimo is not None else {}
+        lote = list(carteiras.find(filtro, {"usuario_id": 1, "acoes": 1, "versao_posicoes": 1})
+                    .sort("_id", 1).limit(tamanho_lote))
+        if not lote:
+            break
+        ultimo = lote[-1]["_id"]
+        resumo["carteiras"] += len(lote)
+        compras = _compras([carteira["usuario_id"] for carteira in lote])
+        operacoes = []
+        for carteira in lote:
+            atribuicoes, filtros = {}, []
+            for posicao in carteira.get("acoes", []):
+                qtd, valor = compras.get((carteira["usuario_id"], str(posicao["acao_id"])), (0, 0.0))
+                if qtd != posicao["qtd"] or not qtd:
+                    resumo["posicoes_divergentes"] += 1
+                    continue
+                medio = valor / qtd
+                if math.isclose(medio, posicao.get("preco_compra", 0.0)):
+                    continue
+                identificador = f"p{len(filtros)}"
+                atribuicoes[f"acoes.$[{identificador}].preco_compra"] = medio
+                filtros.append({f"{identificador}.acao_id": posicao["acao_id"]})
+            if atribuicoes:
+                # A versão das posições impede sobrescrever uma compra gravada depois da leitura
+                operacoes.append(UpdateOne(
+                    {"_id": carteira["_id"], "versao_posicoes": carteira.get("versao_posicoes")},
+                    {"$set": atribuicoes},
+                    array_filters=filtros,
+                ))
+        if operacoes:
+            resultado = carteiras.bulk_write(operacoes, ordered=False)
+            resumo["atualizadas"] += resultado.matched_count
+            resumo["alteradas_durante"] += len(operacoes) - resultado.matched_count
+    if resumo["atualizadas"]:
+        # O valor investido do painel é a soma de qtd x preco_compra. As posições já foram
+        # gravadas: uma falha aqui fica para o job reconciliacao_dashboard
+        try:
+            dashboard.reconciliar()
+        except Exception:
+            logger.exception("Falha ao reconciliar o painel após o recálculo do preço médio")
+    logger.info(f"Preço médio recalculado: {resumo}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula o preço médio ponderado das posições a partir das compras")
+    parser.add_argument("--lote", type=int, default=1000)
+    argumentos = parser.parse_args()
+    print(json.dumps(recalcular(argumentos.lote), indent=2, ensure_ascii=False))
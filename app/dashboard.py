@@ -0,0 +1,227 @@
+"""
+Painel administrativo materializado.
+
+Os números do painel ficam em um único documento (estatisticas/_id="dashboard"),
+atualizado com $inc pelas próprias rotas que alteram os dados: solicitação e decisão de
+depósitos, compras de ações e alterações de preço. Assim o painel é a leitura de um
+documento, sem varrer depositos, carteiras e acoes.
+
+Cada incremento soma 1 ao campo versao. A reconciliação recalcula tudo por agregação e
+aplica as diferenças como um $inc compensatório, que não depende da versão: incrementos
+que chegam depois da leitura do documento continuam somados. Se a versão mudou durante o
+cálculo, não dá para saber se a agregação já viu aquelas alterações, então o cálculo é
+refeito; esgotadas as tentativas (tráfego contínuo), as diferenças são aplicadas assim
+mesmo e o que estava em andamento fica para a reconciliação seguinte. Ela corrige desvios
+que os incrementos não cobrem, como a mudança de risco de uma ação, e registra as
+divergências encontradas.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict
+
+from bson import ObjectId
+
+from pymongo.errors import DuplicateKeyError
+
+from .database import acoes, carteiras, depositos, estatisticas
+
+logger = logging.getLogger(__name__)
+
+DOCUMENTO_ID = "dashboard"
+
+_STATUS_DEPOSITO = ("pendente", "aprovado", "rejeitado")
+
+
+def _inc(incrementos: Dict[str, Any]):
+    estatisticas.update_one(
+        {"_id": DOCUMENTO_ID},
+        {"$inc": {**incrementos, "versao": 1}, "$set": {"atualizado_em": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Incrementos chamados pelas rotas
+# ---------------------------------------------------------------------------
+
+def deposito_solicitado(valor: float):
+    _inc({"depositos.pendente.qtd": 1, "depositos.pendente.valor": valor})
+
+
+def deposito_decidido(valor: float, aprovado: bool):
+    destino = "aprovado" if aprovado else "rejeitado"
+    incrementos = {
+        "depositos.pendente.qtd": -1,
+        "depositos.pendente.valor": -valor,
+        f"depositos.{destino}.qtd": 1,
+        f"depositos.{destino}.valor": valor,
+    }
+    if aprovado:
+        incrementos["caixa_total"] = valor
+    _inc(incrementos)
+
+
+def compra_realizada(acao_id: Any, risco: int, quantidade: int, valor_total: float):
+    """
+    Compra debitada: valor_total sai do caixa. Com o preço médio ponderado, o custo da posição
+    (qtd x preco_compra) cresce exatamente o valor pago.
+    """
+    _inc({
+        "caixa_total": -valor_total,
+        "valor_investido": valor_total,
+        "valor_mercado": valor_total,
+        f"qtd_por_acao.{ObjectId(acao_id)}": quantidade,
+        f"por_risco.{risco}.qtd": quantidade,
+        f"por_risco.{risco}.valor_investido": valor_total,
+    })
+
+
+def preco_alterado(acao_id: Any, variacao: float):
+    """Reavalia as posições da ação a preço de mercado (quantidade detida lida do próprio painel)."""
+    precos_alterados({acao_id: variacao})
+
+
+def precos_alterados(variacoes: Dict[Any, float]):
+    """
+    Várias ações de uma vez (importação em lote). A quantidade detida é lida pelo próprio
+    update (pipeline), então uma compra concorrente não fica fora da reavaliação.
+    """
+    variacoes = {str(ObjectId(acao_id)): variacao for acao_id, variacao in variacoes.items() if variacao}
+    if not variacoes:
+        return
+    valor = {"$add": [
+        {"$multiply": [variacao, {"$ifNull": [f"$qtd_por_acao.{acao_id}", 0]}]}
+        for acao_id, variacao in variacoes.items()
+    ]}
+    estatisticas.update_one(
+        {"_id": DOCUMENTO_ID},
+        [{"$set": {
+            "valor_mercado": {"$add": [{"$ifNull": ["$valor_mercado", 0]}, valor]},
+            "versao": {"$add": [{"$ifNull": ["$versao", 0]}, 1]},
+            "atualizado_em": datetime.utcnow(),
+        }}],
+        upsert=True,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Leitura e reconciliação
+# ---------------------------------------------------------------------------
+
+def obter() -> dict:
+    documento = estatisticas.find_one({"_id": DOCUMENTO_ID}, {"qtd_por_acao": 0}) or {}
+    depositos_doc = documento.get("depositos", {})
+    caixa = round(documento.get("caixa_total", 0.0), 2)
+    valor_mercado = round(documento.get("valor_mercado", 0.0), 2)
+    return {
+        "depositos": {
+            status: {
+                "qtd": depositos_doc.get(status, {}).get("qtd", 0),
+                "valor": round(depositos_doc.get(status, {}).get("valor", 0.0), 2),
+            }
+            for status in _STATUS_DEPOSITO
+        },
+        "caixa_total": caixa,
+        "valor_investido": round(documento.get("valor_investido", 0.0), 2),
+        "valor_mercado": valor_mercado,
+        "aum": round(caixa + valor_mercado, 2),
+        "por_risco": [
+            {"risco": int(risco), "qtd": dados.get("qtd", 0), "valor_investido": round(dados.get("valor_investido", 0.0), 2)}
+            for risco, dados in sorted(documento.get("por_risco", {}).items(), key=lambda item: int(item[0]))
+        ],
+        "atualizado_em": documento.get("atualizado_em"),
+        "reconciliado_em": documento.get("reconciliado_em"),
+    }
+
+
+def _achatar(documento: dict, prefixo: str = "") -> Dict[str, float]:
+    campos = {}
+    for chave, valor in documento.items():
+        caminho = f"{prefixo}{chave}"
+        if isinstance(valor, dict):
+            campos.update(_achatar(valor, caminho + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            campos[caminho] = valor
+    return campos
+
+
+def calcular() -> dict:
+    """Recalcula os agregados a partir das coleções de origem."""
+    calculado: Dict[str, Any] = {
+        "depositos": {status: {"qtd": 0, "valor": 0.0} for status in _STATUS_DEPOSITO},
+        "caixa_total": 0.0,
+        "valor_investido": 0.0,
+        "valor_mercado": 0.0,
+        "qtd_por_acao": {},
+        "por_risco": {},
+    }
+    for grupo in depositos.aggregate([
+        {"$group": {"_id": "$status", "qtd": {"$sum": 1}, "valor": {"$sum": "$valor"}}},
+    ]):
+        # "creditando" é a aprovação em andamento: conta como pendente até concluir
+        status = "pendente" if grupo["_id"] == "creditando" else grupo["_id"]
+        if status in calculado["depositos"]:
+            calculado["depositos"][status]["qtd"] += grupo["qtd"]
+            calculado["depositos"][status]["valor"] += grupo["valor"]
+
+    for grupo in carteiras.aggregate([{"$group": {"_id": None, "saldo": {"$sum": "$saldo"}}}]):
+        calculado["caixa_total"] = grupo["saldo"]
+
+    posicoes = list(carteiras.aggregate([
+        {"$unwind": "$acoes"},
+        {"$group": {
+            "_id": "$acoes.acao_id",
+            "qtd": {"$sum": "$acoes.qtd"},
+            "custo": {"$sum": {"$multiply": ["$acoes.qtd", {"$ifNull": ["$acoes.preco_compra", 0]}]}},
+        }},
+    ]))
+    ids = [ObjectId(p["_id"]) for p in posicoes]
+    catalogo = {a["_id"]: a for a in acoes.find({"_id": {"$in": ids}}, {"preco": 1, "risco": 1})}
+    for posicao in posicoes:
+        acao = catalogo.get(ObjectId(posicao["_id"]), {})
+        risco = str(acao.get("risco", 1))
+        calculado["qtd_por_acao"][str(ObjectId(posicao["_id"]))] = posicao["qtd"]
+        calculado["valor_investido"] += posicao["custo"]
+        calculado["valor_mercado"] += posicao["qtd"] * acao.get("preco", 0.0)
+        faixa = calculado["por_risco"].setdefault(risco, {"qtd": 0, "valor_investido": 0.0})
+        faixa["qtd"] += posicao["qtd"]
+        faixa["valor_investido"] += posicao["custo"]
+    return calculado
+
+
+def reconciliar(tolerancia: float = 0.005, max_tentativas: int = 5) -> dict:
+    """Recalcula os agregados e aplica as diferenças ao documento materializado com $inc."""
+    for tentativa in range(1, max_tentativas + 1):
+        versao = (estatisticas.find_one({"_id": DOCUMENTO_ID}, {"versao": 1}) or {}).get("versao")
+        calculado = calcular()
+        documento = estatisticas.find_one({"_id": DOCUMENTO_ID}) or {}
+        em_andamento = documento.get("versao") != versao
+        if em_andamento and tentativa < max_tentativas:
+            continue
+
+        atual, achatado = _achatar(documento), _achatar(calculado)
+        diferencas = {
+            campo: valor - atual.get(campo, 0)
+            for campo, valor in achatado.items()
+            if abs(valor - atual.get(campo, 0)) > tolerancia
+        }
+        # Campos que existem só no documento (ex.: ação que ninguém mais detém) voltam a zero
+        for campo, valor in atual.items():
+            if campo not in achatado and campo.startswith(("qtd_por_acao.", "por_risco.")) and abs(valor) > tolerancia:
+                diferencas[campo] = -valor
+        agora = datetime.utcnow()
+        atualizacao: Dict[str, Any] = {"$set": {"reconciliado_em": agora, "ultimas_divergencias": len(diferencas)}}
+        if diferencas:
+            atualizacao["$inc"] = diferencas
+        try:
+            estatisticas.update_one({"_id": DOCUMENTO_ID}, atualizacao, upsert=True)
+        except DuplicateKeyError:
+            # O documento foi criado por um incremento concorrente: o update já o encontra
+            estatisticas.update_one({"_id": DOCUMENTO_ID}, atualizacao)
+        if em_andamento:
+            logger.warning(f"Painel alterado durante {max_tentativas} tentativas de reconciliação; "
+                           "incrementos em andamento ficam para a próxima")
+        if diferencas:
+            logger.warning(f"Painel reconciliado com {len(diferencas)} divergência(s): {sorted(diferencas)}")
+        return {"divergencias": {campo: round(valor, 2) for campo, valor in diferencas.items()},
+                "reconciliado_em": agora}
@@ -1,51 +1,233 @@
 import pymongo
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from .archive import MonthlyArchive
+from .change_feed import ChangeFeed, SequenceAllocator, SequencedCollection
 from .config import get_settings
+from .cosmos import RequestChargeListener, RequestChargeMetrics, RetryPolicy, ThrottledCollection
+from .indices import catalogo, garantir_indices
+from .singleflight import CoalescingCollection
+from .slow_queries import SlowQueryRecorder
+from .structured_logging import configure_logging
+from .storage import ENGINES, MemoryDatabase, Repository
+from .write_behind import WriteBehindQueue
 import logging
-import sys
-
-# Configurar logging
-logging.basicConfig(stream=sys.stdout, level=logging.INFO)
-logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+# Pipeline de logging assíncrono (fila + thread de exportação), instalado uma vez por processo
+configure_logging(settings)
+logger = logging.getLogger(__name__)
+
 # Configuração do MongoDB
 MONGODB_URL = settings.MONGODB_URL
 
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def _read_preference(nome: str, max_staleness_s=None):
+    """Converte o nome do modo de leitura (ex.: secondaryPreferred) no objeto do pymongo."""
+    if nome not in _READ_PREFERENCES:
+        raise ValueError(f"Read preference inválida: {nome}")
+    if nome == "primary" or not max_staleness_s:
+        return _READ_PREFERENCES[nome]()
+    return _READ_PREFERENCES[nome](max_staleness=max_staleness_s)
+
+def _opcoes_cliente() -> dict:
+    """Opções de pool, compressão e leitura configuráveis pelo Settings."""
+    opcoes = {
+        "maxPoolSize": settings.MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": settings.MONGODB_MIN_POOL_SIZE,
+        "readPreference": settings.MONGODB_READ_PREFERENCE,
+    }
+    if settings.MONGODB_MAX_IDLE_TIME_MS is not None:
+        opcoes["maxIdleTimeMS"] = settings.MONGODB_MAX_IDLE_TIME_MS
+    if settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS is not None:
+        opcoes["waitQueueTimeoutMS"] = settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS
+    if settings.MONGODB_COMPRESSORS:
+        # zstd e snappy dependem dos pacotes zstandard e python-snappy
+        opcoes["compressors"] = settings.MONGODB_COMPRESSORS
+    if settings.MONGODB_READ_CONCERN:
+        opcoes["readConcernLevel"] = settings.MONGODB_READ_CONCERN
+    return opcoes
+
+def parametros_cliente() -> dict:
+    """Parâmetros do MongoClient da aplicação, sem os listeners (reusados pelos processos auxiliares)."""
+    return {
+        "serverSelectionTimeoutMS": 30000,
+        "connectTimeoutMS": 30000,
+        "socketTimeoutMS": 30000,
+        "tlsAllowInvalidCertificates": True,  # Necessário para alguns ambientes Azure
+        **_opcoes_cliente(),
+    }
+
+# Registro de operações lentas; o listener só pode ser instalado na criação do cliente
+slow_queries = SlowQueryRecorder(
+    threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+    explain_interval_s=settings.SLOW_QUERY_EXPLAIN_INTERVAL_S,
+    max_queue=settings.SLOW_QUERY_MAX_QUEUE,
+)
+
+# Custo em RUs lido das respostas dos comandos (também só instalável na criação do cliente)
+request_charge_listener = RequestChargeListener() if settings.COSMOS_TRACK_REQUEST_CHARGE else None
+
 logger.info(f"Ambiente: {settings.ENVIRONMENT}")
-logger.info("Tentando conectar ao MongoDB...")
-
-try:
-    # Cliente MongoDB com configurações simplificadas
-    client = pymongo.MongoClient(
-        MONGODB_URL,
-        serverSelectionTimeoutMS=30000,
-        connectTimeoutMS=30000,
-        socketTimeoutMS=30000,
-        tlsAllowInvalidCertificates=True  # Necessário para alguns ambientes Azure
+
+if settings.STORAGE_ENGINE not in ENGINES:
+    raise ValueError(f"STORAGE_ENGINE inválido: {settings.STORAGE_ENGINE} (opções: {', '.join(ENGINES)})")
+
+if settings.STORAGE_ENGINE == "memory":
+    # Motor em processo, sem servidor MongoDB (edge de nó único, testes e benchmarks)
+    logger.info("Usando o motor de armazenamento em memória")
+    client = None
+    database = MemoryDatabase(settings.DATABASE_NAME, snapshot_path=settings.MEMORY_SNAPSHOT_PATH)
+else:
+    logger.info("Tentando conectar ao MongoDB...")
+    try:
+        # Cliente MongoDB com pool, compressão e preferência de leitura configuráveis
+        client = pymongo.MongoClient(
+            MONGODB_URL,
+            event_listeners=[
+                listener for listener, ativo in ((slow_queries, settings.SLOW_QUERY_ENABLED),
+                                                 (request_charge_listener, request_charge_listener is not None))
+                if ativo
+            ],
+            **parametros_cliente()
+        )
+        database = client[settings.DATABASE_NAME]
+        # Testar a conexão
+        client.admin.command('ping')
+        logger.info("Conexão com MongoDB estabelecida com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro ao conectar ao MongoDB: {e}")
+        raise
+
+# Política de retentativa para throttling do Cosmos DB e métricas de RUs por rota
+retry_policy = RetryPolicy(
+    max_attempts=settings.COSMOS_RETRY_MAX_ATTEMPTS,
+    base_delay_ms=settings.COSMOS_RETRY_BASE_DELAY_MS,
+    max_delay_ms=settings.COSMOS_RETRY_MAX_DELAY_MS,
+    deadline_ms=settings.COSMOS_REQUEST_DEADLINE_MS,
+)
+request_charge_metrics = RequestChargeMetrics()
+
+def _colecao(nome: str, read_preference=None) -> Repository:
+    if client is None:
+        # Motor em memória: sem throttling nem roteamento de leitura
+        return database[nome]
+    opcoes = {}
+    if read_preference is not None:
+        opcoes["read_preference"] = read_preference
+    if nome in settings.MONGODB_READ_CONCERNS:
+        opcoes["read_concern"] = ReadConcern(settings.MONGODB_READ_CONCERNS[nome])
+    return ThrottledCollection(
+        database[nome].with_options(**opcoes),
+        retry_policy,
+        request_charge_metrics,
+        request_charge=request_charge_listener,
     )
-    database = client[settings.DATABASE_NAME]
-    # Testar a conexão
-    client.admin.command('ping')
-    logger.info("Conexão com MongoDB estabelecida com sucesso!")
-except Exception as e:
-    logger.error(f"Erro ao conectar ao MongoDB: {e}")
-    raise
-
-# Coleções
-usuarios = database.usuarios
-acoes = database.acoes
-carteiras = database.carteiras
-transacoes = database.transacoes
-notificacoes = database.notificacoes
-relatorios = database.relatorios
-depositos = database.depositos
+
+def _colecao_leitura(nome: str) -> Repository:
+    """Coleção para leituras de listagem/relatório, roteadas para os secundários."""
+    if client is None:
+        return database[nome]
+    modo = settings.MONGODB_ANALYTICS_READ_PREFERENCES.get(nome, settings.MONGODB_ANALYTICS_READ_PREFERENCE)
+    return _colecao(nome, _read_preference(modo, settings.MONGODB_ANALYTICS_MAX_STALENESS_S))
+
+# Sequência e tombstones do feed de alterações
+sync_remocoes = _colecao("sync_remocoes")
+sync_sequence = SequenceAllocator()
+
+def _coalescida(colecao) -> Repository:
+    """Coalesce find_one idênticos e concorrentes (leituras quentes por _id/usuário)."""
+    return CoalescingCollection(colecao, cache_ms=settings.SINGLEFLIGHT_CACHE_MS, enabled=settings.SINGLEFLIGHT_ENABLED)
+
+# Repositórios das coleções (ações e carteiras sequenciadas para o delta-sync)
+usuarios = _coalescida(_colecao("usuarios"))
+acoes = _coalescida(SequencedCollection(_colecao("acoes"), "acoes", sync_sequence, sync_remocoes))
+carteiras = _coalescida(SequencedCollection(_colecao("carteiras"), "carteiras", sync_sequence, sync_remocoes))
+transacoes = _colecao("transacoes")
+notificacoes = _colecao("notificacoes")
+relatorios = _colecao("relatorios")
+depositos = _colecao("depositos")
+lancamentos = _colecao("lancamentos")
+saldos_snapshots = _colecao("saldos_snapshots")
+historico_precos = _colecao("historico_precos")
+candles = _colecao("candles")
+estatisticas = _colecao("estatisticas")
+jobs_locks = _colecao("jobs_locks")
+rate_limits = _colecao("rate_limits")
+jobs_execucoes = _colecao("jobs_execucoes")
+precos_referencia = _colecao("precos_referencia")
+reconciliacoes_estoque = _colecao("reconciliacoes_estoque")
+consultas_lentas = database["consultas_lentas"]  # Sem retentativa nem métricas: gravada pela thread do registro
+
+# Coleções para leituras que toleram dados levemente defasados (listagens e relatórios)
+usuarios_leitura = _colecao_leitura("usuarios")
+acoes_leitura = _colecao_leitura("acoes")
+carteiras_leitura = _colecao_leitura("carteiras")
+depositos_leitura = _colecao_leitura("depositos")
+
+change_feed = ChangeFeed(
+    {"acoes": acoes, "carteiras": carteiras},
+    sync_remocoes,
+    settle_ms=settings.SYNC_SETTLE_MS,
+    change_streams=settings.SYNC_CHANGE_STREAMS,
+)
+
+# Arquivamento frio: transações e notificações antigas em coleções mensais comprimidas
+arquivos = _colecao("arquivos")
+
+def _arquivo(origem, nome: str) -> MonthlyArchive:
+    return MonthlyArchive(
+        origem, nome, _colecao, database.create_collection, arquivos,
+        # Os arquivos mensais têm os mesmos índices da coleção de origem
+        preparar=lambda destino: garantir_indices(_colecao, {destino: catalogo(settings)[nome]}, remover_obsoletos=False),
+        idade_dias=settings.ARCHIVE_AFTER_DAYS,
+        compressor=settings.ARCHIVE_COMPRESSOR,
+    )
+
+arquivo_transacoes = _arquivo(transacoes, "transacoes")
+arquivo_notificacoes = _arquivo(notificacoes, "notificacoes")
+
+# Escrita adiada (write-behind) dos registros de auditoria
+escritas_adiadas_falhas = _colecao("escritas_adiadas_falhas")
+write_behind = WriteBehindQueue(
+    max_size=settings.WRITE_BEHIND_MAX_QUEUE,
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval_ms=settings.WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    enqueue_timeout_ms=settings.WRITE_BEHIND_ENQUEUE_TIMEOUT_MS,
+    max_retries=settings.WRITE_BEHIND_MAX_RETRIES,
+    retry_base_ms=settings.WRITE_BEHIND_RETRY_BASE_MS,
+    retry_max_ms=settings.WRITE_BEHIND_RETRY_MAX_MS,
+    dead_letter=escritas_adiadas_falhas,
+)
+
+def registrar_notificacao(notificacao: dict):
+    """Grava a notificação, pela fila de escrita adiada quando habilitada."""
+    if not write_behind.submit(notificacoes, notificacao):
+        notificacoes.insert_one(notificacao)
+
+def registrar_transacao(transacao: dict):
+    """Grava a transação; só usa a fila adiada se WRITE_BEHIND_TRANSACOES permitir."""
+    if not (settings.WRITE_BEHIND_TRANSACOES and write_behind.submit(transacoes, transacao)):
+        transacoes.insert_one(transacao)
+
+def sincronizar_indices(destrutivo: bool = False) -> dict:
+    """Índices do catálogo; recriações e remoções só com destrutivo (python -m app.indices --aplicar)."""
+    return garantir_indices(_colecao, catalogo(settings), remover_obsoletos=destrutivo, recriar=destrutivo)
 
 def init_db():
     """Initialize database with required collections and indexes"""
     try:
         # Lista de coleções necessárias
-        collections = ["usuarios", "acoes", "carteiras", "transacoes", "notificacoes", "relatorios", "depositos"]
+        collections = ["usuarios", "acoes", "carteiras", "transacoes", "notificacoes", "relatorios", "depositos",
+                       "lancamentos", "saldos_snapshots", "historico_precos", "candles", "sync_remocoes"]
         
         # Criar coleções se não existirem
         existing_collections = database.list_collection_names()
@@ -54,28 +236,39 @@ def init_db():
                 database.create_collection(collection)
                 logger.info(f"Coleção {collection} criada com sucesso!")
         
-        # Índices para usuários
-        usuarios.create_index("email", unique=True)
-        
-        # Índices para carteiras
-        carteiras.create_index("usuario_id", unique=True)
+        # Índices declarados em app/indices.py: cria os que faltam; recriações e remoções ficam
+        # para o comando de manutenção, salvo com INDEX_CATALOG_DROP_STALE (instância única)
+        sincronizar_indices(destrutivo=settings.INDEX_CATALOG_DROP_STALE)
         
-        # Índices para transações
-        transacoes.create_index([("usuario_id", 1), ("data", -1)])
-        transacoes.create_index("acao_id")
+        # Documentos anteriores ao feed de alterações recebem uma sequência
+        for colecao in (acoes, carteiras):
+            colecao.update_many({"sync_seq": {"$exists": False}}, {"$set": {}})
         
-        # Índices para notificações
-        notificacoes.create_index("data")  # Índice simples para ordenação por data
-        notificacoes.create_index("usuario_id")  # Índice para filtrar por usuário
-        notificacoes.create_index("tipo")  # Índice para filtrar por tipo
-        
-        # Índices para depósitos
-        depositos.create_index([("usuario_id", 1), ("status", 1), ("data_solicitacao", -1)])
+        # Operações lentas: capped no MongoDB; o Cosmos DB não tem capped collections, então usa TTL
+        if "consultas_lentas" not in existing_collections:
+            try:
+                database.create_collection("consultas_lentas", capped=True, size=settings.SLOW_QUERY_CAPPED_BYTES,
+                                           max=settings.SLOW_QUERY_CAPPED_MAX)
+            except pymongo.errors.OperationFailure as e:
+                logger.warning(f"Coleção consultas_lentas criada sem capped: {e}")
+                database.create_collection("consultas_lentas")
+                consultas_lentas.create_index("data", expireAfterSeconds=settings.SLOW_QUERY_RETENCAO_DIAS * 86400)
+        consultas_lentas.create_index([("data", -1)])
         
         logger.info("Inicialização do banco de dados concluída!")
-    except Exception as e:
-        logger.error(f"Erro ao inicializar o banco de dados: {e}")
+    except Exception:
+        logger.exception("Erro ao inicializar o banco de dados")
         # Não levanta a exceção para permitir que a aplicação continue mesmo se houver erro na inicialização
 
 # Inicializar o banco de dados
 init_db()
+
+def iniciar_registro_consultas_lentas():
+    """Inicia a thread do registro de operações lentas (só com o MongoDB real)."""
+    if settings.SLOW_QUERY_ENABLED and client is not None:
+        slow_queries.start(consultas_lentas, client)
+
+def save_snapshot():
+    """Persiste o snapshot do motor em memória, quando configurado."""
+    if client is None and settings.MEMORY_SNAPSHOT_PATH:
+        database.save_snapshot()
@@ -0,0 +1,172 @@
+"""
+Exportação em lote das carteiras para usuários bot, em formato colunar binário.
+
+Em vez de um JSON aninhado por carteira, o cursor do Mongo é lido em blocos e cada bloco
+vira um lote colunar: uma lista por campo das carteiras e as posições achatadas, com
+offsets no estilo das listas do Arrow (as posições da carteira i ficam em
+acoes_offsets[i]:acoes_offsets[i + 1]). Os identificadores vão como 12 bytes binários.
+
+Formatos:
+    msgpack  - sequência de objetos msgpack: um cabeçalho seguido de um mapa por lote
+               (leitura com msgpack.Unpacker sobre o corpo da resposta)
+    arrow    - stream IPC do Apache Arrow (requer pyarrow instalado)
+"""
+import io
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import msgpack
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from .database import carteiras_leitura, usuarios_leitura
+
+try:  # pyarrow é opcional
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover - depende do ambiente
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+VERSAO = 1
+
+FORMATOS: Dict[str, str] = {
+    "msgpack": "application/x-msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+COLUNAS_CARTEIRA = ("carteira_id", "usuario_id", "usuario_nome", "usuario_email", "saldo",
+                    "qtd_max_acoes", "qtd_max_valor", "nivel_risco")
+
+_PROJECAO = {"usuario_id": 1, "acoes.acao_id": 1, "acoes.qtd": 1, "saldo": 1,
+             "qtd_max_acoes": 1, "qtd_max_valor": 1, "nivel_risco": 1}
+
+
+class FormatoIndisponivel(ValueError):
+    pass
+
+
+def _blocos(tamanho_lote: int) -> Iterator[List[dict]]:
+    bloco: List[dict] = []
+    for carteira in carteiras_leitura.find({}, _PROJECAO).batch_size(tamanho_lote):
+        bloco.append(carteira)
+        if len(bloco) >= tamanho_lote:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _id_binario(valor: Any) -> Optional[bytes]:
+    """12 bytes do ObjectId; posições antigas guardam o acao_id como texto."""
+    if isinstance(valor, ObjectId):
+        return valor.binary
+    try:
+        return ObjectId(valor).binary
+    except (InvalidId, TypeError):
+        return None
+
+
+def lote_colunar(bloco: List[dict]) -> dict:
+    """Converte um bloco de carteiras em colunas (carteiras sem usuário são ignoradas)."""
+    usuarios = {
+        u["_id"]: u
+        for u in usuarios_leitura.find({"_id": {"$in": [c["usuario_id"] for c in bloco]}},
+                                       {"nome": 1, "email": 1})
+    }
+    colunas: Dict[str, list] = {nome: [] for nome in COLUNAS_CARTEIRA}
+    offsets = [0]
+    acao_ids: List[bytes] = []
+    quantidades: List[int] = []
+    ignoradas = 0
+    for carteira in bloco:
+        usuario = usuarios.get(carteira["usuario_id"])
+        if usuario is None:
+            continue
+        colunas["carteira_id"].append(carteira["_id"].binary)
+        colunas["usuario_id"].append(carteira["usuario_id"].binary)
+        colunas["usuario_nome"].append(usuario["nome"])
+        colunas["usuario_email"].append(usuario["email"])
+        colunas["saldo"].append(float(carteira.get("saldo", 0.0)))
+        colunas["qtd_max_acoes"].append(carteira.get("qtd_max_acoes", 100))
+        colunas["qtd_max_valor"].append(float(carteira.get("qtd_max_valor", 100000.0)))
+        colunas["nivel_risco"].append(carteira.get("nivel_risco", 1))
+        for acao in carteira.get("acoes", []):
+            acao_id = _id_binario(acao.get("acao_id"))
+            if acao_id is None:
+                ignoradas += 1
+                continue
+            acao_ids.append(acao_id)
+            quantidades.append(acao["qtd"])
+        offsets.append(len(acao_ids))
+    if ignoradas:
+        logger.warning(f"Exportação: {ignoradas} posição(ões) com acao_id inválido ignorada(s)")
+    return {
+        "linhas": len(colunas["carteira_id"]),
+        **colunas,
+        "acoes_offsets": offsets,
+        "acao_id": acao_ids,
+        "qtd": quantidades,
+        "posicoes_ignoradas": ignoradas,
+    }
+
+
+def exportar_msgpack(tamanho_lote: int) -> Iterable[bytes]:
+    packer = msgpack.Packer(use_bin_type=True)
+    yield packer.pack({"formato": "carteiras", "versao": VERSAO, "colunas": list(COLUNAS_CARTEIRA),
+                       "posicoes": ["acoes_offsets", "acao_id", "qtd"]})
+    for bloco in _blocos(tamanho_lote):
+        yield packer.pack(lote_colunar(bloco))
+
+
+def _schema_arrow():
+    return pyarrow.schema([
+        ("carteira_id", pyarrow.binary(12)),
+        ("usuario_id", pyarrow.binary(12)),
+        ("usuario_nome", pyarrow.string()),
+        ("usuario_email", pyarrow.string()),
+        ("saldo", pyarrow.float64()),
+        ("qtd_max_acoes", pyarrow.int64()),
+        ("qtd_max_valor", pyarrow.float64()),
+        ("nivel_risco", pyarrow.int64()),
+        ("acoes", pyarrow.list_(pyarrow.struct([("acao_id", pyarrow.binary(12)), ("qtd", pyarrow.int64())]))),
+    ])
+
+
+def exportar_arrow(tamanho_lote: int) -> Iterable[bytes]:
+    schema = _schema_arrow()
+    # O escritor grava em um buffer que é esvaziado a cada lote (stream sem acumular tudo)
+    buffer = io.BytesIO()
+
+    def drenar() -> bytes:
+        dados = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return dados
+
+    with pyarrow.ipc.new_stream(buffer, schema) as escritor:
+        for bloco in _blocos(tamanho_lote):
+            colunas = lote_colunar(bloco)
+            posicoes = pyarrow.StructArray.from_arrays(
+                [pyarrow.array(colunas["acao_id"], pyarrow.binary(12)),
+                 pyarrow.array(colunas["qtd"], pyarrow.int64())],
+                names=["acao_id", "qtd"],
+            )
+            acoes = pyarrow.ListArray.from_arrays(pyarrow.array(colunas["acoes_offsets"], pyarrow.int32()), posicoes)
+            escritor.write_batch(pyarrow.record_batch(
+                [pyarrow.array(colunas[nome], schema.field(nome).type) for nome in COLUNAS_CARTEIRA] + [acoes],
+                schema=schema,
+            ))
+            yield drenar()
+    yield drenar()
+
+
+def exportar(formato: str, tamanho_lote: int = 5000) -> Iterable[bytes]:
+    if formato not in FORMATOS:
+        raise FormatoIndisponivel(f"Formato inválido: {formato}")
+    if formato == "arrow":
+        if pyarrow is None:
+            raise FormatoIndisponivel("Exportação Arrow indisponível: pyarrow não está instalado")
+        return exportar_arrow(tamanho_lote)
+    return exportar_msgpack(tamanho_lote)
@@ -0,0 +1,259 @@
+"""
+Importação em lote de ações e preços de referência a partir de CSV.
+
+O arquivo é lido linha a linha: o upload fica no SpooledTemporaryFile do Starlette (em
+disco acima de 1 MB) e o csv.DictReader lê dele sob demanda, então só um lote de linhas
+fica em memória. Cada lote de IMPORT_BATCH_SIZE linhas válidas é gravado com um único
+bulk_write de upserts (ordered=False) e lê os documentos existentes uma única vez, para
+pular linhas sem alteração e registrar os efeitos das alterações de preço (ticks e
+candles, painel administrativo e stream de preços) também em lote.
+
+Os erros são reportados por linha do arquivo (o cabeçalho é a linha 1), até
+IMPORT_MAX_ERROS; as demais linhas continuam sendo importadas.
+"""
+import codecs
+import csv
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import candles, dashboard, schemas
+from .database import acoes, precos_referencia
+
+COLUNAS_ACOES = ("nome", "preco", "qtd", "risco")
+COLUNAS_PRECOS_REFERENCIA = ("preco_referencia",)  # e acao_id ou nome
+
+
+class ArquivoInvalido(ValueError):
+    pass
+
+
+class RelatorioImportacao:
+    def __init__(self, max_erros: int):
+        self.max_erros = max_erros
+        self.linhas = 0
+        self.inseridas = 0
+        self.atualizadas = 0
+        self.inalteradas = 0
+        self.lotes = 0
+        self.total_erros = 0
+        self.erros: List[dict] = []
+        self._inicio = time.perf_counter()
+
+    def erro(self, linha: int, mensagem: str):
+        self.total_erros += 1
+        if len(self.erros) < self.max_erros:
+            self.erros.append({"linha": linha, "erro": mensagem})
+
+    def resultado(self) -> dict:
+        return {
+            "linhas": self.linhas,
+            "inseridas": self.inseridas,
+            "atualizadas": self.atualizadas,
+            "inalteradas": self.inalteradas,
+            "lotes": self.lotes,
+            "total_erros": self.total_erros,
+            "erros": self.erros,
+            "duracao_ms": round((time.perf_counter() - self._inicio) * 1000, 1),
+        }
+
+
+def _mensagem_validacao(erro: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in erro.errors())
+
+
+def _linhas(arquivo: BinaryIO, obrigatorias: Tuple[str, ...], alguma_de: Tuple[str, ...] = ()) -> Iterator[Tuple[int, dict]]:
+    """(número da linha, campos) do CSV; aceita BOM do UTF-8 e separador , ou ;."""
+    texto = codecs.getreader("utf-8-sig")(arquivo, errors="strict")
+    cabecalho = texto.readline()
+    if not cabecalho.strip():
+        raise ArquivoInvalido("Arquivo vazio")
+    separador = ";" if cabecalho.count(";") > cabecalho.count(",") else ","
+    colunas = [coluna.strip().lower() for coluna in next(csv.reader([cabecalho], delimiter=separador))]
+    faltando = [coluna for coluna in obrigatorias if coluna not in colunas]
+    if alguma_de and not any(coluna in colunas for coluna in alguma_de):
+        faltando.append(" ou ".join(alguma_de))
+    if faltando:
+        raise ArquivoInvalido(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+    leitor = csv.DictReader(texto, fieldnames=colunas, delimiter=separador)
+    for campos in leitor:
+        # line_num conta as linhas físicas lidas (campos entre aspas podem ter quebras)
+        linha = leitor.line_num + 1
+        if not any((valor or "").strip() for valor in campos.values() if isinstance(valor, str)):
+            continue
+        yield linha, {chave: (valor.strip() if isinstance(valor, str) else valor) for chave, valor in campos.items()}
+
+
+def _importar(linhas: Iterator[Tuple[int, dict]], validar: Callable[[dict], Any],
+              gravar: Callable[[List[Tuple[int, Any]], RelatorioImportacao], None],
+              tamanho_lote: int, max_erros: int) -> dict:
+    relatorio = RelatorioImportacao(max_erros)
+    lote: List[Tuple[int, Any]] = []
+    try:
+        for linha, campos in linhas:
+            relatorio.linhas += 1
+            if None in campos:
+                relatorio.erro(linha, "Mais colunas que o cabeçalho")
+                continue
+            try:
+                lote.append((linha, validar(campos)))
+            except ValidationError as e:
+                relatorio.erro(linha, _mensagem_validacao(e))
+                continue
+            except ValueError as e:
+                relatorio.erro(linha, str(e))
+                continue
+            if len(lote) >= tamanho_lote:
+                gravar(lote, relatorio)
+                lote = []
+    except UnicodeDecodeError:
+        raise ArquivoInvalido(f"O arquivo deve estar em UTF-8 (erro após a linha {relatorio.linhas + 1})")
+    except csv.Error as e:
+        raise ArquivoInvalido(f"CSV inválido após a linha {relatorio.linhas + 1}: {e}")
+    if lote:
+        gravar(lote, relatorio)
+    return relatorio.resultado()
+
+
+def _bulk_write(colecao, operacoes: List[UpdateOne], linhas: List[int],
+                relatorio: RelatorioImportacao) -> Tuple[Dict[int, Any], set]:
+    """Grava o lote; retorna {índice: _id inserido} e os índices das operações com erro."""
+    relatorio.lotes += 1
+    if not operacoes:
+        return {}, set()
+    try:
+        resultado = colecao.bulk_write(operacoes, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        resultado = e.details
+    falhas = set()
+    for erro in resultado.get("writeErrors", []):
+        falhas.add(erro["index"])
+        relatorio.erro(linhas[erro["index"]], erro.get("errmsg", "Erro de gravação"))
+    inseridos = {item["index"]: item["_id"] for item in resultado.get("upserted", [])}
+    relatorio.inseridas += len(inseridos)
+    relatorio.atualizadas += len(operacoes) - len(inseridos) - len(falhas)
+    return inseridos, falhas
+
+
+# ---------------------------------------------------------------------------
+# Ações
+# ---------------------------------------------------------------------------
+
+def _gravar_acoes(lote: List[Tuple[int, schemas.ImportacaoAcao]], relatorio: RelatorioImportacao,
+                  publicar: Callable[[Any, dict], None]):
+    # A última linha de cada nome no lote prevalece
+    por_nome: Dict[str, Tuple[int, schemas.ImportacaoAcao]] = {}
+    for linha, acao in lote:
+        if acao.nome in por_nome:
+            relatorio.inalteradas += 1
+        por_nome[acao.nome] = (linha, acao)
+    existentes = {
+        a["nome"]: a for a in acoes.find({"nome": {"$in": list(por_nome)}}, {"nome": 1, "preco": 1, "qtd": 1, "risco": 1})
+    }
+
+    operacoes, linhas, alvos = [], [], []
+    for nome, (linha, acao) in por_nome.items():
+        campos = acao.model_dump()
+        atual = existentes.get(nome)
+        if atual is not None and all(atual.get(campo) == valor for campo, valor in campos.items()):
+            relatorio.inalteradas += 1
+            continue
+        operacoes.append(UpdateOne({"nome": nome}, {"$set": campos}, upsert=True))
+        linhas.append(linha)
+        alvos.append((atual, campos))
+    inseridos, falhas = _bulk_write(acoes, operacoes, linhas, relatorio)
+
+    ticks, variacoes = [], {}
+    for indice, (atual, campos) in enumerate(alvos):
+        if indice in falhas:
+            continue
+        acao_id = inseridos[indice] if indice in inseridos else atual["_id"]
+        if atual is None or atual.get("preco") != campos["preco"]:
+            ticks.append((acao_id, campos["preco"]))
+            if atual is not None:
+                variacoes[acao_id] = campos["preco"] - atual.get("preco", 0)
+        publicar(acao_id, {"preco": campos["preco"], "qtd": campos["qtd"]})
+    candles.registrar_ticks(ticks)
+    dashboard.precos_alterados(variacoes)
+
+
+def importar_acoes(arquivo: BinaryIO, tamanho_lote: int, max_erros: int,
+                   publicar: Callable[[Any, dict], None] = lambda acao_id, dados: None) -> dict:
+    """Upsert de ações por nome (nome, preco, qtd, risco)."""
+    return _importar(
+        _linhas(arquivo, COLUNAS_ACOES),
+        lambda campos: schemas.ImportacaoAcao(**{coluna: campos[coluna] for coluna in COLUNAS_ACOES}),
+        lambda lote, relatorio: _gravar_acoes(lote, relatorio, publicar),
+        tamanho_lote, max_erros,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Preços de referência
+# ---------------------------------------------------------------------------
+
+def _gravar_precos_referencia(lote: List[Tuple[int, schemas.ImportacaoPrecoReferencia]],
+                              relatorio: RelatorioImportacao, atualizado_por: str):
+    ids, nomes = set(), set()
+    for _, preco in lote:
+        if preco.acao_id:
+            ids.add(preco.acao_id)
+        else:
+            nomes.add(preco.nome)
+    por_id, por_nome = {}, {}
+    if ids:
+        por_id = {str(a["_id"]): str(a["_id"]) for a in acoes.find({"_id": {"$in": [ObjectId(i) for i in ids]}}, {"_id": 1})}
+    if nomes:
+        por_nome = {a["nome"]: str(a["_id"]) for a in acoes.find({"nome": {"$in": list(nomes)}}, {"nome": 1})}
+
+    agora = datetime.utcnow()
+    por_acao: Dict[str, Tuple[int, float]] = {}
+    for linha, preco in lote:
+        acao_id = por_id.get(preco.acao_id) if preco.acao_id else por_nome.get(preco.nome)
+        if acao_id is None:
+            relatorio.erro(linha, f"Ação não encontrada: {preco.acao_id or preco.nome}")
+            continue
+        if acao_id in por_acao:
+            relatorio.inalteradas += 1
+        por_acao[acao_id] = (linha, preco.preco_referencia)
+
+    operacoes = [
+        UpdateOne(
+            {"acao_id": acao_id},
+            {"$set": {"preco_referencia": valor, "data_atualizacao": agora, "atualizado_por": atualizado_por}},
+            upsert=True,
+        )
+        for acao_id, (_, valor) in por_acao.items()
+    ]
+    _bulk_write(precos_referencia, operacoes, [linha for linha, _ in por_acao.values()], relatorio)
+
+
+def _validar_preco_referencia(campos: dict) -> schemas.ImportacaoPrecoReferencia:
+    preco = schemas.ImportacaoPrecoReferencia(
+        acao_id=campos.get("acao_id") or None, nome=campos.get("nome") or None,
+        preco_referencia=campos["preco_referencia"],
+    )
+    if not preco.acao_id and not preco.nome:
+        raise ValueError("Informe acao_id ou nome")
+    if preco.acao_id and not ObjectId.is_valid(preco.acao_id):
+        raise ValueError(f"acao_id inválido: {preco.acao_id}")
+    return preco
+
+
+def importar_precos_referencia(arquivo: BinaryIO, atualizado_por: str, tamanho_lote: int, max_erros: int) -> dict:
+    """Upsert do preço de referência por ação (acao_id ou nome, preco_referencia)."""
+    return _importar(
+        _linhas(arquivo, COLUNAS_PRECOS_REFERENCIA, alguma_de=("acao_id", "nome")),
+        _validar_preco_referencia,
+        lambda lote, relatorio: _gravar_precos_referencia(lote, relatorio, atualizado_por),
+        tamanho_lote, max_erros,
+    )
+
+
+def obter_preco_referencia(acao_id: str) -> Optional[dict]:
+    return precos_referencia.find_one({"acao_id": acao_id})
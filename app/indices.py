@@ -0,0 +1,267 @@
+"""
+Catálogo declarativo dos índices de cada coleção.
+
+Cada índice lista as formas de consulta que dependem dele (filtro e ordenação de exemplo),
+para que a cobertura possa ser verificada por explain nos testes. garantir_indices() cria
+os índices que faltam (em segundo plano, idempotente). Recriar os que mudaram de opções e
+remover os que saíram do catálogo são operações destrutivas: na inicialização (todos os
+workers ao mesmo tempo) elas só são listadas como pendentes, e são aplicadas pelo comando
+
+    python -m app.indices --aplicar
+
+Coleções fora do catálogo (ex.: consultas_lentas, que é capped ou TTL conforme o servidor)
+não são tocadas.
+"""
+import argparse
+import functools
+import json
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+_EXEMPLO_ID = ObjectId("000000000000000000000000")
+_EXEMPLO_DATA = datetime(2024, 1, 1)
+
+
+class Consulta:
+    """Forma de consulta servida por um índice (os valores são apenas exemplos)."""
+
+    def __init__(self, descricao: str, filtro: dict, ordenacao: Optional[List[Tuple[str, int]]] = None):
+        self.descricao = descricao
+        self.filtro = filtro
+        self.ordenacao = ordenacao
+
+    def __repr__(self) -> str:
+        return f"Consulta({self.descricao!r})"
+
+
+class Indice:
+    def __init__(self, chaves: List[Tuple[str, int]], *consultas: Consulta, unique: bool = False,
+                 expire_after_seconds: Optional[int] = None):
+        self.chaves = chaves
+        self.consultas = consultas
+        self.unique = unique
+        self.expire_after_seconds = expire_after_seconds
+
+    @property
+    def nome(self) -> str:
+        # Mesmo nome padrão gerado pelo MongoDB
+        return "_".join(f"{campo}_{direcao}" for campo, direcao in self.chaves)
+
+    def opcoes(self) -> Dict[str, Any]:
+        opcoes: Dict[str, Any] = {}
+        if self.unique:
+            opcoes["unique"] = True
+        if self.expire_after_seconds is not None:
+            opcoes["expireAfterSeconds"] = self.expire_after_seconds
+        return opcoes
+
+    def __repr__(self) -> str:
+        return f"Indice({self.nome})"
+
+
+def catalogo(settings) -> Dict[str, List[Indice]]:
+    """Índices por coleção; o TTL do histórico de jobs vem do Settings."""
+    sync = Indice(
+        [("sync_seq", 1), ("_id", 1)],
+        Consulta("feed de alterações após a posição do token",
+                 {"$or": [{"sync_seq": {"$gt": 10}}, {"sync_seq": 10, "_id": {"$gt": _EXEMPLO_ID}}]},
+                 [("sync_seq", 1), ("_id", 1)]),
+    )
+    return {
+        "usuarios": [
+            Indice([("email", 1)], Consulta("login e registro", {"email": "a@b.com"}), unique=True),
+        ],
+        "acoes": [
+            # Não é único: a importação faz upsert por nome, mas o cadastro não impede nomes repetidos
+            Indice([("nome", 1)], Consulta("ações existentes de um lote da importação", {"nome": {"$in": ["PETR4"]}})),
+            sync,
+        ],
+        "precos_referencia": [
+            Indice([("acao_id", 1)], Consulta("preço de referência de uma ação", {"acao_id": str(_EXEMPLO_ID)}),
+                   unique=True),
+        ],
+        "carteiras": [
+            Indice([("usuario_id", 1)], Consulta("carteira do usuário", {"usuario_id": _EXEMPLO_ID}), unique=True),
+            # Multikey: uma entrada por ação da carteira
+            Indice([("acoes.acao_id", 1)],
+                   Consulta("detentores de uma ação", {"acoes.acao_id": {"$in": [_EXEMPLO_ID, str(_EXEMPLO_ID)]}}),
+                   Consulta("posições de uma faixa de ações",
+                            {"$or": [{"acoes.acao_id": {"$gte": _EXEMPLO_ID, "$lt": _EXEMPLO_ID}},
+                                     {"acoes.acao_id": {"$gte": str(_EXEMPLO_ID), "$lt": str(_EXEMPLO_ID)}}]})),
+            sync,
+        ],
+        # Dead letter da escrita adiada, reprocessada da mais antiga para a mais nova
+        "escritas_adiadas_falhas": [
+            Indice([("data", 1)], Consulta("reprocessamento das escritas adiadas que falharam", {}, [("data", 1)])),
+        ],
+        "reconciliacoes_estoque": [
+            Indice([("data", -1)], Consulta("último relatório de reconciliação do estoque", {}, [("data", -1)])),
+        ],
+        "transacoes": [
+            Indice([("usuario_id", 1), ("data", -1)],
+                   Consulta("extrato do usuário", {"usuario_id": _EXEMPLO_ID}, [("data", -1)]),
+                   Consulta("extrato do usuário por período",
+                            {"usuario_id": _EXEMPLO_ID, "data": {"$gte": _EXEMPLO_DATA, "$lte": _EXEMPLO_DATA}},
+                            [("data", -1)]),
+                   Consulta("compras de um lote de carteiras (recálculo do preço médio)",
+                            {"usuario_id": {"$in": [_EXEMPLO_ID]}, "tipo": "compra"})),
+            Indice([("acao_id", 1)], Consulta("transações de uma ação", {"acao_id": _EXEMPLO_ID}),
+                   Consulta("compras de uma faixa de ações",
+                            {"tipo": "compra", "$or": [{"acao_id": {"$gte": _EXEMPLO_ID}},
+                                                       {"acao_id": {"$gte": str(_EXEMPLO_ID)}}]})),
+        ],
+        "notificacoes": [
+            # Notificações de admins têm usuario_id None: a igualdade a null também usa o índice
+            Indice([("usuario_id", 1), ("lida", 1), ("data", -1)],
+                   Consulta("não lidas do usuário", {"usuario_id": str(_EXEMPLO_ID), "lida": False}, [("data", -1)]),
+                   Consulta("não lidas dos admins", {"usuario_id": None, "lida": False}, [("data", -1)]),
+                   Consulta("notificações do usuário e gerais", {"usuario_id": {"$in": [str(_EXEMPLO_ID), None]}},
+                            [("data", -1)])),
+            Indice([("lida", 1), ("data", 1)],
+                   Consulta("limpeza das notificações lidas", {"lida": True, "data": {"$lt": _EXEMPLO_DATA}})),
+        ],
+        "depositos": [
+            Indice([("status", 1), ("data_solicitacao", 1)],
+                   Consulta("depósitos pendentes (admin)", {"status": {"$in": ["pendente", "creditando"]}})),
+            Indice([("usuario_id", 1), ("status", 1), ("data_solicitacao", -1)],
+                   Consulta("depósitos do usuário por status", {"usuario_id": _EXEMPLO_ID, "status": "pendente"},
+                            [("data_solicitacao", -1)])),
+        ],
+        # A unicidade de (usuario_id, seq) garante o append do ledger sem lacunas duplicadas
+        "lancamentos": [
+            Indice([("usuario_id", 1), ("seq", 1)],
+                   Consulta("lançamentos do usuário em ordem", {"usuario_id": _EXEMPLO_ID}, [("seq", 1)]),
+                   unique=True),
+        ],
+        "saldos_snapshots": [
+            Indice([("usuario_id", 1), ("seq", 1)],
+                   Consulta("último snapshot", {"usuario_id": _EXEMPLO_ID}, [("seq", -1)]), unique=True),
+            Indice([("usuario_id", 1), ("data", -1)],
+                   Consulta("snapshot até uma data", {"usuario_id": _EXEMPLO_ID, "data": {"$lte": _EXEMPLO_DATA}})),
+        ],
+        "historico_precos": [
+            Indice([("acao_id", 1), ("data", -1)],
+                   Consulta("histórico de uma ação", {"acao_id": _EXEMPLO_ID}, [("data", -1)])),
+        ],
+        "candles": [
+            Indice([("acao_id", 1), ("intervalo", 1), ("inicio", 1)],
+                   Consulta("candles de uma ação", {"acao_id": _EXEMPLO_ID, "intervalo": "1d",
+                                                    "inicio": {"$gte": _EXEMPLO_DATA, "$lte": _EXEMPLO_DATA}},
+                            [("inicio", 1)]),
+                   Consulta("fechamentos diários da carteira", {"acao_id": {"$in": [_EXEMPLO_ID]}, "intervalo": "1d",
+                                                                "inicio": {"$gte": _EXEMPLO_DATA}}),
+                   unique=True),
+        ],
+        "sync_remocoes": [
+            Indice([("sync_seq", 1), ("_id", 1)], Consulta("fim atual do feed", {}, [("sync_seq", -1), ("_id", -1)])),
+            Indice([("colecao", 1), ("sync_seq", 1), ("_id", 1)],
+                   Consulta("remoções visíveis ao usuário",
+                            {"$or": [{"colecao": "carteiras", "usuario_id": _EXEMPLO_ID}, {"colecao": {"$in": ["acoes"]}}]},
+                            [("sync_seq", 1), ("_id", 1)])),
+        ],
+        # Buckets do limite de taxa compartilhado, removidos após ficarem ociosos
+        "rate_limits": [
+            Indice([("expira_em", 1)], Consulta("expiração (TTL)", {"expira_em": {"$lt": _EXEMPLO_DATA}}),
+                   expire_after_seconds=0),
+        ],
+        "jobs_execucoes": [
+            Indice([("job", 1), ("inicio", -1)],
+                   Consulta("últimas execuções de um job", {"job": "relatorios"}, [("inicio", -1)])),
+            Indice([("fim", 1)], Consulta("expiração (TTL)", {"fim": {"$lt": _EXEMPLO_DATA}}),
+                   expire_after_seconds=settings.JOBS_HISTORICO_DIAS * 86400),
+        ],
+    }
+
+
+def _chaves(informacao: dict) -> Tuple[Tuple[str, int], ...]:
+    # Índices de texto/hashed têm direção em string ("text", "hashed")
+    return tuple((campo, direcao if isinstance(direcao, str) else int(direcao)) for campo, direcao in informacao["key"])
+
+
+def _criar(repositorio, indice: Indice):
+    repositorio.create_index(indice.chaves, background=True, **indice.opcoes())
+
+
+def _recriar(repositorio, nome_atual: str, indice: Indice):
+    repositorio.drop_index(nome_atual)
+    _criar(repositorio, indice)
+
+
+def garantir_indices(colecao: Callable[[str], Any], indices: Dict[str, List[Indice]],
+                     remover_obsoletos: bool = False, recriar: bool = False) -> Dict[str, List[str]]:
+    """
+    Sincroniza os índices das coleções com o catálogo (idempotente).
+
+    Retorna {"criados", "recriados", "removidos", "pendentes", "falhas"} com os nomes
+    "colecao.indice". Sem recriar/remover_obsoletos, os índices que precisariam ser
+    recriados ou removidos vão para "pendentes". Uma falha não interrompe as demais
+    coleções: ela é registrada no log e em "falhas".
+    """
+    resumo: Dict[str, List[str]] = {"criados": [], "recriados": [], "removidos": [], "pendentes": [], "falhas": []}
+
+    def executar(destino: str, rotulo: str, operacao: Callable[[], Any]):
+        try:
+            operacao()
+        except Exception as erro:
+            logger.exception(f"Falha ao sincronizar o índice {rotulo}")
+            resumo["falhas"].append(f"{rotulo}: {erro}")
+        else:
+            resumo[destino].append(rotulo)
+
+    for nome, declarados in indices.items():
+        repositorio = colecao(nome)
+        try:
+            existentes = {_chaves(info): (indice, info) for indice, info in repositorio.index_information().items()}
+        except Exception as erro:
+            logger.exception(f"Falha ao listar os índices de {nome}")
+            resumo["falhas"].append(f"{nome}: {erro}")
+            continue
+        esperados = {tuple(indice.chaves): indice for indice in declarados}
+        for chaves, indice in esperados.items():
+            rotulo = f"{nome}.{indice.nome}"
+            atual = existentes.get(chaves)
+            if atual is None:
+                executar("criados", rotulo, functools.partial(_criar, repositorio, indice))
+                continue
+            nome_atual, info = atual
+            opcoes_atuais = {"unique": bool(info.get("unique")), "ttl": info.get("expireAfterSeconds")}
+            if opcoes_atuais == {"unique": indice.unique, "ttl": indice.expire_after_seconds}:
+                continue
+            # Opções diferentes (unicidade ou TTL) exigem recriar o índice
+            if not recriar:
+                resumo["pendentes"].append(f"{rotulo} (recriar)")
+                continue
+            executar("recriados", rotulo, functools.partial(_recriar, repositorio, nome_atual, indice))
+        for chaves, (nome_atual, _) in existentes.items():
+            if nome_atual == "_id_" or chaves in esperados:
+                continue
+            if not remover_obsoletos:
+                resumo["pendentes"].append(f"{nome}.{nome_atual} (remover)")
+                continue
+            executar("removidos", f"{nome}.{nome_atual}", functools.partial(repositorio.drop_index, nome_atual))
+    for acao, nomes in resumo.items():
+        if nomes and acao not in ("pendentes", "falhas"):
+            logger.info(f"Índices {acao}: {', '.join(nomes)}")
+    if resumo["pendentes"]:
+        logger.warning(f"Índices pendentes (python -m app.indices --aplicar): {', '.join(resumo['pendentes'])}")
+    if resumo["falhas"]:
+        logger.error(f"Índices com falha: {'; '.join(resumo['falhas'])}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincroniza os índices das coleções com o catálogo")
+    parser.add_argument("--aplicar", action="store_true",
+                        help="Recria os índices com opções alteradas e remove os que saíram do catálogo")
+    argumentos = parser.parse_args()
+    from .database import sincronizar_indices
+
+    resultado = sincronizar_indices(destrutivo=argumentos.aplicar)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    sys.exit(1 if resultado["falhas"] else 0)
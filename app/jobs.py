@@ -0,0 +1,77 @@
+"""
+Jobs de manutenção executados pelo agendador (app.scheduler).
+
+Os agendamentos vêm das configurações JOB_*_CRON (expressões cron em UTC); um
+agendamento vazio desativa o job.
+"""
+from datetime import datetime, timedelta
+
+from .config import get_settings
+from .database import (
+    arquivo_notificacoes, arquivo_transacoes, carteiras_leitura, jobs_execucoes, jobs_locks, notificacoes, relatorios,
+)
+from .scheduler import JobScheduler
+from . import dashboard, reconciliacao_estoque
+
+settings = get_settings()
+
+
+def gerar_relatorios(tamanho_lote: int = 1000) -> dict:
+    """Grava um relatório com o total investido de cada carteira com posições."""
+    agora = datetime.utcnow()
+    gerados = 0
+    lote = []
+    for grupo in carteiras_leitura.aggregate([
+        {"$unwind": "$acoes"},
+        {"$group": {
+            "_id": "$usuario_id",
+            "total_investido": {"$sum": {"$multiply": ["$acoes.qtd", {"$ifNull": ["$acoes.preco_compra", 0]}]}},
+        }},
+    ]):
+        lote.append({"usuario_id": grupo["_id"], "data": agora, "total_investido": round(grupo["total_investido"], 2)})
+        if len(lote) >= tamanho_lote:
+            relatorios.insert_many(lote, ordered=False)
+            gerados += len(lote)
+            lote = []
+    if lote:
+        relatorios.insert_many(lote, ordered=False)
+        gerados += len(lote)
+    return {"relatorios": gerados}
+
+
+def limpar_notificacoes() -> dict:
+    """Remove notificações lidas mais antigas que NOTIFICACOES_RETENCAO_DIAS."""
+    limite = datetime.utcnow() - timedelta(days=settings.NOTIFICACOES_RETENCAO_DIAS)
+    resultado = notificacoes.delete_many({"lida": True, "data": {"$lt": limite}})
+    return {"removidas": resultado.deleted_count}
+
+
+def arquivar() -> dict:
+    """Move transações e notificações mais antigas que ARCHIVE_AFTER_DAYS para os arquivos mensais."""
+    return {
+        "transacoes": arquivo_transacoes.arquivar(settings.ARCHIVE_BATCH_SIZE)["movidos"],
+        "notificacoes": arquivo_notificacoes.arquivar(settings.ARCHIVE_BATCH_SIZE)["movidos"],
+    }
+
+
+def reconciliar_dashboard() -> dict:
+    return {"divergencias": len(dashboard.reconciliar()["divergencias"])}
+
+
+def reconciliar_estoque() -> dict:
+    relatorio = reconciliacao_estoque.reconciliar()
+    return {"acoes": relatorio["acoes"], "divergencias": relatorio["total_divergencias"]}
+
+
+def criar_agendador() -> JobScheduler:
+    agendador = JobScheduler(jobs_locks, jobs_execucoes, lease_s=settings.JOBS_LEASE_S, jitter_s=settings.JOBS_JITTER_S)
+    for nome, cron, funcao in (
+        ("relatorios", settings.JOB_RELATORIOS_CRON, gerar_relatorios),
+        ("limpeza_notificacoes", settings.JOB_LIMPEZA_NOTIFICACOES_CRON, limpar_notificacoes),
+        ("reconciliacao_dashboard", settings.JOB_RECONCILIACAO_DASHBOARD_CRON, reconciliar_dashboard),
+        ("arquivamento", settings.JOB_ARQUIVAMENTO_CRON, arquivar),
+        ("reconciliacao_estoque", settings.JOB_RECONCILIACAO_ESTOQUE_CRON, reconciliar_estoque),
+    ):
+        if cron:
+            agendador.add(nome, cron, funcao)
+    return agendador
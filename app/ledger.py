@@ -0,0 +1,228 @@
+"""
+Livro-razão (ledger) append-only dos saldos das carteiras.
+
+Cada movimentação gera um lançamento com número de sequência por carteira (índice único
+em usuario_id + seq). O saldo é derivado do último snapshot mais a cauda de lançamentos
+posteriores, então reconstruir o saldo em qualquer instante custa O(cauda), limitada por
+LEDGER_SNAPSHOT_INTERVAL. O campo saldo da carteira é apenas um cache desse valor.
+
+Verificação (recalcula todos os saldos em paralelo):
+    python -m app.ledger --workers 8 --chunk 500
+"""
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from .config import get_settings
+from .database import carteiras, lancamentos, saldos_snapshots
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Tolerância para comparar somas de ponto flutuante (meio centavo)
+TOLERANCIA = 0.005
+
+
+class SaldoInsuficiente(Exception):
+    """O débito deixaria o saldo da carteira negativo."""
+
+    def __init__(self, saldo: float, valor: float):
+        super().__init__(f"Saldo insuficiente: saldo {saldo:.2f}, débito {valor:.2f}")
+        self.saldo = saldo
+        self.valor = valor
+
+
+def _ultimo_snapshot(usuario_id: ObjectId, ate: Optional[datetime] = None) -> Optional[dict]:
+    filtro: Dict[str, Any] = {"usuario_id": usuario_id}
+    if ate is not None:
+        filtro["data"] = {"$lte": ate}
+    return next(iter(saldos_snapshots.find(filtro).sort("seq", -1).limit(1)), None)
+
+
+def _cauda(usuario_id: ObjectId, depois_de: int, ate: Optional[datetime] = None) -> List[dict]:
+    filtro: Dict[str, Any] = {"usuario_id": usuario_id, "seq": {"$gt": depois_de}}
+    if ate is not None:
+        filtro["data"] = {"$lte": ate}
+    return list(lancamentos.find(filtro, {"seq": 1, "valor": 1}).sort("seq", 1))
+
+
+def _estado(usuario_id: ObjectId, ate: Optional[datetime] = None) -> Tuple[int, float, int]:
+    """Retorna (última sequência, saldo, sequência do snapshot usado)."""
+    snapshot = _ultimo_snapshot(usuario_id, ate)
+    seq_base = snapshot["seq"] if snapshot else 0
+    saldo = snapshot["saldo"] if snapshot else 0.0
+    cauda = _cauda(usuario_id, seq_base, ate)
+    for lancamento in cauda:
+        saldo += lancamento["valor"]
+    ultima = cauda[-1]["seq"] if cauda else seq_base
+    return ultima, round(saldo, 2), seq_base
+
+
+def _garantir_abertura(usuario_id: ObjectId, carteira: Optional[dict] = None):
+    """
+    Migra carteiras anteriores ao ledger: o saldo existente vira o lançamento de abertura.
+
+    Toda carteira com lançamentos tem ledger_seq (gravado a cada lançamento) e uma carteira
+    sem saldo não tem o que migrar, então só as demais consultam o ledger. Com a carteira
+    já lida pelo chamador, as migradas não custam nenhuma consulta.
+    """
+    if carteira is None:
+        carteira = carteiras.find_one({"usuario_id": usuario_id}, {"saldo": 1, "ledger_seq": 1})
+    if not carteira or "ledger_seq" in carteira or not carteira.get("saldo"):
+        return
+    if lancamentos.find_one({"usuario_id": usuario_id}, {"_id": 1}):
+        return
+    try:
+        lancamentos.insert_one({
+            "usuario_id": usuario_id,
+            "seq": 1,
+            "tipo": "abertura",
+            "valor": carteira["saldo"],
+            "data": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        pass
+    carteiras.update_one({"usuario_id": usuario_id, "ledger_seq": {"$exists": False}}, {"$set": {"ledger_seq": 1}})
+
+
+def saldo_em(usuario_id: Any, data: Optional[datetime] = None, carteira: Optional[dict] = None) -> float:
+    """Saldo da carteira no instante informado (ou atual), a partir de snapshot + cauda."""
+    usuario_id = ObjectId(usuario_id)
+    _garantir_abertura(usuario_id, carteira)
+    return _estado(usuario_id, data)[1]
+
+
+def saldo_atual(usuario_id: Any, carteira: Optional[dict] = None) -> float:
+    return saldo_em(usuario_id, carteira=carteira)
+
+
+def lancar(
+    usuario_id: Any,
+    tipo: str,
+    valor: float,
+    referencia: Optional[Dict[str, Any]] = None,
+    exigir_saldo: bool = False,
+    max_tentativas: int = 20,
+    carteira: Optional[dict] = None,
+    chave: Optional[str] = None,
+) -> dict:
+    """
+    Acrescenta um lançamento (valor positivo = crédito, negativo = débito).
+
+    A concorrência é otimista: o lançamento usa a próxima sequência e, se outro processo
+    gravou a mesma sequência antes, o saldo é recalculado e a gravação repetida.
+
+    Com chave (ex.: "deposito:<id>"), o lançamento é idempotente: a chave é o _id do
+    lançamento, então repetir a operação retorna o lançamento já gravado.
+    """
+    usuario_id = ObjectId(usuario_id)
+    if chave is not None:
+        existente = lancamentos.find_one({"_id": chave})
+        if existente is not None:
+            return {**existente, "saldo": _estado(usuario_id)[1]}
+    _garantir_abertura(usuario_id, carteira)
+    for _ in range(max_tentativas):
+        seq, saldo, seq_snapshot = _estado(usuario_id)
+        novo_saldo = round(saldo + valor, 2)
+        if exigir_saldo and novo_saldo < 0:
+            raise SaldoInsuficiente(saldo, -valor)
+        lancamento = {
+            "usuario_id": usuario_id,
+            "seq": seq + 1,
+            "tipo": tipo,
+            "valor": valor,
+            "data": datetime.utcnow(),
+        }
+        if referencia:
+            lancamento["referencia"] = referencia
+        if chave is not None:
+            lancamento["_id"] = chave
+        try:
+            lancamentos.insert_one(lancamento)
+        except DuplicateKeyError:
+            existente = lancamentos.find_one({"_id": chave}) if chave is not None else None
+            if existente is not None:
+                # Gravado por uma execução concorrente da mesma operação
+                return {**existente, "saldo": _estado(usuario_id)[1]}
+            continue
+        _apos_lancamento(usuario_id, lancamento, novo_saldo, seq_snapshot)
+        return {**lancamento, "saldo": novo_saldo}
+    raise RuntimeError(f"Não foi possível registrar o lançamento da carteira {usuario_id}: concorrência excessiva")
+
+
+def _apos_lancamento(usuario_id: ObjectId, lancamento: dict, novo_saldo: float, seq_snapshot: int):
+    seq = lancamento["seq"]
+    if seq - seq_snapshot >= settings.LEDGER_SNAPSHOT_INTERVAL:
+        try:
+            saldos_snapshots.insert_one({
+                "usuario_id": usuario_id,
+                "seq": seq,
+                "saldo": novo_saldo,
+                "data": lancamento["data"],
+            })
+        except DuplicateKeyError:
+            pass
+    # Atualiza o cache na carteira apenas se ninguém gravou uma sequência mais nova
+    carteiras.update_one(
+        {"usuario_id": usuario_id, "$or": [{"ledger_seq": {"$lt": seq}}, {"ledger_seq": {"$exists": False}}]},
+        {"$set": {"saldo": novo_saldo, "ledger_seq": seq}},
+    )
+
+
+# ---------------------------------------------------------------------------
+# Verificação
+# ---------------------------------------------------------------------------
+
+def verificar_carteira(usuario_id: ObjectId) -> Optional[dict]:
+    """Recalcula o saldo desde o primeiro lançamento; retorna as divergências encontradas."""
+    problemas = []
+    snapshots = {s["seq"]: s["saldo"] for s in saldos_snapshots.find({"usuario_id": usuario_id})}
+    saldo = 0.0
+    esperado = 1
+    for lancamento in lancamentos.find({"usuario_id": usuario_id}, {"seq": 1, "valor": 1}).sort("seq", 1):
+        if lancamento["seq"] != esperado:
+            problemas.append(f"lacuna na sequência: esperado {esperado}, encontrado {lancamento['seq']}")
+        esperado = lancamento["seq"] + 1
+        saldo += lancamento["valor"]
+        snapshot = snapshots.get(lancamento["seq"])
+        if snapshot is not None and abs(snapshot - saldo) > TOLERANCIA:
+            problemas.append(f"snapshot seq {lancamento['seq']}: {snapshot:.2f} != recalculado {saldo:.2f}")
+    if saldo < -TOLERANCIA:
+        problemas.append(f"saldo negativo: {saldo:.2f}")
+
+    carteira = carteiras.find_one({"usuario_id": usuario_id}, {"saldo": 1, "ledger_seq": 1})
+    if carteira and esperado > 1 and abs(carteira.get("saldo", 0.0) - saldo) > TOLERANCIA:
+        problemas.append(f"cache da carteira {carteira.get('saldo', 0.0):.2f} != recalculado {saldo:.2f}")
+
+    if not problemas:
+        return None
+    return {"usuario_id": str(usuario_id), "saldo_recalculado": round(saldo, 2), "problemas": problemas}
+
+
+def _verificar_lote(usuario_ids: List[ObjectId]) -> List[dict]:
+    return [r for r in (verificar_carteira(usuario_id) for usuario_id in usuario_ids) if r]
+
+
+def verificar(workers: int = 4, chunk: int = 500) -> dict:
+    """Verifica todas as carteiras em lotes paralelos."""
+    usuario_ids = [c["usuario_id"] for c in carteiras.find({}, {"usuario_id": 1})]
+    lotes = [usuario_ids[i:i + chunk] for i in range(0, len(usuario_ids), chunk)]
+    divergencias: List[dict] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for resultado in executor.map(_verificar_lote, lotes):
+            divergencias.extend(resultado)
+    return {"carteiras": len(usuario_ids), "divergencias": divergencias}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula e verifica os saldos a partir do ledger")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk", type=int, default=500)
+    argumentos = parser.parse_args()
+    print(json.dumps(verificar(argumentos.workers, argumentos.chunk), indent=2, ensure_ascii=False))
@@ -0,0 +1,211 @@
+"""
+Limite de concorrência adaptativo e descarte de carga por prioridade (por worker).
+
+Todas as rotas são síncronas e rodam no threadpool do AnyIO: sem controle, a sobrecarga
+vira uma fila invisível no threadpool e a latência cresce até o timeout do gunicorn
+derrubar o worker. O middleware admite no máximo `limite` requisições em andamento; as
+demais esperam numa fila ordenada por prioridade (alta, normal, baixa) e recebem 503 com
+Retry-After quando a espera passa do orçamento da sua prioridade. A "baixa" (ex.:
+listagens de bots) tem o menor orçamento e é descartada primeiro; login e compra, por
+último. Com a espera média recente já acima do orçamento, a requisição é descartada na
+chegada, sem ocupar a fila.
+
+O limite se ajusta pela latência, como o gradiente do concurrency-limits da Netflix: a
+cada janela, compara a latência média curta com a de longo prazo; se a curta passa da
+tolerância (o servidor está saturando), o limite diminui; com a latência estável, ele
+cresce aos poucos até o máximo (o tamanho do threadpool).
+
+A prioridade só é calculada quando a requisição precisa esperar, então o caminho normal
+não decodifica o token.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+PRIORIDADES = ("alta", "normal", "baixa")
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, limite_max: int = 40, limite_min: int = 4, max_fila: int = 1000,
+                 orcamento_fila_ms: Optional[Dict[str, float]] = None, tolerancia: float = 1.5,
+                 janela: int = 50, suavizacao: float = 0.2):
+        self.limite_max = limite_max
+        self.limite_min = min(limite_min, limite_max)
+        self.max_fila = max_fila
+        orcamentos = {"alta": 10000.0, "normal": 1000.0, "baixa": 100.0, **(orcamento_fila_ms or {})}
+        self.orcamento_s = {prioridade: orcamentos[prioridade] / 1000.0 for prioridade in PRIORIDADES}
+        self.tolerancia = tolerancia
+        self.janela = janela
+        self.suavizacao = suavizacao
+        self._limite = float(limite_max)
+        self.em_andamento = 0
+        self._esperando = 0  # Vagas ainda pendentes na fila (o heap guarda também as expiradas)
+        self._fila: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequencia = itertools.count()
+        self._amostras: List[float] = []
+        self._latencia_longa: Optional[float] = None
+        self._latencia_curta: Optional[float] = None
+        self._espera_recente = 0.0  # EWMA da espera na fila (s)
+        self._estatisticas = {
+            "admitidas": 0, "enfileiradas": 0,
+            **{f"descartadas_{prioridade}": 0 for prioridade in PRIORIDADES},
+        }
+
+    @property
+    def limite(self) -> int:
+        return int(self._limite)
+
+    def _registrar_espera(self, espera: float):
+        self._espera_recente = 0.9 * self._espera_recente + 0.1 * espera
+
+    def _descartar(self, prioridade: str) -> bool:
+        self._estatisticas[f"descartadas_{prioridade}"] += 1
+        return False
+
+    def _recusar(self, vaga: asyncio.Future):
+        if not vaga.done():
+            self._esperando -= 1
+            vaga.set_result(False)
+
+    def _despachar(self):
+        while self._fila and self.em_andamento < self.limite:
+            _, _, vaga = heapq.heappop(self._fila)
+            if vaga.done():
+                continue  # Expirada ou descartada
+            self._esperando -= 1
+            self.em_andamento += 1
+            vaga.set_result(True)
+
+    async def adquirir(self, prioridade: Callable[[], str]) -> bool:
+        """Espera uma vaga; False quando a requisição deve ser descartada (503)."""
+        if self.em_andamento < self.limite and not self._esperando:
+            self.em_andamento += 1
+            self._estatisticas["admitidas"] += 1
+            self._registrar_espera(0.0)
+            return True
+
+        nivel = prioridade()
+        orcamento = self.orcamento_s[nivel]
+        if self._espera_recente > orcamento:
+            return self._descartar(nivel)
+        if self._esperando >= self.max_fila:
+            # Fila cheia: abre espaço descartando quem tem prioridade menor que a da chegada
+            self._fila = [entrada for entrada in self._fila if not entrada[2].done()]
+            heapq.heapify(self._fila)
+            pior = max(self._fila)
+            if pior[0] <= PRIORIDADES.index(nivel):
+                return self._descartar(nivel)
+            self._recusar(pior[2])
+
+        loop = asyncio.get_running_loop()
+        vaga = loop.create_future()
+        heapq.heappush(self._fila, (PRIORIDADES.index(nivel), next(self._sequencia), vaga))
+        self._esperando += 1
+        self._estatisticas["enfileiradas"] += 1
+        self._despachar()
+        expira = loop.call_later(orcamento, self._recusar, vaga)
+        chegada = time.monotonic()
+        try:
+            admitida = await vaga
+        except asyncio.CancelledError:
+            # Cliente desconectou na fila; se a vaga já tinha sido concedida, devolve
+            if vaga.cancelled():
+                self._esperando -= 1
+            elif vaga.result():
+                self.liberar()
+            raise
+        finally:
+            expira.cancel()
+        self._registrar_espera(time.monotonic() - chegada)
+        if not admitida:
+            return self._descartar(nivel)
+        self._estatisticas["admitidas"] += 1
+        return True
+
+    def liberar(self, latencia_s: Optional[float] = None):
+        """Devolve a vaga; a latência da requisição admitida ajusta o limite."""
+        self.em_andamento -= 1
+        if latencia_s is not None:
+            self._amostrar(latencia_s)
+        self._despachar()
+
+    def _amostrar(self, latencia_s: float):
+        self._amostras.append(latencia_s)
+        if len(self._amostras) < self.janela:
+            return
+        curta = sum(self._amostras) / len(self._amostras)
+        self._amostras = []
+        self._latencia_curta = curta
+        if self._latencia_longa is None:
+            self._latencia_longa = curta
+        else:
+            self._latencia_longa = 0.95 * self._latencia_longa + 0.05 * curta
+            # Depois de um pico, a média longa não pode ficar muito acima da atual
+            if self._latencia_longa / curta > 2:
+                self._latencia_longa *= 0.9
+        gradiente = max(0.5, min(1.0, self.tolerancia * self._latencia_longa / curta))
+        novo = self._limite * gradiente + math.sqrt(self._limite)
+        self._limite = (1 - self.suavizacao) * self._limite + self.suavizacao * novo
+        self._limite = max(float(self.limite_min), min(float(self.limite_max), self._limite))
+
+    def stats(self) -> dict:
+        return {
+            "limite": self.limite,
+            "limite_max": self.limite_max,
+            "em_andamento": self.em_andamento,
+            "na_fila": self._esperando,
+            "espera_fila_ms": round(self._espera_recente * 1000, 2),
+            "latencia_curta_ms": round(self._latencia_curta * 1000, 2) if self._latencia_curta else None,
+            "latencia_longa_ms": round(self._latencia_longa * 1000, 2) if self._latencia_longa else None,
+            **self._estatisticas,
+        }
+
+
+class LoadSheddingMiddleware:
+    """Middleware ASGI que admite as requisições HTTP pelo limitador e responde 503 ao descartar."""
+
+    def __init__(self, app, limiter: AdaptiveConcurrencyLimiter, prioridades: Dict[str, Dict[str, str]],
+                 rota: Callable[[dict], Optional[str]], tipo: Callable[[dict], str]):
+        self.app = app
+        self.limiter = limiter
+        self.prioridades = prioridades
+        self.rota = rota
+        self.tipo = tipo
+
+    def prioridade(self, scope) -> str:
+        """Prioridade pela regra da rota ("MÉTODO /template") e tipo_usuario; "*" vale para os demais."""
+        regras = self.prioridades.get(f"{scope['method']} {self.rota(scope)}")
+        if not regras:
+            return "normal"
+        if set(regras) == {"*"}:
+            return regras["*"]
+        return regras.get(self.tipo(scope)) or regras.get("*") or "normal"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if not await self.limiter.adquirir(lambda: self.prioridade(scope)):
+            corpo = json.dumps({"detail": "Servidor sobrecarregado. Tente novamente em instantes."}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(corpo)).encode()),
+                    (b"retry-after", b"1"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": corpo})
+            return
+        inicio = time.monotonic()
+        latencia = None
+        try:
+            await self.app(scope, receive, send)
+            latencia = time.monotonic() - inicio
+        finally:
+            # Requisições com erro não entram na amostra de latência
+            self.limiter.liberar(latencia)
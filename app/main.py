@@ -1,23 +1,147 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, File, Query, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app import models, schemas, auth
-from app.database import usuarios, acoes, carteiras, transacoes, notificacoes, relatorios, depositos, init_db
+from starlette.routing import Match
+from app import (
+    models, schemas, auth, context, ledger, candles, risco, exportacao, dashboard, jobs, rate_limit, importacao,
+    reconciliacao_estoque, custo_medio,
+)
+from app.change_feed import ExpiredToken, InvalidToken
+from app.content_negotiation import NegotiatedResponse, NegotiatingRoute
+from app.load_shedding import AdaptiveConcurrencyLimiter, LoadSheddingMiddleware
+from app.price_stream import PriceBroadcaster, poll_change_feed
+from app.price_table import SharedPriceTable, caminho_padrao
+from app.database import (
+    usuarios, acoes, carteiras, transacoes, notificacoes, relatorios, depositos, init_db, request_charge_metrics,
+    usuarios_leitura, acoes_leitura, carteiras_leitura, depositos_leitura, save_snapshot,
+    write_behind, registrar_notificacao, registrar_transacao, change_feed, rate_limits,
+    consultas_lentas, slow_queries, iniciar_registro_consultas_lentas, arquivo_transacoes, arquivo_notificacoes,
+)
 from app.config import get_settings
-from typing import List
+from typing import List, Optional
 from bson import ObjectId
+from contextlib import asynccontextmanager
 from datetime import datetime
+import anyio.to_thread
+import asyncio
+import logging
+import time
+import uuid
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("app.access")
+
+# Distribuição das atualizações de preço para os WebSockets deste processo
+precos_stream = PriceBroadcaster(
+    tick_ms=settings.PRICE_STREAM_TICK_MS,
+    send_timeout_ms=settings.PRICE_STREAM_SEND_TIMEOUT_MS,
+    max_lag_ticks=settings.PRICE_STREAM_MAX_LAG_TICKS,
+    max_subscriptions=settings.PRICE_STREAM_MAX_SUBSCRIPTIONS,
+)
+
+# Preços das ações compartilhados entre os workers, lidos sem ir ao MongoDB
+tabela_precos = None
+if settings.PRICE_TABLE_ENABLED:
+    try:
+        tabela_precos = SharedPriceTable(
+            settings.PRICE_TABLE_PATH or caminho_padrao(f"{settings.DATABASE_NAME}_precos"),
+            capacidade=settings.PRICE_TABLE_CAPACITY,
+            max_atraso_ms=settings.PRICE_TABLE_MAX_STALENESS_MS,
+        )
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Tabela de preços compartilhada desativada: {e}")
+
+# Jobs de manutenção; cada horário é executado por um único worker (lease no Mongo)
+agendador = jobs.criar_agendador()
+
+# Concorrência admitida no threadpool das rotas síncronas, ajustada pela latência
+limitador_concorrencia = AdaptiveConcurrencyLimiter(
+    limite_max=settings.LOAD_SHED_MAX_CONCURRENCY or settings.THREADPOOL_SIZE,
+    limite_min=settings.LOAD_SHED_MIN_CONCURRENCY,
+    max_fila=settings.LOAD_SHED_MAX_QUEUE,
+    orcamento_fila_ms=settings.LOAD_SHED_QUEUE_BUDGET_MS,
+)
+
+async def _snapshot_periodico():
+    """Grava periodicamente o snapshot do motor em memória."""
+    while True:
+        await asyncio.sleep(settings.MEMORY_SNAPSHOT_INTERVAL_S)
+        await asyncio.to_thread(save_snapshot)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Threads disponíveis para as rotas síncronas (o padrão do AnyIO é 40)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+    tarefas = []
+    if settings.STORAGE_ENGINE == "memory" and settings.MEMORY_SNAPSHOT_INTERVAL_S > 0:
+        tarefas.append(asyncio.create_task(_snapshot_periodico()))
+    if settings.WRITE_BEHIND_ENABLED:
+        write_behind.start()
+    precos_stream.start()
+    if tabela_precos is not None:
+        tabela_precos.iniciar(acoes, change_feed, settings.PRICE_TABLE_REFRESH_MS, settings.PRICE_TABLE_RELOAD_S)
+    iniciar_registro_consultas_lentas()
+    if settings.JOBS_ENABLED:
+        agendador.start()
+    if settings.PRICE_STREAM_POLL_MS > 0:
+        tarefas.append(asyncio.create_task(poll_change_feed(precos_stream, change_feed, settings.PRICE_STREAM_POLL_MS)))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await precos_stream.stop()
+    if tabela_precos is not None:
+        await asyncio.to_thread(tabela_precos.parar)
+    await agendador.stop()
+    # Grava o que estiver na fila adiada antes do snapshot final
+    await asyncio.to_thread(write_behind.stop)
+    await asyncio.to_thread(slow_queries.stop)
+    await asyncio.to_thread(save_snapshot)
 
 # Configuração do FastAPI
 app = FastAPI(
     title="API de Investimentos",
     description="API para gerenciamento de investimentos em ações",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Respostas em JSON, msgpack ou CBOR conforme o Accept (app.content_negotiation)
+    default_response_class=NegotiatedResponse,
 )
+# Antes das rotas: corpos msgpack/CBOR e escolha do formato da resposta
+app.router.route_class = NegotiatingRoute
 
 # Inicializar o banco de dados durante a inicialização
 init_db()
 
+# Descarte de carga por prioridade; mais interno que o limite de taxa, que rejeita antes os
+# clientes acima da cota sem ocupar vagas
+if settings.LOAD_SHED_ENABLED:
+    app.add_middleware(
+        LoadSheddingMiddleware,
+        limiter=limitador_concorrencia,
+        prioridades=settings.LOAD_SHED_PRIORIDADES,
+        rota=lambda scope: context.rota_atual.get(),
+        tipo=lambda scope: rate_limit.tipo_usuario(scope, settings.JWT_SECRET, settings.JWT_ALGORITHM),
+    )
+
+# Limite de taxa por cliente e rota; registrado antes do CORS para que as respostas 429
+# também recebam os cabeçalhos CORS (a rota vem do middleware de contexto, mais externo)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        rate_limit.RateLimitMiddleware,
+        limiter=rate_limit.RateLimiter(
+            rate_limit.MongoBucketStore(rate_limits) if settings.RATE_LIMIT_BACKEND == "mongo"
+            else rate_limit.MemoryBucketStore(),
+            rotas=settings.RATE_LIMIT_ROTAS,
+            por_tipo=settings.RATE_LIMIT_POR_TIPO,
+            secret=settings.JWT_SECRET,
+            algorithm=settings.JWT_ALGORITHM,
+            proxies_confiaveis=settings.RATE_LIMIT_TRUSTED_PROXIES,
+        ),
+        rota=lambda scope: context.rota_atual.get(),
+    )
+
 # Configuração do CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +151,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _template_rota(scope) -> str:
+    """Retorna o template da rota (ex.: /api/acoes/{acao_id}) para agrupar métricas."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return scope.get("path", "-")
+
+# Middleware que expõe rota e prazo da requisição para a camada de acesso a dados
+@app.middleware("http")
+async def contexto_requisicao(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token_id = context.request_id.set(request_id)
+    token_rota = context.rota_atual.set(_template_rota(request.scope))
+    token_prazo = context.prazo_requisicao.set(time.monotonic() + settings.COSMOS_REQUEST_DEADLINE_MS / 1000.0)
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        # Log de acesso amostrado por nível (structured_logging.AccessSampler)
+        if status >= 500:
+            nivel = logging.ERROR
+        elif status >= 400 or duracao_ms >= settings.LOG_ACCESS_SLOW_MS:
+            nivel = logging.WARNING
+        else:
+            nivel = logging.INFO
+        access_logger.log(nivel, f"{request.method} {request.url.path} {status} {duracao_ms:.1f} ms", extra={
+            "metodo": request.method, "path": request.url.path, "status": status, "duracao_ms": round(duracao_ms, 2),
+        })
+        context.rota_atual.reset(token_rota)
+        context.prazo_requisicao.reset(token_prazo)
+        context.request_id.reset(token_id)
+
 # Configuração de segurança
 security = HTTPBearer()
 
@@ -57,7 +219,7 @@ def registrar_usuario(usuario: schemas.UsuarioCreate):
     resultado = usuarios.insert_one(usuario_dict)
     
     # Gerar token
-    token = auth.create_access_token(data={"sub": usuario.email})
+    token = auth.create_access_token(data={"sub": usuario.email, "tipo_usuario": usuario.tipo_usuario})
     return {
         "access_token": token,
         "token_type": "bearer",
@@ -80,11 +242,34 @@ def login(usuario: schemas.UsuarioLogin):
         "tipo_usuario": user["tipo_usuario"]
     }
 
+def _ler_acao(acao_id: str) -> Optional[dict]:
+    """Ação lida da tabela de preços compartilhada ou, se ela não estiver atual, do MongoDB."""
+    acao = tabela_precos.obter(acao_id) if tabela_precos is not None else None
+    return acao or acoes.find_one({"_id": ObjectId(acao_id)})
+
+def _publicar_acao(acao: dict):
+    """Propaga preço e quantidade alterados ao stream de preços e à tabela compartilhada."""
+    precos_stream.publish(acao["_id"], {"preco": acao["preco"], "qtd": acao.get("qtd", 0)}, seq=acao.get("sync_seq"))
+    if tabela_precos is not None:
+        tabela_precos.gravar_documento(acao)
+
+def _estornar(usuario_id: str, lancamento: dict, carteira: dict):
+    """Devolve ao ledger o débito de uma operação que não pôde ser concluída."""
+    ledger.lancar(
+        usuario_id,
+        "estorno",
+        -lancamento["valor"],
+        referencia={"seq": lancamento["seq"], "tipo": lancamento["tipo"]},
+        carteira=carteira,
+        chave=f"estorno:{usuario_id}:{lancamento['seq']}"
+    )
+
 # Rotas de ações
 @app.get("/api/acoes", response_model=List[models.Acao], tags=["Ações"])
 def listar_acoes(_: dict = Depends(get_current_user)):
-    cursor = acoes.find()
-    acoes_list = list(cursor)
+    acoes_list = tabela_precos.listar() if tabela_precos is not None else None
+    if acoes_list is None:
+        acoes_list = list(acoes_leitura.find())
     return [
         models.Acao(
             _id=str(acao["_id"]),
@@ -98,7 +283,7 @@ def listar_acoes(_: dict = Depends(get_current_user)):
 
 @app.get("/api/acoes/{acao_id}", response_model=models.Acao, tags=["Ações"])
 def obter_acao(acao_id: str, _: dict = Depends(get_current_user)):
-    acao = acoes.find_one({"_id": ObjectId(acao_id)})
+    acao = _ler_acao(acao_id)
     if not acao:
         raise HTTPException(status_code=404, detail="Ação não encontrada")
     return models.Acao(
@@ -109,6 +294,93 @@ def obter_acao(acao_id: str, _: dict = Depends(get_current_user)):
         risco=acao.get("risco", 1)
     )
 
+@app.get("/api/acoes/{acao_id}/candles", response_model=List[schemas.Candle], tags=["Ações"])
+def obter_candles(
+    acao_id: str,
+    intervalo: str = Query(default="1d", description="Ex.: 1m, 5m, 1h, 4h, 1d, 1w"),
+    inicio: Optional[datetime] = None,
+    fim: Optional[datetime] = None,
+    limite: int = Query(default=500, ge=1, le=5000),
+    _: dict = Depends(get_current_user)
+):
+    if not acoes.find_one({"_id": ObjectId(acao_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Ação não encontrada")
+    
+    try:
+        return candles.obter_candles(acao_id, intervalo, inicio, fim, limite)
+    except candles.IntervaloInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/acoes/{acao_id}/detentores", response_model=schemas.DetentoresAcao, tags=["Ações"])
+def listar_detentores(
+    acao_id: str,
+    pagina: int = Query(default=1, ge=1),
+    limite: int = Query(default=50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    acao = acoes.find_one({"_id": ObjectId(acao_id)}, {"nome": 1, "qtd": 1})
+    if not acao:
+        raise HTTPException(status_code=404, detail="Ação não encontrada")
+    
+    # Só as carteiras com a ação, pelo índice multikey em acoes.acao_id; a página e o total
+    # saem da mesma agregação
+    ids = [acao["_id"], str(acao["_id"])]
+    resultado = next(carteiras_leitura.aggregate([
+        {"$match": {"acoes.acao_id": {"$in": ids}}},
+        {"$unwind": "$acoes"},
+        {"$match": {"acoes.acao_id": {"$in": ids}}},
+        {"$group": {
+            "_id": "$usuario_id",
+            "qtd": {"$sum": "$acoes.qtd"},
+            "custo": {"$sum": {"$multiply": ["$acoes.qtd", {"$ifNull": ["$acoes.preco_compra", 0]}]}},
+        }},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, "detentores": {"$sum": 1}, "qtd": {"$sum": "$qtd"}}}],
+            "pagina": [{"$sort": {"qtd": -1, "_id": 1}}, {"$skip": (pagina - 1) * limite}, {"$limit": limite}],
+        }},
+    ]))
+    total = resultado["total"][0] if resultado["total"] else {"detentores": 0, "qtd": 0}
+    usuarios_pagina = {
+        u["_id"]: u for u in usuarios_leitura.find(
+            {"_id": {"$in": [posicao["_id"] for posicao in resultado["pagina"]]}}, {"nome": 1, "email": 1}
+        )
+    }
+    
+    qtd_disponivel = acao.get("qtd", 0)
+    return schemas.DetentoresAcao(
+        acao_id=str(acao["_id"]),
+        nome=acao["nome"],
+        qtd_disponivel=qtd_disponivel,
+        qtd_em_carteiras=total["qtd"],
+        percentual_em_carteiras=round(100 * total["qtd"] / (total["qtd"] + qtd_disponivel), 2)
+        if total["qtd"] + qtd_disponivel else 0.0,
+        total_detentores=total["detentores"],
+        pagina=pagina,
+        limite=limite,
+        detentores=[
+            schemas.DetentorAcao(
+                usuario_id=str(posicao["_id"]),
+                usuario_nome=usuarios_pagina.get(posicao["_id"], {}).get("nome"),
+                usuario_email=usuarios_pagina.get(posicao["_id"], {}).get("email"),
+                qtd=posicao["qtd"],
+                preco_medio=round(posicao["custo"] / posicao["qtd"], 4) if posicao["qtd"] else None,
+                percentual=round(100 * posicao["qtd"] / total["qtd"], 2) if total["qtd"] else 0.0
+            )
+            for posicao in resultado["pagina"]
+        ]
+    )
+
+@app.get("/api/acoes/{acao_id}/preco-referencia", response_model=schemas.PrecoReferenciaResponse, tags=["Ações"])
+def obter_preco_referencia(acao_id: str, user: dict = Depends(get_current_user)):
+    preco = importacao.obter_preco_referencia(acao_id)
+    if not preco:
+        raise HTTPException(status_code=404, detail="Preço de referência não encontrado")
+    return {**preco, "id": str(preco["_id"])}
+
 @app.post("/api/acoes/cadastrar", response_model=models.Acao, tags=["Ações"])
 def cadastrar_acoes(acao: schemas.AcaoCreate, user: dict = Depends(get_current_user)):
     # Verificar permissões
@@ -122,6 +394,10 @@ def cadastrar_acoes(acao: schemas.AcaoCreate, user: dict = Depends(get_current_u
     if not acao_criada:
         raise HTTPException(status_code=500, detail="Erro ao cadastrar ação")
     
+    # Primeiro ponto do histórico de preços
+    candles.registrar_tick(acao_criada["_id"], acao_criada["preco"])
+    _publicar_acao(acao_criada)
+    
     return models.Acao(
         _id=str(acao_criada["_id"]),
         nome=acao_criada["nome"],
@@ -160,8 +436,15 @@ def atualizar_acoes(acao_id: str, acao: schemas.AcaoUpdate, user: dict = Depends
         return_document=True
     )
     
+    # Removida entre a leitura e a atualização
     if not resultado:
-        raise HTTPException(status_code=500, detail="Erro ao atualizar ação")
+        raise HTTPException(status_code=404, detail="Ação não encontrada")
+    
+    # Registrar a variação de preço no histórico e nos candles
+    if "preco" in atualizacao and atualizacao["preco"] != acao_atual["preco"]:
+        candles.registrar_tick(resultado["_id"], atualizacao["preco"])
+        dashboard.preco_alterado(resultado["_id"], atualizacao["preco"] - acao_atual["preco"])
+    _publicar_acao(resultado)
     
     return models.Acao(
         _id=str(resultado["_id"]),
@@ -199,12 +482,49 @@ def obter_carteira(usuario: dict = Depends(get_current_user)):
             )
             for acao in carteira["acoes"]
         ],
-        saldo=carteira.get("saldo", 0.0),
+        saldo=ledger.saldo_atual(carteira["usuario_id"], carteira),
         qtd_max_acoes=carteira.get("qtd_max_acoes", 100),
         qtd_max_valor=carteira.get("qtd_max_valor", 100000.0),
         nivel_risco=carteira.get("nivel_risco", 1)
     )
 
+@app.get("/api/carteira/saldo", response_model=schemas.SaldoCarteira, tags=["Carteira"])
+def obter_saldo(data: Optional[datetime] = None, usuario: dict = Depends(get_current_user)):
+    # Saldo reconstruído pelo ledger (snapshot + lançamentos posteriores), atual ou em uma data
+    return schemas.SaldoCarteira(
+        usuario_id=str(usuario["_id"]),
+        saldo=ledger.saldo_em(usuario["_id"], data),
+        data=data or datetime.utcnow()
+    )
+
+@app.get("/api/carteira/transacoes", response_model=List[schemas.TransacaoResponse], tags=["Carteira"])
+def listar_transacoes(
+    inicio: Optional[datetime] = None,
+    fim: Optional[datetime] = None,
+    limite: int = Query(default=100, ge=1, le=1000),
+    usuario: dict = Depends(get_current_user)
+):
+    # Períodos anteriores à fronteira do arquivamento também são lidos dos arquivos mensais
+    transacoes_usuario = arquivo_transacoes.consultar({"usuario_id": ObjectId(usuario["_id"])}, inicio, fim, limite)
+    return [
+        schemas.TransacaoResponse(
+            id=str(transacao["_id"]),
+            usuario_id=str(transacao["usuario_id"]),
+            acao_id=str(transacao["acao_id"]) if transacao.get("acao_id") else None,
+            tipo=transacao["tipo"],
+            qtd=transacao.get("qtd"),
+            valor=transacao["valor"],
+            preco_unitario=transacao.get("preco_unitario"),
+            data=transacao["data"]
+        )
+        for transacao in transacoes_usuario
+    ]
+
+@app.get("/api/carteira/risco", response_model=schemas.RiscoCarteira, tags=["Carteira"])
+def obter_risco(usuario: dict = Depends(get_current_user)):
+    # Volatilidade, VaR histórico e concentração; em cache até as posições mudarem
+    return risco.risco_carteira(usuario["_id"])
+
 @app.post("/api/carteira/deposito", response_model=schemas.SolicitacaoDepositoResponse, tags=["Carteira"])
 def solicitar_deposito(
     deposito: schemas.SolicitacaoDeposito,
@@ -220,6 +540,7 @@ def solicitar_deposito(
     }
     
     resultado = depositos.insert_one(deposito_dict)
+    dashboard.deposito_solicitado(deposito.valor)
     
     # Criar notificação para admins
     notificacao = {
@@ -234,7 +555,7 @@ def solicitar_deposito(
             "usuario_email": usuario["email"]
         }
     }
-    notificacoes.insert_one(notificacao)
+    registrar_notificacao(notificacao)
     
     deposito_criado = depositos.find_one({"_id": resultado.inserted_id})
     return schemas.SolicitacaoDepositoResponse(
@@ -263,23 +584,23 @@ def aprovar_deposito(
     if not deposito:
         raise HTTPException(status_code=404, detail="Depósito não encontrado")
     
-    if deposito["status"] != "pendente":
+    # "creditando": aprovação interrompida antes de concluir; uma nova aprovação a retoma
+    if deposito["status"] not in ("pendente", "creditando"):
         raise HTTPException(status_code=400, detail="Este depósito já foi processado")
+    if deposito["status"] == "creditando" and not aprovacao.aprovado:
+        raise HTTPException(status_code=400, detail="Depósito em crédito; aprove novamente para concluir")
     
     agora = datetime.utcnow()
     
     if aprovacao.aprovado:
-        # Atualizar status do depósito
-        depositos.update_one(
-            {"_id": ObjectId(deposito_id)},
-            {
-                "$set": {
-                    "status": "aprovado",
-                    "data_aprovacao": agora,
-                    "aprovado_por": current_user["email"]
-                }
-            }
-        )
+        # Reservar o depósito para crédito (condicional: pendente -> creditando)
+        if deposito["status"] == "pendente":
+            resultado = depositos.update_one(
+                {"_id": ObjectId(deposito_id), "status": "pendente"},
+                {"$set": {"status": "creditando", "aprovado_por": current_user["email"]}}
+            )
+            if resultado.modified_count == 0:
+                raise HTTPException(status_code=400, detail="Este depósito já foi processado")
         
         # Atualizar saldo da carteira
         carteira = carteiras.find_one({"usuario_id": ObjectId(deposito["usuario_id"])})
@@ -295,12 +616,32 @@ def aprovar_deposito(
             }
             carteiras.insert_one(carteira)
         
-        # Atualizar saldo
-        carteiras.update_one(
-            {"usuario_id": ObjectId(deposito["usuario_id"])},
-            {"$inc": {"saldo": deposito["valor"]}}
+        # Creditar o saldo no ledger antes de aprovar; a chave torna o crédito idempotente,
+        # então retomar um depósito "creditando" nunca credita duas vezes
+        ledger.lancar(
+            deposito["usuario_id"],
+            "deposito",
+            deposito["valor"],
+            referencia={"deposito_id": ObjectId(deposito_id)},
+            carteira=carteira,
+            chave=f"deposito:{deposito_id}"
         )
         
+        # Concluir a aprovação (condicional: apenas uma execução registra os efeitos)
+        resultado = depositos.update_one(
+            {"_id": ObjectId(deposito_id), "status": "creditando"},
+            {
+                "$set": {
+                    "status": "aprovado",
+                    "data_aprovacao": agora,
+                    "aprovado_por": current_user["email"]
+                }
+            }
+        )
+        if resultado.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Este depósito já foi processado")
+        dashboard.deposito_decidido(deposito["valor"], aprovado=True)
+        
         # Registrar transação
         transacao = {
             "usuario_id": ObjectId(deposito["usuario_id"]),
@@ -308,7 +649,7 @@ def aprovar_deposito(
             "valor": deposito["valor"],
             "data": agora
         }
-        transacoes.insert_one(transacao)
+        registrar_transacao(transacao)
         
         # Criar notificação para o usuário
         notificacao = {
@@ -323,9 +664,9 @@ def aprovar_deposito(
             }
         }
     else:
-        # Atualizar status do depósito como rejeitado
-        depositos.update_one(
-            {"_id": ObjectId(deposito_id)},
+        # Atualizar status do depósito como rejeitado (condicional, como na aprovação)
+        resultado = depositos.update_one(
+            {"_id": ObjectId(deposito_id), "status": "pendente"},
             {
                 "$set": {
                     "status": "rejeitado",
@@ -335,6 +676,9 @@ def aprovar_deposito(
                 }
             }
         )
+        if resultado.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Este depósito já foi processado")
+        dashboard.deposito_decidido(deposito["valor"], aprovado=False)
         
         # Criar notificação para o usuário
         notificacao = {
@@ -350,7 +694,7 @@ def aprovar_deposito(
             }
         }
     
-    notificacoes.insert_one(notificacao)
+    registrar_notificacao(notificacao)
     
     deposito_atualizado = depositos.find_one({"_id": ObjectId(deposito_id)})
     return schemas.SolicitacaoDepositoResponse(
@@ -364,6 +708,31 @@ def aprovar_deposito(
         aprovado_por=deposito_atualizado.get("aprovado_por")
     )
 
+@app.get("/api/notificacoes", response_model=List[schemas.Notificacao], tags=["Notificações"])
+def listar_notificacoes(
+    inicio: Optional[datetime] = None,
+    fim: Optional[datetime] = None,
+    limite: int = Query(default=100, ge=1, le=1000),
+    usuario: dict = Depends(get_current_user)
+):
+    # Admins também recebem as notificações gerais (usuario_id None)
+    destinatarios = [str(usuario["_id"])]
+    if usuario["tipo_usuario"] == "admin":
+        destinatarios.append(None)
+    filtro = {"usuario_id": {"$in": destinatarios}}
+    return [
+        schemas.Notificacao(
+            id=str(notificacao["_id"]),
+            tipo=notificacao["tipo"],
+            usuario_id=notificacao.get("usuario_id"),
+            mensagem=notificacao["mensagem"],
+            data=notificacao["data"],
+            lida=notificacao.get("lida", False),
+            dados=notificacao.get("dados")
+        )
+        for notificacao in arquivo_notificacoes.consultar(filtro, inicio, fim, limite)
+    ]
+
 @app.get("/api/depositos/pendentes", response_model=list[schemas.DepositoPendente])
 def listar_depositos_pendentes(current_user: dict = Depends(get_current_user)):
     # Verificar se o usuário é admin
@@ -374,8 +743,10 @@ def listar_depositos_pendentes(current_user: dict = Depends(get_current_user)):
         )
 
     try:
-        # Buscar depósitos pendentes sem ordenação no banco
-        depositos_temp = list(depositos.find({"status": "pendente"}))
+        # Depósitos pendentes (e aprovações interrompidas, para retomar), mais recentes primeiro
+        # (índice status + data_solicitacao). Leitura em secundário: a aprovação revalida o status no primário
+        depositos_temp = list(depositos_leitura.find({"status": {"$in": ["pendente", "creditando"]}})
+                              .sort("data_solicitacao", -1))
         
         if not depositos_temp:
             return []
@@ -386,7 +757,7 @@ def listar_depositos_pendentes(current_user: dict = Depends(get_current_user)):
         # Buscar informações dos usuários de uma vez
         usuarios_info = {
             str(u["_id"]): u["nome"] 
-            for u in usuarios.find({"_id": {"$in": list(user_ids)}})
+            for u in usuarios_leitura.find({"_id": {"$in": list(user_ids)}})
         }
         
         # Processar os depósitos com as informações dos usuários
@@ -396,20 +767,17 @@ def listar_depositos_pendentes(current_user: dict = Depends(get_current_user)):
                 "id": str(dep["_id"]),
                 "usuario_id": str(dep["usuario_id"]),
                 "valor": dep["valor"],
-                "descricao": dep["descricao"],
+                "descricao": dep.get("descricao"),
                 "data_solicitacao": dep["data_solicitacao"],
                 "status": dep["status"],
                 "nome_usuario": usuarios_info.get(str(dep["usuario_id"]))
             }
             depositos_list.append(deposito_dict)
         
-        # Ordenar a lista em memória por data_solicitacao (mais recentes primeiro)
-        depositos_list.sort(key=lambda x: x["data_solicitacao"], reverse=True)
-        
         return depositos_list
         
     except Exception as e:
-        print(f"Erro ao listar depósitos pendentes: {str(e)}")
+        logger.exception(f"Erro ao listar depósitos pendentes: {e}")
         raise HTTPException(
             status_code=500,
             detail="Erro ao listar depósitos pendentes"
@@ -417,15 +785,13 @@ def listar_depositos_pendentes(current_user: dict = Depends(get_current_user)):
 
 @app.post("/api/carteira/comprar", response_model=models.Carteira, tags=["Carteira"])
 def comprar_acao(compra: schemas.CompraAcao, usuario: dict = Depends(get_current_user)):
-    # Verificar se a ação existe
-    acao = acoes.find_one({"_id": ObjectId(compra.acao_id)})
+    # Verificar se a ação existe. Preço e risco vêm do MongoDB, não da tabela compartilhada
+    # (que pode estar alguns segundos atrasada); a quantidade disponível só é conferida na
+    # baixa condicional do estoque
+    acao = acoes.find_one({"_id": ObjectId(compra.acao_id)}, {"preco": 1, "risco": 1})
     if not acao:
         raise HTTPException(status_code=404, detail="Ação não encontrada")
     
-    # Verificar quantidade disponível
-    if acao["qtd"] < compra.quantidade:
-        raise HTTPException(status_code=400, detail="Quantidade indisponível")
-    
     # Obter carteira do usuário
     carteira = carteiras.find_one({"usuario_id": ObjectId(usuario["_id"])})
     if not carteira:
@@ -443,8 +809,8 @@ def comprar_acao(compra: schemas.CompraAcao, usuario: dict = Depends(get_current
     # Calcular valor total da compra
     valor_total = acao["preco"] * compra.quantidade
     
-    # Verificar se há saldo suficiente
-    if carteira["saldo"] < valor_total:
+    # Verificar se há saldo suficiente (saldo derivado do ledger)
+    if ledger.saldo_atual(usuario["_id"], carteira) < valor_total:
         raise HTTPException(status_code=400, detail="Saldo insuficiente")
     
     # Verificar nível de risco
@@ -461,35 +827,45 @@ def comprar_acao(compra: schemas.CompraAcao, usuario: dict = Depends(get_current
     if valor_total > carteira["qtd_max_valor"]:
         raise HTTPException(status_code=400, detail="Limite de valor atingido")
     
-    # Atualizar quantidade de ações
-    acao_carteira = None
-    for a in carteira["acoes"]:
-        if str(a["acao_id"]) == compra.acao_id:
-            acao_carteira = a
-            break
-    
-    if acao_carteira:
-        acao_carteira["qtd"] += compra.quantidade
-    else:
-        carteira["acoes"].append({
-            "acao_id": ObjectId(compra.acao_id),
-            "qtd": compra.quantidade,
-            "preco_compra": acao["preco"]  # Registrar preço de compra
-        })
+    # Debitar o saldo no ledger (falha se outra operação consumiu o saldo nesse meio tempo)
+    try:
+        lancamento = ledger.lancar(
+            usuario["_id"],
+            "compra",
+            -valor_total,
+            referencia={"acao_id": ObjectId(compra.acao_id), "qtd": compra.quantidade},
+            exigir_saldo=True,
+            carteira=carteira
+        )
+    except ledger.SaldoInsuficiente:
+        raise HTTPException(status_code=400, detail="Saldo insuficiente")
     
-    # Atualizar saldo da carteira
-    carteira["saldo"] -= valor_total
+    # Baixa condicional: só decrementa se ainda houver a quantidade pedida e o preço for o debitado
+    acao_atualizada = acoes.find_one_and_update(
+        {"_id": ObjectId(compra.acao_id), "qtd": {"$gte": compra.quantidade}, "preco": acao["preco"]},
+        {"$inc": {"qtd": -compra.quantidade}},
+        projection={"nome": 1, "preco": 1, "qtd": 1, "risco": 1, "sync_seq": 1},
+        return_document=True
+    )
+    if acao_atualizada is None:
+        # Quantidade esgotada, preço alterado ou ação removida depois da leitura: o débito é estornado
+        _estornar(usuario["_id"], lancamento, carteira)
+        atual = acoes.find_one({"_id": ObjectId(compra.acao_id)}, {"preco": 1})
+        if atual is None:
+            raise HTTPException(status_code=404, detail="Ação não encontrada")
+        if atual["preco"] != acao["preco"]:
+            raise HTTPException(status_code=409, detail="O preço da ação mudou durante a compra; tente novamente")
+        raise HTTPException(status_code=400, detail="Quantidade indisponível")
+    _publicar_acao(acao_atualizada)
+    dashboard.compra_realizada(compra.acao_id, acao.get("risco", 1), compra.quantidade, valor_total)
     
-    # Atualizar banco de dados
+    # Quantidade e preço médio ponderado da posição numa única escrita atômica
+    # (o saldo da carteira é mantido pelo ledger)
     carteiras.update_one(
         {"_id": carteira["_id"]},
-        {"$set": carteira}
-    )
-    
-    acoes.update_one(
-        {"_id": ObjectId(compra.acao_id)},
-        {"$inc": {"qtd": -compra.quantidade}}
+        custo_medio.atualizacao_compra(compra.acao_id, compra.quantidade, acao["preco"])
     )
+    risco.invalidar(usuario["_id"])
     
     # Registrar transação
     transacao = {
@@ -501,7 +877,7 @@ def comprar_acao(compra: schemas.CompraAcao, usuario: dict = Depends(get_current
         "preco_unitario": acao["preco"],
         "data": datetime.utcnow()
     }
-    transacoes.insert_one(transacao)
+    registrar_transacao(transacao)
     
     # Retornar carteira atualizada com preços de compra
     carteira_atualizada = carteiras.find_one({"_id": carteira["_id"]})
@@ -516,7 +892,7 @@ def comprar_acao(compra: schemas.CompraAcao, usuario: dict = Depends(get_current
             )
             for acao in carteira_atualizada["acoes"]
         ],
-        saldo=carteira_atualizada["saldo"],
+        saldo=lancamento["saldo"],
         qtd_max_acoes=carteira_atualizada.get("qtd_max_acoes", 100),
         qtd_max_valor=carteira_atualizada.get("qtd_max_valor", 100000.0),
         nivel_risco=carteira_atualizada.get("nivel_risco", 1)
@@ -565,7 +941,7 @@ def atualizar_limites_carteira(
             )
             for acao in carteira_atualizada["acoes"]
         ],
-        saldo=carteira_atualizada.get("saldo", 0.0),
+        saldo=ledger.saldo_atual(carteira_atualizada["usuario_id"], carteira_atualizada),
         qtd_max_acoes=carteira_atualizada.get("qtd_max_acoes", 100),
         qtd_max_valor=carteira_atualizada.get("qtd_max_valor", 100000.0),
         nivel_risco=carteira_atualizada.get("nivel_risco", 1)
@@ -578,13 +954,13 @@ def listar_carteiras(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
     # Buscar todas as carteiras
-    cursor = carteiras.find()
+    cursor = carteiras_leitura.find()
     carteiras_list = list(cursor)
     
     # Para cada carteira, buscar informações do usuário
     resultado = []
     for carteira in carteiras_list:
-        usuario = usuarios.find_one({"_id": carteira["usuario_id"]})
+        usuario = usuarios_leitura.find_one({"_id": carteira["usuario_id"]})
         if usuario:
             resultado.append({
                 "_id": str(carteira["_id"]),
@@ -598,7 +974,7 @@ def listar_carteiras(current_user: dict = Depends(get_current_user)):
                     }
                     for acao in carteira["acoes"]
                 ],
-                "saldo": carteira.get("saldo", 0.0),
+                "saldo": ledger.saldo_atual(carteira["usuario_id"], carteira),
                 "qtd_max_acoes": carteira.get("qtd_max_acoes", 100),
                 "qtd_max_valor": carteira.get("qtd_max_valor", 100000.0),
                 "nivel_risco": carteira.get("nivel_risco", 1)
@@ -606,6 +982,23 @@ def listar_carteiras(current_user: dict = Depends(get_current_user)):
     
     return resultado
 
+@app.get("/api/carteiras/exportar", tags=["Carteira"])
+def exportar_carteiras(
+    formato: str = Query("msgpack", pattern="^(msgpack|arrow)$"),
+    lote: int = Query(5000, ge=100, le=50000),
+    current_user: dict = Depends(get_current_user)
+):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") not in ["admin", "bot"]:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # Lotes colunares gerados direto do cursor (declarada antes de /api/carteiras/{usuario_id})
+    try:
+        corpo = exportacao.exportar(formato, lote)
+    except exportacao.FormatoIndisponivel as erro:
+        raise HTTPException(status_code=406, detail=str(erro))
+    return StreamingResponse(corpo, media_type=exportacao.FORMATOS[formato])
+
 @app.get("/api/carteiras/{usuario_id}", response_model=models.Carteira, tags=["Carteira"])
 def buscar_carteira_por_usuario(usuario_id: str, current_user: dict = Depends(get_current_user)):
     # Verificar se o usuário existe
@@ -642,8 +1035,252 @@ def buscar_carteira_por_usuario(usuario_id: str, current_user: dict = Depends(ge
             )
             for acao in carteira["acoes"]
         ],
-        saldo=carteira.get("saldo", 0.0),
+        saldo=ledger.saldo_atual(carteira["usuario_id"], carteira),
         qtd_max_acoes=carteira.get("qtd_max_acoes", 100),
         qtd_max_valor=carteira.get("qtd_max_valor", 100000.0),
         nivel_risco=carteira.get("nivel_risco", 1)
-    )
\ No newline at end of file
+    )
+
+# Stream de preços
+async def _assinar(assinante, ids: List[str]):
+    ids = [i for i in ids if i]
+    if not all(ObjectId.is_valid(i) for i in ids):
+        raise ValueError("Identificador de ação inválido")
+    novas = precos_stream.subscribe(assinante, ids)
+    if novas:
+        # Preços atuais das ações recém-assinadas, enviados pela mesma fila da conexão
+        atuais = await asyncio.to_thread(
+            lambda: list(acoes.find({"_id": {"$in": [ObjectId(i) for i in novas]}}, {"preco": 1, "qtd": 1}))
+        )
+        precos_stream.seed(assinante, {str(a["_id"]): {"preco": a["preco"], "qtd": a.get("qtd", 0)} for a in atuais})
+
+@app.websocket("/ws/precos")
+async def stream_precos(websocket: WebSocket, token: str = Query(...), acoes_ids: Optional[str] = Query(None, alias="acoes")):
+    # Navegadores não enviam headers no WebSocket: o JWT vem na query string
+    try:
+        await asyncio.to_thread(auth.get_current_user, token, HTTPException(status_code=401))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    assinante = precos_stream.connect(websocket.send_text, lambda codigo: websocket.close(code=codigo))
+    try:
+        if acoes_ids:
+            await _assinar(assinante, acoes_ids.split(","))
+        while True:
+            # Mensagens do cliente: {"assinar": [ids]} e/ou {"cancelar": [ids]}
+            mensagem = await websocket.receive_json()
+            try:
+                if mensagem.get("cancelar"):
+                    precos_stream.unsubscribe(assinante, mensagem["cancelar"])
+                if mensagem.get("assinar"):
+                    await _assinar(assinante, mensagem["assinar"])
+            except ValueError as erro:
+                await websocket.send_json({"tipo": "erro", "detalhe": str(erro)})
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        await precos_stream.disconnect(assinante)
+
+# Sincronização incremental
+@app.get("/api/sync/changes", response_model=schemas.AlteracoesSync, tags=["Sincronização"])
+def sync_changes(
+    since: Optional[str] = None,
+    limite: int = Query(500, ge=1, le=5000),
+    current_user: dict = Depends(get_current_user)
+):
+    # Usuários comuns recebem o catálogo de ações e apenas a própria carteira
+    filtros = {}
+    if current_user.get("tipo_usuario") not in ["admin", "bot"]:
+        filtros["carteiras"] = {"usuario_id": ObjectId(current_user["_id"])}
+    
+    try:
+        return change_feed.changes(since, limite, filtros)
+    except InvalidToken as erro:
+        raise HTTPException(status_code=400, detail=str(erro))
+    except ExpiredToken:
+        raise HTTPException(status_code=410, detail="Token expirado; sincronize novamente sem o parâmetro since")
+
+# Rotas administrativas
+@app.get("/api/admin/metricas/ru", response_model=List[schemas.MetricaRU], tags=["Administração"])
+def metricas_ru(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return request_charge_metrics.snapshot()
+
+@app.get("/api/admin/metricas/escrita-adiada", response_model=schemas.MetricasEscritaAdiada, tags=["Administração"])
+def metricas_escrita_adiada(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return {**write_behind.stats(), "ativa": write_behind.running}
+
+@app.post("/api/admin/escrita-adiada/reprocessar", response_model=schemas.ReprocessamentoEscritaAdiada, tags=["Administração"])
+def reprocessar_escrita_adiada(limite: int = Query(1000, ge=1, le=10000), current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return write_behind.reprocessar({"notificacoes": notificacoes, "transacoes": transacoes}, limite)
+
+@app.get("/api/admin/risco", response_model=List[schemas.RiscoCarteira], tags=["Administração"])
+def risco_todas_carteiras(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # Todas as carteiras em lotes, com uma única matriz de covariância por lote
+    return list(risco.risco_todas())
+
+@app.get("/api/admin/metricas/precos-stream", response_model=schemas.MetricasStreamPrecos, tags=["Administração"])
+def metricas_stream_precos(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return {**precos_stream.stats(), "ativo": precos_stream.running}
+
+@app.get("/api/admin/metricas/tabela-precos", response_model=schemas.MetricasTabelaPrecos, tags=["Administração"])
+def metricas_tabela_precos(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    if tabela_precos is None:
+        raise HTTPException(status_code=404, detail="Tabela de preços compartilhada desativada")
+    return {**tabela_precos.stats(), "ativo": True, "atual": tabela_precos.atual}
+
+@app.get("/api/admin/metricas/leituras", response_model=dict[str, schemas.MetricasCoalescencia], tags=["Administração"])
+def metricas_leituras(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # find_one coalescidos e servidos pelo micro-cache neste processo
+    return {
+        "usuarios": usuarios.coalescing_stats(),
+        "acoes": acoes.coalescing_stats(),
+        "carteiras": carteiras.coalescing_stats(),
+    }
+
+@app.get("/api/admin/metricas/carga", response_model=schemas.MetricasCarga, tags=["Administração"])
+def metricas_carga(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # Limite adaptativo, fila e descartes por prioridade deste worker
+    return {**limitador_concorrencia.stats(), "ativo": settings.LOAD_SHED_ENABLED}
+
+@app.get("/api/admin/consultas-lentas", response_model=schemas.ConsultasLentas, tags=["Administração"])
+def listar_consultas_lentas(
+    colecao: Optional[str] = None,
+    rota: Optional[str] = None,
+    chave: Optional[str] = None,
+    limite: int = Query(default=50, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    filtro = {campo: valor for campo, valor in (("colecao", colecao), ("rota", rota), ("chave", chave)) if valor}
+    consultas = list(consultas_lentas.find(filtro, {"_id": 0}).sort("data", -1).limit(limite))
+    return {
+        "ativo": slow_queries.running,
+        "limite_ms": slow_queries.threshold_ms,
+        "estatisticas": slow_queries.stats(),
+        "consultas": consultas,
+    }
+
+@app.post("/api/admin/importacao/acoes", response_model=schemas.ResultadoImportacao, tags=["Administração"])
+def importar_acoes(arquivo: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # O upload é lido linha a linha do arquivo temporário, sem carregar o CSV inteiro
+    try:
+        return importacao.importar_acoes(
+            arquivo.file, settings.IMPORT_BATCH_SIZE, settings.IMPORT_MAX_ERROS,
+            publicar=precos_stream.publish,
+        )
+    except importacao.ArquivoInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/admin/importacao/precos-referencia", response_model=schemas.ResultadoImportacao,
+          tags=["Administração"])
+def importar_precos_referencia(arquivo: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    try:
+        return importacao.importar_precos_referencia(
+            arquivo.file, current_user["email"], settings.IMPORT_BATCH_SIZE, settings.IMPORT_MAX_ERROS,
+        )
+    except importacao.ArquivoInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/dashboard", response_model=schemas.Dashboard, tags=["Administração"])
+def obter_dashboard(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    # Leitura de um único documento, mantido pelas rotas de depósito, compra e preço
+    return dashboard.obter()
+
+@app.post("/api/admin/dashboard/reconciliar", response_model=schemas.ReconciliacaoDashboard, tags=["Administração"])
+def reconciliar_dashboard(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return dashboard.reconciliar()
+
+@app.get("/api/admin/estoque/reconciliacao", response_model=schemas.ReconciliacaoEstoque, tags=["Administração"])
+def relatorio_reconciliacao_estoque(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    relatorio = reconciliacao_estoque.ultimo_relatorio()
+    if not relatorio:
+        raise HTTPException(status_code=404, detail="Nenhuma reconciliação do estoque executada")
+    return relatorio
+
+@app.post("/api/admin/estoque/reconciliar", response_model=schemas.ReconciliacaoEstoque, tags=["Administração"])
+def reconciliar_estoque(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return reconciliacao_estoque.reconciliar()
+
+@app.get("/api/admin/jobs", response_model=List[schemas.StatusJob], tags=["Administração"])
+def status_jobs(current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return agendador.status()
+
+@app.post("/api/admin/jobs/{nome}/executar", response_model=schemas.ExecucaoJob, tags=["Administração"])
+async def executar_job(nome: str, current_user: dict = Depends(get_current_user)):
+    # Verificar permissões
+    if current_user.get("tipo_usuario") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    if nome not in agendador.jobs:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    
+    # Respeita o lease: se outro worker estiver executando o job, não executa de novo
+    registro = await agendador.run(nome)
+    if registro is None:
+        raise HTTPException(status_code=409, detail="Job em execução em outra instância")
+    return registro
@@ -0,0 +1,293 @@
+"""
+Stream de preços por WebSocket com coalescência e fan-out compartilhado.
+
+As rotas síncronas publicam alterações de preço/quantidade com publish() (thread-safe);
+a cada tick o broadcaster pega apenas o último valor de cada ação, serializa cada
+atualização uma única vez e distribui o fragmento JSON para todos os assinantes daquela
+ação. Conexões que recebem o mesmo conjunto de ações no tick compartilham a mesma
+mensagem pronta.
+
+Cada conexão tem uma tarefa de envio própria e um mapa de pendências por ação: enquanto
+um envio está em andamento, novas atualizações apenas substituem as pendentes (o cliente
+lento recebe só o preço mais recente, com memória limitada ao número de ações assinadas).
+Conexões que ficam atrasadas por mais de max_lag_ticks ticks ou cujo envio excede
+send_timeout_ms são desconectadas.
+
+O broadcaster é por processo; com vários workers, o poll do feed de alterações
+(PRICE_STREAM_POLL_MS) propaga as atualizações feitas em outros workers.
+"""
+import asyncio
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Código de fechamento para clientes desconectados por lentidão (Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Subscriber:
+    """Uma conexão assinante; send/close são as corrotinas do transporte (ex.: WebSocket)."""
+
+    __slots__ = ("send", "close", "acoes", "pendente", "pronta", "evento", "envio_desde", "atraso",
+                 "tarefa", "enviadas", "ativa")
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], close: Callable[[int], Awaitable[None]]):
+        self.send = send
+        self.close = close
+        self.acoes: Set[str] = set()
+        self.pendente: Dict[str, str] = {}
+        self.pronta: Optional[str] = None
+        self.evento = asyncio.Event()
+        self.envio_desde: Optional[float] = None  # Início do envio em andamento (loop.time())
+        self.atraso = 0
+        self.tarefa: Optional[asyncio.Task] = None
+        self.enviadas = 0
+        self.ativa = True
+
+
+def _mensagem(fragmentos: List[str]) -> str:
+    return '{"tipo":"precos","dados":[' + ",".join(fragmentos) + "]}"
+
+
+class PriceBroadcaster:
+    def __init__(self, tick_ms: int = 100, send_timeout_ms: int = 5000, max_lag_ticks: int = 50,
+                 max_subscriptions: int = 500):
+        self.tick_ms = tick_ms
+        self.send_timeout_ms = send_timeout_ms
+        self.max_lag_ticks = max_lag_ticks
+        self.max_subscriptions = max_subscriptions
+        self._pendentes: Dict[str, dict] = {}
+        self._ultima_seq: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._assinantes: Dict[str, Set[Subscriber]] = {}
+        self._conexoes: Set[Subscriber] = set()
+        self._tarefa: Optional[asyncio.Task] = None
+        self._stats = {"publicadas": 0, "ticks": 0, "mensagens": 0, "serializadas": 0, "despejadas": 0}
+
+    # -- publicação (qualquer thread) ----------------------------------------
+
+    def publish(self, acao_id: Any, dados: Dict[str, Any], seq: Optional[int] = None):
+        """Registra a atualização da ação; só a última de cada ação no tick é enviada."""
+        acao_id = str(acao_id)
+        with self._lock:
+            if seq is not None:
+                # Descarta versões já publicadas (ex.: recebidas de novo pelo feed)
+                if seq <= self._ultima_seq.get(acao_id, -1):
+                    return
+                self._ultima_seq[acao_id] = seq
+            self._pendentes[acao_id] = {**self._pendentes.get(acao_id, {}), **dados}
+            self._stats["publicadas"] += 1
+
+    # -- ciclo de vida -------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._tarefa is not None and not self._tarefa.done()
+
+    def start(self):
+        if not self.running:
+            self._tarefa = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        for assinante in list(self._conexoes):
+            await self._remover(assinante)
+
+    async def _loop(self):
+        ticks_por_varredura = max(1, 1000 // self.tick_ms)
+        while True:
+            await asyncio.sleep(self.tick_ms / 1000.0)
+            try:
+                self.flush()
+                if self._stats["ticks"] % ticks_por_varredura == 0:
+                    self._varrer_envios()
+            except Exception:
+                logger.exception("Falha ao distribuir atualizações de preço")
+
+    def _envio_expirado(self, assinante: Subscriber, agora: float) -> bool:
+        return assinante.envio_desde is not None and agora - assinante.envio_desde > self.send_timeout_ms / 1000.0
+
+    def _varrer_envios(self):
+        """Desconecta conexões com envio travado mesmo sem novas atualizações (uma vez por segundo)."""
+        agora = asyncio.get_running_loop().time()
+        for assinante in [a for a in self._conexoes if self._envio_expirado(a, agora)]:
+            self._despejar(assinante)
+
+    # -- conexões ------------------------------------------------------------
+
+    def connect(self, send: Callable[[str], Awaitable[None]], close: Callable[[int], Awaitable[None]]) -> Subscriber:
+        assinante = Subscriber(send, close)
+        assinante.tarefa = asyncio.get_running_loop().create_task(self._enviar(assinante))
+        self._conexoes.add(assinante)
+        return assinante
+
+    async def disconnect(self, assinante: Subscriber):
+        await self._remover(assinante, fechar=False)
+
+    def subscribe(self, assinante: Subscriber, acao_ids: Iterable[Any]) -> List[str]:
+        novas = [str(a) for a in acao_ids if str(a) not in assinante.acoes]
+        if len(assinante.acoes) + len(novas) > self.max_subscriptions:
+            raise ValueError(f"Limite de {self.max_subscriptions} ações por conexão")
+        for acao_id in novas:
+            assinante.acoes.add(acao_id)
+            self._assinantes.setdefault(acao_id, set()).add(assinante)
+        return novas
+
+    def unsubscribe(self, assinante: Subscriber, acao_ids: Iterable[Any]):
+        for acao_id in map(str, acao_ids):
+            assinante.acoes.discard(acao_id)
+            assinante.pendente.pop(acao_id, None)
+            conjunto = self._assinantes.get(acao_id)
+            if conjunto is not None:
+                conjunto.discard(assinante)
+                if not conjunto:
+                    del self._assinantes[acao_id]
+
+    async def _remover(self, assinante: Subscriber, fechar: bool = True, codigo: int = 1000):
+        if not assinante.ativa:
+            return
+        assinante.ativa = False
+        self.unsubscribe(assinante, list(assinante.acoes))
+        self._conexoes.discard(assinante)
+        if assinante.tarefa is not None and assinante.tarefa is not asyncio.current_task():
+            assinante.tarefa.cancel()
+        if fechar:
+            try:
+                await assinante.close(codigo)
+            except Exception:
+                pass
+
+    def _despejar(self, assinante: Subscriber):
+        if not assinante.ativa:
+            return
+        self._stats["despejadas"] += 1
+        asyncio.get_running_loop().create_task(self._remover(assinante, codigo=SLOW_CONSUMER_CLOSE_CODE))
+
+    def seed(self, assinante: Subscriber, precos: Dict[str, dict]):
+        """Enfileira os valores atuais para uma conexão (ex.: logo após assinar)."""
+        agora = datetime.utcnow().isoformat()
+        for acao_id, dados in precos.items():
+            if acao_id in assinante.acoes:
+                assinante.pendente[acao_id] = json.dumps({"acao_id": acao_id, **dados, "ts": agora},
+                                                         separators=(",", ":"), default=str)
+        if assinante.pendente:
+            assinante.evento.set()
+
+    # -- distribuição --------------------------------------------------------
+
+    def flush(self):
+        """Distribui as atualizações acumuladas desde o último tick (chamado no event loop)."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+        self._stats["ticks"] += 1
+        if not pendentes:
+            return
+
+        agora = datetime.utcnow().isoformat()
+        fragmentos: Dict[str, str] = {}
+        pares = 0
+        for acao_id, dados in pendentes.items():
+            assinantes = self._assinantes.get(acao_id)
+            if not assinantes:
+                continue
+            # Serializada uma vez, independentemente do número de assinantes
+            fragmentos[acao_id] = json.dumps({"acao_id": acao_id, **dados, "ts": agora}, separators=(",", ":"),
+                                             default=str)
+            pares += len(assinantes)
+        self._stats["serializadas"] += len(fragmentos)
+        if not fragmentos:
+            return
+
+        afetados: Dict[Subscriber, Iterable[str]]
+        if pares > len(self._conexoes):
+            # Muitas ações no tick: interseção de conjuntos por conexão (em C) sai mais barata
+            # do que percorrer o índice par a par
+            chaves = set(fragmentos)
+            afetados = {a: acoes for a in self._conexoes if (acoes := a.acoes & chaves)}
+        else:
+            afetados = {}
+            for acao_id in fragmentos:
+                for assinante in self._assinantes[acao_id]:
+                    afetados.setdefault(assinante, []).append(acao_id)
+
+        prontas: Dict[frozenset, str] = {}
+        relogio = asyncio.get_running_loop().time()
+        for assinante, acao_ids in afetados.items():
+            if assinante.envio_desde is not None or assinante.pendente or assinante.pronta is not None:
+                # Envio em andamento: coalesce com o que ainda não foi enviado
+                for acao_id in acao_ids:
+                    assinante.pendente[acao_id] = fragmentos[acao_id]
+                if assinante.envio_desde is not None:
+                    assinante.atraso += 1
+                    if assinante.atraso > self.max_lag_ticks or self._envio_expirado(assinante, relogio):
+                        self._despejar(assinante)
+                        continue
+            else:
+                # Conexões com o mesmo conjunto de ações no tick compartilham a mensagem
+                chave = frozenset(acao_ids)
+                mensagem = prontas.get(chave)
+                if mensagem is None:
+                    mensagem = prontas[chave] = _mensagem(list(map(fragmentos.__getitem__, acao_ids)))
+                assinante.pronta = mensagem
+            assinante.evento.set()
+
+    async def _enviar(self, assinante: Subscriber):
+        # Sem wait_for por mensagem (criaria uma tarefa a cada envio): o flush e a varredura
+        # periódica desconectam envios que passam de send_timeout_ms.
+        loop = asyncio.get_running_loop()
+        while True:
+            await assinante.evento.wait()
+            assinante.evento.clear()
+            mensagens = []
+            if assinante.pronta is not None:
+                mensagens.append(assinante.pronta)
+                assinante.pronta = None
+            if assinante.pendente:
+                lote, assinante.pendente = assinante.pendente, {}
+                mensagens.append(_mensagem(list(lote.values())))
+            assinante.envio_desde = loop.time()
+            try:
+                for mensagem in mensagens:
+                    await assinante.send(mensagem)
+                    assinante.enviadas += 1
+                    self._stats["mensagens"] += 1
+            except Exception:
+                await self._remover(assinante, fechar=False)
+                return
+            finally:
+                assinante.envio_desde = None
+            assinante.atraso = 0
+
+    def stats(self) -> dict:
+        return {**self._stats, "conexoes": len(self._conexoes), "acoes_assinadas": len(self._assinantes)}
+
+
+async def poll_change_feed(broadcaster: PriceBroadcaster, feed, intervalo_ms: int):
+    """Publica as alterações de ações feitas por outros processos, lidas do feed de alterações."""
+    token = await asyncio.to_thread(feed.head_token)
+    while True:
+        await asyncio.sleep(intervalo_ms / 1000.0)
+        try:
+            mais = True
+            while mais:
+                resposta = await asyncio.to_thread(feed.changes, token, 1000, None, ["acoes"])
+                for alteracao in resposta["alteracoes"]:
+                    documento = alteracao["documento"]
+                    if documento is not None:
+                        broadcaster.publish(alteracao["id"], {"preco": documento.get("preco"),
+                                                              "qtd": documento.get("qtd")},
+                                            seq=documento.get("sync_seq"))
+                token, mais = resposta["token"], resposta["mais"]
+        except Exception:
+            logger.exception("Falha ao ler o feed de alterações de preços")
+            await asyncio.sleep(1)
@@ -0,0 +1,347 @@
+"""
+Tabela de preços das ações em memória compartilhada entre os workers do gunicorn.
+
+O gunicorn sobe cpu_count * 2 + 1 workers: um cache por processo multiplicaria a memória
+e cada worker veria os preços num instante diferente. A tabela é um arquivo mapeado (mmap,
+por padrão em /dev/shm) com layout fixo: um cabeçalho e `capacidade` slots de 256 bytes
+endereçados por hash aberto do ObjectId (crc32, igual em todos os processos, com sondagem
+linear). Cada slot guarda _id, nome, preço, quantidade, risco e a versão (sync_seq) da ação.
+
+Leituras não usam lock: cada slot começa com um contador seqlock, ímpar durante a escrita.
+O leitor lê o contador, o slot e o contador de novo, e repete se ele mudou ou estava ímpar;
+uma leitura custa alguns microssegundos e nunca vê um slot pela metade. Escritores (qualquer
+worker que altera uma ação, e o atualizador) se excluem por flock no próprio arquivo; uma
+gravação só vale se a versão for maior ou igual à do slot, então uma cópia atrasada não
+sobrescreve um preço mais novo.
+
+Um único worker por vez (quem obtém o flock do arquivo .lider) é o atualizador: carrega
+todas as ações, segue o feed de alterações (inclusive as de outros processos, como jobs e
+importações), recarrega tudo periodicamente e renova o horário de sincronização no
+cabeçalho. Se esse worker cair, o lock é liberado e outro assume. Enquanto a tabela não
+foi carregada ou a sincronização está mais atrasada que max_atraso_ms, as leituras
+retornam None e as rotas leem do MongoDB.
+
+Depende de fcntl (Linux/macOS); sem ele a tabela fica desativada.
+"""
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+
+from bson import ObjectId
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_MAGIA = b"PRC1"
+# magia, capacidade, completa, sincronizada_em (epoch), ativos
+_CABECALHO = struct.Struct("<4sIIdI")
+_TAMANHO_CABECALHO = 64
+_SEQ = struct.Struct("<I")
+# estado, _id, preço, quantidade, risco, versão, tamanho do nome, nome
+_DADOS = struct.Struct("<B12sdqiQB199s")
+_TAMANHO_SLOT = 256
+_NOME_MAX = 199
+_VAZIO, _ATIVO, _REMOVIDO = 0, 1, 2
+_NOME_LONGO = 255  # Nome maior que o slot: as leituras voltam ao MongoDB
+_TENTATIVAS_LEITURA = 1000
+
+
+def caminho_padrao(nome: str) -> str:
+    """Arquivo em /dev/shm (memória) quando existir; senão no diretório temporário."""
+    diretorio = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(diretorio, nome)
+
+
+class SharedPriceTable:
+    def __init__(self, caminho: str, capacidade: int = 16384, max_atraso_ms: int = 5000):
+        if fcntl is None:
+            raise RuntimeError("A tabela de preços compartilhada exige fcntl (Linux/macOS)")
+        self.caminho = caminho
+        self.max_atraso_s = max_atraso_ms / 1000.0
+        self._lock = threading.Lock()  # flock não exclui threads do mesmo processo
+        self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            tamanho = os.fstat(self._fd).st_size
+            cabecalho = os.pread(self._fd, _CABECALHO.size, 0) if tamanho >= _TAMANHO_CABECALHO else b""
+            if cabecalho[:4] == _MAGIA:
+                existente = _CABECALHO.unpack(cabecalho)[1]
+                if existente != capacidade:
+                    logger.warning(f"Tabela de preços {caminho} já existe com capacidade {existente}; "
+                                   f"ignorando a capacidade configurada ({capacidade})")
+                capacidade = existente
+            else:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, _TAMANHO_CABECALHO + capacidade * _TAMANHO_SLOT)
+                os.pwrite(self._fd, _CABECALHO.pack(_MAGIA, capacidade, 0, 0.0, 0), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.capacidade = capacidade
+        self._mmap = mmap.mmap(self._fd, _TAMANHO_CABECALHO + capacidade * _TAMANHO_SLOT)
+        self._stats = {"leituras": 0, "releituras": 0, "gravacoes": 0, "gravacoes_antigas": 0, "cheia": 0}
+        self._lider_fd: Optional[int] = None
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- layout --------------------------------------------------------------
+
+    def _cabecalho(self) -> Tuple[bytes, int, int, float, int]:
+        return _CABECALHO.unpack_from(self._mmap, 0)
+
+    def _gravar_cabecalho(self, completa: Optional[bool] = None, sincronizada_em: Optional[float] = None,
+                          ativos: Optional[int] = None):
+        _, capacidade, atual_completa, atual_sincronizada, atual_ativos = self._cabecalho()
+        _CABECALHO.pack_into(
+            self._mmap, 0, _MAGIA, capacidade,
+            atual_completa if completa is None else int(completa),
+            atual_sincronizada if sincronizada_em is None else sincronizada_em,
+            atual_ativos if ativos is None else ativos,
+        )
+
+    def _posicao(self, indice: int) -> int:
+        return _TAMANHO_CABECALHO + indice * _TAMANHO_SLOT
+
+    def _sondagem(self, binario: bytes):
+        inicio = zlib.crc32(binario) % self.capacidade
+        for passo in range(self.capacidade):
+            yield (inicio + passo) % self.capacidade
+
+    def _ler_slot(self, indice: int) -> Optional[tuple]:
+        """Conteúdo consistente do slot (seqlock); None se não conseguir ler sem escrita concorrente."""
+        posicao = self._posicao(indice)
+        for _ in range(_TENTATIVAS_LEITURA):
+            antes = _SEQ.unpack_from(self._mmap, posicao)[0]
+            if antes & 1:
+                self._stats["releituras"] += 1
+                time.sleep(0)
+                continue
+            dados = _DADOS.unpack_from(self._mmap, posicao + _SEQ.size)
+            if _SEQ.unpack_from(self._mmap, posicao)[0] == antes:
+                return dados
+            self._stats["releituras"] += 1
+        return None
+
+    def _escrever_slot(self, indice: int, dados: tuple):
+        posicao = self._posicao(indice)
+        seq = _SEQ.unpack_from(self._mmap, posicao)[0]
+        _SEQ.pack_into(self._mmap, posicao, (seq + 1) & 0xFFFFFFFF)
+        _DADOS.pack_into(self._mmap, posicao + _SEQ.size, *dados)
+        _SEQ.pack_into(self._mmap, posicao, (seq + 2) & 0xFFFFFFFF)
+
+    def _localizar(self, binario: bytes) -> Tuple[Optional[int], Optional[tuple]]:
+        """Slot da ação (ou o primeiro vazio da sondagem, com dados None). Só para escritores."""
+        for indice in self._sondagem(binario):
+            dados = _DADOS.unpack_from(self._mmap, self._posicao(indice) + _SEQ.size)
+            if dados[0] == _VAZIO:
+                return indice, None
+            if dados[1] == binario:
+                return indice, dados
+        return None, None
+
+    # -- escrita -------------------------------------------------------------
+
+    @contextmanager
+    def _escrita(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def gravar(self, acao_id: Any, nome: Optional[str], preco: float, qtd: int, risco: int = 1,
+               versao: int = 0) -> bool:
+        """Grava a ação se a versão não for anterior à da tabela; False se ignorada ou sem espaço."""
+        binario = ObjectId(acao_id).binary
+        nome_bytes = (nome or "").encode("utf-8")
+        tamanho_nome = len(nome_bytes) if len(nome_bytes) <= _NOME_MAX else _NOME_LONGO
+        with self._escrita():
+            indice, atual = self._localizar(binario)
+            if indice is None:
+                self._stats["cheia"] += 1
+                logger.warning(f"Tabela de preços cheia ({self.capacidade} slots); aumente PRICE_TABLE_CAPACITY")
+                return False
+            if atual is not None and atual[0] == _ATIVO and versao < atual[5]:
+                self._stats["gravacoes_antigas"] += 1
+                return False
+            if atual is None or atual[0] != _ATIVO:
+                self._gravar_cabecalho(ativos=self._cabecalho()[4] + 1)
+            self._escrever_slot(indice, (_ATIVO, binario, float(preco), int(qtd), int(risco), int(versao),
+                                         tamanho_nome, nome_bytes[:_NOME_MAX]))
+            self._stats["gravacoes"] += 1
+        return True
+
+    def gravar_documento(self, documento: dict) -> bool:
+        return self.gravar(documento["_id"], documento.get("nome"), documento.get("preco", 0.0),
+                           documento.get("qtd", 0), documento.get("risco", 1), documento.get("sync_seq") or 0)
+
+    def remover(self, acao_id: Any):
+        binario = ObjectId(acao_id).binary
+        with self._escrita():
+            indice, atual = self._localizar(binario)
+            if atual is not None and atual[0] == _ATIVO:
+                # O slot fica marcado como removido para não interromper a sondagem de outras ações
+                self._escrever_slot(indice, (_REMOVIDO,) + atual[1:])
+                self._gravar_cabecalho(ativos=self._cabecalho()[4] - 1)
+
+    # -- leitura -------------------------------------------------------------
+
+    @property
+    def atual(self) -> bool:
+        """Carregada e sincronizada há menos de max_atraso_ms."""
+        _, _, completa, sincronizada_em, _ = self._cabecalho()
+        return bool(completa) and time.time() - sincronizada_em <= self.max_atraso_s
+
+    @staticmethod
+    def _documento(dados: tuple) -> Optional[dict]:
+        _, binario, preco, qtd, risco, versao, tamanho_nome, nome = dados
+        if tamanho_nome == _NOME_LONGO:
+            return None
+        return {"_id": ObjectId(binario), "nome": nome[:tamanho_nome].decode("utf-8"), "preco": preco, "qtd": qtd,
+                "risco": risco, "sync_seq": versao}
+
+    def obter(self, acao_id: Any) -> Optional[dict]:
+        """Documento da ação lido da tabela; None se ela não estiver atual ou não tiver a ação."""
+        if not self.atual or not ObjectId.is_valid(acao_id):
+            return None
+        self._stats["leituras"] += 1
+        binario = ObjectId(acao_id).binary
+        for indice in self._sondagem(binario):
+            dados = self._ler_slot(indice)
+            if dados is None or dados[0] == _VAZIO:
+                return None
+            if dados[1] == binario:
+                return self._documento(dados) if dados[0] == _ATIVO else None
+        return None
+
+    def listar(self) -> Optional[List[dict]]:
+        """Todas as ações em ordem de _id; None se a tabela não estiver atual."""
+        if not self.atual:
+            return None
+        self._stats["leituras"] += 1
+        documentos = []
+        for indice in range(self.capacidade):
+            # O byte de estado é lido sem seqlock só para pular os slots vazios
+            if self._mmap[self._posicao(indice) + _SEQ.size] == _VAZIO:
+                continue
+            dados = self._ler_slot(indice)
+            if dados is None:
+                return None
+            if dados[0] == _ATIVO:
+                documento = self._documento(dados)
+                if documento is None:
+                    return None
+                documentos.append(documento)
+        documentos.sort(key=lambda documento: documento["_id"])
+        return documentos
+
+    def stats(self) -> dict:
+        _, capacidade, completa, sincronizada_em, ativos = self._cabecalho()
+        return {
+            "capacidade": capacidade,
+            "acoes": ativos,
+            "completa": bool(completa),
+            "atraso_ms": round((time.time() - sincronizada_em) * 1000, 2) if sincronizada_em else None,
+            "atualizador": self._lider_fd is not None,
+            **self._stats,
+        }
+
+    # -- atualizador ---------------------------------------------------------
+
+    def carregar(self, colecao, feed) -> str:
+        """
+        Carga completa a partir da coleção de ações; marca como removidas as que não estão
+        mais no banco. Retorna o token do feed capturado antes da leitura, para que as
+        alterações feitas durante a carga sejam aplicadas em seguida.
+        """
+        token = feed.head_token()
+        vistos = set()
+        for documento in colecao.find({}, {"nome": 1, "preco": 1, "qtd": 1, "risco": 1, "sync_seq": 1}):
+            self.gravar_documento(documento)
+            vistos.add(documento["_id"].binary)
+        with self._escrita():
+            ativos = 0
+            for indice in range(self.capacidade):
+                dados = _DADOS.unpack_from(self._mmap, self._posicao(indice) + _SEQ.size)
+                if dados[0] != _ATIVO:
+                    continue
+                if dados[1] in vistos:
+                    ativos += 1
+                else:
+                    self._escrever_slot(indice, (_REMOVIDO,) + dados[1:])
+            self._gravar_cabecalho(completa=True, sincronizada_em=time.time(), ativos=ativos)
+        return token
+
+    def acompanhar(self, feed, token: str, limite: int = 1000) -> str:
+        """Aplica as alterações de ações do feed posteriores ao token (de qualquer processo)."""
+        mais = True
+        while mais:
+            resposta = feed.changes(token, limite, None, ["acoes"])
+            for alteracao in resposta["alteracoes"]:
+                if alteracao["documento"] is None:
+                    self.remover(alteracao["id"])
+                else:
+                    self.gravar_documento({**alteracao["documento"], "_id": alteracao["id"]})
+            token, mais = resposta["token"], resposta["mais"]
+        with self._escrita():
+            self._gravar_cabecalho(sincronizada_em=time.time())
+        return token
+
+    def _assumir(self) -> bool:
+        fd = os.open(f"{self.caminho}.lider", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lider_fd = fd
+        return True
+
+    def _executar(self, colecao, feed, intervalo_s: float, recarga_s: float):
+        token, recarregada_em = None, 0.0
+        while not self._parar.is_set():
+            try:
+                if self._lider_fd is not None or self._assumir():
+                    # A recarga periódica corrige o que o feed não entregou e limpa as removidas
+                    if token is None or time.monotonic() - recarregada_em >= recarga_s:
+                        token, recarregada_em = self.carregar(colecao, feed), time.monotonic()
+                    else:
+                        token = self.acompanhar(feed, token)
+            except Exception:
+                logger.exception("Falha ao sincronizar a tabela de preços compartilhada")
+                token = None
+            self._parar.wait(intervalo_s)
+
+    def iniciar(self, colecao, feed, intervalo_ms: int = 500, recarga_s: int = 300):
+        """Disputa o papel de atualizador numa thread; só um processo por vez sincroniza."""
+        if self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, args=(colecao, feed, intervalo_ms / 1000.0, recarga_s),
+                                        name="tabela-precos", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: float = 5.0):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._lider_fd is not None:
+            os.close(self._lider_fd)  # Libera o flock para outro worker assumir
+            self._lider_fd = None
+
+    def fechar(self):
+        self.parar()
+        self._mmap.close()
+        os.close(self._fd)
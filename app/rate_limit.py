@@ -0,0 +1,222 @@
+"""
+Limitação de taxa por token bucket, por cliente e por rota.
+
+O cliente é identificado pelo "sub" do JWT (assinatura verificada, sem consultar o banco)
+ou, sem token válido, pelo IP. Duas famílias de regras se aplicam a cada requisição:
+
+    RATE_LIMIT_ROTAS    - por rota ("MÉTODO /template") e tipo_usuario; "*" vale para
+                          os tipos sem regra própria. Ex.: protege login e registrar (bcrypt)
+                          e listagens que varrem coleções inteiras.
+    RATE_LIMIT_POR_TIPO - limite global do cliente, somando todas as rotas; tipos sem
+                          regra (ex.: admin) não são limitados.
+
+As regras são "capacidade/período" (ex.: "10/minute"): o bucket comporta capacidade
+requisições em rajada e é reabastecido continuamente à taxa capacidade/período.
+
+Os buckets ficam em memória no processo (cada worker limita sozinho, então o limite
+efetivo da frota é multiplicado pelo número de workers) ou, com RATE_LIMIT_BACKEND=mongo,
+em uma coleção compartilhada, atualizada atomicamente com um pipeline de atualização.
+"""
+import asyncio
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from jose import JWTError, jwt
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+_PERIODOS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+TIPO_ANONIMO = "anonimo"
+
+
+class Rule:
+    __slots__ = ("capacidade", "periodo", "taxa", "spec")
+
+    def __init__(self, spec: str):
+        try:
+            quantidade, _, periodo = spec.partition("/")
+            self.capacidade = int(quantidade)
+            self.periodo = _PERIODOS[periodo.strip().rstrip("s") or "second"]
+        except (KeyError, ValueError):
+            raise ValueError(f"Regra de limite inválida: {spec!r} (esperado ex.: '10/minute')")
+        if self.capacidade < 1:
+            raise ValueError(f"Regra de limite inválida: {spec!r}")
+        self.spec = spec
+        self.taxa = self.capacidade / self.periodo  # Tokens por segundo
+
+
+class MemoryBucketStore:
+    """Buckets no processo; os que ficariam cheios sem uso são descartados periodicamente."""
+
+    def __init__(self, max_chaves: int = 100000):
+        self._buckets: Dict[str, Tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+        self._max_chaves = max_chaves
+        self._proxima_limpeza = time.monotonic() + 60
+
+    def consume(self, chave: str, regra: Rule) -> Tuple[bool, float]:
+        """Consome um token; retorna (permitido, segundos até haver um token)."""
+        agora = time.monotonic()
+        with self._lock:
+            tokens, atualizado, _ = self._buckets.get(chave, (regra.capacidade, agora, regra.periodo))
+            tokens = min(regra.capacidade, tokens + (agora - atualizado) * regra.taxa)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            self._buckets[chave] = (tokens, agora, regra.periodo)
+            if agora >= self._proxima_limpeza or len(self._buckets) > self._max_chaves:
+                self._limpar(agora)
+        return permitido, 0.0 if permitido else (1 - tokens) / regra.taxa
+
+    def _limpar(self, agora: float):
+        # Um bucket parado por um período inteiro da regra está cheio: equivale a não existir
+        self._buckets = {c: b for c, b in self._buckets.items() if agora - b[1] < b[2]}
+        self._proxima_limpeza = agora + 60
+
+
+class MongoBucketStore:
+    """Buckets compartilhados entre workers; uma operação atômica por consumo."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def consume(self, chave: str, regra: Rule) -> Tuple[bool, float]:
+        agora = time.time()
+        reabastecido = {"$min": [regra.capacidade, {"$add": [
+            {"$ifNull": ["$tokens", regra.capacidade]},
+            {"$multiply": [{"$subtract": [agora, {"$ifNull": ["$ts", agora]}]}, regra.taxa]},
+        ]}]}
+        documento = self.collection.find_one_and_update(
+            {"_id": chave},
+            [
+                {"$set": {"tokens": reabastecido}},
+                {"$set": {
+                    "permitido": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "ts": agora,
+                    "expira_em": datetime.utcnow() + timedelta(seconds=regra.periodo),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if documento["permitido"]:
+            return True, 0.0
+        return False, (1 - documento["tokens"]) / regra.taxa
+
+
+def _payload(cabecalhos: Dict[bytes, bytes], secret: str, algorithm: str) -> Optional[dict]:
+    autorizacao = cabecalhos.get(b"authorization", b"").decode("latin-1")
+    if autorizacao[:7].lower() == "bearer ":
+        try:
+            payload = jwt.decode(autorizacao[7:], secret, algorithms=[algorithm])
+            if payload.get("sub"):
+                return payload
+        except JWTError:
+            pass
+    return None
+
+
+def tipo_usuario(scope, secret: str, algorithm: str) -> str:
+    """tipo_usuario do JWT (assinatura verificada, sem consultar o banco) ou "anonimo"."""
+    payload = _payload(dict(scope.get("headers") or []), secret, algorithm)
+    return (payload.get("tipo_usuario") or "comum") if payload else TIPO_ANONIMO
+
+
+class RateLimiter:
+    def __init__(self, store, rotas: Dict[str, Dict[str, str]], por_tipo: Dict[str, str], secret: str,
+                 algorithm: str, proxies_confiaveis: int = 0):
+        self.store = store
+        self.rotas = {rota: {tipo: Rule(spec) for tipo, spec in regras.items()} for rota, regras in rotas.items()}
+        self.por_tipo = {tipo: Rule(spec) for tipo, spec in por_tipo.items()}
+        self.secret = secret
+        self.algorithm = algorithm
+        self.proxies_confiaveis = proxies_confiaveis
+
+    def identificar(self, scope) -> Tuple[str, str]:
+        """Retorna (chave do cliente, tipo_usuario) a partir do JWT ou do IP."""
+        cabecalhos = dict(scope.get("headers") or [])
+        payload = _payload(cabecalhos, self.secret, self.algorithm)
+        if payload:
+            return f"u:{payload['sub']}", payload.get("tipo_usuario") or "comum"
+        return f"ip:{self._ip(scope, cabecalhos)}", TIPO_ANONIMO
+
+    def _ip(self, scope, cabecalhos: Dict[bytes, bytes]) -> str:
+        if self.proxies_confiaveis > 0:
+            # Cada proxy confiável acrescenta o endereço de quem o chamou ao final da lista
+            encaminhado = [p.strip() for p in cabecalhos.get(b"x-forwarded-for", b"").decode("latin-1").split(",")
+                           if p.strip()]
+            if len(encaminhado) >= self.proxies_confiaveis:
+                ip = encaminhado[-self.proxies_confiaveis]
+                # O App Service do Azure envia "ip:porta"
+                return ip.rsplit(":", 1)[0] if ip.count(":") == 1 else ip
+        cliente = scope.get("client")
+        return cliente[0] if cliente else "desconhecido"
+
+    def regras(self, metodo: str, rota: Optional[str], tipo: str) -> List[Tuple[str, Rule]]:
+        """Regras aplicáveis, da mais específica (rota) para a global do tipo."""
+        aplicaveis = []
+        if rota is not None:
+            por_rota = self.rotas.get(f"{metodo} {rota}")
+            if por_rota:
+                regra = por_rota.get(tipo) or por_rota.get("*")
+                if regra is not None:
+                    aplicaveis.append((f"{metodo} {rota}", regra))
+        regra = self.por_tipo.get(tipo)
+        if regra is not None:
+            aplicaveis.append(("*", regra))
+        return aplicaveis
+
+    def check(self, scope, rota: Optional[str]) -> Tuple[bool, float, Optional[Rule]]:
+        cliente, tipo = self.identificar(scope)
+        for escopo, regra in self.regras(scope["method"], rota, tipo):
+            try:
+                permitido, espera = self.store.consume(f"{cliente}|{escopo}", regra)
+            except Exception:
+                # Falha do backend compartilhado não derruba a API: a requisição passa
+                logger.exception("Falha ao consultar o limite de taxa")
+                continue
+            if not permitido:
+                return False, espera, regra
+        return True, 0.0, None
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI que responde 429 com Retry-After quando um bucket está vazio."""
+
+    def __init__(self, app, limiter: RateLimiter, rota: Callable[[dict], Optional[str]]):
+        self.app = app
+        self.limiter = limiter
+        self.rota = rota
+        self._em_thread = isinstance(limiter.store, MongoBucketStore)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rota = self.rota(scope)
+        if self._em_thread:
+            permitido, espera, regra = await asyncio.to_thread(self.limiter.check, scope, rota)
+        else:
+            permitido, espera, regra = self.limiter.check(scope, rota)
+        if permitido:
+            return await self.app(scope, receive, send)
+
+        corpo = json.dumps({"detail": "Limite de requisições excedido. Tente novamente mais tarde."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(max(1, math.ceil(espera))).encode()),
+                (b"x-ratelimit-limit", regra.spec.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": corpo})
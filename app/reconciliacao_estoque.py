@@ -0,0 +1,160 @@
+"""
+Reconciliação do estoque das ações com as carteiras e as transações de compra.
+
+comprar_acao grava a posição na carteira, decrementa acoes.qtd e registra a transação em
+escritas separadas, sem transação: uma falha (ou uma corrida) entre elas deixa o estoque e
+as posições divergentes. Para cada ação, a quantidade em carteiras (índice multikey
+acoes.acao_id) é comparada com as compras em transacoes (índice acao_id, incluindo os meses
+arquivados) e com a quantidade disponível:
+
+- carteiras_vs_compras: posição gravada sem a transação, ou transação sem a posição;
+- estoque_negativo: compras concorrentes passaram da verificação de quantidade disponível;
+- acao_inexistente: carteiras com posição numa ação removida.
+
+A quantidade disponível é editável pelo admin (cadastro, PATCH e importação), então não há
+uma emissão original para comparar; o relatório traz o total (disponível + em carteiras)
+de cada ação divergente.
+
+As ações são divididas em faixas contíguas de _id e cada faixa é agregada por um processo
+do pool (app.reconciliacao_estoque_faixas: spawn, com um cliente MongoDB enxuto por
+processo), de modo que a leitura das carteiras (pelos secundários, como carteiras_leitura)
+e a decodificação dos resultados escalam com os núcleos. No motor em memória o banco só
+existe no processo atual: por padrão as faixas rodam em sequência e, com workers > 1, os
+processos leem um snapshot temporário do banco. Compras em andamento
+durante a leitura (ou transações ainda na fila de escrita adiada) aparecem como
+divergência: por isso as ações divergentes são reconferidas ao final, antes do relatório
+ser gravado em reconciliacoes_estoque.
+
+Execução manual:
+    python -m app.reconciliacao_estoque --workers 8 --particoes 32
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from bson import ObjectId
+
+from . import reconciliacao_estoque_faixas as faixas_estoque
+from .config import get_settings
+from .database import (
+    acoes, arquivo_transacoes, carteiras_leitura, client, database, parametros_cliente, reconciliacoes_estoque,
+    transacoes,
+)
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_MENOR_ID = ObjectId("0" * 24)
+
+
+def _compras() -> List[Any]:
+    return [transacoes] + arquivo_transacoes.colecoes()
+
+
+def reconciliar_faixa(inicio: ObjectId, fim: Optional[ObjectId]) -> Tuple[int, List[dict]]:
+    """Agrega a faixa de ações [inicio, fim) no processo atual; retorna (ações existentes, divergências)."""
+    return faixas_estoque.reconciliar_faixa(acoes, carteiras_leitura, _compras(), inicio, fim)
+
+
+def _reconferir(acao_ids: List[str]) -> List[dict]:
+    valores: List[Any] = list(acao_ids)
+    valores += [ObjectId(acao_id) for acao_id in acao_ids if ObjectId.is_valid(acao_id)]
+    totais = faixas_estoque.agregar(
+        acoes, carteiras_leitura, _compras(),
+        {"acoes.acao_id": {"$in": valores}},
+        {"acao_id": {"$in": valores}},
+        {"_id": {"$in": [valor for valor in valores if isinstance(valor, ObjectId)]}},
+    )
+    return faixas_estoque.divergencias(totais)
+
+
+def _fonte(snapshot: Optional[str]) -> dict:
+    """Como os processos do pool abrem o banco (sem importar app.database)."""
+    arquivos = [colecao.name for colecao in arquivo_transacoes.colecoes()]
+    if client is None:
+        return {"banco": database.name, "snapshot": snapshot, "arquivos": arquivos}
+    return {
+        "banco": database.name,
+        "url": settings.MONGODB_URL,
+        "opcoes": parametros_cliente(),
+        "leitura_carteiras": carteiras_leitura.read_preference,
+        "arquivos": arquivos,
+    }
+
+
+def _em_paralelo(intervalos: List[Tuple[ObjectId, Optional[ObjectId]]], workers: int) -> List[Tuple[int, List[dict]]]:
+    with tempfile.TemporaryDirectory() as diretorio:
+        snapshot = None
+        if client is None:
+            # O banco em memória só existe neste processo: os processos leem um snapshot dele
+            snapshot = os.path.join(diretorio, "estoque.bson")
+            database.save_snapshot(snapshot)
+        fonte = _fonte(snapshot)
+        with ProcessPoolExecutor(max_workers=min(workers, len(intervalos)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(faixas_estoque.reconciliar_faixa_no_processo,
+                                     [fonte] * len(intervalos), *zip(*intervalos)))
+
+
+def faixas(particoes: int) -> List[Tuple[ObjectId, Optional[ObjectId]]]:
+    """Divide os _id das ações em até `particoes` faixas contíguas com o mesmo número de ações."""
+    ids = [acao["_id"] for acao in acoes.find({}, {"_id": 1}).sort("_id", 1)]
+    inicios = sorted({ids[i * len(ids) // particoes] for i in range(1, particoes)} if ids else set())
+    # A primeira faixa começa no menor ObjectId e a última é aberta, para cobrir posições em ações removidas
+    limites = [_MENOR_ID] + inicios
+    return [(inicio, limites[i + 1] if i + 1 < len(limites) else None) for i, inicio in enumerate(limites)]
+
+
+def reconciliar(workers: Optional[int] = None, particoes: Optional[int] = None) -> dict:
+    """Reconcilia todas as ações em paralelo e grava o relatório de divergências."""
+    # No motor em memória os processos leem um snapshot do banco: só com workers explícito
+    workers = workers or settings.INVENTORY_RECONCILE_WORKERS or (os.cpu_count() if client is not None else 1) or 1
+    particoes = particoes or settings.INVENTORY_RECONCILE_PARTITIONS or 4 * workers
+    inicio = time.monotonic()
+    agora = datetime.utcnow()
+    intervalos = faixas(particoes)
+    if workers > 1 and len(intervalos) > 1:
+        resultados = _em_paralelo(intervalos, workers)
+    else:
+        resultados = [reconciliar_faixa(*intervalo) for intervalo in intervalos]
+
+    total_acoes = sum(quantidade for quantidade, _ in resultados)
+    divergencias = [divergencia for _, lista in resultados for divergencia in lista]
+    if divergencias:
+        divergencias = _reconferir([divergencia["acao_id"] for divergencia in divergencias])
+    divergencias.sort(key=lambda divergencia: (-abs(divergencia["diferenca"]), divergencia["acao_id"]))
+
+    relatorio = {
+        "data": agora,
+        "acoes": total_acoes,
+        "particoes": len(intervalos),
+        "workers": workers,
+        "duracao_ms": round((time.monotonic() - inicio) * 1000, 2),
+        "total_divergencias": len(divergencias),
+        "divergencias": divergencias[:settings.INVENTORY_RECONCILE_MAX_DIVERGENCIAS],
+    }
+    reconciliacoes_estoque.insert_one(relatorio)
+    if divergencias:
+        logger.warning(f"Estoque reconciliado com {len(divergencias)} ação(ões) divergente(s)")
+    return relatorio
+
+
+def ultimo_relatorio() -> Optional[dict]:
+    return next(iter(reconciliacoes_estoque.find().sort("data", -1).limit(1)), None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcilia o estoque das ações com carteiras e compras")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--particoes", type=int, default=None)
+    argumentos = parser.parse_args()
+    relatorio = reconciliar(argumentos.workers, argumentos.particoes)
+    relatorio.pop("_id", None)
+    print(json.dumps(relatorio, indent=2, ensure_ascii=False, default=str))
@@ -0,0 +1,113 @@
+"""
+Agregação por faixa de ações da reconciliação do estoque (app.reconciliacao_estoque).
+
+Os processos do pool (spawn) importam só este módulo: cada processo abre, na primeira faixa,
+um cliente próprio descrito pela fonte que o processo principal envia (MongoDB, ou um
+snapshot do motor em memória). Assim os processos não passam por app.database: nada de
+init_db (índices e migrações), pipeline de logging, listeners e coleções da aplicação.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymongo
+from bson import ObjectId
+
+from .storage import MemoryDatabase
+
+# Banco aberto pelo processo do pool (um por processo, reaproveitado entre as faixas)
+_banco = None
+
+
+def condicao(campo: str, inicio: ObjectId, fim: Optional[ObjectId]) -> dict:
+    """Ids de ação na faixa [inicio, fim), como ObjectId ou como texto (carteiras antigas)."""
+    faixa_id: Dict[str, Any] = {"$gte": inicio}
+    faixa_texto: Dict[str, Any] = {"$gte": str(inicio)}
+    if fim is not None:
+        faixa_id["$lt"] = fim
+        faixa_texto["$lt"] = str(fim)
+    return {"$or": [{campo: faixa_id}, {campo: faixa_texto}]}
+
+
+def agregar(acoes, carteiras, compras: List[Any], condicao_carteiras: dict, condicao_transacoes: dict,
+            filtro_acoes: dict) -> Dict[str, dict]:
+    """Quantidade disponível, em carteiras e comprada (transacoes e meses arquivados) de cada ação."""
+    totais: Dict[str, dict] = {}
+
+    def total(acao_id: Any) -> dict:
+        return totais.setdefault(str(acao_id), {
+            "nome": None, "existe": False, "disponivel": 0, "em_carteiras": 0, "compras": 0,
+        })
+
+    for acao in acoes.find(filtro_acoes, {"nome": 1, "qtd": 1}):
+        registro = total(acao["_id"])
+        registro.update(nome=acao.get("nome"), existe=True, disponivel=acao.get("qtd", 0))
+    for grupo in carteiras.aggregate([
+        {"$match": condicao_carteiras},
+        {"$unwind": "$acoes"},
+        {"$match": condicao_carteiras},
+        {"$group": {"_id": "$acoes.acao_id", "qtd": {"$sum": "$acoes.qtd"}}},
+    ]):
+        total(grupo["_id"])["em_carteiras"] += grupo["qtd"]
+    pipeline = [
+        {"$match": {"tipo": "compra", **condicao_transacoes}},
+        {"$group": {"_id": "$acao_id", "qtd": {"$sum": "$qtd"}}},
+    ]
+    for colecao in compras:
+        for grupo in colecao.aggregate(pipeline):
+            total(grupo["_id"])["compras"] += grupo["qtd"]
+    return totais
+
+
+def divergencias(totais: Dict[str, dict]) -> List[dict]:
+    encontradas = []
+    for acao_id, registro in totais.items():
+        tipos = []
+        if registro["em_carteiras"] != registro["compras"]:
+            tipos.append("carteiras_vs_compras")
+        if registro["disponivel"] < 0:
+            tipos.append("estoque_negativo")
+        if not registro["existe"] and registro["em_carteiras"]:
+            tipos.append("acao_inexistente")
+        if tipos:
+            encontradas.append({
+                "acao_id": acao_id,
+                "nome": registro["nome"],
+                "tipos": tipos,
+                "qtd_disponivel": registro["disponivel"],
+                "qtd_em_carteiras": registro["em_carteiras"],
+                "qtd_compras": registro["compras"],
+                "qtd_total": registro["disponivel"] + registro["em_carteiras"],
+                "diferenca": registro["em_carteiras"] - registro["compras"],
+            })
+    return encontradas
+
+
+def reconciliar_faixa(acoes, carteiras, compras: List[Any], inicio: ObjectId,
+                      fim: Optional[ObjectId]) -> Tuple[int, List[dict]]:
+    """Agrega a faixa de ações [inicio, fim); retorna (ações existentes, divergências)."""
+    filtro_acoes: Dict[str, Any] = {"_id": {"$gte": inicio, **({"$lt": fim} if fim is not None else {})}}
+    totais = agregar(acoes, carteiras, compras, condicao("acoes.acao_id", inicio, fim),
+                     condicao("acao_id", inicio, fim), filtro_acoes)
+    return sum(1 for registro in totais.values() if registro["existe"]), divergencias(totais)
+
+
+def _abrir(fonte: dict):
+    global _banco
+    if _banco is None:
+        if "snapshot" in fonte:
+            _banco = MemoryDatabase(fonte["banco"], snapshot_path=fonte["snapshot"])
+        else:
+            _banco = pymongo.MongoClient(fonte["url"], **fonte["opcoes"])[fonte["banco"]]
+    return _banco
+
+
+def reconciliar_faixa_no_processo(fonte: dict, inicio: ObjectId, fim: Optional[ObjectId]) -> Tuple[int, List[dict]]:
+    """
+    Ponto de entrada dos processos do pool. fonte: {"banco", "url", "opcoes",
+    "leitura_carteiras", "arquivos"} (MongoDB) ou {"banco", "snapshot", "arquivos"}.
+    """
+    banco = _abrir(fonte)
+    carteiras = banco["carteiras"]
+    if fonte.get("leitura_carteiras") is not None:
+        carteiras = carteiras.with_options(read_preference=fonte["leitura_carteiras"])
+    compras = [banco["transacoes"]] + [banco[nome] for nome in fonte["arquivos"]]
+    return reconciliar_faixa(banco["acoes"], carteiras, compras, inicio, fim)
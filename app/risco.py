@@ -0,0 +1,205 @@
+"""
+Análise de risco das carteiras: volatilidade, VaR histórico e concentração.
+
+Os retornos diários vêm dos fechamentos dos candles de 1d (app.candles). O cálculo é
+vetorizado com NumPy e o modo em lote (todas as carteiras) monta a matriz de pesos
+carteiras x ações e calcula todas as variâncias e VaRs de uma vez.
+
+Os resultados ficam em cache por carteira, com chave na versao_posicoes da carteira
+(incrementada a cada alteração das posições), além de um TTL para refletir novos preços.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from bson import ObjectId
+
+from .config import get_settings
+from .database import acoes, candles, carteiras
+
+settings = get_settings()
+
+DIAS_UTEIS_ANO = 252
+
+
+class _CacheRisco:
+    """LRU em processo com chave (usuario_id, versao_posicoes)."""
+
+    def __init__(self, max_itens: int, ttl_s: int):
+        self._itens: "OrderedDict[str, tuple[int, float, dict]]" = OrderedDict()
+        self._max_itens = max_itens
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+
+    def get(self, usuario_id: str, versao: int) -> Optional[dict]:
+        with self._lock:
+            item = self._itens.get(usuario_id)
+            if item is None:
+                return None
+            versao_cache, criado_em, resultado = item
+            if versao_cache != versao or time.monotonic() - criado_em > self._ttl_s:
+                del self._itens[usuario_id]
+                return None
+            self._itens.move_to_end(usuario_id)
+            return resultado
+
+    def put(self, usuario_id: str, versao: int, resultado: dict):
+        with self._lock:
+            self._itens[usuario_id] = (versao, time.monotonic(), resultado)
+            self._itens.move_to_end(usuario_id)
+            while len(self._itens) > self._max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidate(self, usuario_id: str):
+        with self._lock:
+            self._itens.pop(usuario_id, None)
+
+
+cache = _CacheRisco(settings.RISCO_CACHE_MAX_ITENS, settings.RISCO_CACHE_TTL_S)
+
+
+def invalidar(usuario_id) -> None:
+    """Descarta o resultado em cache da carteira (as posições mudaram)."""
+    cache.invalidate(str(usuario_id))
+
+
+def _forward_fill(matriz: np.ndarray) -> np.ndarray:
+    """Preenche NaN com o último preço conhecido; NaN iniciais recebem o primeiro preço."""
+    linhas = np.arange(matriz.shape[0])[:, None]
+    validos = ~np.isnan(matriz)
+    indices = np.where(validos, linhas, 0)
+    np.maximum.accumulate(indices, axis=0, out=indices)
+    preenchida = matriz[indices, np.arange(matriz.shape[1])]
+    primeiro = np.argmax(validos, axis=0)
+    primeiros_precos = matriz[primeiro, np.arange(matriz.shape[1])]
+    return np.where(np.isnan(preenchida), primeiros_precos, preenchida)
+
+
+def carregar_retornos(acao_ids: List[ObjectId], precos_atuais: Dict[ObjectId, float],
+                      janela_dias: int) -> np.ndarray:
+    """Matriz (dias x ações) de retornos logarítmicos diários, alinhada por data."""
+    desde = datetime.utcnow() - timedelta(days=janela_dias)
+    colunas = {acao_id: i for i, acao_id in enumerate(acao_ids)}
+    pontos = list(candles.find(
+        {"acao_id": {"$in": acao_ids}, "intervalo": "1d", "inicio": {"$gte": desde}},
+        {"_id": 0, "acao_id": 1, "inicio": 1, "c": 1},
+    ))
+    datas = sorted({p["inicio"] for p in pontos})
+    if len(datas) < 2:
+        return np.zeros((0, len(acao_ids)))
+    linhas = {data: i for i, data in enumerate(datas)}
+    precos = np.full((len(datas), len(acao_ids)), np.nan)
+    for ponto in pontos:
+        precos[linhas[ponto["inicio"]], colunas[ponto["acao_id"]]] = ponto["c"]
+    # Ações sem nenhum candle na janela ficam com o preço atual (retorno zero)
+    sem_historico = np.all(np.isnan(precos), axis=0)
+    for indice in np.flatnonzero(sem_historico):
+        precos[:, indice] = precos_atuais.get(acao_ids[indice], 1.0)
+    precos = _forward_fill(precos)
+    return np.diff(np.log(precos), axis=0)
+
+
+def _posicoes(carteira: dict) -> Dict[ObjectId, int]:
+    posicoes: Dict[ObjectId, int] = {}
+    for item in carteira.get("acoes", []):
+        acao_id = ObjectId(item["acao_id"])
+        posicoes[acao_id] = posicoes.get(acao_id, 0) + item["qtd"]
+    return posicoes
+
+
+def calcular_lote(carteiras_lote: List[dict], janela_dias: Optional[int] = None) -> List[dict]:
+    """Calcula o risco de várias carteiras com uma única matriz de retornos."""
+    janela_dias = janela_dias or settings.RISCO_JANELA_DIAS
+    posicoes = [_posicoes(c) for c in carteiras_lote]
+    acao_ids = sorted({acao_id for p in posicoes for acao_id in p})
+    precos_atuais = {
+        a["_id"]: a["preco"] for a in acoes.find({"_id": {"$in": acao_ids}}, {"preco": 1})
+    } if acao_ids else {}
+    retornos = carregar_retornos(acao_ids, precos_atuais, janela_dias) if acao_ids else np.zeros((0, 0))
+
+    # Matriz de valores (carteiras x ações) e pesos
+    colunas = {acao_id: i for i, acao_id in enumerate(acao_ids)}
+    valores = np.zeros((len(carteiras_lote), len(acao_ids)))
+    for linha, posicao in enumerate(posicoes):
+        for acao_id, qtd in posicao.items():
+            valores[linha, colunas[acao_id]] = qtd * precos_atuais.get(acao_id, 0.0)
+    totais = valores.sum(axis=1)
+    pesos = np.divide(valores, totais[:, None], out=np.zeros_like(valores), where=totais[:, None] > 0)
+
+    dias = retornos.shape[0]
+    if dias >= 2:
+        covariancia = np.atleast_2d(np.cov(retornos, rowvar=False))
+        marginal = pesos @ covariancia                       # (carteiras x ações)
+        variancias = np.einsum("ij,ij->i", marginal, pesos)  # w' Σ w de cada carteira
+        retornos_carteiras = retornos @ pesos.T              # (dias x carteiras)
+        var_95 = -np.percentile(retornos_carteiras, 5, axis=0) * totais
+        var_99 = -np.percentile(retornos_carteiras, 1, axis=0) * totais
+    else:
+        marginal = np.zeros_like(pesos)
+        variancias = np.zeros(len(carteiras_lote))
+        var_95 = var_99 = np.zeros(len(carteiras_lote))
+
+    volatilidades = np.sqrt(np.maximum(variancias, 0.0))
+    contribuicoes = np.divide(marginal * pesos, variancias[:, None], out=np.zeros_like(pesos),
+                              where=variancias[:, None] > 0)
+    agora = datetime.utcnow()
+
+    resultados = []
+    for linha, carteira in enumerate(carteiras_lote):
+        resultados.append({
+            "usuario_id": str(carteira["usuario_id"]),
+            "valor_total": round(float(totais[linha]), 2),
+            "volatilidade_diaria": float(volatilidades[linha]),
+            "volatilidade_anual": float(volatilidades[linha] * np.sqrt(DIAS_UTEIS_ANO)),
+            "var_95": round(max(float(var_95[linha]), 0.0), 2),
+            "var_99": round(max(float(var_99[linha]), 0.0), 2),
+            "hhi": float(np.sum(pesos[linha] ** 2)),
+            "dias_observados": int(dias),
+            "posicoes": [
+                {
+                    "acao_id": str(acao_id),
+                    "valor": round(float(valores[linha, colunas[acao_id]]), 2),
+                    "peso": float(pesos[linha, colunas[acao_id]]),
+                    "contribuicao_risco": float(contribuicoes[linha, colunas[acao_id]]),
+                }
+                for acao_id in posicoes[linha]
+            ],
+            "calculado_em": agora,
+        })
+    return resultados
+
+
+def risco_carteira(usuario_id) -> dict:
+    """Risco da carteira do usuário, usando o cache quando as posições não mudaram."""
+    carteira = carteiras.find_one({"usuario_id": ObjectId(usuario_id)}, {"usuario_id": 1, "acoes": 1, "versao_posicoes": 1})
+    if carteira is None:
+        carteira = {"usuario_id": ObjectId(usuario_id), "acoes": []}
+    versao = carteira.get("versao_posicoes", 0)
+    resultado = cache.get(str(usuario_id), versao)
+    if resultado is None:
+        [resultado] = calcular_lote([carteira])
+        cache.put(str(usuario_id), versao, resultado)
+    return resultado
+
+
+def risco_todas(tamanho_lote: int = 5000) -> Iterable[dict]:
+    """Modo em lote: percorre todas as carteiras em blocos, atualizando o cache."""
+    lote: List[dict] = []
+    cursor = carteiras.find({}, {"usuario_id": 1, "acoes": 1, "versao_posicoes": 1})
+    for carteira in cursor:
+        lote.append(carteira)
+        if len(lote) >= tamanho_lote:
+            yield from _calcular_e_guardar(lote)
+            lote = []
+    if lote:
+        yield from _calcular_e_guardar(lote)
+
+
+def _calcular_e_guardar(lote: List[dict]) -> List[dict]:
+    resultados = calcular_lote(lote)
+    for carteira, resultado in zip(lote, resultados):
+        cache.put(resultado["usuario_id"], carteira.get("versao_posicoes", 0), resultado)
+    return resultados
@@ -0,0 +1,274 @@
+"""
+Agendador de tarefas em segundo plano, seguro com vários workers e instâncias.
+
+Cada job tem um agendamento no formato cron (5 campos, em UTC) e roda em uma tarefa
+asyncio própria, iniciada no lifespan da aplicação. Todos os workers agendam todos os
+jobs, mas antes de executar disputam um lease no Mongo (coleção jobs_locks): o documento
+do job guarda o dono, a expiração do lease e o horário agendado já reivindicado. Só um
+worker consegue reivindicar cada horário, e o lease impede execuções sobrepostas; durante
+a execução o lease é renovado periodicamente. A semântica é no máximo uma vez por
+horário: se o worker cair no meio da execução, o horário é perdido e o job roda no próximo.
+
+O jitter aleatório antes da disputa espalha a carga dos jobs agendados para o mesmo
+minuto. Cada execução é registrada em jobs_execucoes (início, duração, status e erro);
+as métricas de duração são agregadas a partir desse histórico, que cobre toda a frota.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class CronInvalido(ValueError):
+    pass
+
+
+class CronSchedule:
+    """Expressão cron de 5 campos (minuto hora dia mês dia-da-semana), avaliada em UTC.
+
+    Suporta *, listas (1,15), intervalos (1-5) e passos (*/10, 0-30/5). Dia da semana:
+    0-6 a partir de domingo (7 também é domingo). Como no cron, se dia do mês e dia da
+    semana forem restritos, basta um deles coincidir.
+    """
+
+    _LIMITES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expressao: str):
+        campos = expressao.split()
+        if len(campos) != 5:
+            raise CronInvalido(f"Expressão cron deve ter 5 campos: {expressao!r}")
+        self.expressao = expressao
+        conjuntos = [self._campo(campo, *limites) for campo, limites in zip(campos, self._LIMITES)]
+        self.minutos, self.horas, self.dias, self.meses, dias_semana = conjuntos
+        self.dias_semana = {d % 7 for d in dias_semana}
+        self._dia_restrito = campos[2] != "*"
+        self._semana_restrita = campos[4] != "*"
+
+    @staticmethod
+    def _campo(campo: str, minimo: int, maximo: int) -> Set[int]:
+        valores: Set[int] = set()
+        for parte in campo.split(","):
+            intervalo, _, passo = parte.partition("/")
+            try:
+                passo_n = int(passo) if passo else 1
+                if intervalo == "*":
+                    inicio, fim = minimo, maximo
+                elif "-" in intervalo:
+                    inicio, fim = map(int, intervalo.split("-"))
+                else:
+                    inicio = int(intervalo)
+                    fim = maximo if passo else inicio
+            except ValueError:
+                raise CronInvalido(f"Campo cron inválido: {campo!r}")
+            if passo_n < 1 or not minimo <= inicio <= fim <= maximo:
+                raise CronInvalido(f"Campo cron fora do intervalo {minimo}-{maximo}: {campo!r}")
+            valores.update(range(inicio, fim + 1, passo_n))
+        return valores
+
+    def _dia_coincide(self, data: datetime) -> bool:
+        dia = data.day in self.dias
+        # datetime.weekday(): segunda = 0; no cron, domingo = 0
+        semana = (data.weekday() + 1) % 7 in self.dias_semana
+        if self._dia_restrito and self._semana_restrita:
+            return dia or semana
+        return dia and semana
+
+    def next_after(self, momento: datetime) -> datetime:
+        """Próximo horário estritamente depois de momento (datetime UTC sem fuso)."""
+        data = momento.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = data + timedelta(days=366 * 5)
+        while data < limite:
+            if data.month not in self.meses:
+                ano, mes = (data.year + 1, 1) if data.month == 12 else (data.year, data.month + 1)
+                data = data.replace(year=ano, month=mes, day=1, hour=0, minute=0)
+            elif not self._dia_coincide(data):
+                data = (data + timedelta(days=1)).replace(hour=0, minute=0)
+            elif data.hour not in self.horas:
+                data = (data + timedelta(hours=1)).replace(minute=0)
+            elif data.minute not in self.minutos:
+                data += timedelta(minutes=1)
+            else:
+                return data
+        raise CronInvalido(f"Expressão cron sem horário válido: {self.expressao!r}")
+
+
+class LeaseLock:
+    """Lease por job em uma coleção Mongo; reivindica cada horário agendado uma única vez."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def acquire(self, nome: str, dono: str, agendado_para: datetime, lease_s: int) -> bool:
+        agora = datetime.utcnow()
+        filtro = {
+            "_id": nome,
+            "$and": [
+                {"$or": [{"expira_em": {"$lt": agora}}, {"dono": dono}]},
+                {"$or": [{"agendado_para": {"$lt": agendado_para}}, {"agendado_para": {"$exists": False}}]},
+            ],
+        }
+        try:
+            documento = self.collection.find_one_and_update(
+                filtro,
+                {"$set": {"dono": dono, "expira_em": agora + timedelta(seconds=lease_s),
+                          "agendado_para": agendado_para, "adquirido_em": agora}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # O documento existe, mas o lease é de outro worker ou o horário já foi reivindicado
+            return False
+        return documento is not None and documento.get("dono") == dono
+
+    def renew(self, nome: str, dono: str, lease_s: int) -> bool:
+        resultado = self.collection.update_one(
+            {"_id": nome, "dono": dono},
+            {"$set": {"expira_em": datetime.utcnow() + timedelta(seconds=lease_s)}},
+        )
+        return resultado.matched_count == 1
+
+    def release(self, nome: str, dono: str):
+        self.collection.update_one({"_id": nome, "dono": dono}, {"$set": {"expira_em": datetime.utcnow()}})
+
+
+class Job:
+    __slots__ = ("nome", "agendamento", "funcao", "lease_s", "jitter_s", "proxima_execucao", "tarefa")
+
+    def __init__(self, nome: str, agendamento: CronSchedule, funcao: Callable[[], Optional[dict]],
+                 lease_s: int, jitter_s: float):
+        self.nome = nome
+        self.agendamento = agendamento
+        self.funcao = funcao
+        self.lease_s = lease_s
+        self.jitter_s = jitter_s
+        self.proxima_execucao: Optional[datetime] = None
+        self.tarefa: Optional[asyncio.Task] = None
+
+
+class JobScheduler:
+    def __init__(self, locks, runs, lease_s: int = 300, jitter_s: float = 30.0, dono: Optional[str] = None):
+        self.lock = LeaseLock(locks)
+        self.runs = runs
+        self.lease_s = lease_s
+        self.jitter_s = jitter_s
+        self.dono = dono or f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs: Dict[str, Job] = {}
+
+    def add(self, nome: str, cron: str, funcao: Callable[[], Optional[dict]], lease_s: Optional[int] = None,
+            jitter_s: Optional[float] = None) -> Job:
+        """Registra um job síncrono (executado em thread); o retorno (dict) vai para o histórico."""
+        if nome in self.jobs:
+            raise ValueError(f"Job já registrado: {nome}")
+        job = Job(nome, CronSchedule(cron), funcao, lease_s or self.lease_s,
+                  self.jitter_s if jitter_s is None else jitter_s)
+        self.jobs[nome] = job
+        return job
+
+    # -- ciclo de vida -------------------------------------------------------
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        for job in self.jobs.values():
+            if job.tarefa is None or job.tarefa.done():
+                job.tarefa = loop.create_task(self._loop(job))
+
+    async def stop(self):
+        tarefas = [job.tarefa for job in self.jobs.values() if job.tarefa is not None]
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        for job in self.jobs.values():
+            job.tarefa = None
+
+    async def _loop(self, job: Job):
+        while True:
+            agendado_para = job.agendamento.next_after(datetime.utcnow())
+            job.proxima_execucao = agendado_para
+            espera = (agendado_para - datetime.utcnow()).total_seconds() + random.uniform(0, job.jitter_s)
+            await asyncio.sleep(max(espera, 0))
+            try:
+                await self.run(job.nome, agendado_para)
+            except Exception:
+                logger.exception(f"Falha ao executar o job {job.nome}")
+
+    # -- execução ------------------------------------------------------------
+
+    async def run(self, nome: str, agendado_para: Optional[datetime] = None) -> Optional[dict]:
+        """Disputa o lease e executa o job; retorna o registro da execução ou None se outro worker a fez."""
+        job = self.jobs[nome]
+        agendado_para = agendado_para or datetime.utcnow()
+        if not await asyncio.to_thread(self.lock.acquire, nome, self.dono, agendado_para, job.lease_s):
+            return None
+
+        renovacao = asyncio.get_running_loop().create_task(self._renovar(job))
+        inicio, relogio = datetime.utcnow(), time.perf_counter()
+        registro = {"job": nome, "dono": self.dono, "agendado_para": agendado_para, "inicio": inicio}
+        try:
+            resultado = await asyncio.to_thread(job.funcao)
+            registro.update(status="sucesso", resultado=resultado)
+        except Exception as e:
+            logger.exception(f"Job {nome} falhou")
+            registro.update(status="erro", erro=f"{type(e).__name__}: {e}",
+                            traceback=traceback.format_exc(limit=20))
+        finally:
+            renovacao.cancel()
+            registro.update(fim=datetime.utcnow(), duracao_ms=round((time.perf_counter() - relogio) * 1000, 3))
+            await asyncio.to_thread(self.lock.release, nome, self.dono)
+        await asyncio.to_thread(self.runs.insert_one, registro)
+        logger.info(f"Job {nome} concluído ({registro['status']}) em {registro['duracao_ms']:.0f} ms")
+        return registro
+
+    async def _renovar(self, job: Job):
+        while True:
+            await asyncio.sleep(max(job.lease_s / 3, 1))
+            if not await asyncio.to_thread(self.lock.renew, job.nome, self.dono, job.lease_s):
+                logger.warning(f"Lease do job {job.nome} perdido durante a execução")
+                return
+
+    # -- consulta ------------------------------------------------------------
+
+    def status(self, ultimas: int = 5) -> List[dict]:
+        """Agendamento, métricas de duração (todas as instâncias) e últimas execuções de cada job."""
+        metricas = {
+            m["_id"]: m
+            for m in self.runs.aggregate([
+                {"$match": {"job": {"$in": list(self.jobs)}}},
+                {"$group": {
+                    "_id": "$job",
+                    "execucoes": {"$sum": 1},
+                    "falhas": {"$sum": {"$cond": [{"$eq": ["$status", "erro"]}, 1, 0]}},
+                    "duracao_media_ms": {"$avg": "$duracao_ms"},
+                    "duracao_max_ms": {"$max": "$duracao_ms"},
+                    "ultima_execucao": {"$max": "$inicio"},
+                }},
+            ])
+        }
+        jobs = []
+        for job in self.jobs.values():
+            m = metricas.get(job.nome, {})
+            jobs.append({
+                "nome": job.nome,
+                "cron": job.agendamento.expressao,
+                "proxima_execucao": job.proxima_execucao or job.agendamento.next_after(datetime.utcnow()),
+                "execucoes": m.get("execucoes", 0),
+                "falhas": m.get("falhas", 0),
+                "duracao_media_ms": m.get("duracao_media_ms"),
+                "duracao_max_ms": m.get("duracao_max_ms"),
+                "ultima_execucao": m.get("ultima_execucao"),
+                "historico": [
+                    {"dono": r["dono"], "inicio": r["inicio"], "duracao_ms": r["duracao_ms"], "status": r["status"],
+                     "erro": r.get("erro")}
+                    for r in self.runs.find({"job": job.nome}).sort("inicio", -1).limit(ultimas)
+                ],
+            })
+        return jobs
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class UsuarioBase(BaseModel):
@@ -61,6 +61,50 @@ class PrecoReferenciaResponse(BaseModel):
     data_atualizacao: datetime
     atualizado_por: str
 
+class DetentorAcao(BaseModel):
+    usuario_id: str
+    usuario_nome: Optional[str] = None
+    usuario_email: Optional[str] = None
+    qtd: int
+    preco_medio: Optional[float] = None
+    percentual: float  # Da quantidade em carteiras
+
+class DetentoresAcao(BaseModel):
+    acao_id: str
+    nome: str
+    qtd_disponivel: int  # acoes.qtd, ainda não vendida
+    qtd_em_carteiras: int
+    percentual_em_carteiras: float  # Do total (em carteiras + disponível)
+    total_detentores: int
+    pagina: int
+    limite: int
+    detentores: List[DetentorAcao]  # Por quantidade, da maior para a menor
+
+class ImportacaoAcao(BaseModel):
+    nome: str = Field(min_length=1)
+    preco: float = Field(gt=0)
+    qtd: int = Field(ge=0)
+    risco: int = Field(ge=1, le=5)
+
+class ImportacaoPrecoReferencia(BaseModel):
+    acao_id: Optional[str] = None  # Ou nome: a ação é resolvida pelo que vier preenchido
+    nome: Optional[str] = None
+    preco_referencia: float = Field(gt=0)
+
+class ErroImportacao(BaseModel):
+    linha: int  # Linha do arquivo (o cabeçalho é a linha 1)
+    erro: str
+
+class ResultadoImportacao(BaseModel):
+    linhas: int
+    inseridas: int
+    atualizadas: int
+    inalteradas: int  # Sem alteração ou repetidas no mesmo lote (a última prevalece)
+    lotes: int
+    total_erros: int
+    erros: List[ErroImportacao]  # Até IMPORT_MAX_ERROS
+    duracao_ms: float
+
 class CarteiraAcao(BaseModel):
     pass
 
@@ -87,7 +131,7 @@ class SolicitacaoDepositoResponse(BaseModel):
     usuario_id: str
     valor: float
     descricao: Optional[str]
-    status: str  # pendente, aprovado, rejeitado
+    status: str  # pendente, creditando (aprovação em andamento), aprovado, rejeitado
     data_solicitacao: datetime
     data_aprovacao: Optional[datetime] = None
     aprovado_por: Optional[str] = None
@@ -114,7 +158,7 @@ class DepositoPendente(BaseModel):
     id: str
     usuario_id: str
     valor: float
-    descricao: str
+    descricao: Optional[str] = None
     data_solicitacao: datetime
     status: str
     nome_usuario: Optional[str] = None
@@ -122,9 +166,221 @@ class DepositoPendente(BaseModel):
 class TransacaoResponse(BaseModel):
     id: str
     usuario_id: str
-    acao_id: str
+    acao_id: Optional[str] = None  # Depósitos não têm ação
     tipo: str  # compra, venda, deposito
-    qtd: Optional[int]
+    qtd: Optional[int] = None
+    valor: float
+    preco_unitario: Optional[float] = None
+    data: datetime
+
+class MetricaRU(BaseModel):
+    rota: str
+    operacao: str
+    chamadas: int
+    ru_total: float
+    ru_medio: float
+    throttles: int
+    retentativas: int
+    falhas: int
+
+class MetricasEscritaAdiada(BaseModel):
+    ativa: bool
+    enfileirados: int
+    gravados: int
+    lotes: int
+    sincronos: int
+    falhas: int
+    retentativas: int
+    dead_letter: int  # Desviados para escritas_adiadas_falhas após esgotar as tentativas
+    perdidos: int  # Nem a dead letter aceitou: documentos completos no log (CRITICAL)
+    tamanho_fila: int
+
+class ReprocessamentoEscritaAdiada(BaseModel):
+    reprocessados: int
+    falhas: int
+
+class SaldoCarteira(BaseModel):
+    usuario_id: str
+    saldo: float
+    data: datetime
+
+class Candle(BaseModel):
+    inicio: datetime
+    abertura: float
+    maxima: float
+    minima: float
+    fechamento: float
+    ticks: int
+
+class MetricasStreamPrecos(BaseModel):
+    ativo: bool
+    conexoes: int
+    acoes_assinadas: int
+    publicadas: int
+    ticks: int
+    serializadas: int
+    mensagens: int
+    despejadas: int
+
+class MetricasTabelaPrecos(BaseModel):
+    ativo: bool
+    atual: bool  # Carregada e sincronizada dentro de PRICE_TABLE_MAX_STALENESS_MS
+    capacidade: int
+    acoes: int
+    completa: bool
+    atraso_ms: Optional[float] = None
+    atualizador: bool  # Este worker é o atualizador da tabela
+    leituras: int
+    releituras: int  # Leituras repetidas por escrita concorrente no slot (seqlock)
+    gravacoes: int
+    gravacoes_antigas: int  # Ignoradas por versão anterior à da tabela
+    cheia: int
+
+class AlteracaoSync(BaseModel):
+    colecao: str
+    operacao: str  # upsert ou delete
+    id: str
+    documento: Optional[dict] = None
+
+class AlteracoesSync(BaseModel):
+    alteracoes: List[AlteracaoSync]
+    token: str
+    mais: bool
+    modo: str  # change_stream ou sequencia
+
+class RiscoPosicao(BaseModel):
+    acao_id: str
     valor: float
-    preco_unitario: Optional[float]
+    peso: float
+    contribuicao_risco: float
+
+class RiscoCarteira(BaseModel):
+    usuario_id: str
+    valor_total: float
+    volatilidade_diaria: float
+    volatilidade_anual: float
+    var_95: float
+    var_99: float
+    hhi: float
+    dias_observados: int
+    posicoes: List[RiscoPosicao]
+    calculado_em: datetime
+
+class DepositosPorStatus(BaseModel):
+    qtd: int
+    valor: float
+
+class DepositosDashboard(BaseModel):
+    pendente: DepositosPorStatus
+    aprovado: DepositosPorStatus
+    rejeitado: DepositosPorStatus
+
+class RiscoDashboard(BaseModel):
+    risco: int
+    qtd: int
+    valor_investido: float
+
+class Dashboard(BaseModel):
+    depositos: DepositosDashboard
+    caixa_total: float
+    valor_investido: float
+    valor_mercado: float
+    aum: float
+    por_risco: List[RiscoDashboard]
+    atualizado_em: Optional[datetime] = None
+    reconciliado_em: Optional[datetime] = None
+
+class ReconciliacaoDashboard(BaseModel):
+    divergencias: Dict[str, float]
+    reconciliado_em: datetime
+
+class DivergenciaEstoque(BaseModel):
+    acao_id: str
+    nome: Optional[str] = None
+    tipos: List[str]  # carteiras_vs_compras, estoque_negativo, acao_inexistente
+    qtd_disponivel: int
+    qtd_em_carteiras: int
+    qtd_compras: int
+    qtd_total: int  # Disponível + em carteiras
+    diferenca: int  # Em carteiras - compras
+
+class ReconciliacaoEstoque(BaseModel):
     data: datetime
+    acoes: int
+    particoes: int
+    workers: int
+    duracao_ms: float
+    total_divergencias: int
+    divergencias: List[DivergenciaEstoque]
+
+class ExecucaoJob(BaseModel):
+    dono: str
+    inicio: datetime
+    duracao_ms: float
+    status: str  # sucesso ou erro
+    erro: Optional[str] = None
+    resultado: Optional[dict] = None
+
+class StatusJob(BaseModel):
+    nome: str
+    cron: str
+    proxima_execucao: datetime
+    execucoes: int
+    falhas: int
+    duracao_media_ms: Optional[float] = None
+    duracao_max_ms: Optional[float] = None
+    ultima_execucao: Optional[datetime] = None
+    historico: List[ExecucaoJob]
+
+class ExplainConsulta(BaseModel):
+    estagios: List[str]  # Ex.: ["FETCH", "IXSCAN"] ou ["COLLSCAN"]
+    indices: List[str]
+    documentos_examinados: Optional[int] = None
+    chaves_examinadas: Optional[int] = None
+    retornados: Optional[int] = None
+    tempo_ms: Optional[int] = None
+    plano: str  # Plano vencedor em JSON
+
+class ConsultaLenta(BaseModel):
+    data: datetime
+    chave: str  # Identifica a forma da consulta (coleção, comando, filtro e ordenação)
+    comando: str
+    colecao: str
+    filtro: Optional[str] = None
+    ordenacao: Optional[str] = None
+    pipeline: Optional[str] = None
+    rota: Optional[str] = None
+    request_id: Optional[str] = None
+    duracao_ms: float
+    falhou: bool
+    explain: Optional[ExplainConsulta] = None
+    explain_erro: Optional[str] = None
+
+class ConsultasLentas(BaseModel):
+    ativo: bool
+    limite_ms: int
+    estatisticas: Dict[str, int]
+    consultas: List[ConsultaLenta]
+
+class MetricasCarga(BaseModel):
+    ativo: bool
+    limite: int  # Requisições simultâneas admitidas (adaptativo)
+    limite_max: int
+    em_andamento: int
+    na_fila: int
+    espera_fila_ms: float  # Média móvel da espera na fila
+    latencia_curta_ms: Optional[float] = None
+    latencia_longa_ms: Optional[float] = None
+    admitidas: int
+    enfileiradas: int
+    descartadas_alta: int
+    descartadas_normal: int
+    descartadas_baixa: int
+
+class MetricasCoalescencia(BaseModel):
+    chamadas: int
+    consultas: int
+    coalescidas: int
+    cache_hits: int
+    em_andamento: int
+    em_cache: int
@@ -0,0 +1,147 @@
+"""
+Coalescência de leituras idênticas (single-flight) com micro-cache opcional.
+
+Quando várias requisições concorrentes fazem o mesmo find_one na mesma coleção, apenas
+a primeira (líder) vai ao banco; as demais aguardam o resultado da consulta em andamento
+e recebem uma cópia dele. Com cache_ms > 0, o resultado ainda é reaproveitado por esse
+intervalo por leituras que chegam logo depois.
+
+Cada escrita feita pela coleção envolvida avança a geração da coleção, que faz parte da
+chave: uma leitura posterior a uma escrita nunca se junta a uma consulta iniciada antes
+dela, nem usa um resultado em cache anterior (o processo lê as próprias escritas).
+Escritas de outros processos ficam visíveis após no máximo cache_ms.
+
+Os documentos são mutáveis e as rotas os alteram (ex.: carteira["acoes"] na compra), por
+isso cada chamador que compartilha um resultado recebe sua própria cópia.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import bson
+
+_ESCRITAS = frozenset({
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "find_one_and_update", "find_one_and_replace", "find_one_and_delete", "bulk_write",
+})
+
+
+class _Voo:
+    __slots__ = ("evento", "resultado", "erro", "seguidores")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado: Any = None
+        self.erro: Optional[BaseException] = None
+        self.seguidores = 0
+
+
+class SingleFlight:
+    """Grupo de chamadas coalescidas por chave, seguro entre threads."""
+
+    def __init__(self, cache_ms: int = 0, max_cache: int = 10000):
+        self.cache_ms = cache_ms
+        self.max_cache = max_cache
+        self._voos: Dict[Hashable, _Voo] = {}
+        self._cache: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"chamadas": 0, "consultas": 0, "coalescidas": 0, "cache_hits": 0}
+
+    def do(self, chave: Hashable, funcao: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._stats["chamadas"] += 1
+            if self.cache_ms:
+                item = self._cache.get(chave)
+                if item is not None and time.monotonic() < item[0]:
+                    self._stats["cache_hits"] += 1
+                    return copy.deepcopy(item[1])
+            voo = self._voos.get(chave)
+            lider = voo is None
+            if lider:
+                voo = self._voos[chave] = _Voo()
+                self._stats["consultas"] += 1
+            else:
+                voo.seguidores += 1
+                self._stats["coalescidas"] += 1
+
+        if not lider:
+            voo.evento.wait()
+            if voo.erro is not None:
+                raise voo.erro
+            return copy.deepcopy(voo.resultado)
+
+        try:
+            resultado = funcao()
+        except BaseException as e:
+            voo.erro = e
+            with self._lock:
+                del self._voos[chave]
+            voo.evento.set()
+            raise
+
+        with self._lock:
+            # Depois de sair do mapa, nenhum seguidor novo se junta a este voo
+            del self._voos[chave]
+            compartilhar = voo.seguidores > 0 or self.cache_ms > 0
+            if compartilhar:
+                # Cópia privada: o líder pode alterar o documento que recebeu
+                voo.resultado = copy.deepcopy(resultado)
+            if self.cache_ms:
+                self._cache[chave] = (time.monotonic() + self.cache_ms / 1000.0, voo.resultado)
+                self._cache.move_to_end(chave)
+                while len(self._cache) > self.max_cache:
+                    self._cache.popitem(last=False)
+        voo.evento.set()
+        return resultado
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "em_andamento": len(self._voos), "em_cache": len(self._cache)}
+
+
+class CoalescingCollection:
+    """
+    Wrapper que coalesce find_one idênticos e concorrentes. As escritas avançam a geração
+    e limpam o micro-cache; os demais métodos são repassados à coleção envolvida.
+    """
+
+    def __init__(self, collection, cache_ms: int = 0, enabled: bool = True):
+        self._collection = collection
+        self._grupo = SingleFlight(cache_ms)
+        self._enabled = enabled
+        self._geracao = 0
+
+    def __getattr__(self, nome: str):
+        atributo = getattr(self._collection, nome)
+        if nome in _ESCRITAS:
+            def escrever(*args, **kwargs):
+                try:
+                    return atributo(*args, **kwargs)
+                finally:
+                    self._geracao += 1
+                    self._grupo.clear()
+            return escrever
+        return atributo
+
+    def __getitem__(self, nome: str):
+        return self._collection[nome]
+
+    def find_one(self, filter: Any = None, *args, **kwargs):
+        if not self._enabled or "session" in kwargs:
+            return self._collection.find_one(filter, *args, **kwargs)
+        try:
+            consulta = bson.encode({"f": filter, "a": list(args), "k": kwargs})
+        except Exception:
+            # Filtro com tipos fora do BSON (ex.: cursores, callables): sem coalescência
+            return self._collection.find_one(filter, *args, **kwargs)
+        return self._grupo.do((self._geracao, consulta),
+                              lambda: self._collection.find_one(filter, *args, **kwargs))
+
+    def coalescing_stats(self) -> dict:
+        return self._grupo.stats()
@@ -0,0 +1,260 @@
+"""
+Registro de operações lentas do MongoDB com captura do plano de execução.
+
+O SlowQueryRecorder é um CommandListener do pymongo: os eventos são publicados na thread
+que executa o comando, então a rota e o id da requisição vêm das variáveis de contexto.
+Quando um comando passa de SLOW_QUERY_THRESHOLD_MS, a forma da consulta (filtro e
+ordenação com os valores trocados por "?") é enfileirada; uma thread em segundo plano
+roda o explain("executionStats") da forma, no máximo uma vez por
+SLOW_QUERY_EXPLAIN_INTERVAL_S, e grava o registro na coleção consultas_lentas (capped).
+Nada disso acontece no caminho da requisição: com a fila cheia, o registro é descartado.
+"""
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from . import context
+
+logger = logging.getLogger(__name__)
+
+# Comandos com filtro: (campo do filtro, campo da ordenação)
+_COMANDOS = {
+    "find": ("filter", "sort"),
+    "findAndModify": ("query", "sort"),
+    "count": ("query", None),
+    "distinct": ("query", None),
+    "aggregate": (None, None),
+    "update": (None, None),
+    "delete": (None, None),
+}
+
+# Campos de sessão/transporte que o explain não aceita
+_CAMPOS_SESSAO = {
+    "lsid", "$clusterTime", "$db", "txnNumber", "autocommit", "startTransaction", "$readPreference",
+    "readConcern", "writeConcern", "apiVersion", "apiStrict", "apiDeprecationErrors",
+}
+
+_BANCOS_INTERNOS = {"admin", "config", "local"}
+
+
+def forma(valor: Any) -> Any:
+    """Troca os valores por "?" mantendo campos e operadores (listas de filtros são preservadas)."""
+    if isinstance(valor, dict):
+        return {chave: forma(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)) and valor and all(isinstance(item, dict) for item in valor):
+        return [forma(item) for item in valor]
+    return "?"
+
+
+def _para_json(valor: Any) -> str:
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def extrair_forma(nome: str, comando: dict) -> Tuple[Optional[dict], Optional[dict], Optional[list]]:
+    """Filtro e ordenação (já em forma) e, para agregações, a forma do pipeline."""
+    campo_filtro, campo_ordenacao = _COMANDOS[nome]
+    filtro = comando.get(campo_filtro) if campo_filtro else None
+    ordenacao = comando.get(campo_ordenacao) if campo_ordenacao else None
+    pipeline = None
+    if nome == "aggregate":
+        pipeline = [forma(estagio) for estagio in comando.get("pipeline", [])]
+        for estagio in comando.get("pipeline", []):
+            if "$match" in estagio and filtro is None:
+                filtro = estagio["$match"]
+            if "$sort" in estagio and ordenacao is None:
+                ordenacao = estagio["$sort"]
+    elif nome in ("update", "delete"):
+        instrucoes = comando.get("updates" if nome == "update" else "deletes") or [{}]
+        filtro = instrucoes[0].get("q")
+    return (forma(filtro) if filtro is not None else None,
+            dict(ordenacao) if ordenacao is not None else None,
+            pipeline)
+
+
+def comando_explain(nome: str, comando: dict) -> dict:
+    """Comando original sem os campos de sessão (e só com a primeira instrução de escrita)."""
+    explicado = {chave: valor for chave, valor in comando.items() if chave not in _CAMPOS_SESSAO}
+    if nome == "update":
+        explicado["updates"] = list(comando["updates"])[:1]
+    elif nome == "delete":
+        explicado["deletes"] = list(comando["deletes"])[:1]
+    return explicado
+
+
+def _estagios(plano: Any) -> List[dict]:
+    """Estágios do plano vencedor, da raiz para as folhas."""
+    estagios = []
+    pendentes = [plano] if isinstance(plano, dict) else []
+    while pendentes:
+        atual = pendentes.pop(0)
+        estagios.append(atual)
+        if isinstance(atual.get("inputStage"), dict):
+            pendentes.append(atual["inputStage"])
+        pendentes.extend(filho for filho in atual.get("inputStages", []) if isinstance(filho, dict))
+        if isinstance(atual.get("queryPlan"), dict):  # SBE (MongoDB 5.0+)
+            pendentes.append(atual["queryPlan"])
+    return estagios
+
+
+def resumir_explain(explain: dict) -> dict:
+    """Resumo do explain: estágios, índices e contagens de execução (o plano vai como JSON)."""
+    planner = explain.get("queryPlanner", {})
+    if "stages" in explain and not planner:  # agregação com $cursor
+        planner = explain["stages"][0].get("$cursor", {}).get("queryPlanner", {})
+    plano = planner.get("winningPlan", {})
+    stats = explain.get("executionStats", {})
+    estagios = _estagios(plano)
+    return {
+        "estagios": [estagio.get("stage") for estagio in estagios if estagio.get("stage")],
+        "indices": sorted({estagio["indexName"] for estagio in estagios if estagio.get("indexName")}),
+        "documentos_examinados": stats.get("totalDocsExamined"),
+        "chaves_examinadas": stats.get("totalKeysExamined"),
+        "retornados": stats.get("nReturned"),
+        "tempo_ms": stats.get("executionTimeMillis"),
+        "plano": _para_json(plano),
+    }
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    def __init__(self, threshold_ms: int = 500, explain_interval_s: int = 3600, max_queue: int = 1000,
+                 colecao_destino: str = "consultas_lentas"):
+        self.threshold_ms = threshold_ms
+        self.explain_interval_s = explain_interval_s
+        self.colecao_destino = colecao_destino
+        self._fila: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self._pendentes: Dict[Tuple[Any, int], tuple] = {}
+        self._explicados: Dict[str, float] = {}
+        self._interno = threading.local()
+        self._colecao = None
+        self._client = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._estatisticas = {"lentas": 0, "gravadas": 0, "explains": 0, "falhas_explain": 0, "descartadas": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, colecao, client):
+        """Começa a gravar em colecao; o explain roda pelo client (o mesmo monitorado)."""
+        if self.running:
+            return
+        self._colecao = colecao
+        self._client = client
+        self._thread = threading.Thread(target=self._run, name="slow-queries", daemon=True)
+        self._thread.start()
+        logger.info(f"Registro de operações lentas ativo (limite de {self.threshold_ms} ms)")
+
+    def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._fila.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        self._pendentes.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._estatisticas, "tamanho_fila": self._fila.qsize()}
+
+    def _incrementar(self, campo: str):
+        with self._lock:
+            self._estatisticas[campo] += 1
+
+    # -- eventos do pymongo (na thread do comando) ----------------------------
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if not self.running or getattr(self._interno, "ativo", False):
+            return
+        if event.command_name not in _COMANDOS or event.database_name in _BANCOS_INTERNOS:
+            return
+        colecao = event.command.get(event.command_name)
+        if not isinstance(colecao, str) or colecao == self.colecao_destino:
+            return
+        # Só guarda a referência: o comando só é copiado se a operação for lenta
+        self._pendentes[(event.connection_id, event.request_id)] = (
+            event.command, event.database_name, colecao, context.rota_atual.get(), context.request_id.get(),
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._concluir(event, falhou=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._concluir(event, falhou=True)
+
+    def _concluir(self, event, falhou: bool):
+        pendente = self._pendentes.pop((event.connection_id, event.request_id), None)
+        if pendente is None or event.duration_micros < self.threshold_ms * 1000:
+            return
+        comando, banco, colecao, rota, request_id = pendente
+        self._incrementar("lentas")
+        try:
+            self._fila.put_nowait({
+                "nome": event.command_name,
+                "comando": dict(comando),
+                "banco": banco,
+                "colecao": colecao,
+                "rota": rota,
+                "request_id": request_id,
+                "duracao_ms": round(event.duration_micros / 1000, 1),
+                "falhou": falhou,
+                "data": datetime.utcnow(),
+            })
+        except queue.Full:
+            self._incrementar("descartadas")
+
+    # -- thread de gravação ---------------------------------------------------
+
+    def _run(self):
+        self._interno.ativo = True  # Comandos desta thread (explain e gravação) não são monitorados
+        while True:
+            operacao = self._fila.get()
+            if operacao is None:
+                return
+            try:
+                self._colecao.insert_one(self.registro(operacao))
+                self._incrementar("gravadas")
+            except Exception:
+                logger.exception("Falha ao gravar operação lenta")
+
+    def registro(self, operacao: dict) -> dict:
+        """Documento gravado em consultas_lentas, com o explain na primeira ocorrência da forma."""
+        nome = operacao["nome"]
+        filtro, ordenacao, pipeline = extrair_forma(nome, operacao["comando"])
+        chave = hashlib.sha1(_para_json(
+            [operacao["banco"], operacao["colecao"], nome, filtro, list((ordenacao or {}).items()), pipeline]
+        ).encode()).hexdigest()[:16]
+        documento = {
+            "data": operacao["data"],
+            "chave": chave,
+            "comando": nome,
+            "colecao": operacao["colecao"],
+            "filtro": _para_json(filtro) if filtro is not None else None,
+            "ordenacao": _para_json(ordenacao) if ordenacao is not None else None,
+            "pipeline": _para_json(pipeline) if pipeline is not None else None,
+            "rota": operacao["rota"],
+            "request_id": operacao["request_id"],
+            "duracao_ms": operacao["duracao_ms"],
+            "falhou": operacao["falhou"],
+        }
+        agora = time.monotonic()
+        ultimo = self._explicados.get(chave)
+        if ultimo is None or agora - ultimo >= self.explain_interval_s:
+            self._explicados[chave] = agora
+            try:
+                explain = self._client[operacao["banco"]].command(
+                    {"explain": comando_explain(nome, operacao["comando"]), "verbosity": "executionStats"}
+                )
+                documento["explain"] = resumir_explain(explain)
+                self._incrementar("explains")
+            except Exception as e:
+                documento["explain_erro"] = str(e)
+                self._incrementar("falhas_explain")
+        return documento
@@ -0,0 +1,14 @@
+"""
+Motores de armazenamento da API.
+
+- "mongo": MongoDB / Azure Cosmos DB via pymongo (padrão)
+- "memory": motor em processo (app.storage.memory), sem servidor externo
+
+Ambos expõem a interface de repositório descrita em app.storage.base.Repository.
+"""
+from .base import Repository
+from .memory import MemoryCollection, MemoryDatabase
+
+ENGINES = ("mongo", "memory")
+
+__all__ = ["ENGINES", "MemoryCollection", "MemoryDatabase", "Repository"]
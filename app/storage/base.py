@@ -0,0 +1,46 @@
+from typing import Any, Iterable, List, Mapping, Optional, Protocol, Sequence, Union
+
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+Filtro = Mapping[str, Any]
+Atualizacao = Union[Mapping[str, Any], Sequence[Mapping[str, Any]]]
+
+
+class Repository(Protocol):
+    """
+    Interface de repositório usada pelas rotas para cada uma das coleções.
+
+    É o subconjunto da API de coleção do pymongo de que a aplicação depende, implementado
+    tanto pela coleção do MongoDB (envolvida por ThrottledCollection) quanto pelo motor
+    em memória (app.storage.memory.MemoryCollection).
+    """
+
+    name: str
+
+    def find_one(self, filter: Optional[Filtro] = None, *args, **kwargs) -> Optional[dict]: ...
+
+    def find(self, filter: Optional[Filtro] = None, *args, **kwargs) -> Iterable[dict]: ...
+
+    def count_documents(self, filter: Filtro, **kwargs) -> int: ...
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult: ...
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult: ...
+
+    def update_one(self, filter: Filtro, update: Atualizacao, upsert: bool = False, **kwargs) -> UpdateResult: ...
+
+    def update_many(self, filter: Filtro, update: Atualizacao, upsert: bool = False, **kwargs) -> UpdateResult: ...
+
+    def find_one_and_update(self, filter: Filtro, update: Atualizacao, *args, **kwargs) -> Optional[dict]: ...
+
+    def delete_one(self, filter: Filtro, **kwargs) -> DeleteResult: ...
+
+    def delete_many(self, filter: Filtro, **kwargs) -> DeleteResult: ...
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> Any: ...
+
+    def aggregate(self, pipeline: List[Mapping[str, Any]], **kwargs) -> Iterable[dict]: ...
+
+    def create_index(self, keys: Any, **kwargs) -> str: ...
+
+    def with_options(self, **kwargs) -> "Repository": ...
@@ -0,0 +1,1732 @@
+"""
+Motor de armazenamento em memória com a mesma interface de coleção do pymongo.
+
+Permite executar a API sem um servidor MongoDB (implantações de nó único, testes de
+integração e benchmarks). Mantém índices secundários em memória e, opcionalmente,
+persiste um snapshot BSON em disco.
+"""
+import copy
+import datetime
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+logger = logging.getLogger(__name__)
+
+
+class _Missing:
+    """Marca um campo ausente no documento."""
+
+    def __repr__(self):
+        return "<ausente>"
+
+
+MISSING = _Missing()
+
+
+# ---------------------------------------------------------------------------
+# Comparação de valores (ordem de tipos do BSON)
+# ---------------------------------------------------------------------------
+
+def _type_rank(valor: Any) -> int:
+    if valor is MISSING or valor is None:
+        return 1
+    if isinstance(valor, bool):
+        return 8
+    if isinstance(valor, (int, float)):
+        return 2
+    if isinstance(valor, str):
+        return 3
+    if isinstance(valor, dict):
+        return 4
+    if isinstance(valor, list):
+        return 5
+    if isinstance(valor, bytes):
+        return 6
+    if isinstance(valor, ObjectId):
+        return 7
+    if isinstance(valor, datetime.datetime):
+        return 9
+    return 10
+
+
+def compare(a: Any, b: Any) -> int:
+    """Compara dois valores seguindo a ordem de tipos do MongoDB."""
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 1:
+        return 0
+    if rank_a == 4:
+        return compare(list(a.items()), list(b.items()))
+    if rank_a == 5:
+        for x, y in zip(a, b):
+            resultado = compare(x, y)
+            if resultado:
+                return resultado
+        return (len(a) > len(b)) - (len(a) < len(b))
+    if isinstance(a, tuple):
+        return compare(list(a), list(b))
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return compare(repr(a), repr(b))
+
+
+def _equal(a: Any, b: Any) -> bool:
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    if isinstance(a, re.Pattern):
+        return isinstance(b, str) and bool(a.search(b))
+    return _type_rank(a) == _type_rank(b) and compare(a, b) == 0
+
+
+def hash_key(valor: Any) -> Any:
+    """Chave "hasheável" equivalente à igualdade do MongoDB, usada nos índices."""
+    if valor is MISSING:
+        return None
+    if isinstance(valor, bool):
+        return ("bool", valor)
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if isinstance(valor, dict):
+        return ("dict", tuple((k, hash_key(v)) for k, v in valor.items()))
+    if isinstance(valor, list):
+        return ("list", tuple(hash_key(v) for v in valor))
+    return valor
+
+
+# ---------------------------------------------------------------------------
+# Resolução de caminhos ("acoes.acao_id")
+# ---------------------------------------------------------------------------
+
+def path_values(valor: Any, partes: List[str]) -> List[Any]:
+    """Todos os valores alcançados pelo caminho, percorrendo arrays como o MongoDB."""
+    if not partes:
+        return [valor]
+    chave, resto = partes[0], partes[1:]
+    if isinstance(valor, dict):
+        return path_values(valor[chave], resto) if chave in valor else [MISSING]
+    if isinstance(valor, list):
+        if chave.isdigit():
+            indice = int(chave)
+            return path_values(valor[indice], resto) if indice < len(valor) else [MISSING]
+        resultado = []
+        for item in valor:
+            if isinstance(item, (dict, list)):
+                resultado.extend(v for v in path_values(item, partes) if v is not MISSING)
+        return resultado or [MISSING]
+    return [MISSING]
+
+
+def _candidates(valores: List[Any]) -> Iterable[Any]:
+    # O MongoDB compara tanto o array quanto cada um de seus elementos
+    for valor in valores:
+        yield valor
+        if isinstance(valor, list):
+            yield from valor
+
+
+def get_path(documento: dict, caminho: str) -> Any:
+    """Valor de um caminho sem expansão de arrays (usado em ordenação e chaves de índice)."""
+    valor: Any = documento
+    for parte in caminho.split("."):
+        if isinstance(valor, dict):
+            valor = valor.get(parte, MISSING)
+        elif isinstance(valor, list) and parte.isdigit() and int(parte) < len(valor):
+            valor = valor[int(parte)]
+        elif isinstance(valor, list):
+            valores = [v for v in (get_path(item, parte) for item in valor if isinstance(item, dict)) if v is not MISSING]
+            valor = valores if valores else MISSING
+        else:
+            return MISSING
+    return valor
+
+
+# ---------------------------------------------------------------------------
+# Filtros de consulta
+# ---------------------------------------------------------------------------
+
+def _is_operator_doc(condicao: Any) -> bool:
+    return isinstance(condicao, dict) and bool(condicao) and all(str(k).startswith("$") for k in condicao)
+
+
+def _matches_equal(valores: List[Any], alvo: Any) -> bool:
+    for valor in _candidates(valores):
+        if valor is MISSING:
+            if alvo is None:
+                return True
+            continue
+        if _equal(alvo, valor) if isinstance(alvo, re.Pattern) else _equal(valor, alvo):
+            return True
+    return False
+
+
+def _matches_compare(valores: List[Any], alvo: Any, teste) -> bool:
+    for valor in _candidates(valores):
+        if valor is MISSING:
+            continue
+        if _type_rank(valor) == _type_rank(alvo) and teste(compare(valor, alvo)):
+            return True
+    return False
+
+
+def _matches_operator(valores: List[Any], operador: str, argumento: Any, condicao: dict) -> bool:
+    if operador == "$eq":
+        return _matches_equal(valores, argumento)
+    if operador == "$ne":
+        return not _matches_equal(valores, argumento)
+    if operador == "$gt":
+        return _matches_compare(valores, argumento, lambda c: c > 0)
+    if operador == "$gte":
+        return _matches_compare(valores, argumento, lambda c: c >= 0)
+    if operador == "$lt":
+        return _matches_compare(valores, argumento, lambda c: c < 0)
+    if operador == "$lte":
+        return _matches_compare(valores, argumento, lambda c: c <= 0)
+    if operador == "$in":
+        # Atalho para listas grandes: para strings e ObjectIds a igualdade do Python é a do MongoDB
+        if any(isinstance(v, (str, ObjectId)) and v in argumento for v in _candidates(valores)):
+            return True
+        return any(_matches_equal(valores, alvo) for alvo in argumento)
+    if operador == "$nin":
+        return not any(_matches_equal(valores, alvo) for alvo in argumento)
+    if operador == "$exists":
+        existe = any(valor is not MISSING for valor in valores)
+        return existe if argumento else not existe
+    if operador == "$regex":
+        flags = 0
+        for letra in condicao.get("$options", ""):
+            flags |= {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}.get(letra, 0)
+        padrao = argumento if isinstance(argumento, re.Pattern) else re.compile(argumento, flags)
+        return any(isinstance(v, str) and padrao.search(v) for v in _candidates(valores))
+    if operador == "$options":
+        return True
+    if operador == "$size":
+        return any(isinstance(v, list) and len(v) == argumento for v in valores)
+    if operador == "$all":
+        return all(_matches_equal(valores, alvo) for alvo in argumento)
+    if operador == "$elemMatch":
+        for valor in valores:
+            if not isinstance(valor, list):
+                continue
+            for elemento in valor:
+                if _is_operator_doc(argumento) and not any(k in argumento for k in ("$and", "$or", "$nor")):
+                    if _matches_condition([elemento], argumento):
+                        return True
+                elif isinstance(elemento, dict) and matches(elemento, argumento):
+                    return True
+        return False
+    if operador == "$not":
+        return not _matches_condition(valores, argumento)
+    if operador == "$type":
+        nomes = {"double": float, "string": str, "object": dict, "array": list, "objectId": ObjectId,
+                 "bool": bool, "date": datetime.datetime, "null": type(None), "int": int, "long": int}
+        tipos = argumento if isinstance(argumento, list) else [argumento]
+        return any(isinstance(v, nomes.get(t, ())) for v in valores for t in tipos if v is not MISSING)
+    raise OperationFailure(f"unknown operator: {operador}", code=2)
+
+
+def _matches_condition(valores: List[Any], condicao: Any) -> bool:
+    if _is_operator_doc(condicao):
+        return all(_matches_operator(valores, op, arg, condicao) for op, arg in condicao.items())
+    return _matches_equal(valores, condicao)
+
+
+def matches(documento: dict, filtro: Optional[dict]) -> bool:
+    """Indica se o documento satisfaz o filtro de consulta."""
+    if not filtro:
+        return True
+    for chave, condicao in filtro.items():
+        if chave == "$and":
+            if not all(matches(documento, sub) for sub in condicao):
+                return False
+        elif chave == "$or":
+            if not any(matches(documento, sub) for sub in condicao):
+                return False
+        elif chave == "$nor":
+            if any(matches(documento, sub) for sub in condicao):
+                return False
+        elif chave == "$expr":
+            if not evaluate(condicao, documento):
+                return False
+        elif chave == "$comment":
+            continue
+        elif not _matches_condition(path_values(documento, chave.split(".")), condicao):
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Expressões de agregação
+# ---------------------------------------------------------------------------
+
+def _expression_path(valor: Any, partes: List[str]) -> Any:
+    for indice, parte in enumerate(partes):
+        if isinstance(valor, dict):
+            valor = valor.get(parte, MISSING)
+        elif isinstance(valor, list):
+            restantes = partes[indice:]
+            itens = [_expression_path(item, restantes) for item in valor if isinstance(item, dict)]
+            return [item for item in itens if item is not MISSING]
+        else:
+            return MISSING
+    return valor
+
+
+def _numbers(valores: Iterable[Any]) -> List[Any]:
+    return [v for v in valores if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+
+def _arguments(argumento: Any, documento: dict, variaveis: dict) -> List[Any]:
+    if isinstance(argumento, list):
+        return [evaluate(item, documento, variaveis) for item in argumento]
+    return [evaluate(argumento, documento, variaveis)]
+
+
+def _array_argument(argumento: Any, documento: dict, variaveis: dict) -> List[Any]:
+    # $sum/$min/$max/$avg aceitam uma lista de expressões ou uma expressão que resulta em array
+    valores = _arguments(argumento, documento, variaveis)
+    if not isinstance(argumento, list) and len(valores) == 1 and isinstance(valores[0], list):
+        return valores[0]
+    return valores
+
+
+def _cond(argumento: Any, documento: dict, variaveis: dict) -> Any:
+    if isinstance(argumento, dict):
+        se, entao, senao = argumento["if"], argumento["then"], argumento["else"]
+    else:
+        se, entao, senao = argumento
+    return evaluate(entao if _truthy(evaluate(se, documento, variaveis)) else senao, documento, variaveis)
+
+
+def _truthy(valor: Any) -> bool:
+    return valor is not MISSING and valor is not None and valor is not False and valor != 0
+
+
+def _add(valores: List[Any]) -> Any:
+    if any(v is None or v is MISSING for v in valores):
+        return None
+    datas = [v for v in valores if isinstance(v, datetime.datetime)]
+    total = sum(_numbers(valores))
+    if datas:
+        return datas[0] + datetime.timedelta(milliseconds=total)
+    return total
+
+
+def _subtract(a: Any, b: Any) -> Any:
+    if a is None or b is None or a is MISSING or b is MISSING:
+        return None
+    if isinstance(a, datetime.datetime) and isinstance(b, datetime.datetime):
+        return int((a - b).total_seconds() * 1000)
+    if isinstance(a, datetime.datetime):
+        return a - datetime.timedelta(milliseconds=b)
+    return a - b
+
+
+def _multiply(valores: List[Any]) -> Any:
+    if any(v is None or v is MISSING for v in valores):
+        return None
+    resultado = 1
+    for valor in valores:
+        resultado *= valor
+    return resultado
+
+
+def _date_part(parte: str):
+    def extrair(argumento, documento, variaveis):
+        data = evaluate(argumento.get("date") if isinstance(argumento, dict) else argumento, documento, variaveis)
+        if not isinstance(data, datetime.datetime):
+            return None
+        return getattr(data, parte)
+    return extrair
+
+
+def _date_trunc(argumento: dict, documento: dict, variaveis: dict) -> Any:
+    data = evaluate(argumento["date"], documento, variaveis)
+    unidade = argumento["unit"]
+    tamanho = int(evaluate(argumento.get("binSize", 1), documento, variaveis))
+    if not isinstance(data, datetime.datetime):
+        return None
+    segundos = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}.get(unidade)
+    if segundos is None:
+        raise OperationFailure(f"$dateTrunc: unidade não suportada em memória: {unidade}", code=2)
+    passo = segundos * tamanho
+    epoca = datetime.datetime(1970, 1, 1, tzinfo=data.tzinfo)
+    decorrido = int((data - epoca).total_seconds())
+    return epoca + datetime.timedelta(seconds=decorrido - decorrido % passo)
+
+
+_EXPRESSION_OPERATORS = {
+    "$literal": lambda arg, doc, var: arg,
+    "$add": lambda arg, doc, var: _add(_arguments(arg, doc, var)),
+    "$subtract": lambda arg, doc, var: _subtract(*_arguments(arg, doc, var)),
+    "$multiply": lambda arg, doc, var: _multiply(_arguments(arg, doc, var)),
+    "$divide": lambda arg, doc, var: (lambda a, b: None if a is None or b is None else a / b)(*_arguments(arg, doc, var)),
+    "$mod": lambda arg, doc, var: (lambda a, b: a % b)(*_arguments(arg, doc, var)),
+    "$abs": lambda arg, doc, var: abs(_arguments(arg, doc, var)[0]),
+    "$round": lambda arg, doc, var: (lambda v, casas=0: round(v, casas))(*_arguments(arg, doc, var)),
+    "$sqrt": lambda arg, doc, var: _arguments(arg, doc, var)[0] ** 0.5,
+    "$sum": lambda arg, doc, var: sum(_numbers(_array_argument(arg, doc, var))),
+    "$avg": lambda arg, doc, var: (lambda n: sum(n) / len(n) if n else None)(_numbers(_array_argument(arg, doc, var))),
+    "$min": lambda arg, doc, var: min((v for v in _array_argument(arg, doc, var) if v not in (None, MISSING)),
+                                      key=functools.cmp_to_key(compare), default=None),
+    "$max": lambda arg, doc, var: max((v for v in _array_argument(arg, doc, var) if v not in (None, MISSING)),
+                                      key=functools.cmp_to_key(compare), default=None),
+    "$cond": _cond,
+    "$ifNull": lambda arg, doc, var: next(
+        (v for v in _arguments(arg, doc, var)[:-1] if v is not None and v is not MISSING),
+        _arguments(arg, doc, var)[-1],
+    ),
+    "$eq": lambda arg, doc, var: (lambda a, b: compare(a, b) == 0)(*_arguments(arg, doc, var)),
+    "$ne": lambda arg, doc, var: (lambda a, b: compare(a, b) != 0)(*_arguments(arg, doc, var)),
+    "$gt": lambda arg, doc, var: (lambda a, b: compare(a, b) > 0)(*_arguments(arg, doc, var)),
+    "$gte": lambda arg, doc, var: (lambda a, b: compare(a, b) >= 0)(*_arguments(arg, doc, var)),
+    "$lt": lambda arg, doc, var: (lambda a, b: compare(a, b) < 0)(*_arguments(arg, doc, var)),
+    "$lte": lambda arg, doc, var: (lambda a, b: compare(a, b) <= 0)(*_arguments(arg, doc, var)),
+    "$and": lambda arg, doc, var: all(_truthy(v) for v in _arguments(arg, doc, var)),
+    "$or": lambda arg, doc, var: any(_truthy(v) for v in _arguments(arg, doc, var)),
+    "$not": lambda arg, doc, var: not _truthy(_arguments(arg, doc, var)[0]),
+    "$in": lambda arg, doc, var: (lambda v, lista: any(_equal(v, item) for item in lista or []))(*_arguments(arg, doc, var)),
+    "$size": lambda arg, doc, var: len(_arguments(arg, doc, var)[0]),
+    "$arrayElemAt": lambda arg, doc, var: (lambda lista, i: lista[i] if -len(lista) <= i < len(lista) else MISSING)(
+        *_arguments(arg, doc, var)
+    ),
+    "$concatArrays": lambda arg, doc, var: (lambda listas: None if any(l is None or l is MISSING for l in listas)
+                                            else [item for lista in listas for item in lista])(_arguments(arg, doc, var)),
+    "$concat": lambda arg, doc, var: "".join(str(v) for v in _arguments(arg, doc, var)),
+    "$mergeObjects": lambda arg, doc, var: functools.reduce(
+        lambda a, b: {**a, **(b if isinstance(b, dict) else {})}, _array_argument(arg, doc, var), {}
+    ),
+    "$toString": lambda arg, doc, var: (lambda v: None if v is None else str(v))(_arguments(arg, doc, var)[0]),
+    "$toDouble": lambda arg, doc, var: (lambda v: None if v is None else float(v))(_arguments(arg, doc, var)[0]),
+    "$year": _date_part("year"),
+    "$month": _date_part("month"),
+    "$dayOfMonth": _date_part("day"),
+    "$hour": _date_part("hour"),
+    "$minute": _date_part("minute"),
+    "$dateTrunc": _date_trunc,
+}
+
+
+def _map(argumento: dict, documento: dict, variaveis: dict) -> Any:
+    entrada = evaluate(argumento["input"], documento, variaveis)
+    if entrada is None or entrada is MISSING:
+        return None
+    nome = argumento.get("as", "this")
+    return [evaluate(argumento["in"], documento, {**variaveis, nome: item}) for item in entrada]
+
+
+def _filter(argumento: dict, documento: dict, variaveis: dict) -> Any:
+    entrada = evaluate(argumento["input"], documento, variaveis)
+    if entrada is None or entrada is MISSING:
+        return None
+    nome = argumento.get("as", "this")
+    return [item for item in entrada if _truthy(evaluate(argumento["cond"], documento, {**variaveis, nome: item}))]
+
+
+def _reduce(argumento: dict, documento: dict, variaveis: dict) -> Any:
+    acumulado = evaluate(argumento["initialValue"], documento, variaveis)
+    for item in evaluate(argumento["input"], documento, variaveis) or []:
+        acumulado = evaluate(argumento["in"], documento, {**variaveis, "this": item, "value": acumulado})
+    return acumulado
+
+
+def _let(argumento: dict, documento: dict, variaveis: dict) -> Any:
+    novas = {nome: evaluate(expr, documento, variaveis) for nome, expr in argumento["vars"].items()}
+    return evaluate(argumento["in"], documento, {**variaveis, **novas})
+
+
+_EXPRESSION_OPERATORS.update({"$map": _map, "$filter": _filter, "$reduce": _reduce, "$let": _let})
+
+
+def evaluate(expressao: Any, documento: dict, variaveis: Optional[dict] = None) -> Any:
+    """Avalia uma expressão de agregação sobre o documento."""
+    variaveis = variaveis or {}
+    if isinstance(expressao, str) and expressao.startswith("$$"):
+        nome, _, resto = expressao[2:].partition(".")
+        if nome == "ROOT" or nome == "CURRENT":
+            base = documento
+        elif nome == "NOW":
+            base = datetime.datetime.utcnow()
+        else:
+            base = variaveis.get(nome, MISSING)
+        return _expression_path(base, resto.split(".")) if resto else base
+    if isinstance(expressao, str) and expressao.startswith("$"):
+        return _expression_path(documento, expressao[1:].split("."))
+    if isinstance(expressao, list):
+        return [evaluate(item, documento, variaveis) for item in expressao]
+    if isinstance(expressao, dict):
+        if len(expressao) == 1:
+            operador, argumento = next(iter(expressao.items()))
+            if isinstance(operador, str) and operador.startswith("$"):
+                if operador not in _EXPRESSION_OPERATORS:
+                    raise OperationFailure(f"Operador de expressão não suportado em memória: {operador}", code=168)
+                return _EXPRESSION_OPERATORS[operador](argumento, documento, variaveis)
+        resultado = {}
+        for chave, valor in expressao.items():
+            avaliado = evaluate(valor, documento, variaveis)
+            if avaliado is not MISSING:
+                resultado[chave] = avaliado
+        return resultado
+    return expressao
+
+
+# ---------------------------------------------------------------------------
+# Projeção e ordenação
+# ---------------------------------------------------------------------------
+
+def _unset_path(documento: dict, caminho: str):
+    partes = caminho.split(".")
+    alvo: Any = documento
+    for parte in partes[:-1]:
+        if not isinstance(alvo, dict) or parte not in alvo:
+            return
+        alvo = alvo[parte]
+    if isinstance(alvo, dict):
+        alvo.pop(partes[-1], None)
+
+
+def _set_simple_path(documento: dict, caminho: str, valor: Any):
+    partes = caminho.split(".")
+    alvo = documento
+    for parte in partes[:-1]:
+        alvo = alvo.setdefault(parte, {})
+    alvo[partes[-1]] = valor
+
+
+def project(documento: dict, projecao: Optional[Any]) -> dict:
+    """Aplica uma projeção de inclusão ou exclusão (sem operadores de projeção)."""
+    if not projecao:
+        return documento
+    if isinstance(projecao, (list, tuple)):
+        projecao = {campo: 1 for campo in projecao}
+    inclui_id = bool(projecao.get("_id", 1))
+    campos = {k: v for k, v in projecao.items() if k != "_id"}
+    if not campos or all(not v for v in campos.values()):
+        resultado = copy.deepcopy(documento)
+        for campo in campos:
+            _unset_path(resultado, campo)
+        if not inclui_id:
+            resultado.pop("_id", None)
+        return resultado
+    resultado = {}
+    if inclui_id and "_id" in documento:
+        resultado["_id"] = documento["_id"]
+    arvore: dict = {}
+    for campo, valor in campos.items():
+        if isinstance(valor, (dict, str)):
+            avaliado = evaluate(valor, documento)
+            if avaliado is not MISSING:
+                _set_simple_path(resultado, campo, avaliado)
+            continue
+        no = arvore
+        partes = campo.split(".")
+        for parte in partes[:-1]:
+            no = no.setdefault(parte, {})
+            if no is True:
+                break
+        else:
+            no[partes[-1]] = True
+    resultado.update(_incluir(documento, arvore))
+    return resultado
+
+
+def _incluir(documento: dict, arvore: dict) -> dict:
+    """Projeção de inclusão por árvore de campos; caminhos através de arrays são aplicados a cada elemento."""
+    resultado = {}
+    for campo, sub in arvore.items():
+        if campo not in documento:
+            continue
+        valor = documento[campo]
+        if sub is True:
+            resultado[campo] = valor
+        elif isinstance(valor, dict):
+            resultado[campo] = _incluir(valor, sub)
+        elif isinstance(valor, list):
+            resultado[campo] = [_incluir(item, sub) for item in valor if isinstance(item, dict)]
+    return resultado
+
+
+def normalize_sort(chave: Any, direcao: Optional[int] = None) -> List[Tuple[str, int]]:
+    if chave is None:
+        return []
+    if isinstance(chave, str):
+        return [(chave, direcao if direcao is not None else 1)]
+    if isinstance(chave, dict):
+        return list(chave.items())
+    return [tuple(item) for item in chave]
+
+
+def sort_documents(documentos: List[dict], especificacao: List[Tuple[str, int]]) -> List[dict]:
+    def comparar(a, b):
+        for campo, direcao in especificacao:
+            resultado = compare(_sort_value(get_path(a, campo), direcao), _sort_value(get_path(b, campo), direcao))
+            if resultado:
+                return resultado * (1 if direcao >= 0 else -1)
+        return 0
+
+    return sorted(documentos, key=functools.cmp_to_key(comparar))
+
+
+def _sort_value(valor: Any, direcao: int) -> Any:
+    # Arrays ordenam pelo menor elemento (ascendente) ou pelo maior (descendente)
+    if isinstance(valor, list) and valor:
+        escolha = min if direcao >= 0 else max
+        return escolha(valor, key=functools.cmp_to_key(compare))
+    return None if valor is MISSING else valor
+
+
+# ---------------------------------------------------------------------------
+# Operadores de atualização
+# ---------------------------------------------------------------------------
+
+def _positional_index(documento: dict, caminho_array: str, filtro: dict) -> Optional[int]:
+    """Índice do primeiro elemento do array que satisfaz o filtro (operador posicional $)."""
+    array = get_path(documento, caminho_array)
+    if not isinstance(array, list):
+        return None
+    prefixo = caminho_array + "."
+    condicoes = {}
+    for chave, condicao in (filtro or {}).items():
+        if chave.startswith(prefixo):
+            condicoes[chave[len(prefixo):]] = condicao
+        elif chave == caminho_array and isinstance(condicao, dict) and "$elemMatch" in condicao:
+            condicoes.update(condicao["$elemMatch"])
+    for indice, elemento in enumerate(array):
+        if isinstance(elemento, dict) and matches(elemento, condicoes):
+            return indice
+        if not isinstance(elemento, dict) and caminho_array in filtro and _matches_condition([elemento], filtro[caminho_array]):
+            return indice
+    return None
+
+
+def _expand_paths(documento: dict, caminho: str, filtro: dict, array_filters: Optional[List[dict]]) -> List[List[Any]]:
+    """Expande $, $[] e $[identificador] em caminhos concretos."""
+    caminhos: List[List[Any]] = [[]]
+    for parte in caminho.split("."):
+        novos = []
+        for prefixo in caminhos:
+            if parte == "$":
+                indice = _positional_index(documento, ".".join(str(p) for p in prefixo), filtro)
+                if indice is None:
+                    raise OperationFailure("The positional operator did not find the match needed from the query.", code=2)
+                novos.append(prefixo + [indice])
+            elif parte.startswith("$[") and parte.endswith("]"):
+                array = _get_concrete(documento, prefixo)
+                if not isinstance(array, list):
+                    continue
+                identificador = parte[2:-1]
+                for indice, elemento in enumerate(array):
+                    if not identificador or _array_filter_matches(elemento, identificador, array_filters or []):
+                        novos.append(prefixo + [indice])
+            else:
+                novos.append(prefixo + [parte])
+        caminhos = novos
+    return caminhos
+
+
+def _array_filter_matches(elemento: Any, identificador: str, array_filters: List[dict]) -> bool:
+    for filtro in array_filters:
+        relevante = {}
+        for chave, condicao in filtro.items():
+            nome, _, resto = chave.partition(".")
+            if nome != identificador:
+                continue
+            if resto:
+                relevante[resto] = condicao
+            elif not _matches_condition([elemento], condicao):
+                return False
+        if relevante and not (isinstance(elemento, dict) and matches(elemento, relevante)):
+            return False
+    return True
+
+
+def _get_concrete(documento: Any, caminho: List[Any]) -> Any:
+    valor = documento
+    for parte in caminho:
+        if isinstance(valor, list):
+            indice = int(parte)
+            valor = valor[indice] if indice < len(valor) else MISSING
+        elif isinstance(valor, dict):
+            valor = valor.get(parte, MISSING)
+        else:
+            return MISSING
+    return valor
+
+
+def _parent(documento: dict, caminho: List[Any], criar: bool = True) -> Tuple[Any, Any]:
+    alvo: Any = documento
+    for parte in caminho[:-1]:
+        if isinstance(alvo, list):
+            alvo = alvo[int(parte)]
+        else:
+            if parte not in alvo or alvo[parte] is None:
+                if not criar:
+                    return None, None
+                alvo[parte] = {}
+            alvo = alvo[parte]
+    ultimo = caminho[-1]
+    if isinstance(alvo, list):
+        ultimo = int(ultimo)
+        if criar:
+            while len(alvo) <= ultimo:
+                alvo.append(None)
+    return alvo, ultimo
+
+
+def _current(container: Any, chave: Any) -> Any:
+    if isinstance(container, list):
+        return container[chave] if chave < len(container) else MISSING
+    return container.get(chave, MISSING)
+
+
+def apply_update(documento: dict, atualizacao: Any, filtro: Optional[dict] = None,
+                 array_filters: Optional[List[dict]] = None, inserindo: bool = False) -> dict:
+    """Aplica operadores de atualização (ou pipeline de atualização) ao documento."""
+    if isinstance(atualizacao, list):
+        return _apply_update_pipeline(documento, atualizacao)
+    if not any(str(k).startswith("$") for k in atualizacao):
+        novo = copy.deepcopy(dict(atualizacao))
+        if "_id" in documento:
+            novo["_id"] = documento["_id"]
+        return novo
+
+    for operador, campos in atualizacao.items():
+        if operador == "$setOnInsert" and not inserindo:
+            continue
+        for caminho, argumento in campos.items():
+            if operador == "$rename":
+                valor = get_path(documento, caminho)
+                if valor is not MISSING:
+                    _unset_path(documento, caminho)
+                    _set_simple_path(documento, argumento, valor)
+                continue
+            for concreto in _expand_paths(documento, caminho, filtro or {}, array_filters):
+                _apply_operator(documento, operador, concreto, argumento)
+    return documento
+
+
+def _apply_operator(documento: dict, operador: str, caminho: List[Any], argumento: Any):
+    if operador == "$unset":
+        container, chave = _parent(documento, caminho, criar=False)
+        if isinstance(container, dict):
+            container.pop(chave, None)
+        elif isinstance(container, list) and chave < len(container):
+            container[chave] = None
+        return
+
+    container, chave = _parent(documento, caminho)
+    atual = _current(container, chave)
+
+    if operador in ("$set", "$setOnInsert"):
+        container[chave] = copy.deepcopy(argumento)
+    elif operador == "$inc":
+        container[chave] = argumento if atual is MISSING or atual is None else atual + argumento
+    elif operador == "$mul":
+        container[chave] = 0 if atual is MISSING else atual * argumento
+    elif operador == "$min":
+        if atual is MISSING or compare(argumento, atual) < 0:
+            container[chave] = copy.deepcopy(argumento)
+    elif operador == "$max":
+        if atual is MISSING or compare(argumento, atual) > 0:
+            container[chave] = copy.deepcopy(argumento)
+    elif operador == "$currentDate":
+        container[chave] = datetime.datetime.utcnow()
+    elif operador in ("$push", "$addToSet"):
+        lista = [] if atual is MISSING or atual is None else atual
+        if not isinstance(lista, list):
+            raise OperationFailure(f"Cannot apply {operador} to a non-array value", code=2)
+        itens = argumento["$each"] if isinstance(argumento, dict) and "$each" in argumento else [argumento]
+        for item in itens:
+            if operador == "$push" or not any(_equal(item, existente) for existente in lista):
+                lista.append(copy.deepcopy(item))
+        if isinstance(argumento, dict) and "$slice" in argumento:
+            limite = argumento["$slice"]
+            lista[:] = lista[limite:] if limite < 0 else lista[:limite]
+        container[chave] = lista
+    elif operador == "$pull":
+        if isinstance(atual, list):
+            container[chave] = [item for item in atual if not _pull_matches(item, argumento)]
+    elif operador == "$pop":
+        if isinstance(atual, list) and atual:
+            atual.pop(0 if argumento < 0 else -1)
+    else:
+        raise OperationFailure(f"Unknown modifier: {operador}", code=9)
+
+
+def _pull_matches(item: Any, condicao: Any) -> bool:
+    if _is_operator_doc(condicao):
+        return _matches_condition([item], condicao)
+    if isinstance(condicao, dict) and isinstance(item, dict):
+        return matches(item, condicao)
+    return _equal(item, condicao)
+
+
+def _apply_update_pipeline(documento: dict, pipeline: List[dict]) -> dict:
+    resultado = documento
+    for estagio in pipeline:
+        [(nome, argumento)] = estagio.items()
+        if nome in ("$set", "$addFields"):
+            resultado = _add_fields(resultado, argumento)
+        elif nome in ("$unset", "$project"):
+            resultado = _project_stage(resultado, argumento if nome == "$project" else
+                                       {c: 0 for c in ([argumento] if isinstance(argumento, str) else argumento)})
+        elif nome in ("$replaceRoot", "$replaceWith"):
+            novo = evaluate(argumento["newRoot"] if nome == "$replaceRoot" else argumento, resultado)
+            novo.setdefault("_id", resultado.get("_id"))
+            resultado = novo
+        else:
+            raise OperationFailure(f"Estágio não suportado em pipeline de atualização: {nome}", code=72)
+    return resultado
+
+
+def _add_fields(documento: dict, campos: dict) -> dict:
+    resultado = copy.deepcopy(documento)
+    for caminho, expressao in campos.items():
+        valor = evaluate(expressao, documento)
+        if valor is MISSING:
+            _unset_path(resultado, caminho)
+        else:
+            _set_simple_path(resultado, caminho, valor)
+    return resultado
+
+
+def _project_stage(documento: dict, especificacao: dict) -> dict:
+    return project(documento, especificacao)
+
+
+# ---------------------------------------------------------------------------
+# Agregação
+# ---------------------------------------------------------------------------
+
+def _accumulate(operador: str, argumento: Any, documentos: List[dict]) -> Any:
+    if operador == "$count":
+        return len(documentos)
+    valores = [evaluate(argumento, doc) for doc in documentos]
+    if operador == "$sum":
+        total = 0
+        for valor in valores:
+            if isinstance(valor, list):
+                total += sum(_numbers(valor))
+            elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                total += valor
+        return total
+    presentes = [v for v in valores if v is not MISSING and v is not None]
+    if operador == "$avg":
+        numeros = _numbers(presentes)
+        return sum(numeros) / len(numeros) if numeros else None
+    if operador == "$min":
+        return min(presentes, key=functools.cmp_to_key(compare), default=None)
+    if operador == "$max":
+        return max(presentes, key=functools.cmp_to_key(compare), default=None)
+    if operador == "$first":
+        return valores[0] if valores and valores[0] is not MISSING else None
+    if operador == "$last":
+        return valores[-1] if valores and valores[-1] is not MISSING else None
+    if operador == "$push":
+        return [v for v in valores if v is not MISSING]
+    if operador == "$addToSet":
+        conjunto: List[Any] = []
+        for valor in presentes:
+            if not any(_equal(valor, existente) for existente in conjunto):
+                conjunto.append(valor)
+        return conjunto
+    raise OperationFailure(f"Acumulador não suportado em memória: {operador}", code=15952)
+
+
+def _group(documentos: List[dict], especificacao: dict) -> List[dict]:
+    grupos: Dict[Any, Tuple[Any, List[dict]]] = {}
+    for documento in documentos:
+        chave = evaluate(especificacao["_id"], documento)
+        chave = None if chave is MISSING else chave
+        grupos.setdefault(hash_key(chave), (chave, []))[1].append(documento)
+    resultado = []
+    for chave, membros in grupos.values():
+        saida = {"_id": chave}
+        for campo, acumulador in especificacao.items():
+            if campo == "_id":
+                continue
+            [(operador, argumento)] = acumulador.items()
+            saida[campo] = _accumulate(operador, argumento, membros)
+        resultado.append(saida)
+    return resultado
+
+
+def _unwind(documentos: List[dict], especificacao: Any) -> List[dict]:
+    if isinstance(especificacao, str):
+        especificacao = {"path": especificacao}
+    caminho = especificacao["path"][1:]
+    preservar = especificacao.get("preserveNullAndEmptyArrays", False)
+    indice_campo = especificacao.get("includeArrayIndex")
+    resultado = []
+    for documento in documentos:
+        valor = get_path(documento, caminho)
+        if isinstance(valor, list) and valor:
+            for indice, item in enumerate(valor):
+                novo = copy.deepcopy(documento)
+                _set_simple_path(novo, caminho, item)
+                if indice_campo:
+                    novo[indice_campo] = indice
+                resultado.append(novo)
+        elif isinstance(valor, list) or valor is MISSING or valor is None:
+            if preservar:
+                resultado.append(copy.deepcopy(documento))
+        else:
+            resultado.append(documento)
+    return resultado
+
+
+def run_pipeline(documentos: List[dict], pipeline: List[dict], database: "MemoryDatabase") -> List[dict]:
+    """Executa um pipeline de agregação sobre uma lista de documentos."""
+    for estagio in pipeline:
+        [(nome, argumento)] = estagio.items()
+        if nome == "$match":
+            documentos = [doc for doc in documentos if matches(doc, argumento)]
+        elif nome in ("$project", "$unset"):
+            especificacao = argumento if nome == "$project" else {
+                c: 0 for c in ([argumento] if isinstance(argumento, str) else argumento)
+            }
+            documentos = [project(doc, especificacao) for doc in documentos]
+        elif nome in ("$addFields", "$set"):
+            documentos = [_add_fields(doc, argumento) for doc in documentos]
+        elif nome == "$group":
+            documentos = _group(documentos, argumento)
+        elif nome == "$unwind":
+            documentos = _unwind(documentos, argumento)
+        elif nome == "$sort":
+            documentos = sort_documents(documentos, normalize_sort(argumento))
+        elif nome == "$skip":
+            documentos = documentos[argumento:]
+        elif nome == "$limit":
+            documentos = documentos[:argumento]
+        elif nome == "$count":
+            documentos = [{argumento: len(documentos)}] if documentos else []
+        elif nome in ("$replaceRoot", "$replaceWith"):
+            expressao = argumento["newRoot"] if nome == "$replaceRoot" else argumento
+            documentos = [evaluate(expressao, doc) for doc in documentos]
+        elif nome == "$lookup":
+            estrangeiros = database[argumento["from"]]._snapshot()
+            for documento in documentos:
+                local = get_path(documento, argumento["localField"])
+                locais = local if isinstance(local, list) else [local]
+                documento[argumento["as"]] = [
+                    copy.deepcopy(e) for e in estrangeiros
+                    if any(_matches_equal(path_values(e, argumento["foreignField"].split(".")), v) for v in locais)
+                ]
+        elif nome == "$facet":
+            documentos = [{
+                campo: run_pipeline(copy.deepcopy(documentos), sub, database) for campo, sub in argumento.items()
+            }]
+        else:
+            raise OperationFailure(f"Estágio de agregação não suportado em memória: {nome}", code=40324)
+    return documentos
+
+
+# ---------------------------------------------------------------------------
+# Índices
+# ---------------------------------------------------------------------------
+
+def _index_name(chaves: List[Tuple[str, Any]]) -> str:
+    return "_".join(f"{campo}_{direcao}" for campo, direcao in chaves)
+
+
+def _normalize_keys(chaves: Any, direcao: Any = 1) -> List[Tuple[str, Any]]:
+    if isinstance(chaves, str):
+        return [(chaves, direcao)]
+    if isinstance(chaves, dict):
+        return list(chaves.items())
+    return [tuple(item) for item in chaves]
+
+
+class _Index:
+    """Índice secundário: hash sobre o primeiro campo (multikey para arrays)."""
+
+    def __init__(self, nome: str, chaves: List[Tuple[str, Any]], unique: bool = False,
+                 sparse: bool = False, partial: Optional[dict] = None, opcoes: Optional[dict] = None):
+        self.nome = nome
+        self.chaves = chaves
+        self.unique = unique
+        self.sparse = sparse
+        self.partial = partial
+        self.opcoes = opcoes or {}
+        self.campo = chaves[0][0]
+        self.entradas: Dict[Any, set] = {}
+
+    def spec(self) -> dict:
+        spec = {"v": 2, "key": dict(self.chaves), "name": self.nome}
+        if self.unique:
+            spec["unique"] = True
+        if self.sparse:
+            spec["sparse"] = True
+        if self.partial:
+            spec["partialFilterExpression"] = self.partial
+        spec.update(self.opcoes)
+        return spec
+
+    def _aplica(self, documento: dict) -> bool:
+        if self.partial and not matches(documento, self.partial):
+            return False
+        if self.sparse and all(get_path(documento, campo) is MISSING for campo, _ in self.chaves):
+            return False
+        return True
+
+    def _chaves_documento(self, documento: dict) -> set:
+        valores = path_values(documento, self.campo.split("."))
+        chaves = set()
+        for valor in valores:
+            if isinstance(valor, list):
+                # Multikey: cada elemento e o próprio array (igualdade de array inteiro)
+                chaves.update(hash_key(item) for item in valor)
+                chaves.add(hash_key(valor))
+                if not valor:
+                    chaves.add(None)
+            else:
+                chaves.add(hash_key(valor))
+        return chaves
+
+    def _tupla(self, documento: dict) -> tuple:
+        return tuple(hash_key(get_path(documento, campo)) for campo, _ in self.chaves)
+
+    def check_unique(self, documento: dict, documentos: Dict[Any, dict], ignorar: Any = None):
+        if not self.unique or not self._aplica(documento):
+            return
+        tupla = self._tupla(documento)
+        for chave in self._chaves_documento(documento):
+            for _id in self.entradas.get(chave, ()):
+                if _id != ignorar and self._tupla(documentos[_id]) == tupla:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection index: {self.nome} dup key: {dict(zip(dict(self.chaves), tupla))}",
+                        code=11000,
+                        details={"code": 11000, "keyPattern": dict(self.chaves), "index": self.nome},
+                    )
+
+    def add(self, documento: dict):
+        if not self._aplica(documento):
+            return
+        for chave in self._chaves_documento(documento):
+            self.entradas.setdefault(chave, set()).add(documento["_id"])
+
+    def remove(self, documento: dict):
+        for chave in self._chaves_documento(documento):
+            ids = self.entradas.get(chave)
+            if ids:
+                ids.discard(documento["_id"])
+                if not ids:
+                    del self.entradas[chave]
+
+    def lookup(self, valores: List[Any]) -> set:
+        ids = set()
+        for valor in valores:
+            ids |= self.entradas.get(hash_key(valor), set())
+        return ids
+
+    def lookup_range(self, limites: List[Tuple[str, Any]]) -> set:
+        """Ids cujas chaves satisfazem todos os limites ($gt/$gte/$lt/$lte) do mesmo tipo."""
+        ids = set()
+        for chave, entrada in self.entradas.items():
+            if not isinstance(chave, type(limites[0][1])):
+                continue
+            try:
+                if all(_COMPARADORES[operador](chave, limite) for operador, limite in limites):
+                    ids |= entrada
+            except TypeError:  # datetimes com e sem fuso: o filtro completo decide
+                ids |= entrada
+        return ids
+
+
+_COMPARADORES = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+# Tipos cujas chaves de índice têm a mesma ordem do MongoDB dentro do tipo
+_TIPOS_ORDENAVEIS = (float, str, datetime.datetime, ObjectId)
+
+
+def _range_bounds(condicao: Any) -> Optional[List[Tuple[str, Any]]]:
+    """Limites de intervalo utilizáveis num índice (ou None se não houver)."""
+    if not (isinstance(condicao, dict) and condicao and _is_operator_doc(condicao)):
+        return None
+    if not set(condicao) <= set(_COMPARADORES):
+        return None
+    limites = [(operador, hash_key(valor)) for operador, valor in condicao.items()]
+    tipo = type(limites[0][1])
+    if tipo not in _TIPOS_ORDENAVEIS or any(type(limite) is not tipo for _, limite in limites):
+        return None
+    return limites
+
+
+def _equality_values(condicao: Any) -> Optional[List[Any]]:
+    """Valores de igualdade utilizáveis num índice hash (ou None se não houver)."""
+    if isinstance(condicao, dict) and _is_operator_doc(condicao):
+        if "$eq" in condicao:
+            return [condicao["$eq"]]
+        if "$in" in condicao and not any(isinstance(v, re.Pattern) for v in condicao["$in"]):
+            return list(condicao["$in"])
+        return None
+    if isinstance(condicao, (dict, re.Pattern)):
+        return None
+    return [condicao]
+
+
+# ---------------------------------------------------------------------------
+# Cursor
+# ---------------------------------------------------------------------------
+
+class MemoryCursor:
+    """Cursor preguiçoso compatível com o subconjunto usado de pymongo.cursor.Cursor."""
+
+    def __init__(self, colecao: "MemoryCollection", filtro: Optional[dict] = None, projecao: Any = None,
+                 sort: Any = None, skip: int = 0, limit: int = 0, **_ignorados):
+        self._colecao = colecao
+        self._filtro = filtro or {}
+        self._projecao = projecao
+        self._sort = normalize_sort(sort)
+        self._skip = skip
+        self._limit = limit
+        self._iterador = None
+
+    def sort(self, chave: Any, direcao: Optional[int] = None) -> "MemoryCursor":
+        self._sort = normalize_sort(chave, direcao)
+        return self
+
+    def skip(self, quantidade: int) -> "MemoryCursor":
+        self._skip = quantidade
+        return self
+
+    def limit(self, quantidade: int) -> "MemoryCursor":
+        self._limit = quantidade
+        return self
+
+    def _noop(self, *args, **kwargs) -> "MemoryCursor":
+        return self
+
+    batch_size = hint = max_time_ms = collation = comment = allow_disk_use = _noop
+
+    def _execute(self) -> List[dict]:
+        documentos, _ = self._colecao._query(self._filtro)
+        if self._sort:
+            documentos = sort_documents(documentos, self._sort)
+        if self._skip:
+            documentos = documentos[self._skip:]
+        if self._limit:
+            documentos = documentos[:abs(self._limit)]
+        return [project(copy.deepcopy(doc), self._projecao) for doc in documentos]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self._iterador is None:
+            self._iterador = iter(self._execute())
+        return next(self._iterador)
+
+    next = __next__
+
+    @property
+    def alive(self) -> bool:
+        return self._iterador is None or self._iterador.__length_hint__() > 0
+
+    def close(self):
+        self._iterador = iter(())
+
+    def clone(self) -> "MemoryCursor":
+        return MemoryCursor(self._colecao, self._filtro, self._projecao, self._sort, self._skip, self._limit)
+
+    def distinct(self, chave: str) -> List[Any]:
+        return _distinct(self._execute(), chave)
+
+    def explain(self, verbosity: str = "executionStats") -> dict:
+        """
+        Plano no formato do MongoDB: IXSCAN quando um índice atende ao filtro ou, sem isso,
+        à ordenação (varredura do índice inteiro, sem SORT); senão COLLSCAN.
+        """
+        inicio = time.perf_counter()
+        documentos, plano = self._colecao._query(self._filtro, explicar=True)
+        indice_ordenacao = None if plano["estagio"] or not self._sort else self._colecao._sort_index(self._sort)
+        if plano["estagio"]:
+            estagio = {"stage": "FETCH", "inputStage": plano["estagio"]}
+        elif indice_ordenacao:
+            nome, chaves = indice_ordenacao
+            estagio = {"stage": "FETCH", "filter": self._filtro,
+                       "inputStage": {"stage": "IXSCAN", "indexName": nome, "keyPattern": chaves}}
+        else:
+            estagio = {"stage": "COLLSCAN", "filter": self._filtro}
+        if self._sort and not indice_ordenacao:
+            estagio = {"stage": "SORT", "sortPattern": dict(self._sort), "inputStage": estagio}
+        return {
+            "queryPlanner": {"namespace": self._colecao.full_name, "winningPlan": estagio},
+            "executionStats": {
+                "nReturned": len(documentos),
+                "totalDocsExamined": plano["examinados"],
+                "totalKeysExamined": plano["examinados"] if plano["estagio"] else 0,
+                "executionTimeMillis": int((time.perf_counter() - inicio) * 1000),
+            },
+        }
+
+
+class _ListCursor:
+    """Cursor sobre resultados já calculados (agregações)."""
+
+    def __init__(self, documentos: List[dict]):
+        self._iterador = iter(documentos)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        return next(self._iterador)
+
+    next = __next__
+
+    def close(self):
+        self._iterador = iter(())
+
+
+def _distinct(documentos: Iterable[dict], chave: str) -> List[Any]:
+    resultado: List[Any] = []
+    for documento in documentos:
+        for valor in _candidates(path_values(documento, chave.split("."))):
+            if valor is MISSING or isinstance(valor, list):
+                continue
+            if not any(_equal(valor, existente) for existente in resultado):
+                resultado.append(valor)
+    return resultado
+
+
+# ---------------------------------------------------------------------------
+# Coleção e banco
+# ---------------------------------------------------------------------------
+
+class MemoryCollection:
+    """Coleção em memória com a mesma interface (subconjunto) de pymongo.collection.Collection."""
+
+    def __init__(self, database: "MemoryDatabase", nome: str):
+        self.database = database
+        self.name = nome
+        self.full_name = f"{database.name}.{nome}"
+        self._documentos: Dict[Any, dict] = {}
+        self._indices: Dict[str, _Index] = {}
+        self._posicoes: Dict[Any, int] = {}
+        self._sequencia = 0
+        self._capped: Optional[dict] = None
+        self._lock = database._lock
+
+    # -- utilitários internos ------------------------------------------------
+
+    def _snapshot(self) -> List[dict]:
+        with self._lock:
+            return list(self._documentos.values())
+
+    def _plan(self, filtro: dict) -> Optional[Tuple[List[Any], dict]]:
+        """Ids candidatos e o estágio do plano (IXSCAN ou OR) usados (igualdade ou intervalo no primeiro campo, $or com
+        todos os ramos indexáveis ou uma cláusula indexável de $and); None quando só uma
+        varredura atende ao filtro."""
+        if "_id" in filtro:
+            valores = _equality_values(filtro["_id"])
+            if valores is not None:
+                return ([v for v in valores if _hashable(v) and v in self._documentos],
+                        {"stage": "IXSCAN", "indexName": "_id_", "keyPattern": {"_id": 1}})
+            limites = _range_bounds(filtro["_id"])
+            if limites is not None:
+                tipo = type(limites[0][1])
+                return ([_id for _id in self._documentos if isinstance(_id, tipo)
+                         and all(_COMPARADORES[operador](_id, limite) for operador, limite in limites)],
+                        {"stage": "IXSCAN", "indexName": "_id_", "keyPattern": {"_id": 1}})
+        for indice in self._indices.values():
+            if indice.partial or indice.sparse or indice.campo not in filtro:
+                continue
+            valores = _equality_values(filtro[indice.campo])
+            if valores is not None:
+                ids = indice.lookup(valores)
+            else:
+                limites = _range_bounds(filtro[indice.campo])
+                if limites is None:
+                    continue
+                ids = indice.lookup_range(limites)
+            # Mantém a ordem natural (de inserção), como numa varredura
+            return (sorted(ids, key=self._posicoes.__getitem__),
+                    {"stage": "IXSCAN", "indexName": indice.nome, "keyPattern": dict(indice.chaves)})
+        ramos = filtro.get("$or")
+        if isinstance(ramos, list) and ramos:
+            planos = [self._plan(ramo) for ramo in ramos]
+            if all(plano is not None for plano in planos):
+                ids = set().union(*(plano[0] for plano in planos))
+                return (sorted(ids, key=self._posicoes.__getitem__),
+                        {"stage": "OR", "inputStages": [plano[1] for plano in planos]})
+        for clausula in filtro.get("$and") or []:
+            plano = self._plan(clausula)
+            if plano is not None:
+                return plano
+        return None
+
+    def _sort_index(self, sort: List[Tuple[str, int]]) -> Optional[Tuple[str, dict]]:
+        """Índice cujo prefixo produz a ordenação (em qualquer sentido), como (nome, chaves)."""
+        pedida = [(campo, 1 if direcao > 0 else -1) for campo, direcao in sort]
+        invertida = [(campo, -direcao) for campo, direcao in pedida]
+        candidatos = [("_id_", [("_id", 1)])] + [
+            (indice.nome, indice.chaves) for indice in self._indices.values() if not (indice.partial or indice.sparse)
+        ]
+        for nome, chaves in candidatos:
+            prefixo = [(campo, 1 if direcao > 0 else -1) for campo, direcao in chaves[:len(pedida)]]
+            if prefixo in (pedida, invertida):
+                return nome, dict(chaves)
+        return None
+
+    def _query(self, filtro: Optional[dict], explicar: bool = False):
+        """Documentos (referências internas) que satisfazem o filtro, usando índices quando possível."""
+        filtro = filtro or {}
+        with self._lock:
+            plano = self._plan(filtro)
+            if plano is None:
+                candidatos, estagio = list(self._documentos.values()), None
+            else:
+                candidatos, estagio = [self._documentos[_id] for _id in plano[0]], plano[1]
+            resultado = [doc for doc in candidatos if matches(doc, filtro)]
+        if explicar:
+            return resultado, {"estagio": estagio, "examinados": len(candidatos)}
+        return resultado, None
+
+    def _first(self, filtro: Optional[dict], sort: Any = None) -> Optional[dict]:
+        documentos, _ = self._query(filtro)
+        if sort:
+            documentos = sort_documents(documentos, normalize_sort(sort))
+        return documentos[0] if documentos else None
+
+    def _insert(self, documento: dict) -> Any:
+        if "_id" not in documento:
+            documento["_id"] = ObjectId()
+        armazenado = copy.deepcopy(documento)
+        _id = armazenado["_id"]
+        if not _hashable(_id):
+            raise OperationFailure("_id deve ser um valor escalar no motor em memória", code=2)
+        if _id in self._documentos:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: _id_",
+                                    code=11000, details={"code": 11000, "keyPattern": {"_id": 1}})
+        for indice in self._indices.values():
+            indice.check_unique(armazenado, self._documentos)
+        self._documentos[_id] = armazenado
+        self._sequencia += 1
+        self._posicoes[_id] = self._sequencia
+        for indice in self._indices.values():
+            indice.add(armazenado)
+        self.database._touch(self.name)
+        self._trim_capped()
+        return _id
+
+    def _replace_stored(self, antigo: dict, novo: dict):
+        for indice in self._indices.values():
+            indice.check_unique(novo, self._documentos, ignorar=antigo["_id"])
+        for indice in self._indices.values():
+            indice.remove(antigo)
+        self._documentos[antigo["_id"]] = novo
+        for indice in self._indices.values():
+            indice.add(novo)
+
+    def _remove(self, documento: dict):
+        for indice in self._indices.values():
+            indice.remove(documento)
+        del self._documentos[documento["_id"]]
+        del self._posicoes[documento["_id"]]
+
+    def _trim_capped(self):
+        if not self._capped or not self._capped.get("max"):
+            return
+        while len(self._documentos) > self._capped["max"]:
+            self._remove(next(iter(self._documentos.values())))
+
+    def _update(self, filtro: dict, atualizacao: Any, upsert: bool, multi: bool,
+                array_filters: Optional[List[dict]] = None) -> Tuple[int, int, Any, Optional[dict], Optional[dict]]:
+        """Retorna (encontrados, modificados, upserted_id, documento_antes, documento_depois)."""
+        with self._lock:
+            documentos, _ = self._query(filtro)
+            if not multi:
+                documentos = documentos[:1]
+            if not documentos:
+                if not upsert:
+                    return 0, 0, None, None, None
+                novo = _upsert_seed(filtro)
+                novo = apply_update(novo, atualizacao, filtro, array_filters, inserindo=True)
+                _id = self._insert(novo)
+                return 0, 0, _id, None, copy.deepcopy(self._documentos[_id])
+            modificados = 0
+            antes = depois = None
+            for documento in documentos:
+                original = copy.deepcopy(documento)
+                atualizado = apply_update(copy.deepcopy(documento), atualizacao, filtro, array_filters)
+                if atualizado.get("_id") != original["_id"]:
+                    raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'",
+                                           code=66)
+                if compare(atualizado, original) != 0:
+                    self._replace_stored(documento, atualizado)
+                    modificados += 1
+                antes, depois = original, copy.deepcopy(atualizado)
+            self.database._touch(self.name)
+            return len(documentos), modificados, None, antes, depois
+
+    # -- API de consulta -----------------------------------------------------
+
+    def find(self, filter: Optional[dict] = None, projection: Any = None, *args, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection, **kwargs)
+
+    def find_one(self, filter: Any = None, projection: Any = None, *args, **kwargs) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for documento in self.find(filter, projection, *args, **kwargs).limit(1):
+            return documento
+        return None
+
+    def count_documents(self, filter: dict, skip: int = 0, limit: int = 0, **kwargs) -> int:
+        documentos, _ = self._query(filter)
+        total = max(len(documentos) - skip, 0)
+        return min(total, limit) if limit else total
+
+    def estimated_document_count(self, **kwargs) -> int:
+        with self._lock:
+            return len(self._documentos)
+
+    def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        documentos, _ = self._query(filter)
+        return _distinct(documentos, key)
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> _ListCursor:
+        if pipeline and "$match" in pipeline[0]:
+            # Como no MongoDB, o $match inicial usa os índices da coleção
+            documentos, _ = self._query(pipeline[0]["$match"])
+            return _ListCursor(run_pipeline(copy.deepcopy(documentos), pipeline[1:], self.database))
+        documentos = copy.deepcopy(self._snapshot())
+        return _ListCursor(run_pipeline(documentos, pipeline, self.database))
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    # -- API de escrita ------------------------------------------------------
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        with self._lock:
+            return InsertOneResult(self._insert(document), acknowledged=True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        ids, erros = [], []
+        with self._lock:
+            for indice, documento in enumerate(documents):
+                try:
+                    ids.append(self._insert(documento))
+                except DuplicateKeyError as exc:
+                    erros.append({"index": indice, "code": 11000, "errmsg": str(exc), "op": documento})
+                    if ordered:
+                        break
+        if erros:
+            raise BulkWriteError({"writeErrors": erros, "nInserted": len(ids), "nUpserted": 0,
+                                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+                                  "writeConcernErrors": []})
+        return InsertManyResult(ids, acknowledged=True)
+
+    def update_one(self, filter: dict, update: Any, upsert: bool = False, array_filters: Optional[List[dict]] = None,
+                   **kwargs) -> UpdateResult:
+        encontrados, modificados, upserted, _, _ = self._update(filter, update, upsert, False, array_filters)
+        return _update_result(encontrados, modificados, upserted)
+
+    def update_many(self, filter: dict, update: Any, upsert: bool = False, array_filters: Optional[List[dict]] = None,
+                    **kwargs) -> UpdateResult:
+        encontrados, modificados, upserted, _, _ = self._update(filter, update, upsert, True, array_filters)
+        return _update_result(encontrados, modificados, upserted)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        if any(str(k).startswith("$") for k in replacement):
+            raise ValueError("replacement can not include $ operators")
+        encontrados, modificados, upserted, _, _ = self._update(filter, replacement, upsert, False)
+        return _update_result(encontrados, modificados, upserted)
+
+    def find_one_and_update(self, filter: dict, update: Any, projection: Any = None, sort: Any = None,
+                            upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                            array_filters: Optional[List[dict]] = None, **kwargs) -> Optional[dict]:
+        with self._lock:
+            if sort:
+                alvo = self._first(filter, sort)
+                if alvo is not None:
+                    filter = {"_id": alvo["_id"]}
+            _, _, _, antes, depois = self._update(filter, update, upsert, False, array_filters)
+        documento = depois if return_document == ReturnDocument.AFTER else antes
+        return project(documento, projection) if documento is not None else None
+
+    def find_one_and_replace(self, filter: dict, replacement: dict, projection: Any = None, sort: Any = None,
+                             upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, **kwargs):
+        return self.find_one_and_update(filter, replacement, projection, sort, upsert, return_document)
+
+    def find_one_and_delete(self, filter: dict, projection: Any = None, sort: Any = None, **kwargs) -> Optional[dict]:
+        with self._lock:
+            documento = self._first(filter, sort)
+            if documento is None:
+                return None
+            self._remove(documento)
+        return project(documento, projection)
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            documento = self._first(filter)
+            if documento is not None:
+                self._remove(documento)
+        return DeleteResult({"n": int(documento is not None)}, acknowledged=True)
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            documentos, _ = self._query(filter)
+            for documento in documentos:
+                self._remove(documento)
+        return DeleteResult({"n": len(documentos)}, acknowledged=True)
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        resultado = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                     "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self._lock:
+            for indice, operacao in enumerate(requests):
+                try:
+                    self._bulk_operation(operacao, indice, resultado)
+                except (DuplicateKeyError, OperationFailure) as exc:
+                    resultado["writeErrors"].append({"index": indice, "code": exc.code or 2, "errmsg": str(exc),
+                                                     "op": getattr(operacao, "_doc", None)})
+                    if ordered:
+                        break
+        if resultado["writeErrors"]:
+            raise BulkWriteError(resultado)
+        return BulkWriteResult(resultado, acknowledged=True)
+
+    def _bulk_operation(self, operacao: Any, indice: int, resultado: dict):
+        if isinstance(operacao, InsertOne):
+            self._insert(operacao._doc)
+            resultado["nInserted"] += 1
+        elif isinstance(operacao, (UpdateOne, UpdateMany, ReplaceOne)):
+            multi = isinstance(operacao, UpdateMany)
+            array_filters = getattr(operacao, "_array_filters", None)
+            encontrados, modificados, upserted, _, _ = self._update(
+                operacao._filter, operacao._doc, bool(operacao._upsert), multi, array_filters
+            )
+            resultado["nMatched"] += encontrados
+            resultado["nModified"] += modificados
+            if upserted is not None:
+                resultado["nUpserted"] += 1
+                resultado["upserted"].append({"index": indice, "_id": upserted})
+        elif isinstance(operacao, (DeleteOne, DeleteMany)):
+            documentos, _ = self._query(operacao._filter)
+            if isinstance(operacao, DeleteOne):
+                documentos = documentos[:1]
+            for documento in documentos:
+                self._remove(documento)
+            resultado["nRemoved"] += len(documentos)
+        else:
+            raise TypeError(f"Operação de bulk_write não suportada: {operacao!r}")
+
+    # -- índices e administração --------------------------------------------
+
+    def create_index(self, keys: Any, unique: bool = False, name: Optional[str] = None, sparse: bool = False,
+                     partialFilterExpression: Optional[dict] = None, background: bool = False, **kwargs) -> str:
+        chaves = _normalize_keys(keys)
+        nome = name or _index_name(chaves)
+        with self._lock:
+            existente = self._indices.get(nome)
+            if existente is not None:
+                if existente.chaves != chaves or existente.unique != unique:
+                    raise OperationFailure(f"Index with name: {nome} already exists with different options", code=85)
+                return nome
+            indice = _Index(nome, chaves, unique=unique, sparse=sparse, partial=partialFilterExpression, opcoes=kwargs)
+            for documento in self._documentos.values():
+                # As entradas só contêm os documentos já indexados, então a checagem é incremental
+                indice.check_unique(documento, self._documentos)
+                indice.add(documento)
+            self._indices[nome] = indice
+            self.database._touch(self.name)
+        return nome
+
+    def create_indexes(self, indexes: List[Any], **kwargs) -> List[str]:
+        return [self.create_index(modelo.document["key"], **{k: v for k, v in modelo.document.items() if k != "key"})
+                for modelo in indexes]
+
+    def drop_index(self, index_or_name: Any, **kwargs):
+        nome = index_or_name if isinstance(index_or_name, str) else _index_name(_normalize_keys(index_or_name))
+        with self._lock:
+            if nome not in self._indices:
+                raise OperationFailure(f"index not found with name [{nome}]", code=27)
+            del self._indices[nome]
+
+    def drop_indexes(self, **kwargs):
+        with self._lock:
+            self._indices.clear()
+
+    def index_information(self) -> Dict[str, dict]:
+        informacao = {"_id_": {"v": 2, "key": [("_id", 1)]}}
+        with self._lock:
+            for nome, indice in self._indices.items():
+                spec = indice.spec()
+                spec["key"] = list(indice.chaves)
+                spec.pop("name")
+                informacao[nome] = spec
+        return informacao
+
+    def list_indexes(self, **kwargs) -> _ListCursor:
+        with self._lock:
+            return _ListCursor([{"v": 2, "key": {"_id": 1}, "name": "_id_"}] + [i.spec() for i in self._indices.values()])
+
+    def drop(self, **kwargs):
+        self.database.drop_collection(self.name)
+
+    def with_options(self, **kwargs) -> "MemoryCollection":
+        # Preferência de leitura, read/write concern não se aplicam a um único processo
+        return self
+
+    def __getitem__(self, nome: str) -> "MemoryCollection":
+        return self.database[f"{self.name}.{nome}"]
+
+
+def _hashable(valor: Any) -> bool:
+    try:
+        hash(valor)
+        return True
+    except TypeError:
+        return False
+
+
+def _upsert_seed(filtro: dict) -> dict:
+    """Documento inicial de um upsert a partir das igualdades do filtro."""
+    documento: dict = {}
+    for chave, condicao in (filtro or {}).items():
+        if chave == "$and":
+            for sub in condicao:
+                documento.update(_upsert_seed(sub))
+        elif chave.startswith("$"):
+            continue
+        elif _is_operator_doc(condicao):
+            if "$eq" in condicao:
+                _set_simple_path(documento, chave, copy.deepcopy(condicao["$eq"]))
+        else:
+            _set_simple_path(documento, chave, copy.deepcopy(condicao))
+    return documento
+
+
+def _update_result(encontrados: int, modificados: int, upserted: Any) -> UpdateResult:
+    bruto = {"n": encontrados if upserted is None else 1, "nModified": modificados, "ok": 1.0,
+             "updatedExisting": encontrados > 0}
+    if upserted is not None:
+        bruto["upserted"] = upserted
+    return UpdateResult(bruto, acknowledged=True)
+
+
+class MemoryDatabase:
+    """Banco de dados em memória com persistência opcional em snapshot BSON."""
+
+    def __init__(self, name: str, snapshot_path: Optional[str] = None):
+        self.name = name
+        self.client = None
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._colecoes: Dict[str, MemoryCollection] = {}
+        self._existentes: set = set()
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    def __getitem__(self, nome: str) -> MemoryCollection:
+        with self._lock:
+            if nome not in self._colecoes:
+                self._colecoes[nome] = MemoryCollection(self, nome)
+            return self._colecoes[nome]
+
+    def __getattr__(self, nome: str) -> MemoryCollection:
+        if nome.startswith("_"):
+            raise AttributeError(nome)
+        return self[nome]
+
+    def get_collection(self, nome: str, **kwargs) -> MemoryCollection:
+        return self[nome]
+
+    def _touch(self, nome: str):
+        self._existentes.add(nome)
+
+    def list_collection_names(self, **kwargs) -> List[str]:
+        with self._lock:
+            return sorted(self._existentes)
+
+    def create_collection(self, nome: str, capped: bool = False, size: Optional[int] = None,
+                          max: Optional[int] = None, check_exists: bool = True, **kwargs) -> MemoryCollection:
+        with self._lock:
+            if check_exists and nome in self._existentes:
+                raise CollectionInvalid(f"collection {nome} already exists")
+            colecao = self[nome]
+            if capped:
+                colecao._capped = {"size": size, "max": max}
+            self._touch(nome)
+            return colecao
+
+    def drop_collection(self, nome: Any, **kwargs):
+        nome = getattr(nome, "name", nome)
+        with self._lock:
+            self._colecoes.pop(nome, None)
+            self._existentes.discard(nome)
+
+    def command(self, comando: Any, *args, **kwargs) -> dict:
+        nome = comando if isinstance(comando, str) else next(iter(comando))
+        if nome == "ping":
+            return {"ok": 1.0}
+        if nome == "collStats":
+            colecao = self[comando[nome]]
+            return {"ok": 1.0, "ns": colecao.full_name, "count": colecao.estimated_document_count(),
+                    "capped": bool(colecao._capped), "nindexes": len(colecao._indices) + 1}
+        raise OperationFailure(f"no such command: '{nome}'", code=59)
+
+    # -- snapshot ------------------------------------------------------------
+
+    def save_snapshot(self, caminho: Optional[str] = None):
+        """Grava todas as coleções e índices num arquivo BSON (escrita atômica via rename)."""
+        caminho = caminho or self.snapshot_path
+        if not caminho:
+            return
+        temporario = f"{caminho}.tmp"
+        inicio = time.perf_counter()
+        with self._lock:
+            registros = []
+            for nome in sorted(self._existentes):
+                colecao = self[nome]
+                registros.append(bson.encode({"colecao": nome, "capped": colecao._capped}))
+                for indice in colecao._indices.values():
+                    registros.append(bson.encode({"colecao": nome, "indice": indice.spec()}))
+                for documento in colecao._documentos.values():
+                    registros.append(bson.encode({"colecao": nome, "documento": documento}))
+        with open(temporario, "wb") as arquivo:
+            for registro in registros:
+                arquivo.write(registro)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+        logger.info(f"Snapshot em memória gravado em {caminho} ({len(registros)} registros, "
+                    f"{(time.perf_counter() - inicio) * 1000:.1f} ms)")
+
+    def load_snapshot(self, caminho: str):
+        """Carrega um snapshot gravado por save_snapshot, substituindo o conteúdo atual."""
+        with self._lock, open(caminho, "rb") as arquivo:
+            self._colecoes.clear()
+            self._existentes.clear()
+            for registro in bson.decode_file_iter(arquivo):
+                colecao = self[registro["colecao"]]
+                self._touch(colecao.name)
+                if "documento" in registro:
+                    colecao._insert(registro["documento"])
+                elif "indice" in registro:
+                    spec = dict(registro["indice"])
+                    chaves = list(spec.pop("key").items())
+                    spec.pop("v", None)
+                    colecao.create_index(chaves, **spec)
+                elif registro.get("capped"):
+                    colecao._capped = registro["capped"]
+        logger.info(f"Snapshot em memória carregado de {caminho}")
@@ -0,0 +1,256 @@
+"""
+Pipeline de logging assíncrono e estruturado.
+
+As threads da aplicação só enfileiram o registro (QueueHandler, sem I/O): o id da
+requisição e a rota são capturados nesse momento, a partir das variáveis de contexto.
+Uma thread (QueueListener) formata os registros em JSON (um por linha) e os exporta em
+lotes: as linhas acumuladas são escritas de uma vez a cada LOG_BATCH_SIZE registros ou
+LOG_FLUSH_INTERVAL_MS, e o exportador do Application Insights, quando configurado,
+também roda nessa thread, fora do caminho da requisição.
+
+Com a fila cheia (LOG_QUEUE_MAX), os registros são descartados e contados, em vez de
+bloquear a requisição. O log de acesso (logger "app.access") é amostrado por nível antes
+de entrar na fila: erros e requisições lentas sempre são registrados.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, TextIO
+
+from . import context
+
+ACCESS_LOGGER = "app.access"
+
+# Atributos padrão do LogRecord; os demais (extra=...) vão para o JSON
+_ATRIBUTOS_PADRAO = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id", "rota",
+}
+
+
+class ContextQueueHandler(QueueHandler):
+    """Enfileira o registro já com a mensagem interpolada e o contexto da requisição."""
+
+    def __init__(self, fila: queue.Queue):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = context.request_id.get()
+        record.rota = context.rota_atual.get()
+        # Interpola aqui: os argumentos podem ser objetos mutáveis da requisição
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        documento = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            documento["request_id"] = record.request_id
+        if getattr(record, "rota", None):
+            documento["rota"] = record.rota
+        atributos = vars(record)
+        for chave in atributos.keys() - _ATRIBUTOS_PADRAO:
+            documento[chave] = atributos[chave]
+        if record.exc_text:
+            documento["excecao"] = record.exc_text
+        return json.dumps(documento, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento, com o id da requisição."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return super().format(record)
+
+
+class BatchStreamHandler(logging.Handler):
+    """
+    Acumula as linhas formatadas e as escreve no stream em uma única chamada por lote.
+
+    Sem stream, escreve no sys.stdout do momento da escrita (que o host pode ter trocado,
+    como faz o pytest ao capturar a saída).
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, batch_size: int = 200):
+        super().__init__()
+        self._stream = stream
+        self.batch_size = batch_size
+        self._linhas: List[str] = []
+
+    @property
+    def stream(self) -> TextIO:
+        return self._stream if self._stream is not None else sys.stdout
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._linhas.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self._linhas) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._linhas:
+                linhas, self._linhas = self._linhas, []
+                self.stream.write("\n".join(linhas) + "\n")
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class BatchQueueListener(QueueListener):
+    """QueueListener que descarrega os lotes dos handlers quando a fila fica ociosa."""
+
+    def __init__(self, fila: queue.Queue, *handlers: logging.Handler, flush_interval_ms: int = 500):
+        super().__init__(fila, *handlers, respect_handler_level=True)
+        self.flush_interval_s = flush_interval_ms / 1000.0
+        self._proximo_flush = time.monotonic() + self.flush_interval_s
+
+    def dequeue(self, block: bool):
+        while True:
+            agora = time.monotonic()
+            if agora >= self._proximo_flush:
+                self.flush()
+            try:
+                return self.queue.get(block=block, timeout=max(self._proximo_flush - agora, 0.001))
+            except queue.Empty:
+                if not block:
+                    raise
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+        self._proximo_flush = time.monotonic() + self.flush_interval_s
+
+
+class AccessSampler(logging.Filter):
+    """Amostra o log de acesso por nível (ex.: {"INFO": 0.1}); níveis ausentes passam sempre."""
+
+    def __init__(self, taxas: Dict[str, float]):
+        super().__init__()
+        self.taxas = {logging.getLevelName(nivel.upper()): taxa for nivel, taxa in taxas.items()}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        taxa = self.taxas.get(record.levelno)
+        return taxa is None or random.random() < taxa
+
+
+class LogPipeline:
+    def __init__(self, handler: ContextQueueHandler, listener: BatchQueueListener):
+        self.handler = handler
+        self.listener = listener
+        self._parado = False
+        self._lock = threading.Lock()
+
+    def stop(self):
+        with self._lock:
+            if self._parado:
+                return
+            self._parado = True
+        self.listener.stop()
+        self.listener.flush()
+
+    def stats(self) -> dict:
+        return {"fila": self.handler.queue.qsize(), "descartados": self.handler.descartados}
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def _exportador_azure(connection_string: Optional[str]) -> Optional[logging.Handler]:
+    if not connection_string:
+        return None
+    try:  # opencensus-ext-azure é opcional
+        from opencensus.ext.azure.log_exporter import AzureLogHandler
+    except ImportError:
+        logging.getLogger(__name__).warning("opencensus-ext-azure não instalado: logs não serão enviados ao Application Insights")
+        return None
+    return AzureLogHandler(connection_string=connection_string)
+
+
+def _duplicado(handler: logging.Handler) -> bool:
+    """Handler que repetiria o pipeline: o de uma configuração anterior ou o console padrão."""
+    if isinstance(handler, ContextQueueHandler):
+        return True
+    return type(handler) is logging.StreamHandler and handler.stream in (sys.stdout, sys.stderr)
+
+
+def configure_logging(settings, stream: Optional[TextIO] = None, force: bool = False) -> LogPipeline:
+    """
+    Instala o pipeline no logger raiz (uma vez por processo, como logging.basicConfig).
+
+    Os handlers de quem hospeda a aplicação (ex.: o do host do Azure Functions, que encaminha
+    ao Application Insights, ou os do pytest) continuam no logger raiz ao lado do pipeline;
+    só saem os que duplicariam a saída dele.
+    """
+    global _pipeline
+    raiz = logging.getLogger()
+    if _pipeline is not None and not force:
+        return _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+    for handler in [h for h in raiz.handlers if _duplicado(h)]:
+        raiz.removeHandler(handler)
+
+    saida = BatchStreamHandler(stream, batch_size=settings.LOG_BATCH_SIZE)
+    saida.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+    handlers = [saida]
+    azure = _exportador_azure(settings.APPLICATIONINSIGHTS_CONNECTION_STRING)
+    if azure is not None:
+        handlers.append(azure)
+
+    fila: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_MAX)
+    handler = ContextQueueHandler(fila)
+    listener = BatchQueueListener(fila, *handlers, flush_interval_ms=settings.LOG_FLUSH_INTERVAL_MS)
+    raiz.addHandler(handler)
+    raiz.setLevel(settings.LOG_LEVEL.upper())
+
+    acesso = logging.getLogger(ACCESS_LOGGER)
+    for filtro in [f for f in acesso.filters if isinstance(f, AccessSampler)]:
+        acesso.removeFilter(filtro)
+    acesso.addFilter(AccessSampler(settings.LOG_ACCESS_SAMPLE_RATES))
+    # O log de acesso é o da aplicação (com request_id e rota); o do uvicorn seria duplicado
+    logging.getLogger("uvicorn.access").disabled = True
+    for nome in ("uvicorn", "uvicorn.error", "gunicorn.error"):
+        logging.getLogger(nome).handlers.clear()
+        logging.getLogger(nome).propagate = True
+
+    listener.start()
+    _pipeline = LogPipeline(handler, listener)
+    atexit.register(_pipeline.stop)
+    return _pipeline
+
+
+def pipeline() -> Optional[LogPipeline]:
+    return _pipeline
@@ -1,20 +1,27 @@
-from pymongo import MongoClient
+"""
+Atribui um nível de risco aleatório (1 a 5) a cada ação.
+
+Script de carga para ambientes de desenvolvimento, executado manualmente:
+    python -m app.update_risk_levels
+
+Não é agendado: sobrescreveria o risco cadastrado das ações, usado na validação das compras.
+"""
 import random
 
-def update_risk_levels():
-    client = MongoClient()
-    db = client.investimentos
-    
-    # Get all actions
-    acoes = list(db.acoes.find())
-    
-    # Update each action with a random risk level
-    for acao in acoes:
-        db.acoes.update_one(
+from .database import acoes
+
+
+def update_risk_levels() -> dict:
+    # Atualizar cada ação com um nível de risco aleatório
+    atualizadas = 0
+    for acao in acoes.find({}, {"_id": 1}):
+        acoes.update_one(
             {'_id': acao['_id']},
             {'$set': {'risco': random.randint(1, 5)}}
         )
-        print(f"Updated {acao['nome']} with risk level {random.randint(1, 5)}")
+        atualizadas += 1
+    return {"atualizadas": atualizadas}
+
 
 if __name__ == "__main__":
-    update_risk_levels()
+    print(update_risk_levels())
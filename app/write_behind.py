@@ -0,0 +1,219 @@
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Código de chave duplicada: um documento já gravado numa tentativa anterior
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindQueue:
+    """
+    Fila limitada de inserções adiadas, drenada por uma thread em segundo plano que
+    grava lotes com insert_many (por tamanho ou por tempo).
+
+    Quando a fila está cheia por mais de enqueue_timeout_ms, submit() retorna False e o
+    chamador deve gravar de forma síncrona (backpressure).
+
+    Documentos que falham são regravados até max_retries vezes, com backoff exponencial
+    (o _id é fixado no submit, então uma regravação do que já foi gravado é só uma chave
+    duplicada). Esgotadas as tentativas, ou no desligamento, vão para a coleção dead_letter
+    com o erro; reprocessar() os devolve à coleção de origem. Nada é descartado em silêncio.
+    """
+
+    def __init__(self, max_size: int = 10000, batch_size: int = 500, flush_interval_ms: int = 200,
+                 enqueue_timeout_ms: int = 50, max_retries: int = 5, retry_base_ms: int = 200,
+                 retry_max_ms: int = 5000, dead_letter: Any = None):
+        self._fila: "queue.Queue[Tuple[Any, dict]]" = queue.Queue(maxsize=max_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self._max_retries = max_retries
+        self._retry_base = retry_base_ms / 1000.0
+        self._retry_max = retry_max_ms / 1000.0
+        self._dead_letter = dead_letter
+        self._parando = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._estatisticas = {"enfileirados": 0, "gravados": 0, "lotes": 0, "sincronos": 0, "falhas": 0,
+                              "retentativas": 0, "dead_letter": 0, "perdidos": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._parando.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info("Fila de escrita adiada iniciada")
+
+    def stop(self, timeout: float = 30.0):
+        """Para a thread após gravar tudo o que estiver na fila."""
+        if not self.running:
+            return
+        self._parando.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Fila de escrita adiada não esvaziou em {timeout}s; {self._fila.qsize()} documento(s) pendente(s)")
+        else:
+            logger.info("Fila de escrita adiada esvaziada e encerrada")
+        self._thread = None
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Aguarda a gravação (ou o desvio para a dead letter) de tudo o que já foi enfileirado."""
+        prazo = time.monotonic() + timeout
+        with self._fila.all_tasks_done:
+            while self._fila.unfinished_tasks:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    return False
+                self._fila.all_tasks_done.wait(restante)
+        return True
+
+    def submit(self, colecao: Any, documento: dict) -> bool:
+        """Enfileira o documento; retorna False se a fila não está ativa ou continua cheia."""
+        if not self.running or self._parando.is_set():
+            return False
+        # O _id é definido aqui para que o chamador já possa referenciá-lo
+        documento.setdefault("_id", ObjectId())
+        try:
+            self._fila.put((colecao, documento), timeout=self._enqueue_timeout)
+        except queue.Full:
+            self._incrementar("sincronos")
+            return False
+        self._incrementar("enfileirados")
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._estatisticas, "tamanho_fila": self._fila.qsize()}
+
+    def _incrementar(self, campo: str, valor: int = 1):
+        with self._lock:
+            self._estatisticas[campo] += valor
+
+    def _run(self):
+        while True:
+            lote = self._next_batch()
+            if lote:
+                try:
+                    self._write(lote)
+                finally:
+                    for _ in lote:
+                        self._fila.task_done()
+            elif self._parando.is_set():
+                return
+
+    def _next_batch(self) -> List[Tuple[Any, dict]]:
+        if self._parando.is_set():
+            # Desligamento: esvazia sem esperar o intervalo de flush
+            lote = []
+            while len(lote) < self._batch_size:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            return lote
+        try:
+            lote = [self._fila.get(timeout=self._flush_interval)]
+        except queue.Empty:
+            return []
+        prazo = time.monotonic() + self._flush_interval
+        while len(lote) < self._batch_size:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _write(self, lote: List[Tuple[Any, dict]]):
+        por_colecao: Dict[int, Tuple[Any, List[dict]]] = {}
+        for colecao, documento in lote:
+            por_colecao.setdefault(id(colecao), (colecao, []))[1].append(documento)
+
+        for colecao, documentos in por_colecao.values():
+            pendentes, erro = self._inserir(colecao, documentos)
+            tentativas = 1
+            while pendentes and tentativas <= self._max_retries and not self._parando.is_set():
+                self._incrementar("retentativas")
+                logger.warning(f"Falha ao gravar {len(pendentes)} documento(s) adiado(s) em {colecao.name} "
+                               f"(tentativa {tentativas}): {erro}")
+                time.sleep(self._espera(tentativas))
+                pendentes, erro = self._inserir(colecao, pendentes)
+                tentativas += 1
+            if pendentes:
+                self._incrementar("falhas", len(pendentes))
+                self._desviar(colecao, pendentes, erro, tentativas)
+            self._incrementar("lotes")
+
+    def _espera(self, tentativa: int) -> float:
+        teto = min(self._retry_max, self._retry_base * (2 ** (tentativa - 1)))
+        return random.uniform(teto / 2, teto)
+
+    def _inserir(self, colecao: Any, documentos: List[dict]) -> Tuple[List[dict], Optional[str]]:
+        """Grava os documentos; retorna os que falharam (chave duplicada conta como gravado)."""
+        try:
+            colecao.insert_many(documentos, ordered=False)
+        except BulkWriteError as exc:
+            erros = [e for e in exc.details.get("writeErrors", []) if e.get("code") != DUPLICATE_KEY]
+            self._incrementar("gravados", len(documentos) - len(erros))
+            return [documentos[e["index"]] for e in erros], (erros[0].get("errmsg") if erros else None)
+        except PyMongoError as exc:
+            return documentos, str(exc)
+        self._incrementar("gravados", len(documentos))
+        return [], None
+
+    def _desviar(self, colecao: Any, documentos: List[dict], erro: Optional[str], tentativas: int):
+        """Grava os documentos que não puderam ser gravados na coleção de dead letter."""
+        ids = [str(documento["_id"]) for documento in documentos]
+        if self._dead_letter is not None:
+            try:
+                self._dead_letter.insert_many([
+                    {"colecao": colecao.name, "documento": documento, "erro": erro, "tentativas": tentativas,
+                     "data": datetime.utcnow()}
+                    for documento in documentos
+                ], ordered=False)
+                self._incrementar("dead_letter", len(documentos))
+                logger.error(f"{len(documentos)} documento(s) adiado(s) de {colecao.name} desviado(s) para "
+                             f"{self._dead_letter.name} após {tentativas} tentativa(s): {erro}")
+                return
+            except PyMongoError as exc:
+                erro = f"{erro}; dead letter: {exc}"
+        # Último recurso: os documentos completos ficam no log para recuperação manual
+        self._incrementar("perdidos", len(documentos))
+        logger.critical(f"{len(documentos)} documento(s) adiado(s) de {colecao.name} não gravado(s) ({erro}); "
+                        f"ids={ids} documentos={documentos!r}")
+
+    def reprocessar(self, colecoes: Dict[str, Any], limite: int = 1000) -> Dict[str, int]:
+        """Devolve os documentos da dead letter às coleções de origem (idempotente pelo _id)."""
+        resumo = {"reprocessados": 0, "falhas": 0}
+        if self._dead_letter is None:
+            return resumo
+        for falha in self._dead_letter.find({}).sort("data", 1).limit(limite):
+            colecao = colecoes.get(falha["colecao"])
+            if colecao is None:
+                resumo["falhas"] += 1
+                continue
+            pendentes, erro = self._inserir(colecao, [falha["documento"]])
+            if pendentes:
+                resumo["falhas"] += 1
+                self._dead_letter.update_one({"_id": falha["_id"]},
+                                             {"$set": {"erro": erro}, "$inc": {"tentativas": 1}})
+            else:
+                resumo["reprocessados"] += 1
+                self._dead_letter.delete_one({"_id": falha["_id"]})
+        return resumo
@@ -0,0 +1,105 @@
+"""
+Benchmark do custo de logging por requisição (app.structured_logging).
+
+Cada "requisição" emite alguns logs de aplicação e um log de acesso, com o id da
+requisição no contexto. Compara o logging síncrono anterior (StreamHandler no caminho da
+requisição, como o logging.basicConfig) com o pipeline de fila, medindo o tempo gasto na
+thread da requisição. O destino pode ser rápido (arquivo) ou lento (--latencia-ms por
+escrita, como um pipe congestionado ou um exportador remoto).
+
+    python -m benchmarks.logging_overhead --requisicoes 20000 --latencia-ms 0.2
+"""
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+
+from app import context
+from app.structured_logging import (
+    AccessSampler, BatchQueueListener, BatchStreamHandler, ContextQueueHandler, JsonFormatter,
+)
+
+
+class _DestinoLento:
+    """Arquivo cujas escritas demoram latencia_s (uma por chamada de write)."""
+
+    def __init__(self, arquivo, latencia_s: float):
+        self.arquivo = arquivo
+        self.latencia_s = latencia_s
+
+    def write(self, dados: str):
+        if self.latencia_s:
+            time.sleep(self.latencia_s)
+        return self.arquivo.write(dados)
+
+    def flush(self):
+        self.arquivo.flush()
+
+
+def _requisicoes(quantidade: int, logs_por_requisicao: int):
+    app = logging.getLogger("bench.app")
+    acesso = logging.getLogger("bench.access")
+    inicio = time.perf_counter()
+    for i in range(quantidade):
+        token = context.request_id.set(f"{i:032x}")
+        for j in range(logs_por_requisicao):
+            app.info("operação %d da requisição", j, extra={"usuario_id": "65f0c0ffee"})
+        acesso.info(f"GET /api/acoes/{i} 200 1.2 ms", extra={"status": 200, "duracao_ms": 1.2})
+        context.request_id.reset(token)
+    return time.perf_counter() - inicio
+
+
+def _configurar(handler: logging.Handler, amostragem: float):
+    for nome in ("bench.app", "bench.access"):
+        logger = logging.getLogger(nome)
+        logger.handlers = [handler]
+        logger.filters = []
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+    logging.getLogger("bench.access").addFilter(AccessSampler({"INFO": amostragem}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=20000)
+    parser.add_argument("--logs", type=int, default=3, help="Logs de aplicação por requisição")
+    parser.add_argument("--latencia-ms", type=float, default=0.2, help="Latência por escrita do destino lento")
+    parser.add_argument("--amostragem", type=float, default=0.1, help="Fração mantida do log de acesso (INFO)")
+    argumentos = parser.parse_args()
+
+    print(f"{argumentos.requisicoes} requisições, {argumentos.logs} logs + 1 de acesso cada")
+    print(f"{'modo':<50}{'µs/req (requisição)':>22}{'drenagem (s)':>14}")
+    with tempfile.TemporaryDirectory() as diretorio:
+        for destino_nome, latencia in (("arquivo", 0.0), (f"destino lento {argumentos.latencia_ms} ms", argumentos.latencia_ms)):
+            for modo in ("síncrono", "síncrono + amostragem", "fila + lotes + amostragem"):
+                arquivo = open(os.path.join(diretorio, f"{modo}-{latencia}.log"), "w")
+                destino = _DestinoLento(arquivo, latencia / 1000.0)
+                amostragem = 1.0 if modo == "síncrono" else argumentos.amostragem
+                listener = None
+                if modo.startswith("fila"):
+                    saida = BatchStreamHandler(destino)
+                    saida.setFormatter(JsonFormatter())
+                    fila = queue.Queue(maxsize=1_000_000)
+                    handler = ContextQueueHandler(fila)
+                    listener = BatchQueueListener(fila, saida)
+                    listener.start()
+                else:
+                    handler = logging.StreamHandler(destino)
+                    handler.setFormatter(JsonFormatter())
+                _configurar(handler, amostragem)
+
+                duracao = _requisicoes(argumentos.requisicoes, argumentos.logs)
+                inicio_drenagem = time.perf_counter()
+                if listener is not None:
+                    listener.stop()
+                    listener.flush()
+                drenagem = time.perf_counter() - inicio_drenagem
+                arquivo.close()
+                print(f"{destino_nome + ', ' + modo:<50}{duracao / argumentos.requisicoes * 1e6:>22.1f}"
+                      f"{drenagem:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
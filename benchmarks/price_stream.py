@@ -0,0 +1,123 @@
+"""
+Benchmark do fan-out do stream de preços (app.price_stream) em um único worker.
+
+Simula N conexões assinantes com transporte em memória (o custo de socket/TLS fica de
+fora; mede-se coalescência, serialização e distribuição no event loop) e compara com o
+envio ingênuo, que serializa cada atualização para cada assinante.
+
+    python -m benchmarks.price_stream --conexoes 10000 --acoes 500 --assinaturas 20 --ticks 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import resource
+
+from app.price_stream import PriceBroadcaster
+
+
+class _Transporte:
+    __slots__ = ("mensagens", "bytes")
+
+    def __init__(self):
+        self.mensagens = 0
+        self.bytes = 0
+
+    async def send(self, mensagem: str):
+        self.mensagens += 1
+        self.bytes += len(mensagem)
+
+    async def close(self, codigo: int):
+        pass
+
+
+async def _compartilhado(argumentos, assinaturas, atualizacoes_por_tick):
+    broadcaster = PriceBroadcaster(tick_ms=argumentos.tick_ms, max_subscriptions=argumentos.assinaturas)
+    transportes = []
+    for acoes in assinaturas:
+        transporte = _Transporte()
+        broadcaster.subscribe(broadcaster.connect(transporte.send, transporte.close), acoes)
+        transportes.append(transporte)
+
+    duracoes, flushes = [], []
+    for atualizacoes in atualizacoes_por_tick:
+        for acao_id, preco in atualizacoes:
+            broadcaster.publish(acao_id, {"preco": preco, "qtd": 100})
+        inicio = time.perf_counter()
+        broadcaster.flush()
+        flushes.append(time.perf_counter() - inicio)
+        # Aguarda as tarefas de envio drenarem o tick (verificação a cada 1 ms)
+        while any(a.evento.is_set() or a.envio_desde is not None for a in broadcaster._conexoes):
+            await asyncio.sleep(0.001)
+        duracoes.append(time.perf_counter() - inicio)
+    estatisticas = broadcaster.stats()
+    await broadcaster.stop()
+    return duracoes, flushes, sum(t.mensagens for t in transportes), estatisticas
+
+
+async def _ingenuo(assinaturas, atualizacoes_por_tick):
+    indice = {}
+    transportes = []
+    for acoes in assinaturas:
+        transporte = _Transporte()
+        transportes.append(transporte)
+        for acao_id in acoes:
+            indice.setdefault(acao_id, []).append(transporte)
+
+    duracoes = []
+    for atualizacoes in atualizacoes_por_tick:
+        inicio = time.perf_counter()
+        for acao_id, preco in atualizacoes:
+            for transporte in indice.get(acao_id, ()):
+                await transporte.send(json.dumps({"tipo": "preco", "acao_id": acao_id, "preco": preco, "qtd": 100}))
+        duracoes.append(time.perf_counter() - inicio)
+    return duracoes, sum(t.mensagens for t in transportes)
+
+
+def _resumo(nome, duracoes, mensagens):
+    ordenadas = sorted(duracoes)
+    p99 = ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.99))]
+    total = sum(duracoes)
+    print(f"{nome:<14} tick p50 {statistics.median(duracoes) * 1000:8.2f} ms | p99 {p99 * 1000:8.2f} ms | "
+          f"{mensagens:>9} mensagens | {mensagens / total:>12,.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conexoes", type=int, default=10000)
+    parser.add_argument("--acoes", type=int, default=500)
+    parser.add_argument("--assinaturas", type=int, default=20, help="Ações assinadas por conexão")
+    parser.add_argument("--atualizacoes", type=int, default=2000, help="Atualizações publicadas por tick")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--tick-ms", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    argumentos = parser.parse_args()
+
+    aleatorio = random.Random(argumentos.seed)
+    ids = [f"acao{i:05d}" for i in range(argumentos.acoes)]
+    # Popularidade enviesada: poucas ações concentram a maior parte das assinaturas
+    pesos = [1.0 / (i + 1) for i in range(argumentos.acoes)]
+    assinaturas = [set(aleatorio.choices(ids, pesos, k=argumentos.assinaturas)) for _ in range(argumentos.conexoes)]
+    atualizacoes_por_tick = [
+        [(aleatorio.choice(ids), round(aleatorio.uniform(1, 100), 2)) for _ in range(argumentos.atualizacoes)]
+        for _ in range(argumentos.ticks)
+    ]
+
+    print(f"{argumentos.conexoes} conexões, {argumentos.acoes} ações, {argumentos.assinaturas} assinaturas/conexão, "
+          f"{argumentos.atualizacoes} atualizações/tick, {argumentos.ticks} ticks")
+    duracoes, flushes, mensagens, estatisticas = asyncio.run(
+        _compartilhado(argumentos, assinaturas, atualizacoes_por_tick)
+    )
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    _resumo("compartilhado", duracoes, mensagens)
+    print(f"{'':<14} flush p50 {statistics.median(flushes) * 1000:.2f} ms | serializações {estatisticas['serializadas']} | "
+          f"RSS máximo do processo {pico:.0f} MiB")
+    if argumentos.conexoes * argumentos.atualizacoes <= 50_000_000:
+        duracoes, mensagens = asyncio.run(_ingenuo(assinaturas, atualizacoes_por_tick[:5]))
+        _resumo("ingênuo (5)", duracoes, mensagens)
+
+
+if __name__ == "__main__":
+    main()
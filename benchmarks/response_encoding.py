@@ -0,0 +1,86 @@
+"""
+Benchmark da codificação da resposta de listar_carteiras em JSON, msgpack e CBOR
+(app.content_negotiation).
+
+Gera carteiras sintéticas no formato de GET /api/carteiras, serializa uma vez pelo
+response_model (como o FastAPI faz antes de codificar, igual para todos os formatos) e mede,
+por formato, o tempo de codificação pela NegotiatedResponse, o de decodificação no cliente
+(o bot) e o tamanho do corpo. CBOR só entra com cbor2 instalado.
+
+    python -m benchmarks.response_encoding --carteiras 5000 --posicoes 8
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, List, Tuple
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from app import context
+from app.content_negotiation import NegotiatedResponse, decodificar, disponiveis
+from app.schemas import CarteiraComUsuario
+
+
+def _carteiras(quantidade: int, posicoes: int) -> List[dict]:
+    acoes = [str(ObjectId()) for _ in range(200)]
+    return [
+        {
+            "_id": str(ObjectId()),
+            "usuario_id": str(ObjectId()),
+            "usuario_nome": f"Bot {i}",
+            "usuario_email": f"bot{i}@example.com",
+            "acoes": [{"acao_id": acao_id, "qtd": random.randint(1, 1000)}
+                      for acao_id in random.sample(acoes, posicoes)],
+            "saldo": round(random.uniform(0, 100000), 2),
+            "qtd_max_acoes": 100,
+            "qtd_max_valor": 100000.0,
+            "nivel_risco": random.randint(1, 5),
+        }
+        for i in range(quantidade)
+    ]
+
+
+def _medir(funcao, repeticoes: int) -> Tuple[float, Any]:
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resultado = funcao()
+    return (time.perf_counter() - inicio) / repeticoes, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carteiras", type=int, default=5000)
+    parser.add_argument("--posicoes", type=int, default=8, help="Posições por carteira")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    argumentos = parser.parse_args()
+
+    adaptador = TypeAdapter(List[CarteiraComUsuario])
+    carteiras = adaptador.validate_python(_carteiras(argumentos.carteiras, argumentos.posicoes))
+    serializacao, conteudo = _medir(lambda: adaptador.dump_python(carteiras, mode="json", by_alias=True),
+                                    argumentos.repeticoes)
+
+    print(f"{argumentos.carteiras} carteiras, {argumentos.posicoes} posições cada")
+    print(f"serialização pelo response_model (todos os formatos): {serializacao * 1000:.1f} ms")
+    print(f"{'formato':<10}{'codificação (ms)':>18}{'decodificação (ms)':>20}{'bytes':>12}{'vs JSON':>10}")
+    base = None
+    for formato in disponiveis():
+        token = context.formato_resposta.set(formato)
+        try:
+            codificacao, resposta = _medir(lambda: NegotiatedResponse(conteudo), argumentos.repeticoes)
+        finally:
+            context.formato_resposta.reset(token)
+        corpo = resposta.body
+        if formato == "json":
+            decodificacao, decodificado = _medir(lambda: json.loads(corpo), argumentos.repeticoes)
+        else:
+            decodificacao, decodificado = _medir(lambda: decodificar(corpo, formato), argumentos.repeticoes)
+        assert decodificado == conteudo
+        base = base or len(corpo)
+        print(f"{formato:<10}{codificacao * 1000:>18.1f}{decodificacao * 1000:>20.1f}{len(corpo):>12}"
+              f"{len(corpo) / base:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark da coalescência de leituras (app.singleflight) sob carga concorrente.
+
+Simula o pool de threads das rotas síncronas fazendo find_one por _id em poucas ações
+"quentes" (distribuição de Zipf). A coleção é a do motor em memória com uma latência
+artificial por consulta, no lugar da ida e volta ao Mongo/Cosmos; mede-se quantas
+consultas chegam ao banco e a vazão, sem coalescência, com coalescência e com micro-cache.
+
+    python -m benchmarks.singleflight --threads 40 --leituras 20000 --latencia-ms 2
+"""
+import argparse
+import random
+import threading
+import time
+
+from app.singleflight import CoalescingCollection
+from app.storage import MemoryDatabase
+
+
+class _ComLatencia:
+    """Envolve a coleção contando as consultas e simulando a latência de rede."""
+
+    def __init__(self, colecao, latencia_s: float):
+        self.colecao = colecao
+        self.latencia_s = latencia_s
+        self.consultas = 0
+        self._lock = threading.Lock()
+
+    def find_one(self, *args, **kwargs):
+        with self._lock:
+            self.consultas += 1
+        time.sleep(self.latencia_s)
+        return self.colecao.find_one(*args, **kwargs)
+
+
+def _executar(colecao, ids, argumentos) -> float:
+    por_thread = argumentos.leituras // argumentos.threads
+    barreira = threading.Barrier(argumentos.threads + 1)
+
+    def trabalhar(semente):
+        gerador = random.Random(semente)
+        pesos = [1 / (i + 1) ** argumentos.zipf for i in range(len(ids))]
+        sorteados = gerador.choices(ids, weights=pesos, k=por_thread)
+        barreira.wait()
+        for acao_id in sorteados:
+            colecao.find_one({"_id": acao_id})
+
+    threads = [threading.Thread(target=trabalhar, args=(i,)) for i in range(argumentos.threads)]
+    for thread in threads:
+        thread.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=40, help="Threads concorrentes (pool do AnyIO: 40)")
+    parser.add_argument("--leituras", type=int, default=20000)
+    parser.add_argument("--acoes", type=int, default=200)
+    parser.add_argument("--zipf", type=float, default=1.2, help="Expoente da popularidade das ações")
+    parser.add_argument("--latencia-ms", type=float, default=2.0)
+    parser.add_argument("--cache-ms", type=int, default=50)
+    argumentos = parser.parse_args()
+
+    colecao = MemoryDatabase("benchmark")["acoes"]
+    ids = colecao.insert_many([
+        {"nome": f"ACAO{i}", "preco": 10.0 + i, "qtd": 1000, "risco": 1} for i in range(argumentos.acoes)
+    ]).inserted_ids
+
+    leituras = argumentos.leituras // argumentos.threads * argumentos.threads
+    print(f"{leituras} leituras, {argumentos.threads} threads, {argumentos.acoes} ações, "
+          f"latência {argumentos.latencia_ms} ms")
+    print(f"{'modo':<22}{'consultas':>10}{'redução':>10}{'leituras/s':>12}")
+    for nome, envolver in (
+        ("sem coalescência", lambda c: c),
+        ("single-flight", lambda c: CoalescingCollection(c)),
+        (f"+ cache {argumentos.cache_ms} ms", lambda c: CoalescingCollection(c, cache_ms=argumentos.cache_ms)),
+    ):
+        banco = _ComLatencia(colecao, argumentos.latencia_ms / 1000.0)
+        duracao = _executar(envolver(banco), ids, argumentos)
+        print(f"{nome:<22}{banco.consultas:>10}{1 - banco.consultas / leituras:>10.1%}{leituras / duracao:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,9 @@
 import azure.functions as func
-import logging
 from app.main import app
-from opencensus.ext.azure.log_exporter import AzureLogHandler
 
-# Configuração do Application Insights
-logger = logging.getLogger(__name__)
-logger.addHandler(AzureLogHandler())
+# Os logs vão ao Application Insights pelo pipeline assíncrono da aplicação
+# (app/structured_logging.py), configurado por APPLICATIONINSIGHTS_CONNECTION_STRING:
+# o exportador roda na thread do pipeline, fora do caminho da requisição.
 
 def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
     """
@@ -1,11 +1,5 @@
 import multiprocessing
 import os
-import sys
-
-# Debug: Print current directory and Python path
-print(f"Current directory: {os.getcwd()}")
-print(f"PYTHONPATH: {os.environ.get('PYTHONPATH', '')}")
-print(f"sys.path: {sys.path}")
 
 # Server socket
 bind = "0.0.0.0:8000"
@@ -18,11 +12,11 @@ worker_connections = 1000
 timeout = 600
 keepalive = 2
 
-# Logging
-accesslog = "-"
+# Logging: a aplicação registra o acesso (JSON, amostrado, com request_id) pelo próprio
+# pipeline assíncrono (app/structured_logging.py); o gunicorn só registra seus erros
+accesslog = None
 errorlog = "-"
-loglevel = "debug"
-capture_output = True
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
 
 # Process naming
 proc_name = "investimentos_api"
@@ -35,27 +29,18 @@ pythonpath = "/home/site/wwwroot"
 reload = False  # Desabilitado em produção
 reload_extra_files = []
 
-# Debug hooks
+
 def on_starting(server):
-    print("Starting Gunicorn server...")
-    print(f"Current directory: {os.getcwd()}")
-    print(f"Directory contents: {os.listdir()}")
-    print(f"App directory contents: {os.listdir('app') if os.path.exists('app') else 'app dir not found'}")
-    print(f"PYTHONPATH: {os.environ.get('PYTHONPATH', '')}")
-    print(f"sys.path: {sys.path}")
+    server.log.info(f"Iniciando o gunicorn em {os.getcwd()} com {workers} workers")
+
 
 def post_worker_init(worker):
-    print(f"Initializing worker {worker.pid}")
-    try:
-        from app.main import app
-        print("Successfully imported app.main")
-    except Exception as e:
-        print(f"Error importing app.main: {e}")
-        sys.exit(1)
+    worker.log.info(f"Worker {worker.pid} inicializado")
+
 
 def worker_abort(worker):
-    print(f"Worker {worker.pid} aborted")
-    print(f"Last error: {getattr(worker, 'last_error', None)}")
+    worker.log.warning(f"Worker {worker.pid} abortado (timeout)")
+
 
 # WSGI app
 wsgi_app = "app.main:app"
@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# Os testes usam o motor de armazenamento em memória, dispensando um servidor MongoDB
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+
+# Os testes registram muitos usuários a partir do mesmo cliente; o limite de taxa é
+# testado isoladamente em test_rate_limit.py
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+# Tabela de preços compartilhada própria de cada execução da suíte
+os.environ.setdefault("PRICE_TABLE_PATH", os.path.join(tempfile.mkdtemp(), "precos"))
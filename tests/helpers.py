@@ -0,0 +1,18 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def registrar(tipo_usuario="comum"):
+    """Registra um usuário novo e retorna os headers de autenticação."""
+    email = f"{uuid.uuid4().hex}@example.com"
+    resposta = client.post("/api/usuarios/registrar", json={
+        "email": email, "nome": "Teste", "senha": "senha", "tipo_usuario": tipo_usuario,
+    })
+    assert resposta.status_code == 200
+    token = client.post("/api/usuarios/login", json={"email": email, "senha": "senha"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import jobs
+from app.archive import MonthlyArchive
+from app.database import arquivo_transacoes, database, notificacoes, transacoes
+from app.storage import MemoryDatabase
+
+from tests.helpers import client, registrar
+
+
+def _id_em(data: datetime) -> ObjectId:
+    # ObjectId com o horário de criação da data (o restante é único)
+    return ObjectId(ObjectId.from_datetime(data).binary[:4] + ObjectId().binary[4:])
+
+
+def _usuario_id(cabecalhos) -> ObjectId:
+    return ObjectId(client.get("/api/carteira", headers=cabecalhos).json()["usuario_id"])
+
+
+def test_job_move_transacoes_antigas_e_leitura_passa_pelo_arquivo():
+    cabecalhos = registrar()
+    usuario_id = _usuario_id(cabecalhos)
+    agora = datetime.utcnow()
+    datas = [agora - timedelta(days=dias) for dias in (1, 400, 430, 800)]
+    transacoes.insert_many([
+        {"_id": _id_em(data), "usuario_id": usuario_id, "tipo": "deposito", "valor": float(i), "data": data}
+        for i, data in enumerate(datas)
+    ])
+
+    resultado = client.post("/api/admin/jobs/arquivamento/executar", headers=registrar("admin")).json()
+    assert resultado["status"] == "sucesso" and resultado["resultado"]["transacoes"] >= 3
+    assert [t["valor"] for t in transacoes.find({"usuario_id": usuario_id})] == [0.0]
+    meses = {data.strftime("%Y_%m") for data in datas[1:]}
+    for mes in meses:
+        assert f"transacoes_arquivo_{mes}" in database.list_collection_names()
+    assert arquivo_transacoes.estado()["fronteira"] < agora
+
+    extrato = client.get("/api/carteira/transacoes", headers=cabecalhos).json()
+    assert [t["valor"] for t in extrato] == [0.0, 1.0, 2.0, 3.0] and extrato[0]["acao_id"] is None
+    assert [t["valor"] for t in client.get("/api/carteira/transacoes", params={"limite": 2},
+                                           headers=cabecalhos).json()] == [0.0, 1.0]
+    periodo = {"inicio": (datas[2] - timedelta(days=1)).isoformat(), "fim": (datas[1] + timedelta(days=1)).isoformat()}
+    assert [t["valor"] for t in client.get("/api/carteira/transacoes", params=periodo,
+                                           headers=cabecalhos).json()] == [1.0, 2.0]
+    recente = {"inicio": (agora - timedelta(days=2)).isoformat()}
+    assert [t["valor"] for t in client.get("/api/carteira/transacoes", params=recente,
+                                           headers=cabecalhos).json()] == [0.0]
+
+
+def test_arquivamento_interrompido_e_retomado_sem_duplicar():
+    banco = MemoryDatabase("arquivamento")
+    origem = banco["eventos"]
+    arquivo = MonthlyArchive(origem, "eventos", banco.__getitem__, banco.create_collection, banco["arquivos"],
+                             idade_dias=30)
+    antiga = datetime(2020, 3, 15)
+    documentos = [{"_id": _id_em(antiga + timedelta(minutes=i)), "usuario": "a", "data": antiga + timedelta(minutes=i)}
+                  for i in range(5)]
+    origem.insert_many(documentos)
+    # Execução anterior que gravou parte do arquivo e caiu antes de remover da origem
+    banco.create_collection("eventos_arquivo_2020_03")
+    banco["eventos_arquivo_2020_03"].insert_many(documentos[:2])
+
+    assert arquivo.arquivar(tamanho_lote=2) == {"movidos": 5, "meses": {"2020-03": 5}}
+    assert origem.count_documents({}) == 0
+    assert banco["eventos_arquivo_2020_03"].count_documents({}) == 5
+    assert len(arquivo.consultar({"usuario": "a"})) == 5
+    assert arquivo.consultar({"usuario": "a"}, inicio=datetime(2020, 4, 1)) == []
+    assert arquivo.arquivar() == {"movidos": 0, "meses": {}}
+
+
+def test_notificacoes_do_usuario_e_gerais_para_admin():
+    cabecalhos, admin = registrar(), registrar("admin")
+    usuario_id = str(_usuario_id(cabecalhos))
+    notificacoes.insert_many([
+        {"tipo": "teste", "usuario_id": usuario_id, "mensagem": "sua", "data": datetime.utcnow(), "lida": False},
+        {"tipo": "teste", "usuario_id": None, "mensagem": "geral", "data": datetime.utcnow(), "lida": False},
+    ])
+    jobs.arquivar()
+    assert [n["mensagem"] for n in client.get("/api/notificacoes", headers=cabecalhos).json()] == ["sua"]
+    mensagens = [n["mensagem"] for n in client.get("/api/notificacoes", headers=admin).json()]
+    assert "geral" in mensagens and "sua" not in mensagens
+
+
+def test_consulta_le_do_arquivo_so_o_que_falta():
+    banco = MemoryDatabase("arquivo_limite")
+    origem = banco["eventos"]
+    abertas = []
+
+    def abrir(nome):
+        abertas.append(nome)
+        return banco[nome]
+
+    arquivo = MonthlyArchive(origem, "eventos", abrir, banco.create_collection, banco["arquivos"], idade_dias=30)
+    datas = [datetime(2020, mes, dia) for mes in (3, 4) for dia in (5, 10, 15)]
+    origem.insert_many([{"_id": _id_em(data), "usuario": "a", "data": data} for data in datas])
+    arquivo.arquivar(agora=datetime(2020, 6, 1))
+    recentes = [datetime.utcnow() - timedelta(days=dias) for dias in (1, 2, 3)]
+    origem.insert_many([{"_id": _id_em(data), "usuario": "a", "data": data} for data in recentes])
+
+    # A coleção quente preenche o limite: nenhum arquivo é lido
+    abertas.clear()
+    assert [d["data"] for d in arquivo.consultar({"usuario": "a"}, limite=3)] == recentes
+    assert abertas == []
+
+    # Faltam dois: só o mês mais recente é lido
+    assert [d["data"] for d in arquivo.consultar({"usuario": "a"}, limite=5)] == recentes + [datas[5], datas[4]]
+    assert abertas == ["eventos_arquivo_2020_04"]
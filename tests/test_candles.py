@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from app import candles
+
+from tests.helpers import client, registrar
+
+
+def test_reamostrar():
+    inicios = np.array([0, 60, 120, 300, 360], dtype=np.int64)
+    barras = candles.reamostrar(
+        inicios,
+        o=np.array([1.0, 2.0, 3.0, 4.0, 5.0]),
+        h=np.array([1.5, 2.5, 3.5, 4.5, 9.0]),
+        l=np.array([0.5, 1.5, 2.5, 3.5, 4.5]),
+        c=np.array([1.2, 2.2, 3.2, 4.2, 5.2]),
+        n=np.array([1, 1, 2, 1, 1]),
+        segundos=300,
+    )
+    assert barras["inicio"].tolist() == [0, 300]
+    assert barras["o"].tolist() == [1.0, 4.0]
+    assert barras["h"].tolist() == [3.5, 9.0]
+    assert barras["l"].tolist() == [0.5, 3.5]
+    assert barras["c"].tolist() == [3.2, 5.2]
+    assert barras["n"].tolist() == [4, 2]
+
+
+def test_candles_a_partir_dos_ticks():
+    acao_id = ObjectId()
+    for minuto, preco in [(0, 10.0), (0, 12.0), (1, 9.0), (7, 11.0)]:
+        candles.registrar_tick(acao_id, preco, datetime(2024, 1, 2, 10, minuto, 30))
+
+    [diario] = candles.obter_candles(acao_id, "1d", inicio=datetime(2024, 1, 1), fim=datetime(2024, 1, 3))
+    assert (diario["abertura"], diario["maxima"], diario["minima"], diario["fechamento"]) == (10.0, 12.0, 9.0, 11.0)
+
+    barras = candles.obter_candles(acao_id, "5m", inicio=datetime(2024, 1, 2, 10), fim=datetime(2024, 1, 2, 11))
+    assert [(b["inicio"].minute, b["fechamento"], b["ticks"]) for b in barras] == [(0, 9.0, 3), (5, 11.0, 1)]
+
+
+def test_intervalo_invalido():
+    with pytest.raises(candles.IntervaloInvalido):
+        candles.parse_intervalo("10s")
+
+
+def test_semana_comeca_na_segunda():
+    acao_id = ObjectId()
+    # Domingo 7/1/2024 e segunda 8/1/2024: semanas diferentes
+    for data, preco in [(datetime(2024, 1, 4, 12), 5.0), (datetime(2024, 1, 7, 23), 6.0),
+                        (datetime(2024, 1, 8, 1), 7.0), (datetime(2024, 1, 14, 22), 8.0)]:
+        candles.registrar_tick(acao_id, preco, data)
+
+    barras = candles.obter_candles(acao_id, "1w", inicio=datetime(2024, 1, 1), fim=datetime(2024, 1, 15))
+    assert [(b["inicio"], b["abertura"], b["fechamento"], b["ticks"]) for b in barras] == [
+        (datetime(2024, 1, 1), 5.0, 6.0, 2),
+        (datetime(2024, 1, 8), 7.0, 8.0, 2),
+    ]
+    assert candles._inicio_bucket(datetime(2024, 1, 7, 23, 59), 7 * 86400) == datetime(2024, 1, 1)
+    assert candles._inicio_bucket(datetime(2024, 1, 8), 14 * 86400).weekday() == 0
+
+
+def test_rota_aceita_datas_com_fuso():
+    admin = registrar("admin")
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "FUSO3", "preco": 10.0, "qtd": 10, "risco": 1},
+                       headers=admin).json()
+    candles.registrar_tick(acao["_id"], 10.0, datetime(2024, 1, 2, 10, 0))
+    candles.registrar_tick(acao["_id"], 11.0, datetime(2024, 1, 2, 13, 0))
+
+    url = f"/api/acoes/{acao['_id']}/candles"
+    [diario] = client.get(url, params={"intervalo": "1d", "inicio": "2024-01-01T00:00:00Z",
+                                       "fim": "2024-01-03T00:00:00Z"}, headers=admin).json()
+    assert (diario["abertura"], diario["fechamento"]) == (10.0, 11.0)
+    # 12:00-03:00 é 15:00 UTC: só o tick das 10:00 fica de fora
+    [hora] = client.get(url, params={"intervalo": "1h", "inicio": "2024-01-02T09:30:00-03:00",
+                                     "fim": "2024-01-02T12:00:00-03:00"}, headers=admin).json()
+    assert hora["abertura"] == 11.0
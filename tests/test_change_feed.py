@@ -0,0 +1,151 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.change_feed import ChangeFeed, SequenceAllocator, SequencedCollection
+from app.storage import MemoryDatabase
+from tests.helpers import client, registrar
+
+
+def _feed(db, **kwargs):
+    sequencia = SequenceAllocator()
+    acoes = SequencedCollection(db.acoes, "acoes", sequencia, db.sync_remocoes)
+    carteiras = SequencedCollection(db.carteiras, "carteiras", sequencia, db.sync_remocoes)
+    feed = ChangeFeed({"acoes": acoes, "carteiras": carteiras}, db.sync_remocoes, settle_ms=0, **kwargs)
+    return feed, acoes, carteiras
+
+
+def _ids(resposta):
+    return [(a["colecao"], a["operacao"], a["id"]) for a in resposta["alteracoes"]]
+
+
+def test_sequencia_paginacao_e_remocoes():
+    feed, acoes, carteiras = _feed(MemoryDatabase("feed"))
+    ids = acoes.insert_many([{"nome": f"A{i}", "preco": 1.0} for i in range(3)]).inserted_ids
+    dono = ObjectId()
+    carteira_id = carteiras.insert_one({"usuario_id": dono, "acoes": []}).inserted_id
+    carteiras.insert_one({"usuario_id": ObjectId(), "acoes": []})
+
+    primeira = feed.changes(limite=2)
+    assert primeira["modo"] == "sequencia" and primeira["mais"]
+    segunda = feed.changes(primeira["token"], limite=10)
+    assert len(primeira["alteracoes"]) + len(segunda["alteracoes"]) == 5 and not segunda["mais"]
+    assert feed.changes(segunda["token"])["alteracoes"] == []
+
+    acoes.update_one({"_id": ids[1]}, {"$set": {"preco": 2.0}})
+    acoes.bulk_write([UpdateOne({"_id": ids[2]}, {"$set": {"preco": 3.0}})])
+    acoes.delete_one({"_id": ids[0]})
+    delta = feed.changes(segunda["token"])
+    assert _ids(delta) == [("acoes", "upsert", str(ids[1])), ("acoes", "upsert", str(ids[2])),
+                           ("acoes", "delete", str(ids[0]))]
+    assert delta["alteracoes"][0]["documento"]["preco"] == 2.0
+
+    # Filtro por coleção: apenas a carteira do próprio usuário
+    restrito = feed.changes(filtros={"carteiras": {"usuario_id": dono}})
+    assert [a["id"] for a in restrito["alteracoes"] if a["colecao"] == "carteiras"] == [str(carteira_id)]
+
+    # A remoção da carteira de outro usuário não aparece após o token do usuário restrito
+    alheia = carteiras.insert_one({"usuario_id": ObjectId(), "acoes": []}).inserted_id
+    carteiras.delete_one({"_id": alheia})
+    carteiras.delete_one({"_id": carteira_id})
+    apos = feed.changes(restrito["token"], filtros={"carteiras": {"usuario_id": dono}})
+    assert _ids(apos) == [("carteiras", "delete", str(carteira_id))]
+
+
+def test_remocoes_de_carteiras_so_para_o_dono():
+    feed, _, carteiras = _feed(MemoryDatabase("feed_usuarios"))
+    ana, bia = ObjectId(), ObjectId()
+    carteira_ana = carteiras.insert_one({"usuario_id": ana, "acoes": []}).inserted_id
+    carteira_bia = carteiras.insert_one({"usuario_id": bia, "acoes": []}).inserted_id
+    tokens = {dono: feed.changes(filtros={"carteiras": {"usuario_id": dono}})["token"] for dono in (ana, bia)}
+
+    carteiras.delete_one({"_id": carteira_ana})
+    carteiras.delete_one({"_id": carteira_bia})
+    for dono, carteira_id in ((ana, carteira_ana), (bia, carteira_bia)):
+        delta = feed.changes(tokens[dono], filtros={"carteiras": {"usuario_id": dono}})
+        assert _ids(delta) == [("carteiras", "delete", str(carteira_id))]
+
+
+def test_sequencia_crescente_sem_contador():
+    relogio = iter([100.0, 100.0, 99.0, 101.0])
+    sequencia = SequenceAllocator(lambda: next(relogio))
+    valores = [sequencia.next(), sequencia.next(3), sequencia.next(), sequencia.next()]
+    assert valores[0] < valores[1] and valores[1] + 3 == valores[2] < valores[3]
+
+
+class _Stream:
+    def __init__(self, eventos, inicio):
+        self._eventos = eventos
+        self._posicao = inicio
+        self.resume_token = {"_data": str(inicio)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def try_next(self):
+        if self._posicao >= len(self._eventos):
+            return None
+        evento = self._eventos[self._posicao]
+        self._posicao += 1
+        self.resume_token = {"_data": str(self._posicao)}
+        return evento
+
+
+class _ColecaoComStream(SequencedCollection):
+    eventos: list = []
+
+    def watch(self, pipeline=None, resume_after=None, **kwargs):
+        return _Stream(self.eventos, int(resume_after["_data"]) if resume_after else len(self.eventos))
+
+
+def test_change_streams_apos_carga_inicial():
+    db = MemoryDatabase("feed_cs")
+    sequencia = SequenceAllocator()
+    acoes = _ColecaoComStream(db.acoes, "acoes", sequencia, db.sync_remocoes)
+    feed = ChangeFeed({"acoes": acoes}, db.sync_remocoes, settle_ms=0)
+    acao_id = acoes.insert_one({"nome": "A", "preco": 1.0}).inserted_id
+
+    carga = feed.changes()
+    assert carga["modo"] == "change_stream" and len(carga["alteracoes"]) == 1
+
+    acoes.eventos.extend([
+        {"operationType": "update", "documentKey": {"_id": acao_id}, "fullDocument": {"_id": acao_id, "preco": 5.0}},
+        {"operationType": "delete", "documentKey": {"_id": acao_id}},
+    ])
+    delta = feed.changes(carga["token"])
+    assert _ids(delta) == [("acoes", "upsert", str(acao_id)), ("acoes", "delete", str(acao_id))]
+    assert feed.changes(delta["token"])["alteracoes"] == []
+
+
+def test_change_streams_remocoes_filtradas_pelo_dono():
+    db = MemoryDatabase("feed_cs_usuarios")
+    sequencia = SequenceAllocator()
+    carteiras = _ColecaoComStream(db.carteiras, "carteiras", sequencia, db.sync_remocoes)
+    carteiras.eventos = []
+    feed = ChangeFeed({"carteiras": carteiras}, db.sync_remocoes, settle_ms=0)
+    dono = ObjectId()
+    filtros = {"carteiras": {"usuario_id": dono}}
+    propria = carteiras.insert_one({"usuario_id": dono, "acoes": []}).inserted_id
+    alheia = carteiras.insert_one({"usuario_id": ObjectId(), "acoes": []}).inserted_id
+    carga = feed.changes(filtros=filtros)
+
+    # A remoção ainda sem tombstone fica retida até ele ser gravado
+    carteiras.eventos.extend([{"operationType": "delete", "documentKey": {"_id": doc_id}}
+                              for doc_id in (alheia, propria)])
+    retida = feed.changes(carga["token"], filtros=filtros)
+    assert retida["alteracoes"] == []
+
+    carteiras.delete_many({})
+    delta = feed.changes(retida["token"], filtros=filtros)
+    assert _ids(delta) == [("carteiras", "delete", str(propria))]
+
+
+def test_endpoint_sync():
+    usuario = registrar()
+    resposta = client.get("/api/sync/changes?limite=5000", headers=usuario).json()
+    assert resposta["modo"] == "sequencia"
+    carteiras = [a for a in resposta["alteracoes"] if a["colecao"] == "carteiras"]
+    assert len(carteiras) <= 1
+    assert client.get("/api/sync/changes?since=xyz", headers=usuario).status_code == 400
@@ -0,0 +1,60 @@
+import msgpack
+import pytest
+
+from app import content_negotiation
+from app.content_negotiation import escolher_formato
+
+from tests.helpers import client, registrar
+
+MSGPACK = {"Accept": "application/msgpack"}
+
+
+def test_escolha_do_formato_pelo_accept():
+    assert escolher_formato(None) == escolher_formato("*/*") == "json"
+    assert escolher_formato("application/x-msgpack") == "msgpack"
+    assert escolher_formato("application/json, application/msgpack") == "json"  # Empate: ordem do cabeçalho
+    assert escolher_formato("application/json;q=0.5, application/vnd.msgpack") == "msgpack"
+    assert escolher_formato("application/msgpack;q=0.1, */*;q=0.8") == "json"
+    assert escolher_formato("text/html") == "json"
+    if content_negotiation.cbor2 is None:
+        assert escolher_formato("application/cbor, application/msgpack;q=0.5") == "msgpack"
+
+
+def test_respostas_e_corpos_em_msgpack():
+    admin, usuario = registrar("admin"), registrar()
+    corpo = msgpack.packb({"nome": "Binaria", "preco": 2.5, "qtd": 100, "risco": 1})
+    resposta = client.post("/api/acoes/cadastrar", content=corpo,
+                           headers={**admin, **MSGPACK, "Content-Type": "application/msgpack"})
+    assert resposta.status_code == 200
+    assert resposta.headers["content-type"] == "application/x-msgpack" and "Accept" in resposta.headers["vary"]
+    acao = msgpack.unpackb(resposta.content)
+    assert (acao["nome"], acao["preco"]) == ("Binaria", 2.5)
+
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    resposta = client.post("/api/carteira/comprar", content=msgpack.packb({"acao_id": acao["_id"], "quantidade": 4}),
+                           headers={**usuario, **MSGPACK, "Content-Type": "application/msgpack"})
+    assert resposta.status_code == 200
+    carteira = msgpack.unpackb(resposta.content)
+    assert [(p["acao_id"], p["qtd"]) for p in carteira["acoes"]] == [(acao["_id"], 4)]
+
+    # A listagem dos bots traz os mesmos dados em JSON e em msgpack
+    em_json = client.get("/api/carteiras", headers=admin)
+    em_msgpack = client.get("/api/carteiras", headers={**admin, **MSGPACK})
+    assert msgpack.unpackb(em_msgpack.content) == em_json.json()
+    assert len(em_msgpack.content) < len(em_json.content)
+
+    # Corpo inválido: mesma validação do JSON
+    invalido = client.post("/api/carteira/comprar", content=msgpack.packb({"quantidade": "muitas"}),
+                           headers={**usuario, "Content-Type": "application/msgpack"})
+    assert invalido.status_code == 422
+    malformado = client.post("/api/carteira/comprar", content=b"\xc1",
+                             headers={**usuario, "Content-Type": "application/msgpack"})
+    assert malformado.status_code == 400
+
+
+@pytest.mark.skipif(content_negotiation.cbor2 is not None, reason="cbor2 instalado")
+def test_corpo_cbor_sem_cbor2():
+    resposta = client.post("/api/carteira/comprar", content=b"\xa0",
+                           headers={**registrar(), "Content-Type": "application/cbor", "Accept": "application/cbor"})
+    assert resposta.status_code == 415 and resposta.headers["content-type"] == "application/json"
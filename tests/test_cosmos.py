@@ -0,0 +1,160 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from app.context import rota_atual
+from app.cosmos import (
+    RequestChargeListener,
+    RequestChargeMetrics,
+    RetryPolicy,
+    ThrottledCollection,
+    is_throttle_error,
+    retry_after_ms,
+)
+
+
+def erro_throttling(retry_after=5):
+    return OperationFailure(
+        f"Request rate is large. More Request Units may be needed, so no changes were made. "
+        f"Please retry this request later. RetryAfterMs={retry_after}, Details='Response status code does not indicate success'",
+        code=16500,
+    )
+
+
+class FakeCosmosCollection:
+    """
+    Coleção falsa que injeta erros 16500 nas primeiras chamadas e, como o pymongo, publica a
+    resposta de cada comando bem-sucedido ao listener na thread da operação.
+    """
+
+    name = "acoes"
+
+    def __init__(self, falhas=0, documentos=None, listener=None, charge=2.5):
+        self.falhas = falhas
+        self.chamadas = 0
+        self.documentos = documentos or []
+        self.listener = listener
+        self.charge = charge
+
+    def _talvez_falhar(self):
+        self.chamadas += 1
+        if self.chamadas <= self.falhas:
+            raise erro_throttling()
+        if self.listener is not None:
+            self.listener.succeeded(SimpleNamespace(reply={"ok": 1, "RequestCharge": self.charge}))
+
+    def find_one(self, filtro):
+        self._talvez_falhar()
+        return {"_id": 1, **filtro}
+
+    def find(self, *args, **kwargs):
+        colecao = self
+
+        class Cursor:
+            def __init__(self):
+                self._iter = None
+
+            def sort(self, *args, **kwargs):
+                return self
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                if self._iter is None:
+                    colecao._talvez_falhar()
+                    self._iter = iter(colecao.documentos)
+                return next(self._iter)
+
+        return Cursor()
+
+
+def politica():
+    return RetryPolicy(max_attempts=5, base_delay_ms=1, max_delay_ms=10, deadline_ms=1000)
+
+
+def test_detecta_throttling_e_retry_after():
+    assert is_throttle_error(erro_throttling())
+    assert retry_after_ms(erro_throttling(7)) == 7
+    assert not is_throttle_error(OperationFailure("outro erro", code=2))
+
+
+def test_bulk_write_com_throttling():
+    erro = BulkWriteError({"writeErrors": [{"code": 16500, "errmsg": "RetryAfterMs=3"}], "nInserted": 0})
+    assert is_throttle_error(erro)
+    assert retry_after_ms(erro) == 3
+
+
+def test_repete_ate_sucesso_e_registra_ru():
+    metricas = RequestChargeMetrics()
+    listener = RequestChargeListener()
+    colecao = ThrottledCollection(FakeCosmosCollection(falhas=2, listener=listener), politica(), metricas,
+                                  request_charge=listener)
+
+    token = rota_atual.set("/api/acoes/{acao_id}")
+    try:
+        assert colecao.find_one({"nome": "TESTE3"})["nome"] == "TESTE3"
+    finally:
+        rota_atual.reset(token)
+
+    [metrica] = metricas.snapshot()
+    assert metrica["rota"] == "/api/acoes/{acao_id}"
+    assert metrica["operacao"] == "find_one"
+    assert metrica["chamadas"] == 1
+    assert metrica["retentativas"] == 2
+    assert metrica["ru_total"] == 2.5
+
+
+def test_ru_atribuida_pela_resposta_da_propria_operacao():
+    metricas = RequestChargeMetrics()
+    listener = RequestChargeListener()
+    cara = ThrottledCollection(FakeCosmosCollection(listener=listener, charge=40.0), politica(), metricas,
+                               request_charge=listener)
+    barata = ThrottledCollection(FakeCosmosCollection(listener=listener, charge=1.0), politica(), metricas,
+                                 request_charge=listener)
+    sem_custo = ThrottledCollection(FakeCosmosCollection(), politica(), metricas, request_charge=listener)
+
+    def consultar(colecao, rota):
+        token = rota_atual.set(rota)
+        try:
+            for _ in range(200):
+                colecao.find_one({})
+        finally:
+            rota_atual.reset(token)
+
+    # Operações concorrentes em outras threads não entram na medida das desta
+    threads = [threading.Thread(target=consultar, args=(cara, "/cara")) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    consultar(barata, "/barata")
+    for thread in threads:
+        thread.join()
+    consultar(sem_custo, "/sem-custo")
+
+    metricas_por_rota = {metrica["rota"]: metrica for metrica in metricas.snapshot()}
+    assert (metricas_por_rota["/cara"]["chamadas"], metricas_por_rota["/cara"]["ru_medio"]) == (800, 40.0)
+    assert (metricas_por_rota["/barata"]["chamadas"], metricas_por_rota["/barata"]["ru_medio"]) == (200, 1.0)
+    assert metricas_por_rota["/sem-custo"]["ru_total"] == 0.0
+
+
+def test_desiste_apos_max_tentativas():
+    metricas = RequestChargeMetrics()
+    colecao = ThrottledCollection(FakeCosmosCollection(falhas=10), politica(), metricas)
+
+    with pytest.raises(OperationFailure):
+        colecao.find_one({})
+
+    [metrica] = metricas.snapshot()
+    assert metrica["retentativas"] == 4
+    assert metrica["falhas"] == 1
+
+
+def test_find_repete_primeiro_lote():
+    metricas = RequestChargeMetrics()
+    fake = FakeCosmosCollection(falhas=1, documentos=[{"_id": 1}, {"_id": 2}])
+    colecao = ThrottledCollection(fake, politica(), metricas)
+
+    assert list(colecao.find({}).sort("nome")) == [{"_id": 1}, {"_id": 2}]
+    assert fake.chamadas == 2
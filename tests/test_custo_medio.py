@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+from app import custo_medio, dashboard
+from app.database import carteiras, transacoes
+
+from tests.helpers import client, registrar
+
+
+def _posicao(carteira: dict, acao_id: str) -> dict:
+    return next(posicao for posicao in carteira["acoes"] if posicao["acao_id"] == acao_id)
+
+
+def test_compra_atualiza_preco_medio_ponderado():
+    admin, usuario = registrar("admin"), registrar()
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": "Media", "preco": 2.0, "qtd": 100, "risco": 1},
+                          headers=admin).json()["_id"]
+    deposito = client.post("/api/carteira/deposito", json={"valor": 1000.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    investido = client.get("/api/admin/dashboard", headers=admin).json()["valor_investido"]
+
+    client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": 10}, headers=usuario)
+    client.patch(f"/api/acoes/{acao_id}", json={"preco": 5.0}, headers=admin)
+    carteira = client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": 20}, headers=usuario).json()
+    posicao = _posicao(carteira, acao_id)
+    assert (posicao["qtd"], posicao["preco_compra"]) == (30, 4.0)
+    assert client.get("/api/admin/dashboard", headers=admin).json()["valor_investido"] == round(investido + 120.0, 2)
+
+
+def test_recalculo_a_partir_das_transacoes():
+    usuario_id = ObjectId(client.get("/api/carteira", headers=registrar()).json()["usuario_id"])
+    media, divergente = ObjectId(), ObjectId()
+    # Posições gravadas antes do preço médio: preco_compra da primeira compra
+    carteiras.update_one({"usuario_id": usuario_id}, {"$set": {"acoes": [
+        {"acao_id": media, "qtd": 4, "preco_compra": 10.0},
+        {"acao_id": divergente, "qtd": 9, "preco_compra": 1.0},
+    ]}})
+    transacoes.insert_many([
+        {"usuario_id": usuario_id, "acao_id": media, "tipo": "compra", "qtd": qtd, "valor": qtd * preco,
+         "preco_unitario": preco, "data": datetime.utcnow()}
+        for qtd, preco in ((1, 10.0), (3, 14.0))
+    ] + [{"usuario_id": usuario_id, "acao_id": divergente, "tipo": "compra", "qtd": 5, "valor": 5.0,
+          "preco_unitario": 1.0, "data": datetime.utcnow()}])
+
+    resumo = custo_medio.recalcular(tamanho_lote=2)
+    assert resumo["atualizadas"] >= 1 and resumo["posicoes_divergentes"] >= 1
+    posicoes = carteiras.find_one({"usuario_id": usuario_id})["acoes"]
+    assert [(posicao["qtd"], posicao["preco_compra"]) for posicao in posicoes] == [(4, 13.0), (9, 1.0)]
+    assert custo_medio.recalcular()["atualizadas"] == 0
+
+
+def test_recalculo_concluido_mesmo_com_falha_no_painel(monkeypatch):
+    usuario_id = ObjectId(client.get("/api/carteira", headers=registrar()).json()["usuario_id"])
+    acao_id = ObjectId()
+    carteiras.update_one({"usuario_id": usuario_id}, {"$set": {"acoes": [
+        {"acao_id": acao_id, "qtd": 2, "preco_compra": 1.0},
+    ]}})
+    transacoes.insert_one({"usuario_id": usuario_id, "acao_id": acao_id, "tipo": "compra", "qtd": 2, "valor": 6.0,
+                           "preco_unitario": 3.0, "data": datetime.utcnow()})
+
+    def falhar():
+        raise RuntimeError("painel indisponível")
+
+    monkeypatch.setattr(dashboard, "reconciliar", falhar)
+    assert custo_medio.recalcular()["atualizadas"] >= 1
+    assert carteiras.find_one({"usuario_id": usuario_id})["acoes"][0]["preco_compra"] == 3.0
@@ -0,0 +1,103 @@
+from app import dashboard
+from app.database import acoes, estatisticas
+
+from tests.helpers import client, registrar
+
+
+def _valores(painel):
+    return (
+        painel["depositos"]["pendente"]["qtd"], painel["depositos"]["aprovado"]["valor"],
+        painel["depositos"]["rejeitado"]["qtd"], painel["caixa_total"], painel["valor_investido"],
+        painel["valor_mercado"],
+    )
+
+
+def test_dashboard_incremental_e_reconciliacao():
+    admin, usuario = registrar("admin"), registrar()
+    assert client.get("/api/admin/dashboard", headers=usuario).status_code == 403
+
+    # O banco é compartilhado entre os testes: parte de um painel reconciliado
+    dashboard.reconciliar()
+    antes = _valores(client.get("/api/admin/dashboard", headers=admin).json())
+
+    aprovado = client.post("/api/carteira/deposito", json={"valor": 1000.0}, headers=usuario).json()
+    rejeitado = client.post("/api/carteira/deposito", json={"valor": 50.0}, headers=usuario).json()
+    client.post("/api/carteira/deposito", json={"valor": 30.0}, headers=usuario)
+    decisao = f"/api/carteira/deposito/{aprovado['id']}/aprovar"
+    assert client.post(decisao, json={"aprovado": True}, headers=admin).status_code == 200
+    assert client.post(decisao, json={"aprovado": False}, headers=admin).status_code == 400
+    assert client.post(f"/api/carteira/deposito/{rejeitado['id']}/aprovar",
+                       json={"aprovado": False, "motivo_rejeicao": "teste"}, headers=admin).status_code == 200
+
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": "Painel", "preco": 20.0, "qtd": 100, "risco": 1},
+                          headers=admin).json()["_id"]
+    for _ in range(2):
+        assert client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": 5},
+                           headers=usuario).status_code == 200
+    assert client.patch(f"/api/acoes/{acao_id}", json={"preco": 25.0}, headers=admin).status_code == 200
+
+    depois = _valores(client.get("/api/admin/dashboard", headers=admin).json())
+    deltas = tuple(round(d - a, 2) for a, d in zip(antes, depois))
+    assert deltas == (1, 1000.0, 1, 800.0, 200.0, 250.0)
+
+    # Os incrementos coincidem com a agregação completa
+    assert dashboard.reconciliar()["divergencias"] == {}
+
+    # Mudança de risco não é coberta pelos incrementos: a reconciliação corrige
+    acoes.update_one({"_id": acoes.find_one({"nome": "Painel"})["_id"]}, {"$set": {"risco": 4}})
+    resposta = client.post("/api/admin/dashboard/reconciliar", headers=admin).json()
+    assert resposta["divergencias"]["por_risco.4.qtd"] >= 10
+    painel = client.get("/api/admin/dashboard", headers=admin).json()
+    assert any(faixa["risco"] == 4 and faixa["qtd"] >= 10 for faixa in painel["por_risco"])
+
+
+def test_reconciliacao_refeita_quando_o_painel_muda_durante_o_calculo(monkeypatch):
+    dashboard.reconciliar()
+    calcular = dashboard.calcular
+    chamadas = []
+
+    def calcular_com_deposito_concorrente():
+        resultado = calcular()
+        if not chamadas:
+            # Depósito solicitado durante a agregação: a origem e o incremento chegam juntos
+            client.post("/api/carteira/deposito", json={"valor": 7.0}, headers=registrar())
+            resultado["depositos"]["pendente"]["qtd"] += 99  # Um $set sem a versão gravaria este valor
+        chamadas.append(resultado)
+        return resultado
+
+    monkeypatch.setattr(dashboard, "calcular", calcular_com_deposito_concorrente)
+    assert dashboard.reconciliar()["divergencias"] == {}
+    assert len(chamadas) == 2
+    monkeypatch.setattr(dashboard, "calcular", calcular)
+    assert dashboard.reconciliar()["divergencias"] == {}
+
+
+def test_reconciliacao_sob_trafego_continuo_aplica_as_diferencas(monkeypatch):
+    dashboard.reconciliar()
+    estatisticas.update_one({"_id": dashboard.DOCUMENTO_ID}, {"$inc": {"caixa_total": 123.0}})
+    calcular = dashboard.calcular
+    chamadas = []
+
+    def calcular_com_depositos_concorrentes():
+        # Um depósito (origem e incremento) a cada tentativa: a versão nunca fica parada
+        client.post("/api/carteira/deposito", json={"valor": 3.0}, headers=registrar())
+        chamadas.append(1)
+        return calcular()
+
+    monkeypatch.setattr(dashboard, "calcular", calcular_com_depositos_concorrentes)
+    resultado = dashboard.reconciliar()
+    assert len(chamadas) == 5
+    assert resultado["divergencias"] == {"caixa_total": -123.0}
+    monkeypatch.setattr(dashboard, "calcular", calcular)
+    assert dashboard.reconciliar()["divergencias"] == {}
+
+
+def test_variacao_de_preco_usa_a_quantidade_do_painel_na_escrita():
+    dashboard.reconciliar()
+    acao_id = acoes.insert_one({"nome": "PipeVar", "preco": 1.0, "qtd": 10, "risco": 1}).inserted_id
+    dashboard.compra_realizada(acao_id, 1, 4, 4.0)
+    antes = dashboard.obter()["valor_mercado"]
+    dashboard.precos_alterados({acao_id: 2.5})
+    assert round(dashboard.obter()["valor_mercado"] - antes, 2) == 10.0
+    acoes.delete_one({"_id": acao_id})
+    assert "qtd_por_acao." + str(acao_id) in dashboard.reconciliar()["divergencias"]
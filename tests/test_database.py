@@ -0,0 +1,35 @@
+import pymongo
+from pymongo.read_preferences import SecondaryPreferred
+
+from app import database
+from app.config import Settings
+
+
+def test_opcoes_de_pool_e_leitura_chegam_ao_mongoclient(monkeypatch):
+    monkeypatch.setenv("MONGODB_MAX_POOL_SIZE", "250")
+    monkeypatch.setenv("MONGODB_MIN_POOL_SIZE", "10")
+    monkeypatch.setenv("MONGODB_MAX_IDLE_TIME_MS", "60000")
+    monkeypatch.setenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")
+    monkeypatch.setenv("MONGODB_COMPRESSORS", "zlib")
+    monkeypatch.setenv("MONGODB_READ_PREFERENCE", "primaryPreferred")
+    monkeypatch.setenv("MONGODB_READ_CONCERN", "majority")
+    monkeypatch.setattr(database, "settings", Settings())
+
+    opcoes = database._opcoes_cliente()
+    assert opcoes["compressors"] == "zlib"  # zstd e snappy dependem de pacotes opcionais
+    # connect=False: o cliente valida e guarda as opções sem abrir conexões
+    cliente = pymongo.MongoClient("mongodb://localhost:27017", connect=False, **opcoes)
+    try:
+        pool = cliente.options.pool_options
+        assert (pool.max_pool_size, pool.min_pool_size, pool.max_idle_time_seconds) == (250, 10, 60)
+        assert pool.wait_queue_timeout == 2
+        assert cliente.options.read_preference.mongos_mode == "primaryPreferred"
+        assert cliente.options.read_concern.level == "majority"
+    finally:
+        cliente.close()
+
+
+def test_read_preference_das_leituras_analiticas():
+    preferencia = database._read_preference("secondaryPreferred", 120)
+    assert isinstance(preferencia, SecondaryPreferred) and preferencia.max_staleness == 120
+    assert database._read_preference("primary", 120).max_staleness == -1
@@ -0,0 +1,35 @@
+from tests.helpers import client, registrar
+
+
+def _comprar(admin, acao_id, quantidade):
+    usuario = registrar()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 1000.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    resposta = client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": quantidade}, headers=usuario)
+    assert resposta.status_code == 200
+    return resposta.json()["usuario_id"]
+
+
+def test_detentores_por_quantidade_e_paginados():
+    admin = registrar("admin")
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": "Detida", "preco": 5.0, "qtd": 100, "risco": 1},
+                          headers=admin).json()["_id"]
+    outra_id = client.post("/api/acoes/cadastrar", json={"nome": "Outra", "preco": 5.0, "qtd": 100, "risco": 1},
+                           headers=admin).json()["_id"]
+    assert client.get(f"/api/acoes/{acao_id}/detentores", headers=registrar()).status_code == 403
+    vazia = client.get(f"/api/acoes/{acao_id}/detentores", headers=admin).json()
+    assert vazia["total_detentores"] == 0 and vazia["detentores"] == [] and vazia["qtd_disponivel"] == 100
+
+    usuarios = [_comprar(admin, acao_id, qtd) for qtd in (10, 30, 20)]
+    _comprar(admin, outra_id, 50)
+
+    pagina = client.get(f"/api/acoes/{acao_id}/detentores", params={"limite": 2}, headers=admin).json()
+    assert [(d["usuario_id"], d["qtd"]) for d in pagina["detentores"]] == [(usuarios[1], 30), (usuarios[2], 20)]
+    assert pagina["detentores"][0]["percentual"] == 50.0 and pagina["detentores"][0]["preco_medio"] == 5.0
+    assert pagina["detentores"][0]["usuario_email"].endswith("@example.com")
+    assert (pagina["total_detentores"], pagina["qtd_em_carteiras"], pagina["qtd_disponivel"]) == (3, 60, 40)
+    assert pagina["percentual_em_carteiras"] == 60.0
+
+    segunda = client.get(f"/api/acoes/{acao_id}/detentores", params={"limite": 2, "pagina": 2}, headers=admin).json()
+    assert [(d["usuario_id"], d["qtd"]) for d in segunda["detentores"]] == [(usuarios[0], 10)]
+    assert client.get("/api/acoes/000000000000000000000000/detentores", headers=admin).status_code == 404
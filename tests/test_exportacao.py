@@ -0,0 +1,58 @@
+import io
+
+import msgpack
+import pytest
+from bson import ObjectId
+
+from app import exportacao
+from tests.helpers import client, registrar
+
+
+def _comprar(admin, usuario, quantidade):
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "EXPT3", "preco": 1.0, "qtd": 1000, "risco": 1},
+                       headers=admin).json()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    client.post("/api/carteira/comprar", json={"acao_id": acao["_id"], "quantidade": quantidade}, headers=usuario)
+    return acao["_id"]
+
+
+def test_exportacao_msgpack_colunar():
+    admin, bot, usuario = registrar("admin"), registrar("bot"), registrar()
+    acao_id = _comprar(admin, usuario, 7)
+    usuario_id = client.get("/api/carteira", headers=usuario).json()["usuario_id"]
+
+    assert client.get("/api/carteiras/exportar", headers=usuario).status_code == 403
+    resposta = client.get("/api/carteiras/exportar?lote=100", headers=bot)
+    assert resposta.headers["content-type"] == "application/x-msgpack"
+
+    cabecalho, *lotes = msgpack.Unpacker(io.BytesIO(resposta.content))
+    assert cabecalho["colunas"] == list(exportacao.COLUNAS_CARTEIRA)
+    linhas = {}
+    for lote in lotes:
+        for i in range(lote["linhas"]):
+            inicio, fim = lote["acoes_offsets"][i], lote["acoes_offsets"][i + 1]
+            linhas[ObjectId(lote["usuario_id"][i])] = list(zip(lote["acao_id"][inicio:fim], lote["qtd"][inicio:fim]))
+    assert linhas[ObjectId(usuario_id)] == [(ObjectId(acao_id).binary, 7)]
+
+
+def test_exportacao_arrow():
+    pyarrow = pytest.importorskip("pyarrow")
+    admin, usuario = registrar("admin"), registrar()
+    acao_id = _comprar(admin, usuario, 3)
+
+    resposta = client.get("/api/carteiras/exportar?formato=arrow&lote=100", headers=admin)
+    tabela = pyarrow.ipc.open_stream(resposta.content).read_all()
+    acoes = dict(zip(tabela.column("usuario_email").to_pylist(), tabela.column("acoes").to_pylist()))
+    assert [{"acao_id": ObjectId(acao_id).binary, "qtd": 3}] in acoes.values()
+
+
+def test_lote_colunar_com_acao_id_legado_em_texto():
+    usuario_id = ObjectId(client.get("/api/carteira", headers=registrar()).json()["usuario_id"])
+    acao_id = ObjectId()
+    lote = exportacao.lote_colunar([{
+        "_id": ObjectId(), "usuario_id": usuario_id, "saldo": 10.0, "nivel_risco": 1,
+        "acoes": [{"acao_id": str(acao_id), "qtd": 2}, {"acao_id": "invalido", "qtd": 5}],
+    }])
+    assert (lote["acao_id"], lote["qtd"], lote["acoes_offsets"]) == ([acao_id.binary], [2], [0, 1])
+    assert lote["posicoes_ignoradas"] == 1
@@ -0,0 +1,80 @@
+import uuid
+
+from app.database import acoes, historico_precos
+
+from tests.helpers import client, registrar
+
+
+def _enviar(rota, conteudo, cabecalhos):
+    return client.post(rota, files={"arquivo": ("dados.csv", conteudo.encode("utf-8-sig"), "text/csv")},
+                       headers=cabecalhos)
+
+
+def test_importacao_de_acoes_em_lotes_com_erros_por_linha(monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    prefixo = uuid.uuid4().hex[:8]
+    linhas = ["nome;preco;qtd;risco"]
+    linhas += [f"{prefixo}-{i};{10 + i};100;{1 + i % 5}" for i in range(5)]
+    linhas += [
+        f"{prefixo}-ruim;-1;100;3",         # linha 7: preço inválido
+        f"{prefixo}-4;15;100;1",            # linha 8: repetida no mesmo lote, prevalece
+        "",
+        f"{prefixo}-extra;10;1;1;sobra",    # linha 10: colunas a mais
+        f"{prefixo}-risco;10;1;9",          # linha 11: risco fora de 1-5
+    ]
+    conteudo = "\n".join(linhas)
+    assert _enviar("/api/admin/importacao/acoes", conteudo, usuario).status_code == 403
+
+    monkeypatch.setattr("app.main.settings.IMPORT_BATCH_SIZE", 2)
+    resposta = _enviar("/api/admin/importacao/acoes", conteudo, admin)
+    assert resposta.status_code == 200
+    resultado = resposta.json()
+    # Lotes de 2 linhas válidas; a repetição só é descartada dentro do mesmo lote
+    assert (resultado["linhas"], resultado["inseridas"], resultado["atualizadas"]) == (9, 5, 0)
+    assert resultado["inalteradas"] == 1 and resultado["lotes"] == 3
+    assert [e["linha"] for e in resultado["erros"]] == [7, 10, 11] and resultado["total_erros"] == 3
+    assert "preco" in resultado["erros"][0]["erro"]
+
+    repetida = acoes.find_one({"nome": f"{prefixo}-4"})
+    assert repetida["preco"] == 15.0 and repetida["risco"] == 1
+    assert historico_precos.count_documents({"acao_id": repetida["_id"]}) == 1
+
+    # Reimportação: só a linha com preço novo é gravada
+    linhas[2] = f"{prefixo}-1;99;100;2"
+    resultado = _enviar("/api/admin/importacao/acoes", "\n".join(linhas), admin).json()
+    assert (resultado["inseridas"], resultado["atualizadas"], resultado["inalteradas"]) == (0, 1, 5)
+    alterada = acoes.find_one({"nome": f"{prefixo}-1"})
+    assert alterada["preco"] == 99.0
+    assert historico_precos.count_documents({"acao_id": alterada["_id"]}) == 2
+
+
+def test_importacao_rejeita_arquivo_sem_colunas():
+    admin = registrar("admin")
+    resposta = _enviar("/api/admin/importacao/acoes", "nome,preco\nA,1", admin)
+    assert resposta.status_code == 400 and "qtd" in resposta.json()["detail"]
+    assert _enviar("/api/admin/importacao/precos-referencia", "", admin).status_code == 400
+
+
+def test_importacao_de_precos_de_referencia():
+    admin, usuario = registrar("admin"), registrar()
+    nome = f"Ref-{uuid.uuid4().hex[:8]}"
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": nome, "preco": 10.0, "qtd": 10, "risco": 1},
+                          headers=admin).json()["_id"]
+    assert client.get(f"/api/acoes/{acao_id}/preco-referencia", headers=usuario).status_code == 404
+
+    conteudo = "\n".join([
+        "acao_id,nome,preco_referencia",
+        f"{acao_id},,12.5",
+        f",{nome},13",
+        ",Inexistente,1",
+        "invalido,,1",
+    ])
+    resultado = _enviar("/api/admin/importacao/precos-referencia", conteudo, admin).json()
+    assert (resultado["inseridas"], resultado["inalteradas"]) == (1, 1)
+    assert sorted(e["linha"] for e in resultado["erros"]) == [4, 5]
+
+    preco = client.get(f"/api/acoes/{acao_id}/preco-referencia", headers=usuario).json()
+    assert preco["preco_referencia"] == 13.0 and preco["acao_id"] == acao_id
+
+    resultado = _enviar("/api/admin/importacao/precos-referencia", f"nome,preco_referencia\n{nome},14", admin).json()
+    assert (resultado["inseridas"], resultado["atualizadas"]) == (0, 1)
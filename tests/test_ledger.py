@@ -0,0 +1,184 @@
+import time
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app import ledger, main
+from app.database import acoes, carteiras, lancamentos, saldos_snapshots
+
+from tests.helpers import client, registrar
+
+
+@pytest.fixture
+def usuario_id(monkeypatch):
+    monkeypatch.setattr(ledger.settings, "LEDGER_SNAPSHOT_INTERVAL", 3)
+    usuario_id = ObjectId()
+    carteiras.insert_one({"usuario_id": usuario_id, "acoes": [], "saldo": 0.0})
+    return usuario_id
+
+
+def test_saldo_por_snapshot_e_cauda(usuario_id):
+    for valor in (100.0, 50.0, -30.0, 20.0):
+        ledger.lancar(usuario_id, "teste", valor)
+    meio = datetime.utcnow()
+    time.sleep(0.001)
+    ledger.lancar(usuario_id, "teste", -40.0)
+
+    assert ledger.saldo_atual(usuario_id) == 100.0
+    assert ledger.saldo_em(usuario_id, meio) == 140.0
+    assert [s["seq"] for s in saldos_snapshots.find({"usuario_id": usuario_id})] == [3]
+    assert carteiras.find_one({"usuario_id": usuario_id})["saldo"] == 100.0
+    assert ledger.verificar_carteira(usuario_id) is None
+
+
+def test_debito_exige_saldo(usuario_id):
+    ledger.lancar(usuario_id, "deposito", 10.0)
+    with pytest.raises(ledger.SaldoInsuficiente):
+        ledger.lancar(usuario_id, "compra", -10.01, exigir_saldo=True)
+    assert lancamentos.count_documents({"usuario_id": usuario_id}) == 1
+
+
+def test_abertura_de_carteira_anterior_ao_ledger():
+    usuario_id = ObjectId()
+    carteiras.insert_one({"usuario_id": usuario_id, "acoes": [], "saldo": 75.0})
+
+    assert ledger.lancar(usuario_id, "compra", -25.0, exigir_saldo=True)["saldo"] == 50.0
+    assert [l["tipo"] for l in lancamentos.find({"usuario_id": usuario_id}).sort("seq", 1)] == ["abertura", "compra"]
+
+
+def test_verificacao_detecta_divergencia(usuario_id):
+    ledger.lancar(usuario_id, "deposito", 10.0)
+    carteiras.update_one({"usuario_id": usuario_id}, {"$set": {"saldo": 999.0}})
+
+    relatorio = ledger.verificar(workers=2, chunk=1)
+    [divergencia] = [d for d in relatorio["divergencias"] if d["usuario_id"] == str(usuario_id)]
+    assert divergencia["saldo_recalculado"] == 10.0
+
+
+def test_lancamento_com_chave_e_idempotente(usuario_id):
+    primeiro = ledger.lancar(usuario_id, "deposito", 30.0, chave=f"deposito:{usuario_id}")
+    repetido = ledger.lancar(usuario_id, "deposito", 30.0, chave=f"deposito:{usuario_id}")
+    assert repetido["_id"] == primeiro["_id"] and repetido["saldo"] == 30.0
+    assert lancamentos.count_documents({"usuario_id": usuario_id}) == 1
+
+
+def test_carteira_migrada_nao_consulta_abertura(monkeypatch):
+    usuario_id = ObjectId()
+    carteiras.insert_one({"usuario_id": usuario_id, "acoes": [], "saldo": 20.0})
+    assert ledger.saldo_atual(usuario_id) == 20.0  # Migra: lançamento de abertura
+    carteira = carteiras.find_one({"usuario_id": usuario_id})
+    assert carteira["ledger_seq"] == 1
+
+    consultas = []
+    for colecao in (ledger.lancamentos, ledger.carteiras):
+        def contar(*args, _original=colecao.find_one, **kwargs):
+            consultas.append(args)
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(colecao, "find_one", contar)
+    assert ledger.saldo_atual(usuario_id, carteira) == 20.0
+    ledger.lancar(usuario_id, "compra", -5.0, exigir_saldo=True, carteira=carteira)
+    assert consultas == []
+
+
+def test_aprovacao_interrompida_e_retomada_sem_credito_duplo(monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 80.0}, headers=usuario).json()
+    original = ledger.lancar
+
+    def falhar(*args, **kwargs):
+        raise RuntimeError("ledger indisponível")
+
+    monkeypatch.setattr(ledger, "lancar", falhar)
+    with pytest.raises(RuntimeError):
+        client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    monkeypatch.setattr(ledger, "lancar", original)
+
+    # Não foi aprovado nem creditado: fica "creditando", visível para o admin retomar
+    pendentes = {d["id"]: d for d in client.get("/api/depositos/pendentes", headers=admin).json()}
+    assert pendentes[deposito["id"]]["status"] == "creditando"
+    assert client.get("/api/carteira/saldo", headers=usuario).json()["saldo"] == 0.0
+    rejeicao = client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar",
+                           json={"aprovado": False, "motivo_rejeicao": "x"}, headers=admin)
+    assert rejeicao.status_code == 400
+
+    aprovado = client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    assert aprovado.status_code == 200 and aprovado.json()["status"] == "aprovado"
+    repetido = client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    assert repetido.status_code == 400
+    assert client.get("/api/carteira/saldo", headers=usuario).json()["saldo"] == 80.0
+
+
+def test_compra_de_acao_removida_estorna_o_debito(monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "REMV3", "preco": 10.0, "qtd": 50, "risco": 1},
+                       headers=admin).json()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    lancar = ledger.lancar
+
+    def debitar_e_remover(*args, **kwargs):
+        # A ação é removida entre o débito e a baixa do estoque
+        lancamento = lancar(*args, **kwargs)
+        acoes.delete_one({"_id": ObjectId(acao["_id"])})
+        return lancamento
+
+    monkeypatch.setattr(ledger, "lancar", debitar_e_remover)
+    resposta = client.post("/api/carteira/comprar", json={"acao_id": acao["_id"], "quantidade": 2}, headers=usuario)
+    assert resposta.status_code == 404
+    assert client.get("/api/carteira/saldo", headers=usuario).json()["saldo"] == 100.0
+    assert client.get("/api/carteira", headers=usuario).json()["acoes"] == []
+
+
+def test_visoes_do_admin_mostram_o_saldo_do_ledger():
+    admin, usuario = registrar("admin"), registrar()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 40.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    usuario_id = client.get("/api/carteira", headers=usuario).json()["usuario_id"]
+    carteiras.update_one({"usuario_id": ObjectId(usuario_id)}, {"$set": {"saldo": 999.0}})
+
+    listadas = {c["usuario_id"]: c for c in client.get("/api/carteiras", headers=admin).json()}
+    assert listadas[usuario_id]["saldo"] == 40.0
+    limites = client.patch(f"/api/carteiras/{usuario_id}/limites", json={"nivel_risco": 3}, headers=admin)
+    assert limites.status_code == 200 and limites.json()["saldo"] == 40.0
+
+
+def test_compra_usa_o_preco_do_documento_e_nao_o_da_tabela(monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "ATRS3", "preco": 10.0, "qtd": 50, "risco": 1},
+                       headers=admin).json()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    # Preço alterado no MongoDB; a tabela compartilhada ainda mostra o anterior
+    acoes.update_one({"_id": ObjectId(acao["_id"])}, {"$set": {"preco": 20.0}})
+    ler_acao = main._ler_acao
+    monkeypatch.setattr(main, "_ler_acao", lambda acao_id: {**ler_acao(acao_id), "preco": 10.0})
+    registradas = []
+    monkeypatch.setattr(main, "registrar_transacao", registradas.append)
+
+    carteira = client.post("/api/carteira/comprar", json={"acao_id": acao["_id"], "quantidade": 2}, headers=usuario)
+    assert carteira.status_code == 200 and carteira.json()["saldo"] == 60.0
+    assert carteira.json()["acoes"][0]["preco_compra"] == 20.0
+    assert [(t["valor"], t["preco_unitario"]) for t in registradas] == [(40.0, 20.0)]
+
+
+def test_compra_com_preco_alterado_antes_da_baixa_e_estornada(monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "VARP3", "preco": 10.0, "qtd": 50, "risco": 1},
+                       headers=admin).json()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    lancar = ledger.lancar
+
+    def debitar_e_reprecificar(*args, **kwargs):
+        # O preço muda entre o débito e a baixa do estoque
+        lancamento = lancar(*args, **kwargs)
+        acoes.update_one({"_id": ObjectId(acao["_id"])}, {"$set": {"preco": 12.0}})
+        return lancamento
+
+    monkeypatch.setattr(ledger, "lancar", debitar_e_reprecificar)
+    resposta = client.post("/api/carteira/comprar", json={"acao_id": acao["_id"], "quantidade": 2}, headers=usuario)
+    assert resposta.status_code == 409
+    assert client.get("/api/carteira/saldo", headers=usuario).json()["saldo"] == 100.0
+    assert acoes.find_one({"_id": ObjectId(acao["_id"])})["qtd"] == 50
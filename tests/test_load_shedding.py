@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+from app import auth
+from app.load_shedding import AdaptiveConcurrencyLimiter, LoadSheddingMiddleware
+
+from tests.helpers import client, registrar
+
+
+def test_fila_por_prioridade_e_descarte_da_baixa():
+    async def cenario():
+        limiter = AdaptiveConcurrencyLimiter(limite_max=1, limite_min=1,
+                                             orcamento_fila_ms={"alta": 1000, "normal": 1000, "baixa": 20})
+        assert await limiter.adquirir(lambda: "baixa")
+        ordem = []
+
+        async def esperar(prioridade):
+            if await limiter.adquirir(lambda: prioridade):
+                ordem.append(prioridade)
+                await asyncio.sleep(0)
+                limiter.liberar(0.01)
+            else:
+                ordem.append(f"503 {prioridade}")
+
+        tarefas = [asyncio.create_task(esperar(p)) for p in ("baixa", "normal", "alta")]
+        await asyncio.sleep(0.05)  # A baixa passa do orçamento de 20 ms e é descartada
+        limiter.liberar(0.01)
+        await asyncio.gather(*tarefas)
+        return limiter, ordem
+
+    limiter, ordem = asyncio.run(cenario())
+    assert ordem == ["503 baixa", "alta", "normal"]
+    stats = limiter.stats()
+    assert stats["descartadas_baixa"] == 1 and stats["descartadas_alta"] == 0
+    assert stats["em_andamento"] == 0 and stats["na_fila"] == 0 and stats["enfileiradas"] == 3
+
+
+def test_limite_adapta_pela_latencia():
+    limiter = AdaptiveConcurrencyLimiter(limite_max=40, limite_min=4, janela=5)
+    limiter.em_andamento = 100  # liberar() só é chamado aqui para alimentar as amostras
+    for latencia in [0.01] * 5 + [0.1] * 50:
+        limiter.liberar(latencia)
+    assert limiter.limite < 25
+    for _ in range(300):
+        limiter.liberar(0.1)
+    assert limiter.limite == 40
+
+
+def test_middleware_responde_503_para_baixa_prioridade():
+    liberar = asyncio.Event()
+
+    async def lenta(scope, receive, send):
+        await liberar.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    bot = auth.create_access_token({"sub": "bot@example.com", "tipo_usuario": "bot"})
+    middleware = LoadSheddingMiddleware(
+        lenta, AdaptiveConcurrencyLimiter(limite_max=1, limite_min=1, orcamento_fila_ms={"baixa": 10}),
+        prioridades={"GET /api/acoes": {"bot": "baixa"}, "POST /api/carteira/comprar": {"*": "alta"}},
+        rota=lambda scope: scope["path"],
+        tipo=lambda scope: "bot" if dict(scope["headers"]).get(b"authorization") else "comum",
+    )
+
+    async def requisicao(metodo, path, token=None):
+        respostas = []
+
+        async def send(mensagem):
+            respostas.append(mensagem)
+
+        cabecalhos = [(b"authorization", f"Bearer {token}".encode())] if token else []
+        await middleware({"type": "http", "method": metodo, "path": path, "headers": cabecalhos}, None, send)
+        return respostas
+
+    async def cenario():
+        ocupada = asyncio.create_task(requisicao("GET", "/api/acoes"))
+        await asyncio.sleep(0)
+        compra = asyncio.create_task(requisicao("POST", "/api/carteira/comprar"))
+        descartada = await requisicao("GET", "/api/acoes", bot)
+        liberar.set()
+        return descartada, await compra, await ocupada
+
+    descartada, compra, ocupada = asyncio.run(cenario())
+    assert descartada[0]["status"] == 503 and (b"retry-after", b"1") in descartada[0]["headers"]
+    assert "sobrecarregado" in json.loads(descartada[1]["body"])["detail"]
+    assert compra[0]["status"] == 200 and ocupada[0]["status"] == 200
+    assert middleware.limiter.stats()["descartadas_baixa"] == 1
+
+
+def test_endpoint_metricas_carga():
+    assert client.get("/api/admin/metricas/carga", headers=registrar()).status_code == 403
+    metricas = client.get("/api/admin/metricas/carga", headers=registrar("admin")).json()
+    assert metricas["ativo"] and metricas["admitidas"] > 0 and metricas["em_andamento"] >= 1
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.main import app
+from app.price_stream import SLOW_CONSUMER_CLOSE_CODE, PriceBroadcaster
+from tests.helpers import client, registrar
+
+
+class _Conexao:
+    def __init__(self, travada=False):
+        self.recebidas = []
+        self.fechada_com = None
+        self.travada = travada
+
+    async def send(self, mensagem):
+        if self.travada:
+            await asyncio.Event().wait()
+        self.recebidas.append(mensagem)
+
+    async def close(self, codigo):
+        self.fechada_com = codigo
+
+
+def test_coalescencia_e_fan_out_compartilhado():
+    async def cenario():
+        broadcaster = PriceBroadcaster(tick_ms=10)
+        conexoes = [_Conexao(), _Conexao(), _Conexao()]
+        assinantes = [broadcaster.connect(c.send, c.close) for c in conexoes]
+        broadcaster.subscribe(assinantes[0], ["a", "b"])
+        broadcaster.subscribe(assinantes[1], ["a", "b"])
+        broadcaster.subscribe(assinantes[2], ["b"])
+
+        for preco in (1.0, 2.0, 3.0):
+            broadcaster.publish("a", {"preco": preco})
+        broadcaster.publish("b", {"preco": 9.0})
+        broadcaster.publish("c", {"preco": 5.0})  # sem assinantes
+        broadcaster.flush()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert conexoes[0].recebidas[0] is conexoes[1].recebidas[0]
+        dados = json.loads(conexoes[0].recebidas[0])["dados"]
+        assert sorted((d["acao_id"], d["preco"]) for d in dados) == [("a", 3.0), ("b", 9.0)]
+        assert [d["acao_id"] for d in json.loads(conexoes[2].recebidas[0])["dados"]] == ["b"]
+        assert broadcaster.stats()["serializadas"] == 2
+        await broadcaster.stop()
+
+    asyncio.run(cenario())
+
+
+def test_consumidor_lento_e_desconectado():
+    async def cenario():
+        broadcaster = PriceBroadcaster(tick_ms=10, max_lag_ticks=2)
+        lenta, rapida = _Conexao(travada=True), _Conexao()
+        for conexao in (lenta, rapida):
+            broadcaster.subscribe(broadcaster.connect(conexao.send, conexao.close), ["a"])
+
+        for preco in range(5):
+            broadcaster.publish("a", {"preco": float(preco)})
+            broadcaster.flush()
+            await asyncio.sleep(0.005)
+
+        assert lenta.fechada_com == SLOW_CONSUMER_CLOSE_CODE
+        # O consumidor rápido segue recebendo (coalescido) até o preço mais recente
+        assert json.loads(rapida.recebidas[-1])["dados"][0]["preco"] == 4.0
+        assert broadcaster.stats()["conexoes"] == 1
+        await broadcaster.stop()
+
+    asyncio.run(cenario())
+
+
+def test_websocket_recebe_preco_atual_e_atualizacoes():
+    admin = registrar("admin")
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "WS3", "preco": 10.0, "qtd": 10, "risco": 1},
+                       headers=admin).json()
+    token = admin["Authorization"].split()[1]
+
+    with TestClient(app) as cliente:
+        with pytest.raises(WebSocketDisconnect):
+            with cliente.websocket_connect("/ws/precos?token=invalido") as ws:
+                ws.receive_text()
+
+        with cliente.websocket_connect(f"/ws/precos?token={token}&acoes={acao['_id']}") as ws:
+            assert ws.receive_json()["dados"][0]["preco"] == 10.0
+            cliente.patch(f"/api/acoes/{acao['_id']}", json={"preco": 12.5}, headers=admin)
+            [atualizacao] = ws.receive_json()["dados"]
+            assert (atualizacao["acao_id"], atualizacao["preco"], atualizacao["qtd"]) == (acao["_id"], 12.5, 10)
@@ -0,0 +1,122 @@
+import multiprocessing
+
+from bson import ObjectId
+
+from app import main
+from app.database import acoes, change_feed
+from app.price_table import SharedPriceTable
+
+from tests.helpers import client, registrar
+
+
+class _Feed:
+    """Feed de alterações mínimo: uma página com as alterações informadas."""
+
+    def __init__(self, alteracoes):
+        self.alteracoes = alteracoes
+
+    def head_token(self):
+        return "inicio"
+
+    def changes(self, token, limite, filtros, colecoes):
+        alteracoes, self.alteracoes = self.alteracoes, []
+        return {"alteracoes": alteracoes, "token": "fim", "mais": False}
+
+
+class _Acoes:
+    def __init__(self, documentos):
+        self.documentos = documentos
+
+    def find(self, filtro, projecao):
+        return iter(self.documentos)
+
+
+def _escrever_sem_parar(caminho, acao_id, vezes):
+    tabela = SharedPriceTable(caminho, capacidade=64)
+    for i in range(vezes):
+        tabela.gravar(acao_id, f"Acao{i}", float(i), i, versao=i)
+
+
+def test_gravar_ler_e_remover(tmp_path):
+    tabela = SharedPriceTable(str(tmp_path / "precos"), capacidade=8)
+    acao_id, outra_id = ObjectId(), ObjectId()
+    assert tabela.gravar(acao_id, "PETR4", 10.5, 100, risco=2, versao=5)
+    assert tabela.obter(acao_id) is None  # Ainda não carregada pelo atualizador
+
+    tabela.carregar(_Acoes([{"_id": acao_id, "nome": "PETR4", "preco": 10.5, "qtd": 100, "risco": 2, "sync_seq": 5},
+                            {"_id": outra_id, "nome": "x" * 300, "preco": 1.0, "qtd": 1}]), _Feed([]))
+    assert tabela.obter(str(acao_id)) == {"_id": acao_id, "nome": "PETR4", "preco": 10.5, "qtd": 100, "risco": 2,
+                                          "sync_seq": 5}
+    assert not tabela.gravar(acao_id, "PETR4", 9.0, 100, versao=4)  # Versão anterior à da tabela
+    assert tabela.obter(outra_id) is None and tabela.listar() is None  # Nome longo: leitura vai ao MongoDB
+
+    # O mesmo arquivo aberto por outro processo (aqui, outra instância) enxerga as gravações
+    outra = SharedPriceTable(str(tmp_path / "precos"), capacidade=1024)
+    assert outra.capacidade == 8 and outra.obter(acao_id)["preco"] == 10.5
+    outra.acompanhar(_Feed([{"id": str(outra_id), "documento": None},
+                            {"id": str(acao_id), "documento": {"nome": "PETR4", "preco": 11.0, "qtd": 90,
+                                                               "sync_seq": 6}}]), "inicio")
+    assert [(a["_id"], a["preco"], a["qtd"]) for a in tabela.listar()] == [(acao_id, 11.0, 90)]
+    assert tabela.stats()["acoes"] == 1
+
+
+def test_leitura_consistente_com_escritor_em_outro_processo(tmp_path):
+    caminho = str(tmp_path / "precos")
+    tabela = SharedPriceTable(caminho, capacidade=64)
+    acao_id = ObjectId()
+    tabela.carregar(_Acoes([{"_id": acao_id, "nome": "Acao0", "preco": 0.0, "qtd": 0}]), _Feed([]))
+    escritor = multiprocessing.get_context("fork").Process(target=_escrever_sem_parar, args=(caminho, acao_id, 20000))
+    escritor.start()
+    lidas = 0
+    while escritor.is_alive():
+        acao = tabela.obter(acao_id)
+        # Nome, preço e quantidade vêm sempre da mesma gravação (nunca de duas pela metade)
+        assert acao["nome"] == f"Acao{acao['qtd']}" and acao["preco"] == acao["qtd"]
+        lidas += 1
+    escritor.join()
+    assert escritor.exitcode == 0 and lidas > 0
+    assert tabela.obter(acao_id)["qtd"] == 19999
+
+
+def test_rotas_leem_da_tabela_quando_atual(tmp_path, monkeypatch):
+    admin = registrar("admin")
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": "Compartilhada", "preco": 3.0, "qtd": 10, "risco": 1},
+                          headers=admin).json()["_id"]
+    tabela = SharedPriceTable(str(tmp_path / "precos"), capacidade=4096)
+    monkeypatch.setattr(main, "tabela_precos", tabela)
+    removida = ObjectId()
+    tabela.gravar(removida, "Removida", 1.0, 1)
+    tabela.carregar(acoes, change_feed)
+    assert tabela.obter(removida) is None and tabela.obter(acao_id)["preco"] == 3.0
+
+    # Alteração de outro processo aplicada só na tabela: as leituras não vão ao MongoDB
+    tabela.gravar(acao_id, "Compartilhada", 4.0, 10, versao=tabela.obter(acao_id)["sync_seq"] + 1)
+    assert client.get(f"/api/acoes/{acao_id}", headers=admin).json()["preco"] == 4.0
+    listadas = {a["_id"]: a for a in client.get("/api/acoes", headers=admin).json()}
+    assert listadas[acao_id]["preco"] == 4.0 and len(listadas) == acoes.count_documents({})
+
+    # A escrita da rota atualiza a tabela na hora
+    client.patch(f"/api/acoes/{acao_id}", json={"preco": 5.0}, headers=admin)
+    assert tabela.obter(acao_id)["preco"] == 5.0
+    metricas = client.get("/api/admin/metricas/tabela-precos", headers=admin).json()
+    assert metricas["atual"] and metricas["acoes"] == len(listadas) and metricas["leituras"] > 0
+
+
+def test_compra_nao_autoriza_quantidade_pela_tabela(tmp_path, monkeypatch):
+    admin, usuario = registrar("admin"), registrar()
+    acao_id = client.post("/api/acoes/cadastrar", json={"nome": "Esgotada", "preco": 2.0, "qtd": 5, "risco": 1},
+                          headers=admin).json()["_id"]
+    deposito = client.post("/api/carteira/deposito", json={"valor": 100.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    tabela = SharedPriceTable(str(tmp_path / "precos"), capacidade=4096)
+    monkeypatch.setattr(main, "tabela_precos", tabela)
+    tabela.carregar(acoes, change_feed)
+
+    # A tabela ainda mostra estoque, mas outro processo já vendeu quase tudo
+    acoes.update_one({"_id": ObjectId(acao_id)}, {"$set": {"qtd": 1}})
+    assert tabela.obter(acao_id)["qtd"] == 5
+    resposta = client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": 3}, headers=usuario)
+    assert resposta.status_code == 400 and resposta.json()["detail"] == "Quantidade indisponível"
+    assert acoes.find_one({"_id": ObjectId(acao_id)})["qtd"] == 1
+    assert client.get("/api/carteira/saldo", headers=usuario).json()["saldo"] == 100.0
+    assert client.get("/api/carteira", headers=usuario).json()["acoes"] == []
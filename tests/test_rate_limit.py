@@ -0,0 +1,95 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import auth, context
+from app.config import Settings
+from app.database import rate_limits
+from app.rate_limit import MemoryBucketStore, MongoBucketStore, RateLimiter, RateLimitMiddleware, Rule
+
+
+def _cliente(store, proxies_confiaveis=0):
+    app = FastAPI()
+
+    @app.post("/login")
+    def login():
+        return {"ok": True}
+
+    @app.get("/dados")
+    def dados():
+        return {"ok": True}
+
+    @app.get("/livre")
+    def livre():
+        return {"ok": True}
+
+    limiter = RateLimiter(
+        store,
+        rotas={"POST /login": {"*": "2/minute"}, "GET /dados": {"*": "3/minute", "bot": "1/minute"}},
+        por_tipo={"anonimo": "5/minute", "comum": "100/minute", "bot": "100/minute"},
+        secret=auth.SECRET_KEY,
+        algorithm=auth.ALGORITHM,
+        proxies_confiaveis=proxies_confiaveis,
+    )
+    # No app principal a rota vem do middleware de contexto; aqui o path já é o template
+    app.add_middleware(RateLimitMiddleware, limiter=limiter, rota=lambda scope: scope["path"])
+    return TestClient(app)
+
+
+def _token(email, tipo):
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': email, 'tipo_usuario': tipo})}"}
+
+
+def test_regra_invalida():
+    assert Rule("10/minute").taxa == 10 / 60 and Rule("5/hours").periodo == 3600
+    for spec in ("dez/minute", "10/semana", "0/minute"):
+        try:
+            Rule(spec)
+        except ValueError:
+            continue
+        raise AssertionError(spec)
+
+
+def test_limite_por_rota_e_tipo():
+    client = _cliente(MemoryBucketStore())
+    assert [client.post("/login").status_code for _ in range(3)] == [200, 200, 429]
+    bloqueada = client.post("/login")
+    assert bloqueada.headers["retry-after"] == "30" and bloqueada.headers["x-ratelimit-limit"] == "2/minute"
+
+    # Usuários autenticados têm buckets próprios; bot tem regra mais restrita na rota
+    comum, bot = _token("a@example.com", "comum"), _token("b@example.com", "bot")
+    assert [client.get("/dados", headers=comum).status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert [client.get("/dados", headers=bot).status_code for _ in range(2)] == [200, 429]
+    # Rota sem regra própria: só o limite global do anônimo (5, dos quais o login usou 2)
+    assert [client.get("/livre").status_code for _ in range(4)] == [200, 200, 200, 429]
+    # Token inválido conta como anônimo, pelo IP
+    assert client.get("/livre", headers={"Authorization": "Bearer invalido"}).status_code == 429
+    assert client.get("/livre", headers=comum).status_code == 200
+
+
+def test_ip_pelo_proxy_confiavel():
+    client = _cliente(MemoryBucketStore(), proxies_confiaveis=1)
+    # O cliente pode forjar o início da lista, mas não o endereço acrescentado pelo proxy
+    for forjado in ("1.1.1.1", "2.2.2.2"):
+        client.post("/login", headers={"X-Forwarded-For": f"{forjado}, 10.0.0.1:5555"})
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.1:6000"}).status_code == 429
+    assert client.post("/login", headers={"X-Forwarded-For": "10.0.0.2"}).status_code == 200
+
+
+def test_padrao_separa_os_clientes_atras_do_app_service():
+    client = _cliente(MemoryBucketStore(), Settings.model_fields["RATE_LIMIT_TRUSTED_PROXIES"].default)
+    # Todas as conexões vêm do front-end; cada cliente tem o próprio bucket de login
+    assert [client.post("/login", headers={"X-Forwarded-For": "203.0.113.7:41000"}).status_code
+            for _ in range(3)] == [200, 200, 429]
+    assert client.post("/login", headers={"X-Forwarded-For": "198.51.100.9:52000"}).status_code == 200
+    # Sem o cabeçalho (acesso direto), vale o endereço da conexão
+    assert client.post("/login").status_code == 200
+
+
+def test_backend_compartilhado():
+    rate_limits.delete_many({})
+    # Dois "workers" com buckets no mesmo banco dividem o limite
+    a, b = _cliente(MongoBucketStore(rate_limits)), _cliente(MongoBucketStore(rate_limits))
+    assert [c.post("/login").status_code for c in (a, b, a)] == [200, 200, 429]
+    [documento] = [d for d in rate_limits.find() if d["_id"].endswith("|POST /login")]
+    assert documento["tokens"] < 1 and "expira_em" in documento
+    assert context.rota_atual.get() is None
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import jobs, reconciliacao_estoque
+from app import reconciliacao_estoque_faixas as faixas_estoque
+from app.database import acoes, carteiras, database, transacoes
+
+from tests.helpers import client, registrar
+
+
+def _cadastrar(admin, nome, qtd=100):
+    return client.post("/api/acoes/cadastrar", json={"nome": nome, "preco": 2.0, "qtd": qtd, "risco": 1},
+                       headers=admin).json()["_id"]
+
+
+def _comprar(admin, acao_id, quantidade):
+    usuario = registrar()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 1000.0}, headers=usuario).json()
+    client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    resposta = client.post("/api/carteira/comprar", json={"acao_id": acao_id, "quantidade": quantidade}, headers=usuario)
+    assert resposta.status_code == 200
+    return ObjectId(resposta.json()["usuario_id"])
+
+
+def test_relatorio_aponta_divergencias_do_estoque():
+    admin = registrar("admin")
+    assert client.get("/api/admin/estoque/reconciliacao", headers=registrar()).status_code == 403
+    consistente, sem_transacao, vendida_demais, removida, arquivada = (
+        _cadastrar(admin, nome) for nome in ("Consistente", "SemTransacao", "VendidaDemais", "Removida", "Arquivada")
+    )
+    _comprar(admin, consistente, 10)
+    usuario_id = _comprar(admin, sem_transacao, 4)
+    # Posição gravada duas vezes e transação perdida (escritas separadas em comprar_acao)
+    carteiras.update_one({"usuario_id": usuario_id, "acoes.acao_id": ObjectId(sem_transacao)},
+                         {"$inc": {"acoes.$.qtd": 3}})
+    _comprar(admin, vendida_demais, 5)
+    acoes.update_one({"_id": ObjectId(vendida_demais)}, {"$set": {"qtd": -2}})
+    _comprar(admin, removida, 6)
+    acoes.delete_one({"_id": ObjectId(removida)})
+    # Compra antiga cuja transação já foi para o arquivo mensal
+    antiga = datetime.utcnow() - timedelta(days=800)
+    carteiras.update_one({"usuario_id": usuario_id},
+                         {"$push": {"acoes": {"acao_id": ObjectId(arquivada), "qtd": 7, "preco_compra": 2.0}}})
+    transacoes.insert_one({
+        "_id": ObjectId(ObjectId.from_datetime(antiga).binary[:4] + ObjectId().binary[4:]),
+        "usuario_id": usuario_id, "acao_id": ObjectId(arquivada), "tipo": "compra", "qtd": 7, "data": antiga,
+    })
+    jobs.arquivar()
+
+    relatorio = client.post("/api/admin/estoque/reconciliar", headers=admin).json()
+    assert relatorio["acoes"] >= 4 and relatorio["particoes"] >= 1 and relatorio["workers"] == 1
+    divergencias = {d["acao_id"]: d for d in relatorio["divergencias"]}
+    assert consistente not in divergencias and arquivada not in divergencias
+    assert divergencias[sem_transacao]["tipos"] == ["carteiras_vs_compras"]
+    assert (divergencias[sem_transacao]["qtd_em_carteiras"], divergencias[sem_transacao]["qtd_compras"],
+            divergencias[sem_transacao]["diferenca"]) == (7, 4, 3)
+    assert divergencias[vendida_demais]["tipos"] == ["estoque_negativo"]
+    assert divergencias[vendida_demais]["qtd_total"] == 3
+    assert divergencias[removida]["tipos"] == ["acao_inexistente"] and divergencias[removida]["nome"] is None
+    ultimo = client.get("/api/admin/estoque/reconciliacao", headers=admin).json()
+    assert ultimo["data"] == relatorio["data"] and ultimo["total_divergencias"] == relatorio["total_divergencias"]
+
+
+def test_faixas_cobrem_todas_as_acoes_e_nao_mudam_o_resultado():
+    admin = registrar("admin")
+    for i in range(5):
+        _cadastrar(admin, f"Faixa{i}")
+    intervalos = reconciliacao_estoque.faixas(3)
+    assert len(intervalos) == 3 and intervalos[-1][1] is None
+    assert all(fim == proximo for (_, fim), (proximo, _) in zip(intervalos, intervalos[1:]))
+    ids = [acao["_id"] for acao in acoes.find({}, {"_id": 1})]
+    assert all(sum(1 for inicio, fim in intervalos if inicio <= _id and (fim is None or _id < fim)) == 1
+               for _id in ids)
+
+    uma = reconciliacao_estoque.reconciliar(particoes=1)
+    varias = reconciliacao_estoque.reconciliar(particoes=7)
+    assert varias["particoes"] == 7 and uma["acoes"] == varias["acoes"] == len(ids)
+    assert uma["divergencias"] == varias["divergencias"]
+
+
+def test_pool_de_processos_com_snapshot_sem_init_db():
+    admin = registrar("admin")
+    consistente, divergente = _cadastrar(admin, "PoolConsistente"), _cadastrar(admin, "PoolDivergente")
+    _comprar(admin, consistente, 2)
+    usuario_id = _comprar(admin, divergente, 3)
+    carteiras.update_one({"usuario_id": usuario_id, "acoes.acao_id": ObjectId(divergente)},
+                         {"$inc": {"acoes.$.qtd": 1}})
+
+    sequencial = reconciliacao_estoque.reconciliar(workers=1, particoes=4)
+    paralelo = reconciliacao_estoque.reconciliar(workers=2, particoes=4)
+    assert paralelo["workers"] == 2 and paralelo["acoes"] == sequencial["acoes"]
+    assert paralelo["divergencias"] == sequencial["divergencias"]
+    assert divergente in {d["acao_id"] for d in paralelo["divergencias"]}
+
+    # O processo do pool só importa o módulo das faixas: app.database (e o init_db) fica de fora
+    with tempfile.TemporaryDirectory() as diretorio:
+        snapshot = os.path.join(diretorio, "estoque.bson")
+        database.save_snapshot(snapshot)
+        fonte = {"banco": database.name, "snapshot": snapshot, "arquivos": []}
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            existentes, _ = executor.submit(faixas_estoque.reconciliar_faixa_no_processo,
+                                            fonte, ObjectId(consistente), None).result()
+            assert existentes >= 2
+            assert not executor.submit(eval, "'app.database' in __import__('sys').modules").result()
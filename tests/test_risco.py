@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+
+from app import candles, risco
+from app.database import acoes, carteiras
+
+
+def _acao_com_historico(precos):
+    acao_id = acoes.insert_one({"nome": "Teste", "preco": precos[-1], "qtd": 100, "risco": 1}).inserted_id
+    inicio = datetime.utcnow() - timedelta(days=len(precos))
+    for dia, preco in enumerate(precos):
+        candles.registrar_tick(acao_id, preco, inicio + timedelta(days=dia))
+    return acao_id
+
+
+def test_forward_fill():
+    matriz = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, 3.0]])
+    assert risco._forward_fill(matriz).tolist() == [[2.0, 1.0], [2.0, 1.0], [2.0, 3.0]]
+
+
+def test_risco_em_lote_e_cache():
+    volatil = _acao_com_historico([10.0, 12.0, 9.0, 13.0, 8.0, 12.0])
+    estavel = _acao_com_historico([20.0] * 6)
+    concentrada = {"usuario_id": ObjectId(), "acoes": [{"acao_id": volatil, "qtd": 10}], "versao_posicoes": 0}
+    diversificada = {
+        "usuario_id": ObjectId(),
+        "acoes": [{"acao_id": volatil, "qtd": 5}, {"acao_id": estavel, "qtd": 3}],
+        "versao_posicoes": 0,
+    }
+    carteiras.insert_many([concentrada, diversificada])
+
+    a, b = risco.calcular_lote([concentrada, diversificada])
+    assert a["valor_total"] == 120.0 and a["hhi"] == 1.0
+    assert a["dias_observados"] == 5
+    assert a["volatilidade_diaria"] > b["volatilidade_diaria"] > 0
+    assert a["var_95"] > 0
+    assert b["hhi"] == 0.5
+    # Ação sem variação não contribui para o risco
+    assert [round(p["contribuicao_risco"], 6) for p in b["posicoes"]] == [1.0, 0.0]
+
+    primeiro = risco.risco_carteira(concentrada["usuario_id"])
+    assert risco.risco_carteira(concentrada["usuario_id"]) is primeiro
+    carteiras.update_one({"_id": concentrada["_id"]}, {"$inc": {"versao_posicoes": 1}})
+    assert risco.risco_carteira(concentrada["usuario_id"]) is not primeiro
+
+
+def test_niveis_risco():
+    from app.update_risk_levels import update_risk_levels
+
+    acao_id = acoes.insert_one({"nome": "Niveis", "preco": 1.0, "qtd": 1, "risco": 0}).inserted_id
+    assert update_risk_levels()["atualizadas"] >= 1
+    assert 1 <= acoes.find_one({"_id": acao_id})["risco"] <= 5
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import jobs
+from app.database import jobs_execucoes, jobs_locks, notificacoes
+from app.scheduler import CronInvalido, CronSchedule, JobScheduler
+
+from tests.helpers import client, registrar
+
+
+def test_cron_proximo_horario():
+    base = datetime(2024, 1, 31, 10, 7, 30)
+    assert CronSchedule("*/15 * * * *").next_after(base) == datetime(2024, 1, 31, 10, 15)
+    assert CronSchedule("0 3 * * *").next_after(base) == datetime(2024, 2, 1, 3, 0)
+    assert CronSchedule("0 0 1 */3 *").next_after(base) == datetime(2024, 4, 1, 0, 0)
+    # Domingo (0 ou 7); 31/01/2024 é uma quarta-feira
+    assert CronSchedule("30 8 * * 7").next_after(base) == datetime(2024, 2, 4, 8, 30)
+    # Dia do mês e dia da semana restritos: basta um coincidir
+    assert CronSchedule("0 0 15 * 1").next_after(base) == datetime(2024, 2, 5, 0, 0)
+    for invalida in ("* * * *", "60 * * * *", "*/0 * * * *", "a * * * *"):
+        with pytest.raises(CronInvalido):
+            CronSchedule(invalida)
+
+
+def test_lease_um_worker_por_horario():
+    execucoes = []
+    a = JobScheduler(jobs_locks, jobs_execucoes, lease_s=60, dono="a")
+    b = JobScheduler(jobs_locks, jobs_execucoes, lease_s=60, dono="b")
+    for agendador in (a, b):
+        agendador.add("teste_lease", "* * * * *", lambda: execucoes.append(1))
+
+    horario = datetime.utcnow().replace(second=0, microsecond=0)
+
+    async def disputar(agendado_para):
+        return await asyncio.gather(a.run("teste_lease", agendado_para), b.run("teste_lease", agendado_para))
+
+    resultados = asyncio.run(disputar(horario))
+    assert sum(r is not None for r in resultados) == 1
+    # O horário já reivindicado não roda de novo, nem no mesmo worker
+    assert asyncio.run(disputar(horario)) == [None, None]
+    assert sum(r is not None for r in asyncio.run(disputar(horario + timedelta(minutes=1)))) == 1
+    assert len(execucoes) == 2
+
+    # Lease ativo de outro dono bloqueia mesmo um horário novo
+    assert a.lock.acquire("teste_lease", "a", horario + timedelta(minutes=5), 60)
+    assert asyncio.run(b.run("teste_lease", horario + timedelta(minutes=6))) is None
+
+
+def test_historico_e_metricas():
+    agendador = JobScheduler(jobs_locks, jobs_execucoes, dono="c")
+    agendador.add("teste_ok", "0 0 * * *", lambda: {"itens": 3})
+    agendador.add("teste_erro", "0 0 * * *", lambda: 1 / 0)
+
+    ok = asyncio.run(agendador.run("teste_ok"))
+    erro = asyncio.run(agendador.run("teste_erro"))
+    assert ok["status"] == "sucesso" and ok["resultado"] == {"itens": 3} and ok["duracao_ms"] >= 0
+    assert erro["status"] == "erro" and "ZeroDivisionError" in erro["erro"]
+    # O lease é liberado ao final: nova execução manual é possível
+    assert asyncio.run(agendador.run("teste_ok")) is not None
+
+    status = {s["nome"]: s for s in agendador.status()}
+    assert status["teste_ok"]["execucoes"] == 2 and status["teste_ok"]["falhas"] == 0
+    assert status["teste_erro"]["falhas"] == 1
+    assert status["teste_ok"]["duracao_max_ms"] >= status["teste_ok"]["duracao_media_ms"]
+    assert len(status["teste_ok"]["historico"]) == 2
+
+
+def test_limpeza_notificacoes_e_endpoint():
+    antiga = datetime.utcnow() - timedelta(days=365)
+    notificacoes.insert_many([
+        {"tipo": "teste_job", "usuario_id": None, "mensagem": "lida", "data": antiga, "lida": True},
+        {"tipo": "teste_job", "usuario_id": None, "mensagem": "não lida", "data": antiga, "lida": False},
+    ])
+    jobs.limpar_notificacoes()
+    assert [n["mensagem"] for n in notificacoes.find({"tipo": "teste_job"})] == ["não lida"]
+
+    admin = registrar("admin")
+    assert client.get("/api/admin/jobs", headers=registrar()).status_code == 403
+    assert client.post("/api/admin/jobs/inexistente/executar", headers=admin).status_code == 404
+    resposta = client.post("/api/admin/jobs/relatorios/executar", headers=admin)
+    assert resposta.status_code == 200 and resposta.json()["status"] == "sucesso"
+    nomes = [j["nome"] for j in client.get("/api/admin/jobs", headers=admin).json()]
+    assert nomes == ["relatorios", "limpeza_notificacoes", "reconciliacao_dashboard", "arquivamento",
+                     "reconciliacao_estoque"]
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from app.singleflight import CoalescingCollection, SingleFlight
+from app.database import usuarios
+
+from tests.helpers import client, registrar
+
+
+class _ColecaoLenta:
+    """Coleção falsa que conta as consultas e demora o suficiente para haver concorrência."""
+
+    def __init__(self, atraso_s=0.05):
+        self.documentos = {1: {"_id": 1, "preco": 10.0, "acoes": []}}
+        self.consultas = 0
+        self.atraso_s = atraso_s
+
+    def find_one(self, filtro, *args, **kwargs):
+        self.consultas += 1
+        time.sleep(self.atraso_s)
+        documento = self.documentos.get(filtro["_id"])
+        return dict(documento, acoes=list(documento["acoes"])) if documento else None
+
+    def update_one(self, filtro, atualizacao):
+        self.documentos[filtro["_id"]].update(atualizacao["$set"])
+
+
+def _concorrentes(funcao, n=20):
+    barreira = threading.Barrier(n)
+    resultados = [None] * n
+
+    def executar(i):
+        barreira.wait()
+        resultados[i] = funcao()
+
+    threads = [threading.Thread(target=executar, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_leituras_concorrentes_compartilham_a_consulta():
+    base = _ColecaoLenta()
+    colecao = CoalescingCollection(base)
+    resultados = _concorrentes(lambda: colecao.find_one({"_id": 1}))
+    assert base.consultas < 5
+    assert all(r == {"_id": 1, "preco": 10.0, "acoes": []} for r in resultados)
+    # Cada chamador recebe a própria cópia
+    resultados[0]["acoes"].append("alterado")
+    assert all(r["acoes"] == [] for r in resultados[1:])
+    stats = colecao.coalescing_stats()
+    assert stats["chamadas"] == 20 and stats["consultas"] + stats["coalescidas"] == 20
+
+    # Sem concorrência e sem cache, cada leitura vai ao banco
+    colecao.find_one({"_id": 1})
+    colecao.find_one({"_id": 1})
+    assert base.consultas == stats["consultas"] + 2
+
+
+def test_micro_cache_e_invalidacao_na_escrita():
+    base = _ColecaoLenta(atraso_s=0)
+    colecao = CoalescingCollection(base, cache_ms=10000)
+    assert colecao.find_one({"_id": 1})["preco"] == 10.0
+    assert colecao.find_one({"_id": 1})["preco"] == 10.0
+    assert base.consultas == 1 and colecao.coalescing_stats()["cache_hits"] == 1
+    # A escrita pelo próprio processo invalida o cache: lê a própria escrita
+    colecao.update_one({"_id": 1}, {"$set": {"preco": 12.0}})
+    assert colecao.find_one({"_id": 1})["preco"] == 12.0
+    assert base.consultas == 2
+
+
+def test_erro_propagado_aos_seguidores():
+    grupo = SingleFlight()
+    chamadas = []
+
+    def falhar():
+        chamadas.append(1)
+        time.sleep(0.05)
+        raise RuntimeError("falha no banco")
+
+    erros = _concorrentes(lambda: pytest.raises(RuntimeError, grupo.do, "chave", falhar), n=10)
+    assert len(erros) == 10 and len(chamadas) < 10
+    assert grupo.stats()["em_andamento"] == 0
+
+
+def test_metricas_e_colecoes_da_api():
+    admin = registrar("admin")
+    antes = client.get("/api/admin/metricas/leituras", headers=admin).json()["usuarios"]["chamadas"]
+    client.get("/api/acoes", headers=admin)
+    depois = client.get("/api/admin/metricas/leituras", headers=admin).json()
+    assert depois["usuarios"]["chamadas"] > antes
+    assert set(depois) == {"usuarios", "acoes", "carteiras"}
+    assert isinstance(usuarios, CoalescingCollection)
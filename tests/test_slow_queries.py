@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+
+from app import context
+from app.database import consultas_lentas, slow_queries
+from app.slow_queries import SlowQueryRecorder, comando_explain, extrair_forma
+from app.storage import MemoryDatabase
+
+from tests.helpers import client, registrar
+
+
+class _Cliente:
+    """Cliente mínimo: o explain do find roda no cursor do motor em memória."""
+
+    def __init__(self, banco):
+        self.banco = banco
+        self.explains = 0
+
+    def __getitem__(self, nome):
+        return self
+
+    def command(self, comando):
+        self.explains += 1
+        find = comando["explain"]
+        assert comando["verbosity"] == "executionStats" and "lsid" not in find
+        return self.banco[find["find"]].find(find["filter"]).sort(list(find["sort"].items())).explain()
+
+
+def _executar(recorder, conexao, requisicao, comando, duracao_ms):
+    recorder.started(SimpleNamespace(
+        command_name=next(iter(comando)), command=comando, database_name="investimentos",
+        connection_id=conexao, request_id=requisicao,
+    ))
+    recorder.succeeded(SimpleNamespace(
+        command_name=next(iter(comando)), connection_id=conexao, request_id=requisicao,
+        duration_micros=int(duracao_ms * 1000),
+    ))
+
+
+def test_forma_da_consulta_ignora_valores():
+    a = {"update": "carteiras", "updates": [{"q": {"usuario_id": "a", "$or": [{"x": 1}, {"y": {"$in": [1, 2]}}]}}]}
+    b = {"update": "carteiras", "updates": [{"q": {"usuario_id": "b", "$or": [{"x": 7}, {"y": {"$in": [3]}}]}}]}
+    assert extrair_forma("update", a) == extrair_forma("update", b)
+    assert extrair_forma("update", a)[0] == {"usuario_id": "?", "$or": [{"x": "?"}, {"y": {"$in": "?"}}]}
+    filtro, ordenacao, pipeline = extrair_forma("aggregate", {
+        "aggregate": "acoes", "pipeline": [{"$match": {"risco": 3}}, {"$sort": {"preco": -1}}],
+    })
+    assert filtro == {"risco": "?"} and ordenacao == {"preco": -1} and len(pipeline) == 2
+    explicado = comando_explain("find", {"find": "acoes", "filter": {}, "lsid": {}, "$db": "x", "$clusterTime": {}})
+    assert explicado == {"find": "acoes", "filter": {}}
+
+
+def test_registra_operacoes_lentas_com_um_explain_por_forma():
+    banco = MemoryDatabase("lentas")
+    banco["acoes"].insert_many([{"nome": f"A{i}", "risco": i % 5} for i in range(50)])
+    cliente = _Cliente(banco)
+    recorder = SlowQueryRecorder(threshold_ms=100, explain_interval_s=3600)
+    recorder.start(banco["consultas_lentas"], cliente)
+
+    token = context.rota_atual.set("GET /api/acoes")
+    try:
+        for i, duracao in enumerate((250, 20, 300)):
+            _executar(recorder, ("db", 27017), i, {
+                "find": "acoes", "filter": {"risco": i}, "sort": {"nome": 1}, "lsid": {"id": i},
+            }, duracao)
+        # Comandos sem filtro e a própria coleção de destino não são monitorados
+        _executar(recorder, ("db", 27017), 10, {"insert": "acoes", "documents": []}, 900)
+        _executar(recorder, ("db", 27017), 11, {"find": "consultas_lentas", "filter": {}}, 900)
+    finally:
+        context.rota_atual.reset(token)
+    recorder.stop()
+
+    registros = list(banco["consultas_lentas"].find().sort("data", 1))
+    assert [r["duracao_ms"] for r in registros] == [250.0, 300.0]
+    assert {r["chave"] for r in registros} == {registros[0]["chave"]}
+    assert all(r["rota"] == "GET /api/acoes" and json.loads(r["filtro"]) == {"risco": "?"} for r in registros)
+    # O explain roda uma vez por forma no intervalo
+    assert cliente.explains == 1 and "explain" not in registros[1]
+    explain = registros[0]["explain"]
+    assert "COLLSCAN" in explain["estagios"] and explain["documentos_examinados"] == 50
+    assert recorder.stats()["lentas"] == 2 and recorder.stats()["explains"] == 1
+
+
+def test_endpoint_consultas_lentas():
+    admin, usuario = registrar("admin"), registrar()
+    assert client.get("/api/admin/consultas-lentas", headers=usuario).status_code == 403
+
+    slow_queries.start(consultas_lentas, _Cliente(MemoryDatabase("explain")))
+    try:
+        _executar(slow_queries, ("db", 27017), 1, {"count": "transacoes", "query": {"usuario_id": "x"}},
+                  slow_queries.threshold_ms + 1)
+    finally:
+        slow_queries.stop()
+
+    resposta = client.get("/api/admin/consultas-lentas", params={"colecao": "transacoes"}, headers=admin)
+    assert resposta.status_code == 200
+    consulta = resposta.json()["consultas"][0]
+    assert consulta["comando"] == "count" and consulta["filtro"] == '{"usuario_id":"?"}'
+    # O cliente de teste só sabe explicar find: o erro fica registrado
+    assert consulta["explain"] is None and consulta["explain_erro"]
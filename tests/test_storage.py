@@ -0,0 +1,105 @@
+import pytest
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.storage import MemoryDatabase
+from tests.helpers import client, registrar
+
+
+@pytest.fixture
+def db():
+    return MemoryDatabase("teste")
+
+
+def test_consultas_e_operadores(db):
+    db.acoes.insert_many([
+        {"nome": "PETR4", "preco": 30.0, "qtd": 100, "risco": 3},
+        {"nome": "VALE3", "preco": 60.0, "qtd": 50, "risco": 2},
+        {"nome": "ITUB4", "preco": 25.0, "qtd": 0, "risco": 1},
+    ])
+
+    assert db.acoes.count_documents({"preco": {"$gte": 30}}) == 2
+    assert [a["nome"] for a in db.acoes.find({"risco": {"$in": [1, 2]}}).sort("preco", -1)] == ["VALE3", "ITUB4"]
+    assert db.acoes.find_one({"$or": [{"qtd": 0}, {"nome": "XXX"}]})["nome"] == "ITUB4"
+    assert db.acoes.find_one({"nome": "PETR4"}, {"_id": 0, "preco": 1}) == {"preco": 30.0}
+
+
+def test_atualizacoes_e_arrays(db):
+    usuario_id, acao_id = ObjectId(), ObjectId()
+    db.carteiras.insert_one({"usuario_id": usuario_id, "saldo": 100.0, "acoes": [{"acao_id": acao_id, "qtd": 1}]})
+
+    db.carteiras.update_one({"usuario_id": usuario_id, "acoes.acao_id": acao_id}, {"$inc": {"acoes.$.qtd": 2, "saldo": -10}})
+    carteira = db.carteiras.find_one_and_update(
+        {"usuario_id": usuario_id},
+        {"$push": {"acoes": {"acao_id": ObjectId(), "qtd": 5}}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+    assert carteira["saldo"] == 90.0
+    assert carteira["acoes"][0]["qtd"] == 3
+    assert len(carteira["acoes"]) == 2
+    assert db.carteiras.count_documents({"acoes.acao_id": acao_id}) == 1
+
+
+def test_upsert_e_bulk_write(db):
+    resultado = db.acoes.bulk_write([
+        UpdateOne({"nome": "PETR4"}, {"$set": {"preco": 31.0}}, upsert=True),
+        UpdateOne({"nome": "PETR4"}, {"$inc": {"qtd": 10}}, upsert=True),
+    ])
+    assert resultado.upserted_count == 1
+    assert resultado.modified_count == 1
+    assert db.acoes.find_one({"nome": "PETR4"})["qtd"] == 10
+
+
+def test_indice_unico_e_explain(db):
+    db.usuarios.create_index("email", unique=True)
+    db.usuarios.insert_one({"email": "a@example.com"})
+
+    with pytest.raises(DuplicateKeyError):
+        db.usuarios.insert_one({"email": "a@example.com"})
+
+    plano = db.usuarios.find({"email": "a@example.com"}).explain()
+    assert plano["queryPlanner"]["winningPlan"]["inputStage"]["stage"] == "IXSCAN"
+    assert db.usuarios.find({"nome": "x"}).explain()["queryPlanner"]["winningPlan"]["stage"] == "COLLSCAN"
+
+
+def test_agregacao(db):
+    db.carteiras.insert_many([
+        {"acoes": [{"acao_id": 1, "qtd": 2}, {"acao_id": 2, "qtd": 3}]},
+        {"acoes": [{"acao_id": 1, "qtd": 5}]},
+    ])
+    resultado = list(db.carteiras.aggregate([
+        {"$unwind": "$acoes"},
+        {"$group": {"_id": "$acoes.acao_id", "total": {"$sum": "$acoes.qtd"}}},
+        {"$sort": {"_id": 1}},
+    ]))
+    assert resultado == [{"_id": 1, "total": 7}, {"_id": 2, "total": 3}]
+
+
+def test_snapshot(tmp_path, db):
+    caminho = str(tmp_path / "snapshot.bson")
+    db.usuarios.create_index("email", unique=True)
+    db.usuarios.insert_one({"email": "a@example.com", "nome": "A"})
+    db.save_snapshot(caminho)
+
+    restaurado = MemoryDatabase("teste", snapshot_path=caminho)
+    assert restaurado.usuarios.find_one({"email": "a@example.com"})["nome"] == "A"
+    with pytest.raises(DuplicateKeyError):
+        restaurado.usuarios.insert_one({"email": "a@example.com"})
+
+
+def test_fluxo_completo_em_memoria():
+    admin = registrar("admin")
+    usuario = registrar()
+
+    acao = client.post("/api/acoes/cadastrar", json={"nome": "TESTE3", "preco": 10.0, "qtd": 100, "risco": 1},
+                       headers=admin).json()
+    deposito = client.post("/api/carteira/deposito", json={"valor": 500.0}, headers=usuario).json()
+    aprovado = client.post(f"/api/carteira/deposito/{deposito['id']}/aprovar", json={"aprovado": True}, headers=admin)
+    assert aprovado.json()["status"] == "aprovado"
+
+    compra = client.post("/api/carteira/comprar", json={"acao_id": acao["_id"], "quantidade": 10}, headers=usuario)
+    assert compra.status_code == 200
+    assert compra.json()["saldo"] == 400.0
+    assert client.get(f"/api/acoes/{acao['_id']}", headers=usuario).json()["qtd"] == 90
@@ -0,0 +1,97 @@
+import io
+import json
+import logging
+import queue
+
+from app import context, structured_logging
+from app.config import get_settings
+from app.structured_logging import (
+    AccessSampler, BatchQueueListener, BatchStreamHandler, ContextQueueHandler, JsonFormatter, configure_logging,
+)
+
+from tests.helpers import client
+
+
+def _pipeline(nome, maxsize=0, batch_size=100, flush_interval_ms=60000):
+    saida = io.StringIO()
+    destino = BatchStreamHandler(saida, batch_size=batch_size)
+    destino.setFormatter(JsonFormatter())
+    fila = queue.Queue(maxsize=maxsize)
+    handler = ContextQueueHandler(fila)
+    logger = logging.getLogger(nome)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger, handler, BatchQueueListener(fila, destino, flush_interval_ms=flush_interval_ms), saida
+
+
+def test_json_com_contexto_e_lotes():
+    logger, _, listener, saida = _pipeline("teste.pipeline")
+    token = context.request_id.set("abc123")
+    try:
+        dados = {"valor": 1}
+        logger.info("compra %s", dados, extra={"usuario": "u1"})
+        dados["valor"] = 2  # A mensagem é interpolada na thread de origem
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("falhou")
+    finally:
+        context.request_id.reset(token)
+    logger.warning("sem requisição")
+
+    listener.start()
+    listener.stop()
+    assert saida.getvalue() == ""  # Ainda no lote: escrito só no flush
+    listener.flush()
+    linhas = [json.loads(linha) for linha in saida.getvalue().splitlines()]
+    assert [linha["mensagem"] for linha in linhas] == ["compra {'valor': 1}", "falhou", "sem requisição"]
+    assert linhas[0]["request_id"] == "abc123" and linhas[0]["usuario"] == "u1" and linhas[0]["nivel"] == "INFO"
+    assert "ZeroDivisionError" in linhas[1]["excecao"]
+    assert "request_id" not in linhas[2]
+
+
+def test_fila_cheia_descarta_sem_bloquear():
+    logger, handler, _, _ = _pipeline("teste.fila", maxsize=2)
+    for i in range(5):
+        logger.info("registro %d", i)
+    assert handler.descartados == 3
+
+
+def test_amostragem_por_nivel():
+    sampler = AccessSampler({"INFO": 0.0, "WARNING": 1.0})
+    registro = lambda nivel: logging.LogRecord("app.access", nivel, "", 0, "", (), None)
+    assert not sampler.filter(registro(logging.INFO))
+    assert sampler.filter(registro(logging.WARNING)) and sampler.filter(registro(logging.ERROR))
+
+
+def test_request_id_na_resposta():
+    assert client.get("/", headers={"X-Request-ID": "req-1"}).headers["X-Request-ID"] == "req-1"
+    assert len(client.get("/").headers["X-Request-ID"]) == 32
+
+
+def test_pipeline_instalado_ao_lado_dos_handlers_do_host(monkeypatch):
+    class Host(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.mensagens = []
+
+        def emit(self, record):
+            self.mensagens.append(record.getMessage())
+
+    raiz, host = logging.getLogger(), Host()
+    anterior = ContextQueueHandler(queue.Queue())
+    # Como no Azure Functions: o host já registrou o seu handler no logger raiz
+    monkeypatch.setattr(raiz, "handlers", [host, anterior])
+    monkeypatch.setattr(structured_logging, "_pipeline", None)
+    nivel = raiz.level
+    saida = io.StringIO()
+    try:
+        pipeline = configure_logging(get_settings(), stream=saida)
+        assert pipeline is not None and raiz.handlers == [host, pipeline.handler]
+        logging.getLogger("teste.host").warning("exportado")
+        pipeline.stop()
+    finally:
+        raiz.setLevel(nivel)
+    assert host.mensagens == ["exportado"]
+    assert json.loads(saida.getvalue().splitlines()[-1])["mensagem"] == "exportado"
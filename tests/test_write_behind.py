@@ -0,0 +1,118 @@
+import threading
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app.storage import MemoryDatabase
+from app.write_behind import WriteBehindQueue
+
+
+class _ColecaoInstavel:
+    """Coleção que falha nas primeiras gravações (rede) ou recusa documentos marcados."""
+
+    def __init__(self, colecao, falhas_de_rede=0, bloqueio=None):
+        self.colecao = colecao
+        self.name = colecao.name
+        self.falhas_de_rede = falhas_de_rede
+        self.bloqueio = bloqueio
+        self.gravando = threading.Event()
+
+    def insert_many(self, documentos, ordered=True):
+        self.gravando.set()
+        if self.bloqueio is not None:
+            self.bloqueio.wait()
+        if self.falhas_de_rede:
+            self.falhas_de_rede -= 1
+            # Falha depois de gravar parte do lote: a regravação encontra chaves duplicadas
+            try:
+                self.colecao.insert_many(documentos[:1])
+            except BulkWriteError:
+                pass
+            raise AutoReconnect("conexão perdida")
+        recusados = [i for i, documento in enumerate(documentos) if documento.get("invalido")]
+        aceitos = [documento for documento in documentos if not documento.get("invalido")]
+        if aceitos:
+            try:
+                self.colecao.insert_many(aceitos, ordered=False)
+            except BulkWriteError:
+                pass
+        if recusados:
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": 121, "errmsg": "Document failed validation"}
+                                                  for i in recusados], "nInserted": len(aceitos)})
+
+
+def test_grava_em_lotes_e_esvazia_ao_parar():
+    db = MemoryDatabase("teste")
+    fila = WriteBehindQueue(max_size=100, batch_size=10, flush_interval_ms=1000)
+    fila.start()
+
+    for i in range(25):
+        assert fila.submit(db.notificacoes, {"mensagem": str(i)})
+    fila.stop()
+
+    assert db.notificacoes.count_documents({}) == 25
+    estatisticas = fila.stats()
+    assert estatisticas["gravados"] == 25
+    assert estatisticas["lotes"] >= 3
+    assert estatisticas["tamanho_fila"] == 0
+
+
+def test_fila_inativa_ou_cheia_recusa_documento():
+    db = MemoryDatabase("teste")
+    bloqueio = threading.Event()
+    colecao = _ColecaoInstavel(db.notificacoes, bloqueio=bloqueio)
+    fila = WriteBehindQueue(max_size=1, batch_size=1, enqueue_timeout_ms=1)
+    assert not fila.submit(colecao, {"mensagem": "fila parada"})
+
+    # Gravação travada: a fila enche e o chamador recebe backpressure
+    fila.start()
+    assert fila.submit(colecao, {"mensagem": "1"})
+    assert colecao.gravando.wait(5)
+    assert fila.submit(colecao, {"mensagem": "2"})
+    assert not fila.submit(colecao, {"mensagem": "3"})
+    assert not fila.flush(timeout=0.05)
+    assert fila.stats()["sincronos"] == 1
+
+    bloqueio.set()
+    assert fila.flush()
+    fila.stop()
+    assert db.notificacoes.count_documents({}) == 2
+
+
+def test_falha_de_rede_e_regravada_com_backoff():
+    db = MemoryDatabase("teste")
+    colecao = _ColecaoInstavel(db.transacoes, falhas_de_rede=2)
+    fila = WriteBehindQueue(batch_size=10, flush_interval_ms=10, retry_base_ms=1, retry_max_ms=5,
+                            dead_letter=db.escritas_adiadas_falhas)
+    fila.start()
+    for i in range(5):
+        assert fila.submit(colecao, {"valor": float(i)})
+    assert fila.flush()
+    fila.stop()
+
+    assert db.transacoes.count_documents({}) == 5
+    estatisticas = fila.stats()
+    assert (estatisticas["retentativas"], estatisticas["falhas"], estatisticas["dead_letter"]) == (2, 0, 0)
+
+
+def test_falhas_persistentes_vao_para_dead_letter_e_sao_reprocessadas():
+    db = MemoryDatabase("teste")
+    colecao = _ColecaoInstavel(db.transacoes)
+    fila = WriteBehindQueue(batch_size=10, flush_interval_ms=10, max_retries=2, retry_base_ms=1, retry_max_ms=5,
+                            dead_letter=db.escritas_adiadas_falhas)
+    fila.start()
+    for i in range(4):
+        assert fila.submit(colecao, {"valor": float(i), "invalido": i == 2})
+    assert fila.flush()
+    fila.stop()
+
+    assert db.transacoes.count_documents({}) == 3
+    [falha] = db.escritas_adiadas_falhas.find({})
+    assert (falha["colecao"], falha["documento"]["valor"], falha["tentativas"]) == ("transacoes", 2.0, 3)
+    assert "validation" in falha["erro"]
+    estatisticas = fila.stats()
+    assert (estatisticas["retentativas"], estatisticas["falhas"], estatisticas["dead_letter"]) == (2, 1, 1)
+
+    # Corrigido o problema, o documento volta à coleção de origem com o mesmo _id
+    assert fila.reprocessar({"transacoes": db.transacoes}) == {"reprocessados": 1, "falhas": 0}
+    assert db.transacoes.count_documents({"_id": falha["documento"]["_id"]}) == 1
+    assert db.escritas_adiadas_falhas.count_documents({}) == 0